@@ -6,6 +6,8 @@ import time
 import numpy
 import functools
 import threading
+import typing
+from collections import OrderedDict, deque
 from Dataset import Dataset
 from Log import log
 from Util import NumbersDict
@@ -13,11 +15,17 @@ from Util import NumbersDict
 
 class CachedDataset(Dataset):
 
-  def __init__(self, cache_byte_size=0, **kwargs):
+  def __init__(self, cache_byte_size=0, cache_backend="alloc_intervals", **kwargs):
     """
     :param int cache_byte_size:
+    :param str cache_backend: "alloc_intervals" (default) or "slab_lru" (see :class:`SeqSlabCache`).
+      Only relevant if cache_byte_size != 0.
     """
     super(CachedDataset, self).__init__(**kwargs)
+    assert cache_backend in ("alloc_intervals", "slab_lru"), "%s: invalid cache_backend %r" % (self, cache_backend)
+    self.cache_backend = cache_backend
+    self._cache_byte_size = cache_byte_size
+    self._seq_cache = None  # type: typing.Optional[SeqSlabCache]  # via _get_seq_cache()
     self.cache_byte_size_total_limit = cache_byte_size
     if cache_byte_size == -1:
       self.cache_byte_size_limit_at_start = 1024 ** 4
@@ -48,7 +56,9 @@ class CachedDataset(Dataset):
   def initialize(self):
     super(CachedDataset, self).initialize()
 
-    if self.cache_byte_size_limit_at_start > 0:
+    if self._is_seq_cache_enabled():
+      pass  # The seq cache is created lazily. See _get_seq_cache().
+    elif self.cache_byte_size_limit_at_start > 0:
       # Calculate cache sizes.
       temp_cache_size_bytes = max(0, self.cache_byte_size_total_limit)
       self.definite_cache_leftover = temp_cache_size_bytes if self.num_seqs_cached_at_start == self.num_seqs else 0
@@ -60,15 +70,18 @@ class CachedDataset(Dataset):
             max(temp_cache_size_bytes / float(1024 * 1024 * 1024), 0),
             file=log.v4)
 
-  def init_seq_order(self, epoch=None, seq_list=None):
+  def init_seq_order(self, epoch=None, seq_list=None, seq_order=None):
     """
     :type epoch: int|None
     :param list[str] | None seq_list: In case we want to set a predefined order.
+    :param list[int]|numpy.ndarray|None seq_order: predefined order as real seq idxs
     Initialize lists:
       self.seq_index  # sorted seq idx
     """
-    super(CachedDataset, self).init_seq_order(epoch=epoch, seq_list=seq_list)
-    if seq_list is not None:
+    super(CachedDataset, self).init_seq_order(epoch=epoch, seq_list=seq_list, seq_order=seq_order)
+    if seq_order is not None:
+      seq_index = numpy.asarray(seq_order).tolist()
+    elif seq_list is not None:
       self._update_tag_idx()
       seq_index = [self._tag_idx[tag] for tag in seq_list]
     else:
@@ -77,6 +90,17 @@ class CachedDataset(Dataset):
     old_index_map = self._index_map[:]
     self._index_map = range(len(seq_index))  # sorted seq idx -> seq_index idx
 
+    if self._is_seq_cache_enabled():
+      # The seq cache uses the real seq idx, thus it stays valid, and we don't need any of the logic below.
+      if self._seq_cache:
+        print("%s, seq cache stats since last init_seq_order: %s" % (self, self._seq_cache.get_stats_str()),
+              file=log.v4)
+        self._seq_cache.reset_stats()
+      if self._seq_index == seq_index:
+        return False
+      self._seq_index = seq_index
+      return True
+
     if self._seq_index == seq_index and self.start_cache_initialized:
       return False
 
@@ -172,6 +196,10 @@ class CachedDataset(Dataset):
     assert start >= 0
     assert start <= end
 
+    if self._is_seq_cache_enabled():
+      self._load_seqs_with_seq_cache(start, end)
+      return
+
     if self.is_cached(start, end, blocking=True):
       return
 
@@ -207,6 +235,93 @@ class CachedDataset(Dataset):
       self.preload_end = end
       threading.Thread(target=self._preload_seqs,args=(start,end)).start()
 
+  def _is_seq_cache_enabled(self):
+    """
+    :return: whether we use the :class:`SeqSlabCache` instead of the alloc intervals
+    :rtype: bool
+    """
+    return self.cache_backend == "slab_lru" and self.cache_byte_size_total_limit != 0
+
+  def _get_seq_cache(self):
+    """
+    :rtype: SeqSlabCache
+    """
+    if self._seq_cache:
+      return self._seq_cache
+    assert self._is_seq_cache_enabled()
+    frame_shape = self.get_data_shape("data")
+    dtype = self.get_data_dtype("data")
+    frame_nbytes = int(numpy.prod(frame_shape, dtype="int64")) * numpy.dtype(dtype).itemsize
+    block_size = SeqSlabCache.DefaultBlockSize
+    # Never allocate more than what we need for the whole dataset.
+    max_num_blocks = int(numpy.sum((self._seq_lengths[:, 0] + block_size - 1) // block_size))
+    if self._cache_byte_size > 0:
+      num_blocks = min(self._cache_byte_size // (frame_nbytes * block_size), max_num_blocks)
+    else:  # -1, i.e. unlimited
+      num_blocks = max_num_blocks
+    self._seq_cache = SeqSlabCache(
+      num_blocks=max(num_blocks, 1), block_size=block_size, frame_shape=frame_shape, dtype=dtype,
+      max_bytes=self._cache_byte_size if self._cache_byte_size > 0 else None)
+    print("%s, seq cache: %s" % (self, self._seq_cache), file=log.v4)
+    return self._seq_cache
+
+  def _get_real_seq_idx(self, sorted_seq_idx):
+    """
+    :param int sorted_seq_idx:
+    :return: real seq idx, which is used as the key in the seq cache
+    :rtype: int
+    """
+    return self._seq_index[self._index_map[sorted_seq_idx]]
+
+  def _load_seqs_with_seq_cache(self, start, end):
+    """
+    :param int start: start sorted seq idx
+    :param int end: end sorted seq idx
+    """
+    seq_cache = self._get_seq_cache()
+    missing = [
+      real_seq_idx for real_seq_idx in map(self._get_real_seq_idx, range(start, end))
+      if not seq_cache.lookup(real_seq_idx)]
+    if missing:
+      self._load_real_seqs_into_seq_cache(missing)
+
+  def _load_real_seqs_into_seq_cache(self, real_seq_idxs):
+    """
+    Load the data of the given seqs, and call :func:`_put_into_seq_cache` for each.
+    Needs to be implemented by the derived class if it supports the "slab_lru" cache backend.
+
+    :param list[int] real_seq_idxs:
+    """
+    raise NotImplementedError("%s does not support cache_backend 'slab_lru'" % self.__class__.__name__)
+
+  def _put_into_seq_cache(self, real_seq_idx, data, targets):
+    """
+    :param int real_seq_idx:
+    :param numpy.ndarray data: raw input data
+    :param dict[str,numpy.ndarray] targets:
+    """
+    x = self.preprocess(data)
+    if self.window > 1:
+      x = self.sliding_window(x)
+    self._get_seq_cache().put(real_seq_idx, x, extra=targets)
+
+  def _get_from_seq_cache(self, sorted_seq_idx):
+    """
+    :param int sorted_seq_idx:
+    :return: input data, targets
+    :rtype: (numpy.ndarray, dict[str,numpy.ndarray])
+    """
+    real_seq_idx = self._get_real_seq_idx(sorted_seq_idx)
+    seq_cache = self._get_seq_cache()
+    res = seq_cache.get(real_seq_idx)
+    if res is None:
+      # Maybe evicted already, e.g. if load_seqs() was called for more seqs than what fits into the cache.
+      seq_cache.lookup(real_seq_idx)  # count as miss
+      self._load_real_seqs_into_seq_cache([real_seq_idx])
+      res = seq_cache.get(real_seq_idx)
+      assert res is not None, "%s: seq %i does not fit into the seq cache" % (self, real_seq_idx)
+    return res
+
   def _preload_seqs(self,start,end):
     print("Preloading cache from", start, "to", end, file=log.v4)
     super(CachedDataset, self).load_seqs(start, end)
@@ -440,6 +555,8 @@ class CachedDataset(Dataset):
     if start == end:
       return True  # Empty.
     assert start < end
+    if self._is_seq_cache_enabled():
+      return all(self._get_real_seq_idx(i) in self._get_seq_cache() for i in range(start, end))
     if blocking and end <= self.preload_end:
       while not set(range(start,end)) <= self.preload_set:
         time.sleep(0.2)
@@ -477,6 +594,8 @@ class CachedDataset(Dataset):
     return self.timestamps[seq_start:seq_start + seq_len]
 
   def get_input_data(self, sorted_seq_idx):
+    if self._is_seq_cache_enabled():
+      return self._get_from_seq_cache(sorted_seq_idx)[0]
     seq_idx = self._index_map[sorted_seq_idx]
     idi = self.alloc_interval_index(seq_idx)
     assert idi >= 0, "failed to get data for seq %i" % sorted_seq_idx
@@ -493,6 +612,8 @@ class CachedDataset(Dataset):
     return self.num_outputs[key][0]
 
   def get_targets(self, target, sorted_seq_idx):
+    if self._is_seq_cache_enabled():
+      return self._get_from_seq_cache(sorted_seq_idx)[1][target]
     seq_idx = self._index_map[sorted_seq_idx]
     idx = self.target_keys.index(target) + 1
     seq_start = self.get_seq_start(seq_idx)[idx]
@@ -515,6 +636,13 @@ class CachedDataset(Dataset):
   def have_corpus_seq_idx(self):
     return True
 
+  def supports_seq_order(self):
+    """
+    :return: whether init_seq_order() supports seq_order, which are the real seq idxs here
+    :rtype: bool
+    """
+    return True
+
   def get_corpus_seq_idx(self, seq_idx):
     """
     :param int seq_idx: sorted sequence index from the current epoch, depending on seq_ordering
@@ -524,3 +652,195 @@ class CachedDataset(Dataset):
     if self.seq_ordering == "default":
       return seq_idx
     return self._seq_index[self._index_map[seq_idx]]
+
+
+class SeqSlabCache(object):
+  """
+  Cache for sequences, used by :class:`CachedDataset` with ``cache_backend="slab_lru"``.
+
+  All the data is in one preallocated array (the slab), which is split into blocks of ``block_size`` frames.
+  A sequence occupies ``ceil(len / block_size)`` blocks, which are usually contiguous, and then we can return a view.
+  The lookup is O(1). When there are not enough free blocks, or when the stored bytes would exceed ``max_bytes``,
+  we evict the least recently used sequences.
+  The extra data (e.g. the targets) is stored outside of the slab, but is counted against ``max_bytes`` as well.
+  In contrast to the alloc intervals, this never copies the already cached data.
+  """
+
+  DefaultBlockSize = 32
+
+  def __init__(self, num_blocks, block_size, frame_shape, dtype, max_bytes=None):
+    """
+    :param int num_blocks:
+    :param int block_size: number of frames per block
+    :param list[int]|tuple[int] frame_shape: shape of a single frame, e.g. [feature_dim]
+    :param str dtype:
+    :param int|None max_bytes: limit for all stored bytes, including the extra data. None: only limited by the slab
+    """
+    self.num_blocks = num_blocks
+    self.block_size = block_size
+    self.slab = numpy.zeros((num_blocks * block_size,) + tuple(frame_shape), dtype=dtype)
+    self.frame_nbytes = self.slab.itemsize * int(numpy.prod(frame_shape, dtype="int64"))
+    self.block_nbytes = self.block_size * self.frame_nbytes
+    self.max_bytes = max_bytes
+    self._free_blocks = deque(range(num_blocks))
+    # key -> (blocks, seq len, data if not in the slab, extra). In LRU order, i.e. least recently used first.
+    self._entries = OrderedDict()  # type: typing.Dict[int,typing.Tuple[typing.List[int],int,typing.Any,typing.Any]]
+    self._outside_nbytes = 0  # data not in the slab, and all extra data
+    self._lock = threading.RLock()
+    self.num_hits = 0
+    self.num_misses = 0
+    self.num_evictions = 0
+    self.num_evicted_bytes = 0
+
+  def __repr__(self):
+    return "<%s %i seqs, %i/%i blocks of %i frames used, %.2f GB used, %.2f GB slab>" % (
+      self.__class__.__name__, len(self._entries), self.num_blocks - len(self._free_blocks), self.num_blocks,
+      self.block_size, self.get_used_bytes() / float(1024 ** 3), self.slab.nbytes / float(1024 ** 3))
+
+  def get_used_bytes(self):
+    """
+    :return: all stored bytes, i.e. the used blocks of the slab, and the data outside of the slab, incl. the extra data
+    :rtype: int
+    """
+    return (self.num_blocks - len(self._free_blocks)) * self.block_nbytes + self._outside_nbytes
+
+  def __contains__(self, key):
+    """
+    :param int key:
+    :rtype: bool
+    """
+    return key in self._entries
+
+  def lookup(self, key):
+    """
+    Like ``key in self``, but this counts as a hit or miss, and marks the seq as recently used.
+
+    :param int key:
+    :rtype: bool
+    """
+    with self._lock:
+      entry = self._entries.pop(key, None)
+      if entry is None:
+        self.num_misses += 1
+        return False
+      self._entries[key] = entry
+      self.num_hits += 1
+      return True
+
+  def get(self, key):
+    """
+    :param int key:
+    :return: (data, extra) or None if not in the cache
+    :rtype: (numpy.ndarray, object)|None
+    """
+    with self._lock:
+      entry = self._entries.get(key)
+      if entry is None:
+        return None
+      blocks, seq_len, data, extra = entry
+      if data is not None:
+        return data, extra
+      if self._is_contiguous(blocks):
+        offset = blocks[0] * self.block_size
+        return self.slab[offset:offset + seq_len], extra
+      idxs = (numpy.array(blocks)[:, None] * self.block_size + numpy.arange(self.block_size)[None, :]).flatten()
+      return self.slab[idxs[:seq_len]], extra
+
+  def put(self, key, data, extra=None):
+    """
+    :param int key:
+    :param numpy.ndarray data: shape (seq len,) + frame_shape
+    :param object extra: anything else which should be stored along (and evicted with) this seq, e.g. targets
+    """
+    with self._lock:
+      if key in self._entries:
+        self._remove(key)
+      seq_len = data.shape[0]
+      num_blocks = (seq_len + self.block_size - 1) // self.block_size
+      extra_nbytes = self._get_nbytes(extra)
+      if num_blocks > self.num_blocks or (
+            self.max_bytes is not None and num_blocks * self.block_nbytes + extra_nbytes > self.max_bytes):
+        # Does not fit into the cache at all. Keep it as a separate array, but only until the next put(),
+        # i.e. put it at the LRU end, and it will be the first to be evicted, see below.
+        self._outside_nbytes += data.nbytes + extra_nbytes
+        self._entries = OrderedDict([(key, ([], seq_len, data, extra))] + list(self._entries.items()))
+        return
+      while self._entries and self._entries[next(iter(self._entries))][2] is not None:
+        self._evict()  # seqs which do not fit, see above
+      while len(self._free_blocks) < num_blocks or (
+            self.max_bytes is not None and
+            self.get_used_bytes() + num_blocks * self.block_nbytes + extra_nbytes > self.max_bytes):
+        self._evict()
+      # Blocks of evicted seqs are freed in order, thus we usually get contiguous blocks here.
+      blocks = [self._free_blocks.popleft() for _ in range(num_blocks)]
+      if self._is_contiguous(blocks):
+        offset = blocks[0] * self.block_size
+        self.slab[offset:offset + seq_len] = data
+      else:
+        for i, block in enumerate(blocks):
+          self.slab[block * self.block_size:(block + 1) * self.block_size][:seq_len - i * self.block_size] = (
+            data[i * self.block_size:(i + 1) * self.block_size])
+      self._outside_nbytes += extra_nbytes
+      self._entries[key] = (blocks, seq_len, None, extra)
+
+  @classmethod
+  def _get_nbytes(cls, obj):
+    """
+    :param numpy.ndarray|dict|list|tuple|object obj: e.g. the extra data, like the targets
+    :return: number of bytes of all the Numpy arrays in obj
+    :rtype: int
+    """
+    if isinstance(obj, numpy.ndarray):
+      return obj.nbytes
+    if isinstance(obj, dict):
+      return sum([cls._get_nbytes(v) for v in obj.values()])
+    if isinstance(obj, (list, tuple)):
+      return sum([cls._get_nbytes(v) for v in obj])
+    return 0
+
+  @staticmethod
+  def _is_contiguous(blocks):
+    """
+    :param list[int] blocks:
+    :rtype: bool
+    """
+    return all(block == blocks[0] + i for i, block in enumerate(blocks))
+
+  def _remove(self, key):
+    """
+    :param int key:
+    :return: number of bytes freed
+    :rtype: int
+    """
+    blocks, seq_len, data, extra = self._entries.pop(key)
+    self._free_blocks.extend(blocks)
+    nbytes = self._get_nbytes(extra)
+    if data is not None:
+      nbytes += data.nbytes
+    self._outside_nbytes -= nbytes
+    return nbytes + len(blocks) * self.block_nbytes
+
+  def _evict(self):
+    """
+    Evicts the least recently used seq.
+    """
+    assert self._entries, "%s: nothing to evict" % self
+    key = next(iter(self._entries))
+    self.num_evicted_bytes += self._remove(key)
+    self.num_evictions += 1
+
+  def reset_stats(self):
+    """
+    Resets the hit/miss/eviction statistics, e.g. at the beginning of a new epoch.
+    """
+    with self._lock:
+      self.num_hits = self.num_misses = self.num_evictions = self.num_evicted_bytes = 0
+
+  def get_stats_str(self):
+    """
+    :rtype: str
+    """
+    num_lookups = self.num_hits + self.num_misses
+    return "%i hits, %i misses (hit rate %.1f%%), %i evictions (%.2f GB), %r" % (
+      self.num_hits, self.num_misses, 100.0 * self.num_hits / max(num_lookups, 1),
+      self.num_evictions, self.num_evicted_bytes / float(1024 ** 3), self)
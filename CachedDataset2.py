@@ -3,8 +3,13 @@
 Provides :class:`CachedDataset2`.
 """
 
+from __future__ import print_function
+
 from Dataset import Dataset, DatasetSeq
+from Log import log
 from threading import Condition
+import os
+import numpy
 import typing
 try:
   # noinspection PyCompatibility
@@ -26,9 +31,22 @@ class CachedDataset2(Dataset):
   - handle seq ordering by overriding `init_seq_order`
   - you can set `_estimated_num_seqs`
   - you can set `_num_seqs` or `_num_timesteps` if you know them in advance
+  - you can implement `have_corpus_seq_idx`/`get_corpus_seq_idx` (or `supports_seq_len_index`)
+    to support `seq_len_index_dir`
   """
 
-  def __init__(self, **kwargs):
+  def __init__(self, seq_len_index_dir=None, seq_len_index_key=None, seq_len_index_data_key="data", **kwargs):
+    """
+    :param str|None seq_len_index_dir: if set, we store the seq lengths of the corpus in a :class:`SeqLenIndex`
+      in this directory. They are collected while loading the seqs (e.g. in the first epoch),
+      or via ``tools/build-seq-len-index.py``. Once the index is complete,
+      ``seq_ordering`` like "sorted" or "laplace" uses the lengths from the index,
+      and the seqs don't need to be loaded for that anymore.
+      This needs :func:`supports_seq_len_index`.
+    :param str|None seq_len_index_key: identifies the dataset in seq_len_index_dir.
+      :func:`Dataset.init_dataset` sets this to the hash of the dataset options (:func:`get_dataset_config_hash`).
+    :param str seq_len_index_data_key: the lengths of this data key are used for the seq ordering
+    """
     super(CachedDataset2, self).__init__(**kwargs)
     self._num_timesteps = None
     self.epoch = None
@@ -36,6 +54,15 @@ class CachedDataset2(Dataset):
     self.added_data = []  # type: typing.List[DatasetSeq]
     self.expected_load_seq_start = 0
     self._num_timesteps_accumulated = 0
+    self.seq_len_index_dir = seq_len_index_dir
+    if seq_len_index_dir and not seq_len_index_key:
+      from Dataset import get_dataset_config_hash
+      seq_len_index_key = get_dataset_config_hash({"class": self.__class__.__name__, "name": self.name})
+      print("%s: no seq_len_index_key given, using %r based on the dataset name." % (self, seq_len_index_key),
+            file=log.v3)
+    self.seq_len_index_key = seq_len_index_key
+    self.seq_len_index_data_key = seq_len_index_data_key
+    self._seq_len_index = None  # type: typing.Optional[SeqLenIndex]
 
   def init_seq_order(self, epoch=None, seq_list=None):
     """
@@ -118,6 +145,66 @@ class CachedDataset2(Dataset):
     seqs = list(filter(None, seqs))  # We might not know the num seqs in advance.
     self._num_timesteps_accumulated += sum([seq.num_frames for seq in seqs])
     self.added_data += seqs
+    if self._seq_len_index and not self._seq_len_index.is_complete():
+      for seq in seqs:
+        self._seq_len_index.add(self.get_corpus_seq_idx(seq.seq_idx), seq.num_frames)
+      if self._seq_len_index.is_complete():
+        self._seq_len_index.save(self._get_seq_len_index_filename())
+        print("%s: seq len index complete, saved to %r." % (self, self._get_seq_len_index_filename()), file=log.v4)
+
+  def supports_seq_len_index(self):
+    """
+    :return: whether :func:`get_corpus_seq_idx` can be used for the seq len index (``seq_len_index_dir``).
+      by default, if :func:`have_corpus_seq_idx`.
+      a subclass can override this to support the index without :func:`have_corpus_seq_idx`,
+      which also changes other code paths (e.g. the seq order in forwarding)
+    :rtype: bool
+    """
+    return self.have_corpus_seq_idx()
+
+  def _get_seq_len_index_filename(self):
+    """
+    :rtype: str
+    """
+    assert self.seq_len_index_dir and self.seq_len_index_key
+    return "%s/%s.seq_lens.npz" % (self.seq_len_index_dir, self.seq_len_index_key)
+
+  def _init_seq_len_index(self, num_seqs):
+    """
+    Loads the index if it exists, or starts collecting the seq lengths.
+
+    :param int num_seqs: total num seqs in the corpus
+    """
+    if self._seq_len_index and self._seq_len_index.num_seqs == num_seqs:
+      return
+    filename = self._get_seq_len_index_filename()
+    if os.path.exists(filename):
+      index = SeqLenIndex.load(filename)
+      if index.num_seqs == num_seqs:
+        print("%s: loaded seq len index %r." % (self, filename), file=log.v4)
+        self._seq_len_index = index
+        return
+      print("%s: seq len index %r has %i seqs but we have %i seqs, ignoring it." % (
+        self, filename, index.num_seqs, num_seqs), file=log.v2)
+    print("%s: seq len index %r will be created while loading the seqs." % (self, filename), file=log.v4)
+    self._seq_len_index = SeqLenIndex(num_seqs=num_seqs)
+
+  def get_seq_order_for_epoch(self, epoch, num_seqs, get_seq_len=None):
+    """
+    If the seq len index is enabled and complete, it is used for get_seq_len.
+    Otherwise, as in :func:`Dataset.get_seq_order_for_epoch`.
+
+    :param int epoch:
+    :param int num_seqs:
+    :param ((int) -> int)|None get_seq_len:
+    :rtype: list[int]
+    """
+    if self.seq_len_index_dir and self.supports_seq_len_index():
+      self._init_seq_len_index(num_seqs=num_seqs)
+      if self._seq_len_index.is_complete():
+        get_seq_len = self._seq_len_index.get_seq_len_func(self.seq_len_index_data_key)
+    return super(CachedDataset2, self).get_seq_order_for_epoch(
+      epoch=epoch, num_seqs=num_seqs, get_seq_len=get_seq_len)
 
   def is_less_than_num_seqs(self, n):
     """
@@ -356,3 +443,98 @@ class SingleStreamPipeDataset(CachedDataset2):
         if self.producer_finished:
           return None
         self.condition.wait()
+
+
+class SeqLenIndex:
+  """
+  The seq lengths for every data key of every seq of a corpus, indexed by the corpus seq idx
+  (see :func:`Dataset.get_corpus_seq_idx`).
+  Used by :class:`CachedDataset2` via the ``seq_len_index_dir`` option, and created by ``tools/build-seq-len-index.py``.
+  Unknown lengths are -1.
+  """
+
+  def __init__(self, num_seqs, seq_lens=None):
+    """
+    :param int num_seqs: total num seqs in the corpus
+    :param dict[str,numpy.ndarray]|None seq_lens: data key -> lengths, shape (num_seqs,)
+    """
+    self.num_seqs = num_seqs
+    self.seq_lens = seq_lens or {}  # type: typing.Dict[str,numpy.ndarray]
+    self._num_known = (
+      int(numpy.count_nonzero(numpy.min([v for v in self.seq_lens.values()], axis=0) >= 0)) if self.seq_lens else 0)
+
+  def __repr__(self):
+    return "<%s num_seqs=%i, known=%i, keys=%r>" % (
+      self.__class__.__name__, self.num_seqs, self._num_known, sorted(self.seq_lens.keys()))
+
+  def is_complete(self):
+    """
+    :return: whether we know the lengths of all seqs
+    :rtype: bool
+    """
+    return self._num_known == self.num_seqs
+
+  def add(self, corpus_seq_idx, seq_lens):
+    """
+    :param int corpus_seq_idx:
+    :param Util.NumbersDict|dict[str,int] seq_lens: data key -> len
+    """
+    if hasattr(seq_lens, "dict"):  # NumbersDict
+      seq_lens = seq_lens.dict
+    if not self.seq_lens:
+      self.seq_lens = {key: numpy.full((self.num_seqs,), -1, dtype="int32") for key in seq_lens.keys()}
+    assert set(seq_lens.keys()) == set(self.seq_lens.keys()), "%r: keys %r do not match" % (self, seq_lens.keys())
+    first_key = next(iter(self.seq_lens.keys()))
+    if self.seq_lens[first_key][corpus_seq_idx] < 0:
+      self._num_known += 1
+    for key, value in seq_lens.items():
+      self.seq_lens[key][corpus_seq_idx] = value
+
+  def merge(self, other):
+    """
+    :param SeqLenIndex other: with the same num_seqs. known lengths from other will be copied
+    """
+    assert other.num_seqs == self.num_seqs
+    if not other.seq_lens:
+      return
+    if not self.seq_lens:
+      self.seq_lens = {key: value.copy() for (key, value) in other.seq_lens.items()}
+    else:
+      assert set(other.seq_lens.keys()) == set(self.seq_lens.keys())
+      known = numpy.min([v for v in other.seq_lens.values()], axis=0) >= 0
+      for key, value in other.seq_lens.items():
+        self.seq_lens[key][known] = value[known]
+    self._num_known = int(numpy.count_nonzero(numpy.min([v for v in self.seq_lens.values()], axis=0) >= 0))
+
+  def get_seq_len_func(self, key):
+    """
+    :param str key: data key
+    :return: function corpus seq idx -> len, e.g. for :func:`Dataset.get_seq_order_for_epoch`
+    :rtype: (int)->int
+    """
+    assert self.is_complete()
+    assert key in self.seq_lens, "%r: no data key %r" % (self, key)
+    return self.seq_lens[key].tolist().__getitem__
+
+  def save(self, filename):
+    """
+    :param str filename: npz
+    """
+    assert filename.endswith(".npz")
+    arrays = {"num_seqs": numpy.array(self.num_seqs)}
+    arrays.update({"seq_lens.%s" % key: value for (key, value) in self.seq_lens.items()})
+    # Write to a temp file first, as other jobs might read it in parallel.
+    tmp_filename = "%s.tmp-%i.npz" % (filename[:-len(".npz")], os.getpid())
+    numpy.savez(tmp_filename, **arrays)
+    os.rename(tmp_filename, filename)
+
+  @classmethod
+  def load(cls, filename):
+    """
+    :param str filename: npz, via :func:`save`
+    :rtype: SeqLenIndex
+    """
+    with numpy.load(filename) as f:
+      return SeqLenIndex(
+        num_seqs=int(f["num_seqs"]),
+        seq_lens={key[len("seq_lens."):]: f[key] for key in f.files if key.startswith("seq_lens.")})
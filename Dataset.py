@@ -379,20 +379,31 @@ class Dataset(object):
 
     return seq_index
 
-  def init_seq_order(self, epoch=None, seq_list=None):
+  def init_seq_order(self, epoch=None, seq_list=None, seq_order=None):
     """
     :type epoch: int|None
     :param list[str] | None seq_list: In case we want to set a predefined order.
+    :param list[int]|numpy.ndarray|None seq_order: predefined order as corpus seq indices,
+      i.e. indices into :func:`get_all_tags`. Only allowed if :func:`supports_seq_order`.
     :rtype: bool
     :returns whether the order changed (True is always safe to return)
 
     This is called when we start a new epoch, or at initialization.
     Call this when you reset the seq list.
     """
+    assert seq_order is None or self.supports_seq_order(), "%s: seq_order not supported" % self
     self.epoch = epoch
     self.rnd_seq_drop = Random(epoch or 1)
     return False
 
+  def supports_seq_order(self):
+    """
+    :return: whether :func:`init_seq_order` supports the ``seq_order`` argument.
+      This is much cheaper than a ``seq_list`` for big datasets, as we do not need to look up the tags.
+    :rtype: bool
+    """
+    return False
+
   def get_current_seq_order(self):
     """
     :return: many datasets use self.get_seq_order_for_epoch. this function would return the current seq order
@@ -1065,7 +1076,26 @@ def get_dataset_class(name):
   mod_names = [
     "HDFDataset", "SprintDataset", "GeneratingDataset", "NumpyDumpDataset",
     "MetaDataset", "LmDataset", "StereoDataset", "RawWavDataset"]
-  for mod_name in mod_names:
+  my_dir = os.path.dirname(os.path.abspath(__file__))
+
+  def _maybe_defined_in(mod_name_):
+    """
+    Importing all the modules is slow (e.g. h5py, Sprint stuff), so we look into the source first.
+
+    :param str mod_name_:
+    :rtype: bool
+    """
+    if mod_name_ in sys.modules:
+      return True
+    filename = "%s/%s.py" % (my_dir, mod_name_)
+    if not os.path.exists(filename):
+      return True
+    # Binary mode, as some of the files are not pure ASCII, and we should not depend on the locale.
+    with open(filename, "rb") as f:
+      return ("\nclass %s(" % name).encode("utf8") in f.read()
+
+  # If we did not find it via the source, fallback to try all the modules.
+  for mod_name in [mod_name for mod_name in mod_names if _maybe_defined_in(mod_name)] + mod_names:
     mod = import_module(mod_name)
     if name in vars(mod):
       clazz = getattr(mod, name)
@@ -1107,12 +1137,48 @@ def init_dataset(kwargs, extra_kwargs=None, default_kwargs=None):
       kwargs.setdefault(key, value)
   if extra_kwargs:
     kwargs.update(extra_kwargs)
+  if kwargs.get("seq_len_index_dir") and not kwargs.get("seq_len_index_key"):
+    kwargs["seq_len_index_key"] = get_dataset_config_hash(dict(kwargs, **{"class": clazz_name}))
   obj = clazz(**kwargs)
   assert isinstance(obj, Dataset)
   obj.initialize()
   return obj
 
 
+# These dataset options do not influence the seqs of the corpus or their lengths,
+# only e.g. the order, the epoch split or the chunking. Some are set via :func:`Dataset.kwargs_update_from_config`.
+_DatasetOptsIgnoredForConfigHash = {
+  "name", "seq_ordering", "partition_epoch", "repeat_epoch", "estimated_num_seqs",
+  "window", "context_window", "chunking", "min_chunk_size", "shuffle_frames_of_nseqs", "cache_byte_size",
+  "seq_len_index_dir", "seq_len_index_key", "seq_len_index_data_key"}
+
+
+def get_dataset_config_hash(kwargs):
+  """
+  Hash of the dataset options, e.g. to identify the dataset in some cache (see :class:`CachedDataset2.SeqLenIndex`).
+  Options which only change the seq order, such as ``seq_ordering`` or ``partition_epoch``, are ignored.
+  The options should only consist of plain Python values (no functions), otherwise the hash is not stable.
+
+  :param dict[str] kwargs: including "class"
+  :rtype: str
+  """
+  import hashlib
+
+  def _canonical_repr(obj):
+    """
+    :param object obj:
+    :rtype: str
+    """
+    if isinstance(obj, dict):
+      return "{%s}" % ", ".join(["%r: %s" % (k, _canonical_repr(v)) for (k, v) in sorted(obj.items())])
+    if isinstance(obj, (list, tuple)):
+      return "[%s]" % ", ".join([_canonical_repr(v) for v in obj])
+    return repr(obj)
+
+  kwargs = {key: value for (key, value) in kwargs.items() if key not in _DatasetOptsIgnoredForConfigHash}
+  return hashlib.md5(_canonical_repr(kwargs).encode("utf8")).hexdigest()
+
+
 def init_dataset_via_str(config_str, config=None, cache_byte_size=None, **kwargs):
   """
   :param str config_str: hdf-files, or "LmDataset:..." or so
@@ -1,7 +1,7 @@
 
 from __future__ import print_function
 
-from TaskSystem import AsyncTask, ProcConnectionDied
+from TaskSystem import AsyncTask, ProcConnectionDied, SharedMem, SharedNumpyBuffer
 from Updater import Updater
 from Util import cmd, progress_bar, dict_diff_str, hms, start_daemon_thread, interrupt_main, CalledProcessError, NumbersDict, custom_exec, dict_joined, attr_chain
 from Log import log
@@ -92,6 +92,25 @@ def sort_strint(txt):
   return [ str2int(i) for i in re.split('(\d+)', txt) ]
 
 
+def _write_arrays_to_shared_buffer(buffer, values):
+  """
+  Used for the params with shared_mem_transfer. See :class:`TaskSystem.SharedNumpyBuffer`.
+
+  :param SharedNumpyBuffer buffer: we are the writer
+  :param list[numpy.ndarray] values: will be stored as float32, by index "0", "1", ...
+  :return: message for the reader, or None if we cannot use the shared memory
+  :rtype: dict[str]|None
+  """
+  try:
+    arrays = buffer.alloc([("%i" % i, v.shape, "float32") for i, v in enumerate(values)])
+  except SharedMem.ShmException as exc:
+    print("%r: shared memory exception: %s. Fallback to the pipe." % (buffer, exc), file=log.v3)
+    return None
+  for i, v in enumerate(values):
+    arrays["%i" % i][...] = v
+  return buffer.get_message()
+
+
 class Device(object):
   def __init__(self, device, config, blocking=False, num_batches=1, update_specs=None):
     """
@@ -134,6 +153,14 @@ class Device(object):
     update_specs.setdefault('block_size', 0)
     self.update_specs = update_specs
     self.main_pid = os.getpid()
+    # With shared_mem_transfer, the batch data and the params are transferred via persistent shared memory,
+    # and only small control messages via the pipe. See _startProc().
+    self.shared_mem_transfer = False
+    self._shared_data_buffers = None; " :type: list[SharedNumpyBuffer] | None "  # double buffered
+    self._shared_data_buffer = None; " :type: SharedNumpyBuffer | None "  # of the current batch, via alloc_data()
+    self._shared_data_arrays = None; " :type: dict[str,numpy.ndarray] | None "
+    self._shared_params_buffer = None; " :type: SharedNumpyBuffer | None "  # host -> device
+    self._shared_train_params_buffer = None; " :type: SharedNumpyBuffer | None "  # device -> host
 
     if blocking:
       if device[0:3] == 'gpu':
@@ -226,6 +253,15 @@ class Device(object):
       env_update=env_update)
     # The connection (duplex pipe) is managed by AsyncTask.
     self.input_queue = self.output_queue = self.proc.conn
+    if self.config.bool("device_shared_mem_transfer", False):
+      if SharedMem.is_shmget_functioning():
+        self.shared_mem_transfer = True
+        self._shared_data_buffers = [
+          SharedNumpyBuffer(name="data%i" % i, check_alive=self.proc.is_alive) for i in range(2)]
+        self._shared_params_buffer = SharedNumpyBuffer(name="params", check_alive=self.proc.is_alive)
+        self._shared_train_params_buffer = SharedNumpyBuffer(name="train-params")
+      else:
+        print("Device %s: shmget does not work, cannot use device_shared_mem_transfer" % self.name, file=log.v3)
 
     try:
       self.id = self.output_queue.recv(); """ :type: int """
@@ -934,6 +970,9 @@ class Device(object):
     output_queue.send(len(self.trainnet.train_params_vars))
     print("Device %s proc, pid %i is ready for commands." % (device, os.getpid()), file=log.v4)
     network_params = []
+    shared_buffers = {}  # name -> SharedNumpyBuffer. we are the reader. via shared_mem_transfer
+    train_params_buffer = SharedNumpyBuffer(
+      name="train-params", check_alive=lambda: os.getppid() == asyncTask.parent_pid)  # we are the writer
     while True:
       cmd = input_queue.recv()
       if cmd == "stop":  # via self.terminate()
@@ -973,11 +1012,24 @@ class Device(object):
         #self.c.set_value(c.astype('int32'), borrow = True)
         for k in target_keys:
           self.j[k].set_value(self.output_index[k].astype('int8'), borrow = True)
-        try:
-          self.tags_var.set_value(numpy.array(self.tags).view(dtype='int8').reshape((len(self.tags), max(map(len, self.tags)))))
-        except:
-          tags = [s.encode('utf-8') for s in self.tags]
-          self.tags_var.set_value(numpy.array(tags).view(dtype='int8').reshape((len(tags), max(map(len, tags)))))
+        self._set_tags_var()
+        self.update_total_time += time.time() - update_start_time
+      elif cmd == "update-data-shared":  # via self.update_data() with shared_mem_transfer
+        msg, target_keys, self.tags = input_queue.recv()
+        if msg["name"] not in shared_buffers:
+          shared_buffers[msg["name"]] = SharedNumpyBuffer(name=msg["name"])
+        shared_buffer = shared_buffers[msg["name"]]
+        arrays = shared_buffer.read(msg)
+        update_start_time = time.time()
+        # Note that astype() copies, thus we do not keep any reference to the shared memory.
+        for k in target_keys:
+          self.y[k].set_value(arrays["targets:%s" % k].astype(self.y[k].dtype), borrow = True)
+        for k in target_keys:
+          self.j[k].set_value(arrays["index:%s" % k].astype('int8'), borrow = True)
+        if self.trainnet.loss in ('ctc', 'ce_ctc', 'hmm'):
+          self.cp.set_value(arrays["ctc_targets"].copy(), borrow = True)
+        shared_buffer.read_done()
+        self._set_tags_var()
         self.update_total_time += time.time() - update_start_time
       elif cmd == "set-learning-rate":  # via self.set_learning_rate()
         learning_rate = input_queue.recv()
@@ -985,28 +1037,19 @@ class Device(object):
           self.updater.setLearningRate(learning_rate)
       elif cmd == "set-net-params":  # via self.set_net_params()
         self.total_cost = 0
-        our_params_trainnet = self.trainnet.get_all_params_vars()
-        our_params_testnet = self.testnet.get_all_params_vars()
-        assert isinstance(our_params_trainnet, list)
         params_len = input_queue.recv()
-        params = [input_queue.recv_bytes() for i in range(params_len)]
+        params = [numpy.frombuffer(input_queue.recv_bytes(), dtype='float32') for i in range(params_len)]
         assert input_queue.recv() == "end-set-net-params"
-        assert len(params) == len(our_params_trainnet)
-        if self.testnet_share_params:
-          assert len(our_params_testnet) == 0
-        else:
-          assert len(params) == len(our_params_testnet)
-        for i in range(params_len):
-          param_str = params[i]
-          param = numpy.fromstring(param_str, dtype='float32')
-          our_p_train = our_params_trainnet[i]
-          our_param_shape = our_p_train.get_value(borrow=True, return_internal_type=True).shape
-          assert numpy.prod(our_param_shape) == numpy.prod(param.shape)
-          #assert numpy.isfinite(param).all()
-          converted = param.reshape(our_param_shape)
-          our_p_train.set_value(converted)
-          if not self.testnet_share_params:
-            our_params_testnet[i].set_value(converted)
+        self._set_own_net_params(params)
+      elif cmd == "set-net-params-shared":  # via self.set_net_encoded_params() with shared_mem_transfer
+        self.total_cost = 0
+        msg = input_queue.recv()
+        if msg["name"] not in shared_buffers:
+          shared_buffers[msg["name"]] = SharedNumpyBuffer(name=msg["name"])
+        shared_buffer = shared_buffers[msg["name"]]
+        arrays = shared_buffer.read(msg)
+        self._set_own_net_params([arrays["%i" % i] for i in range(len(arrays))])  # set_value() copies
+        shared_buffer.read_done()
       elif cmd == 'get-num-updates':
         if self.updater:
           output_queue.send(int(self.updater.i.get_value()))
@@ -1014,16 +1057,23 @@ class Device(object):
           output_queue.send(0)
       elif cmd == 'get-total-cost':
         output_queue.send(self.total_cost)
-      elif cmd == "get-net-train-params":  # via self.get_net_train_params()
-        output_queue.send("net-train-params")
-        output_queue.send(len(network_params))
-        for p in network_params:
-          output_queue.send_bytes(p)
-        output_queue.send("end-get-net-train-params")
+      elif cmd in ("get-net-train-params", "get-net-train-params-shared"):  # via self.get_net_train_params()
+        shared_msg = None
+        if cmd == "get-net-train-params-shared":
+          shared_msg = _write_arrays_to_shared_buffer(train_params_buffer, network_params)
+        if shared_msg:
+          output_queue.send("net-train-params-shared")
+          output_queue.send(shared_msg)
+        else:
+          output_queue.send("net-train-params")
+          output_queue.send(len(network_params))
+          for p in network_params:
+            output_queue.send_bytes(p.tobytes())
+          output_queue.send("end-get-net-train-params")
       elif cmd == "sync-net-train-params":
         network_params = []
         for p in self.trainnet.get_all_params_vars():
-          network_params.append(numpy.asarray(p.get_value(), dtype='float32').tostring())
+          network_params.append(numpy.array(p.get_value(), dtype='float32'))
       elif cmd == "task":  # via self.run()
         task = input_queue.recv()
         try:
@@ -1048,6 +1098,36 @@ class Device(object):
       else:
         raise Exception("cmd %s unknown" % cmd)
 
+  def _set_tags_var(self):
+    try:
+      self.tags_var.set_value(numpy.array(self.tags).view(dtype='int8').reshape((len(self.tags), max(map(len, self.tags)))))
+    except:
+      tags = [s.encode('utf-8') for s in self.tags]
+      self.tags_var.set_value(numpy.array(tags).view(dtype='int8').reshape((len(tags), max(map(len, tags)))))
+
+  def _set_own_net_params(self, params):
+    """
+    :param list[numpy.ndarray] params: float32, maybe flat. for all params. we copy them
+    """
+    assert self.is_device_proc()
+    our_params_trainnet = self.trainnet.get_all_params_vars()
+    our_params_testnet = self.testnet.get_all_params_vars()
+    assert isinstance(our_params_trainnet, list)
+    assert len(params) == len(our_params_trainnet)
+    if self.testnet_share_params:
+      assert len(our_params_testnet) == 0
+    else:
+      assert len(params) == len(our_params_testnet)
+    for i, param in enumerate(params):
+      our_p_train = our_params_trainnet[i]
+      our_param_shape = our_p_train.get_value(borrow=True, return_internal_type=True).shape
+      assert numpy.prod(our_param_shape) == numpy.prod(param.shape)
+      #assert numpy.isfinite(param).all()
+      converted = param.reshape(our_param_shape)
+      our_p_train.set_value(converted)
+      if not self.testnet_share_params:
+        our_params_testnet[i].set_value(converted)
+
   def sync_net_train_params(self):
     if not self.blocking:
       self.input_queue.send("sync-net-train-params")
@@ -1057,8 +1137,15 @@ class Device(object):
       return [v.get_value(borrow=True, return_internal_type=True) for v in self.trainnet.get_all_params_vars()]
     else:
       assert self.main_pid == os.getpid()
-      self.input_queue.send("get-net-train-params")
+      self.input_queue.send("get-net-train-params-shared" if self.shared_mem_transfer else "get-net-train-params")
       r = self.output_queue.recv()
+      if r == "net-train-params-shared":
+        arrays = self._shared_train_params_buffer.read(self.output_queue.recv())
+        vars = network.get_all_params_vars()
+        assert len(arrays) == len(vars)
+        res = [numpy.array(arrays["%i" % i]).reshape(p.get_value().shape) for i, p in enumerate(vars)]
+        self._shared_train_params_buffer.read_done()
+        return res
       assert r == "net-train-params"
       param_count = self.output_queue.recv()
       assert param_count == len(network.get_all_params_vars())
@@ -1077,10 +1164,16 @@ class Device(object):
     This updates *all* params, not just the train params.
     """
     assert not self.blocking
+    if self.shared_mem_transfer:
+      shared_msg = _write_arrays_to_shared_buffer(self._shared_params_buffer, network_params)
+      if shared_msg:
+        self.input_queue.send("set-net-params-shared")
+        self.input_queue.send(shared_msg)
+        return
     self.input_queue.send("set-net-params")
     self.input_queue.send(len(network_params))
     for p in network_params:
-      self.input_queue.send_bytes(p.astype('float32').tostring())
+      self.input_queue.send_bytes(p.astype('float32').tobytes())
     self.input_queue.send("end-set-net-params")
 
   def set_net_params(self, network):
@@ -1151,10 +1244,47 @@ class Device(object):
     assert all([s > 0 for s in shapes["data"]])
     # For output_shape, we allow zeros, because e.g. in forwarding, we don't know them and will not use it.
     import theano
+    self.tags = [None] * shapes["data"][1]  # type: list[str]  # seq-name for each batch slice
+    ctc_targets_shape = (shapes.get('classes', [0,0])[1], max_ctc_length)
+    if self.shared_mem_transfer:
+      # We alternate between two buffers, because the device proc might not have read the previous batch yet.
+      self._shared_data_buffer = self._shared_data_buffers[0]
+      self._shared_data_buffers.reverse()
+      try:
+        self._shared_data_arrays = self._shared_data_buffer.alloc(
+          [("targets:%s" % k, shapes[k], theano.config.floatX) for k in self.used_data_keys] +
+          [("index:%s" % k, shapes[k][0:2], "int8") for k in self.used_data_keys] +
+          [("ctc_targets", ctc_targets_shape, theano.config.floatX)])
+      except SharedMem.ShmException as exc:
+        print("Device %s: shared memory exception: %s. Fallback to the pipe." % (self.name, exc), file=log.v3)
+        self.shared_mem_transfer = False
+      else:
+        self.targets = {k: self._shared_data_arrays["targets:%s" % k] for k in self.used_data_keys}
+        self.output_index = {k: self._shared_data_arrays["index:%s" % k] for k in self.used_data_keys}
+        self.ctc_targets = self._shared_data_arrays["ctc_targets"]
+        for k in self.used_data_keys:
+          self.targets[k].fill(-1)
+          self.output_index[k].fill(0)
+        self.ctc_targets.fill(0)
+        return
     self.targets = {k: numpy.full(shapes[k], -1, dtype=theano.config.floatX) for k in self.used_data_keys}
-    self.ctc_targets = numpy.zeros((shapes.get('classes', [0,0])[1], max_ctc_length), dtype=theano.config.floatX)
+    self.ctc_targets = numpy.zeros(ctc_targets_shape, dtype=theano.config.floatX)
     self.output_index = {k: numpy.zeros(shapes[k][0:2], dtype='int8') for k in self.used_data_keys}
-    self.tags = [None] * shapes["data"][1]  # type: list[str]  # seq-name for each batch slice
+
+  def _is_data_in_shared_buffer(self):
+    """
+    :return: whether the current data is in the shared memory from alloc_data().
+      E.g. EngineUtil._device_maybe_enlarge_data() can replace the arrays.
+    :rtype: bool
+    """
+    if not self.shared_mem_transfer or not self._shared_data_arrays:
+      return False
+    for k in self.used_data_keys:
+      if self.targets[k] is not self._shared_data_arrays["targets:%s" % k]:
+        return False
+      if self.output_index[k] is not self._shared_data_arrays["index:%s" % k]:
+        return False
+    return self.ctc_targets is self._shared_data_arrays["ctc_targets"]
 
   def update_data(self):
     # self.data is set in Engine.allocate_devices()
@@ -1167,6 +1297,10 @@ class Device(object):
       if self.trainnet.loss in ('ctc','ce_ctc', 'hmm'):
         self.cp.set_value(self.ctc_targets)
       self.update_total_time += time.time() - update_start_time
+    elif self._is_data_in_shared_buffer():
+      assert self.main_pid == os.getpid()
+      self.input_queue.send("update-data-shared")
+      self.input_queue.send((self._shared_data_buffer.get_message(), list(sorted(self.used_data_keys)), self.tags))
     else:
       assert self.main_pid == os.getpid()
       self.input_queue.send("update-data")
@@ -8,6 +8,7 @@ import collections
 import gc
 import h5py
 import numpy
+import typing
 from CachedDataset import CachedDataset
 from CachedDataset2 import CachedDataset2
 from Dataset import Dataset, DatasetSeq
@@ -214,8 +215,42 @@ class HDFDataset(CachedDataset):
       fin.close()
     gc.collect()
 
+  def _load_real_seqs_into_seq_cache(self, real_seq_idxs):
+    """
+    Used for cache_backend="slab_lru", see :class:`CachedDataset.SeqSlabCache`.
+
+    :param list[int] real_seq_idxs:
+    """
+    seqs_by_file = {}  # type: typing.Dict[int,typing.List[int]]  # file idx -> real seq idxs
+    for ids in real_seq_idxs:
+      seqs_by_file.setdefault(self.file_index[ids], []).append(ids)
+    for i, file_real_seq_idxs in sorted(seqs_by_file.items()):
+      fin = h5py.File(self.files[i], 'r')
+      inputs = fin['inputs']
+      targets = {}
+      if 'targets' in fin:
+        targets = {k: fin['targets/data/' + k] for k in fin['targets/data']}
+      for ids in sorted(file_real_seq_idxs):
+        s = ids - self.file_start[i]
+        p = self.file_seq_start[i][s]
+        l = self._seq_lengths[ids]
+        seq_targets = {}
+        for k, target in targets.items():
+          ldx = self.target_keys.index(k) + 1
+          seq_targets[k] = target[p[ldx]:p[ldx] + l[ldx]]
+        self._put_into_seq_cache(ids, data=inputs[p[0]:p[0] + l[0]], targets=seq_targets)
+      fin.close()
+
+  def _is_cache_used(self):
+    """
+    :return: whether we read the data via the cache (alloc intervals or seq cache), or directly from the file
+    :rtype: bool
+    """
+    # With cache_byte_size=-1, the alloc intervals are not used, but the seq cache is.
+    return self.cache_byte_size_total_limit > 0 or self._is_seq_cache_enabled()
+
   def get_data(self, seq_idx, key):
-    if self.cache_byte_size_total_limit > 0:  # Use the cache?
+    if self._is_cache_used():
       return super(HDFDataset, self).get_data(seq_idx, key)
 
     # Otherwise, directly read it from file now.
@@ -238,12 +273,12 @@ class HDFDataset(CachedDataset):
     return data
 
   def get_input_data(self, sorted_seq_idx):
-    if self.cache_byte_size_total_limit > 0:  # Use the cache?
+    if self._is_cache_used():
       return super(HDFDataset, self).get_input_data(sorted_seq_idx)
     return self.get_data(sorted_seq_idx, "data")
 
   def get_targets(self, target, sorted_seq_idx):
-    if self.cache_byte_size_total_limit > 0:  # Use the cache?
+    if self._is_cache_used():
       return super(HDFDataset, self).get_targets(target, sorted_seq_idx)
     return self.get_data(sorted_seq_idx, target)
 
@@ -755,12 +790,25 @@ class SiameseHDFDataset(CachedDataset2):
 
 
 class SimpleHDFWriter:
-  def __init__(self, filename, dim, labels=None, ndim=None):
+  """
+  Writes batches (e.g. the network output) into an HDF file, which can be read by :class:`HDFDataset`.
+
+  The inserted batches are buffered in memory and written in big contiguous chunks,
+  by default from a background thread, such that the caller (e.g. the forwarding loop) is not blocked
+  by many tiny HDF5 writes.
+  The HDF datasets are grown geometrically, and shrunk to the final size in :func:`close`.
+  At most one chunk is written while the next one is being buffered,
+  thus the buffered memory is bounded by about `max_buffer_size` (plus one batch).
+  """
+
+  def __init__(self, filename, dim, labels=None, ndim=None, max_buffer_size=100 * 1024 * 1024, write_in_background=True):
     """
     :param str filename:
     :param int|None dim:
     :param int ndim: counted without batch
     :param list[str]|None labels:
+    :param int max_buffer_size: in bytes. every time half of this is buffered, we write it out
+    :param bool write_in_background: write the buffered chunks in a separate thread
     """
     if ndim is None:
       if dim is None:
@@ -773,10 +821,10 @@ class SimpleHDFWriter:
     self.labels = labels
     if labels:
       assert len(labels) == dim
+    self.max_buffer_size = max_buffer_size
     self._file = h5py.File(filename, "w")
 
     self._file.attrs['numTimesteps'] = 0  # we will increment this on-the-fly
-    self._other_num_time_steps = 0
     self._file.attrs['inputPattSize'] = dim or 1
     self._file.attrs['numDims'] = 1  # ignored?
     self._file.attrs['numLabels'] = dim or 1
@@ -786,80 +834,136 @@ class SimpleHDFWriter:
     else:
       self._file.create_dataset('labels', (0,), dtype="S5")
 
-    self._datasets = {}  # type: dict[str, h5py.Dataset]
-    self._tags = []  # type: list[str]
+    self._datasets = {}  # type: typing.Dict[str,h5py.Dataset]
+    self._dataset_sizes = {}  # type: typing.Dict[str,int]  # used size, the HDF dataset can be bigger
+    self._tags = []  # type: typing.List[typing.Union[str,bytes]]
+    self._num_seqs = 0
     self._seq_lengths = self._file.create_dataset("seqLengths", (0, 2), dtype='i', maxshape=(None, 2))
+    self._dataset_sizes["seqLengths"] = 0
+
+    self._buffer = self._new_buffer()
+    self._buffer_size = 0
+    self._closed = False
+    self._writer_exception = None  # type: typing.Optional[BaseException]
+    self._writer_queue = None
+    if write_in_background:
+      from Util import start_daemon_thread
+      from Util import PY3
+      if PY3:
+        import queue
+      else:
+        # noinspection PyUnresolvedReferences,PyPep8Naming
+        import Queue as queue
+      self._writer_queue = queue.Queue()
+      start_daemon_thread(target=self._writer_thread_loop)
 
-  def _insert_h5_inputs(self, raw_data):
+  @staticmethod
+  def _new_buffer():
     """
-    Inserts a record into the hdf5-file.
-    Resizes if necessary.
-
-    :param numpy.ndarray raw_data: shape=(time,data) or shape=(time,)
+    :return: buffer for a new chunk. data key -> list of arrays, concatenated along the time axis.
+      "seqLengths" is special, it has one entry per seq.
+    :rtype: dict[str,list[numpy.ndarray]]
+    """
+    return {"seqLengths": []}
+
+  def _writer_thread_loop(self):
+    while True:
+      chunk = self._writer_queue.get()
+      if chunk is None:
+        self._writer_queue.task_done()
+        return
+      # noinspection PyBroadException
+      try:
+        if not self._writer_exception:
+          self._write_chunk(chunk)
+      except BaseException as exc:
+        self._writer_exception = exc
+      finally:
+        self._writer_queue.task_done()
+
+  def _check_writer_exception(self):
+    if self._writer_exception:
+      raise Exception("%s: exception in writer thread: %r" % (self.__class__.__name__, self._writer_exception))
+
+  def _get_h5_dataset(self, name, raw_data):
+    """
+    :param str name: "inputs", "seqLengths" or other data key
+    :param numpy.ndarray raw_data: first data, to create the dataset
+    :rtype: h5py.Dataset
     """
-    assert raw_data.ndim >= 1
-    name = "inputs"
-    if name not in self._datasets:
-      self._datasets[name] = self._file.create_dataset(
+    if name in self._datasets:
+      return self._datasets[name]
+    if name == "seqLengths":
+      dataset = self._seq_lengths
+    elif name == "inputs":
+      dataset = self._file.create_dataset(
         name, raw_data.shape, raw_data.dtype, maxshape=tuple(None for _ in raw_data.shape))
     else:
-      old_shape = self._datasets[name].shape
-      self._datasets[name].resize((old_shape[0] + raw_data.shape[0],) + old_shape[1:])
-    # append raw data to dataset
-    self._datasets[name][self._file.attrs['numTimesteps']:] = raw_data
-    self._file.attrs['numTimesteps'] += raw_data.shape[0]
-    self._file.attrs['numSeqs'] += 1
-
-  def _insert_h5_other(self, data_key, raw_data, dtype=None, add_time_dim=False, dim=None):
-    """
-    :param str data_key:
-    :param numpy.ndarray|int|float|list[int] raw_data: shape=(time,data) or shape=(time,) or shape=()...
-    :param str dtype:
-    :param bool add_time_dim:
-    :param int|None dim:
-    """
-    if isinstance(raw_data, (int, float, list)):
-      raw_data = numpy.array(raw_data)
-    assert isinstance(raw_data, numpy.ndarray)
-    if add_time_dim:
-      raw_data = raw_data[None, :]
-    assert raw_data.ndim > 0 and raw_data.shape[0] > 0
-    if dtype:
-      raw_data = raw_data.astype(dtype)
-    if dim is None:
-      if raw_data.ndim > 1:
-        dim = raw_data.shape[-1]
-      else:
-        dim = 1  # dummy
-    assert data_key != "inputs"
-    name = data_key
-    # Keep consistent with _insert_h5_inputs.
-    if name not in self._datasets:
       if 'targets/data' not in self._file:
         self._file.create_group('targets/data')
       if 'targets/size' not in self._file:
         self._file.create_group('targets/size')
       if "targets/labels" not in self._file:
         self._file.create_group("targets/labels")
-      Util.hdf5_strings(self._file, "targets/labels/%s" % data_key, ["dummy-label"])
-      self._datasets[name] = self._file['targets/data'].create_dataset(
-        data_key, raw_data.shape, raw_data.dtype, maxshape=tuple(None for _ in raw_data.shape))
-      self._file['targets/size'].attrs[data_key] = [dim, raw_data.ndim]  # (dim, ndim)
-    else:
-      old_shape = self._datasets[name].shape
-      self._datasets[name].resize((old_shape[0] + raw_data.shape[0],) + old_shape[1:])
+      Util.hdf5_strings(self._file, "targets/labels/%s" % name, ["dummy-label"])
+      dataset = self._file['targets/data'].create_dataset(
+        name, raw_data.shape, raw_data.dtype, maxshape=tuple(None for _ in raw_data.shape))
+      dim = raw_data.shape[-1] if raw_data.ndim > 1 else 1  # dummy
+      self._file['targets/size'].attrs[name] = [dim, raw_data.ndim]  # (dim, ndim)
+    self._datasets[name] = dataset
+    self._dataset_sizes[name] = 0
+    return dataset
 
-    assert self._file.attrs['numSeqs'] > 0 and self._seq_lengths.shape[0] > 0  # assume _insert_h5_inputs called before
+  def _write_chunk(self, chunk):
+    """
+    Writes the buffered chunk to the HDF file.
+    Each HDF dataset gets only a single write, and is resized geometrically (see :func:`close`).
 
-    if self._seq_lengths[self._file.attrs['numSeqs'] - 1, 1]:
-      assert self._seq_lengths[self._file.attrs['numSeqs'] - 1, 1] == raw_data.shape[0]
+    :param dict[str,list[numpy.ndarray]] chunk: see :func:`_new_buffer`
+    """
+    for name, values in sorted(chunk.items()):
+      if not values:
+        continue
+      if name == "seqLengths":
+        raw_data = numpy.array(values, dtype="int32")
+      elif len(values) == 1:
+        raw_data = values[0]
+      else:
+        raw_data = numpy.concatenate(values, axis=0)
+      dataset = self._get_h5_dataset(name, raw_data=raw_data)
+      offset = self._dataset_sizes[name]
+      new_size = offset + raw_data.shape[0]
+      if new_size > dataset.shape[0]:
+        dataset.resize((max(new_size, dataset.shape[0] * 2),) + dataset.shape[1:])
+      dataset[offset:new_size] = raw_data
+      self._dataset_sizes[name] = new_size
+    self._file.attrs['numTimesteps'] = self._dataset_sizes.get("inputs", 0)
+    self._file.attrs['numSeqs'] = self._dataset_sizes["seqLengths"]
+
+  def _flush(self):
+    """
+    Hands the current buffer over to the writer.
+    If there is a writer thread, waits until the previous chunk is written, such that there is at most one.
+    """
+    chunk = self._buffer
+    self._buffer = self._new_buffer()
+    self._buffer_size = 0
+    if not chunk["seqLengths"]:
+      return
+    if self._writer_queue:
+      self._writer_queue.join()
+      self._check_writer_exception()
+      self._writer_queue.put(chunk)
     else:
-      self._seq_lengths[self._file.attrs['numSeqs'] - 1, 1] = raw_data.shape[0]
-      self._other_num_time_steps += raw_data.shape[0]
+      self._write_chunk(chunk)
 
-    offset = self._other_num_time_steps - raw_data.shape[0]
-    hdf_data = self._datasets[name]
-    hdf_data[offset:] = raw_data
+  def _add_to_buffer(self, name, raw_data):
+    """
+    :param str name: "inputs" or other data key
+    :param numpy.ndarray raw_data: shape=(time,...), will be copied
+    """
+    self._buffer.setdefault(name, []).append(numpy.array(raw_data))
+    self._buffer_size += raw_data.nbytes
 
   def insert_batch(self, inputs, seq_len, seq_tag, extra=None):
     """
@@ -868,6 +972,8 @@ class SimpleHDFWriter:
     :param list[str|bytes] seq_tag: sequence tags of length n_batch
     :param dict[str,numpy.ndarray]|None extra:
     """
+    assert not self._closed
+    self._check_writer_exception()
     n_batch = len(seq_tag)
     assert n_batch == inputs.shape[0]
     assert inputs.ndim == self.ndim + 1  # one more for the batch-dim
@@ -885,41 +991,64 @@ class SimpleHDFWriter:
     if extra:
       assert all([n_batch == value.shape[0] for value in extra.values()])
 
-    seqlen_offset = self._seq_lengths.shape[0]
-    self._seq_lengths.resize(seqlen_offset + n_batch, axis=0)
-
     for i in range(n_batch):
       self._tags.append(seq_tag[i])
       # Note: Currently, our HDFDataset does not support to have multiple axes with dynamic length.
       # Thus, we flatten all together, and calculate the flattened seq len.
       # (Ignore this if there is only a single time dimension.)
-      flat_seq_len = numpy.prod([seq_len[axis][i] for axis in range(ndim_with_seq_len)])
+      flat_seq_len = int(numpy.prod([seq_len[axis][i] for axis in range(ndim_with_seq_len)]))
       assert flat_seq_len > 0
       flat_shape = [flat_seq_len]
       if self.dim:
         flat_shape.append(self.dim)
-      self._seq_lengths[seqlen_offset + i, 0] = flat_seq_len
       data = inputs[i]
       data = data[tuple([slice(None, seq_len[axis][i]) for axis in range(ndim_with_seq_len)])]
       data = numpy.reshape(data, flat_shape)
-      self._insert_h5_inputs(data)
+      self._add_to_buffer("inputs", data)
+      other_seq_len = 0
       if len(seq_len) > 1:
         # Note: Because we have flattened multiple axes with dynamic len into a single one,
         # we want to store the individual axes lengths. We store those in a separate data entry "sizes".
         # Note: We could add a dummy time-dim for this "sizes", and then have a feature-dim = number of axes.
         # However, we keep it consistent to how we handled it in our 2D MDLSTM experiments.
-        self._insert_h5_other(
-          "sizes", [seq_len[axis][i] for axis in range(ndim_with_seq_len)], add_time_dim=False, dtype="int32")
+        self._add_to_buffer(
+          "sizes", numpy.array([seq_len[axis][i] for axis in range(ndim_with_seq_len)], dtype="int32"))
+        other_seq_len = ndim_with_seq_len
       if extra:
         assert len(seq_len) == 1  # otherwise you likely will get trouble with seq len mismatch
         for key, value in extra.items():
-          self._insert_h5_other(key, value[i])
+          assert key not in ["inputs", "seqLengths"]
+          value_seq = value[i]
+          assert value_seq.ndim > 0 and value_seq.shape[0] > 0
+          if other_seq_len:
+            assert other_seq_len == value_seq.shape[0], "all extra data must have the same seq len"
+          other_seq_len = value_seq.shape[0]
+          self._add_to_buffer(key, value_seq)
+      self._buffer["seqLengths"].append((flat_seq_len, other_seq_len))
+
+    if self._buffer_size * 2 >= self.max_buffer_size:
+      self._flush()
 
   def close(self):
+    """
+    Writes all remaining data, the seq tags, and closes the file.
+    """
+    if self._closed:
+      return
+    self._flush()
+    if self._writer_queue:
+      self._writer_queue.join()
+      self._writer_queue.put(None)  # exit the thread
+    self._closed = True
+    self._check_writer_exception()
+    # Shrink the datasets to the used size. See _write_chunk.
+    for name, dataset in self._datasets.items():
+      if dataset.shape[0] != self._dataset_sizes[name]:
+        dataset.resize((self._dataset_sizes[name],) + dataset.shape[1:])
+    assert len(self._tags) == self._dataset_sizes["seqLengths"]
     max_tag_len = max([len(d) for d in self._tags]) if self._tags else 0
-    self._file.create_dataset('seqTags', shape=(len(self._tags),), dtype="S%i" % (max_tag_len + 1))
-    for i, tag in enumerate(self._tags):
-      self._file['seqTags'][i] = numpy.array(tag, dtype="S%i" % (max_tag_len + 1))
+    dtype = "S%i" % (max_tag_len + 1)
+    self._file.create_dataset('seqTags', data=numpy.array(self._tags, dtype=dtype), dtype=dtype)
     self._file.close()
 
 
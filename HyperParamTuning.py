@@ -18,20 +18,35 @@ Also, instead of always starting from scratch, we could keep intermediate result
 or use real training intermediate results and resume from them.
 We could even do some simple search in the beginning of each epoch when we keep it cheap enough.
 
+Each individual is trained in its own worker process (fork+exec via :class:`TaskSystem.AsyncTask`),
+with its own thread budget (``num_threads_per_worker``).
+``num_workers`` of them run in parallel.
+The train data is written once to shared memory, and all the workers map it read-only.
+With ``successive_halving_num_rungs`` > 1, we use successive halving:
+All individuals are trained on the first part of the train data (a rung),
+then only the best ``1 / successive_halving_eta`` of them continue training on the next part, and so on.
+The train data until the end of a rung is ``successive_halving_eta`` times the train data until the end of
+the previous rung, i.e. each rung is ``successive_halving_eta - 1`` times as large as the previous rungs together.
+The worker process of an individual keeps its engine between the rungs, such that it continues the training.
+The evaluation measure of a rung is the train score on the new part of the data.
+
 Also, we could store the population of hyper params on disk to allow resuming of a search.
 """
 
 from __future__ import print_function
 
+import os
 import sys
 import time
+import math
+import typing
 import numpy
 import tensorflow as tf
 from Config import Config
 from Log import log
 from Dataset import Dataset
 from GeneratingDataset import StaticDataset
-from TFEngine import Engine, Runner, CancelTrainingException
+from TFEngine import Engine, Runner
 from Util import CollectionReadCheckCovered, hms_fraction, guess_requested_max_num_threads
 
 
@@ -264,6 +279,7 @@ class Individual:
     """
     self.hyper_param_mapping = hyper_param_mapping
     self.cost = None
+    self.num_trained_rungs = 0  # successive halving. the cost is from the last trained rung
     self.name = name
 
   def cross_over(self, hyper_params, population, random_seed):
@@ -319,8 +335,56 @@ class Optimization:
     self.num_kill_individuals = self.opts.get(
       "num_kill_individuals", self.num_individuals // 2)
     self.num_best = self.opts.get("num_best", 10)
-    self.num_threads = self.opts.get("num_threads", guess_requested_max_num_threads())
+    num_threads = self.opts.get("num_threads", guess_requested_max_num_threads() or 1)
+    self.num_workers = self.opts.get("num_workers", num_threads)  # num_threads is the old name
+    self.num_threads_per_worker = self.opts.get(
+      "num_threads_per_worker", max((guess_requested_max_num_threads() or 1) // self.num_workers, 1))
+    self.num_rungs = self.opts.get("successive_halving_num_rungs", 1)
+    self.successive_halving_eta = self.opts.get("successive_halving_eta", 2)
     self.opts.assert_all_read()
+    assert self.num_rungs >= 1 and self.successive_halving_eta >= 2
+    self.rung_seq_ends = self._get_rung_seq_ends()
+    self.shared_train_data = None  # type: typing.Optional[_SharedTrainData]  # in work()
+
+  def _get_rung_seq_ends(self):
+    """
+    :return: for each successive halving rung, the end seq idx of the train data.
+      rung i trains on the seqs from the end of rung i - 1 until its end.
+      each end is ``successive_halving_eta`` times the previous end (approximately, as we round),
+      i.e. each rung has ``successive_halving_eta - 1`` times the seqs of the previous rungs together.
+    :rtype: list[int]
+    """
+    num_seqs = len(self.train_data.data)
+    assert num_seqs >= self.num_rungs, "not enough train seqs for %i successive halving rungs" % self.num_rungs
+    seq_ends = []
+    for rung_idx in range(self.num_rungs):
+      frac = float(self.successive_halving_eta) ** (rung_idx - self.num_rungs + 1)
+      seq_end = int(math.ceil(num_seqs * frac))
+      if seq_ends:
+        seq_end = max(seq_end, seq_ends[-1] + 1)
+      seq_ends.append(seq_end)
+    assert seq_ends[-1] == num_seqs
+    return seq_ends
+
+  def get_rung_seq_range(self, rung_idx):
+    """
+    :param int rung_idx:
+    :return: start seq idx, end seq idx of the train data for the successive halving rung
+    :rtype: (int,int)
+    """
+    return (self.rung_seq_ends[rung_idx - 1] if rung_idx > 0 else 0), self.rung_seq_ends[rung_idx]
+
+  def select_rung_survivors(self, individuals):
+    """
+    Successive halving: After a rung, only the best ``1 / successive_halving_eta`` of the individuals continue.
+
+    :param list[Individual] individuals: which were trained on the rung, i.e. have the cost of it
+    :return: the individuals which continue, sorted by cost, and the stopped individuals
+    :rtype: (list[Individual], list[Individual])
+    """
+    individuals = sorted(individuals, key=lambda p: p.cost)
+    num_continue = max(len(individuals) // self.successive_halving_eta, 1)
+    return individuals[:num_continue], individuals[num_continue:]
 
   def _find_hyper_params(self, base=None, visited=None):
     """
@@ -408,46 +472,48 @@ class Optimization:
     if isinstance(gpu_opts, dict):
       gpu_opts = tf.GPUOptions(**gpu_opts)
     gpu_opts.visible_device_list = ",".join(map(str, sorted(gpu_ids)))
+    gpu_opts.allow_growth = True  # multiple worker processes can share a GPU
     return config
 
   def work(self):
-    print("Starting hyper param search. Using %i threads." % self.num_threads, file=log.v1)
+    print("Starting hyper param search. Using %i worker processes with %i threads each." % (
+      self.num_workers, self.num_threads_per_worker), file=log.v1)
     from TFUtil import get_available_gpu_devices
-    from Log import wrap_log_streams, StreamDummy
     from threading import Thread, Condition
     from Util import progress_bar, hms, is_tty
 
     class Outstanding:
       cond = Condition()
       threads = []  # type: list[WorkerThread]
-      population = []
+      population = []  # type: list[Individual]
+      worker_procs = {}  # type: dict[Individual,_IndividualWorkerProcess]
       exit = False
       exception = None
 
     class WorkerThread(Thread):
-      def __init__(self, gpu_ids):
+      def __init__(self, rung_idx, gpu_ids):
         """
-        :param set[int] gpu_ids:
+        :param int rung_idx: successive halving rung
+        :param set[int] gpu_ids: for new worker processes
         """
         super(WorkerThread, self).__init__(name="Hyper param tune train thread")
+        self.rung_idx = rung_idx
         self.gpu_ids = gpu_ids
-        self.trainer = None  # type: _IndividualTrainer
+        self.worker_proc = None  # type: _IndividualWorkerProcess
         self.finished = False
         self.start()
 
       def cancel(self, join=False):
         with Outstanding.cond:
-          if self.trainer:
-            self.trainer.cancel_flag = True
-            if self.trainer.runner:
-              self.trainer.runner.cancel_flag = True
+          if self.worker_proc:
+            self.worker_proc.cancel()
         if join:
           self.join()
 
       def get_complete_frac(self):
         with Outstanding.cond:
-          if self.trainer and self.trainer.runner:
-            return self.trainer.runner.data_provider.get_complete_frac()
+          if self.worker_proc:
+            return self.worker_proc.complete_frac
         return 0.0
 
       def run(self_thread):
@@ -461,22 +527,79 @@ class Optimization:
                 Outstanding.cond.notify_all()
                 return
               individual = Outstanding.population.pop(0)
-              self_thread.trainer = _IndividualTrainer(optim=self, individual=individual, gpu_ids=self_thread.gpu_ids)
+              if individual not in Outstanding.worker_procs:
+                Outstanding.worker_procs[individual] = _IndividualWorkerProcess(
+                  optim=self, individual=individual, gpu_ids=self_thread.gpu_ids)
+              self_thread.worker_proc = Outstanding.worker_procs[individual]
             self_thread.name = "Hyper param tune train thread on %r" % individual.name
-            self_thread.trainer.run()
+            cost = self_thread.worker_proc.train(*self.get_rung_seq_range(self_thread.rung_idx))
+            with Outstanding.cond:
+              individual.cost = cost
+              individual.num_trained_rungs = self_thread.rung_idx + 1
+              self_thread.worker_proc = None
         except Exception as exc:
           with Outstanding.cond:
+            # Other exceptions are likely just a consequence of the first one (we cancel all others).
+            is_first_exception = not Outstanding.exception and not Outstanding.exit
             if not Outstanding.exception:
               Outstanding.exception = exc or True
             Outstanding.cond.notify_all()
           for thread in Outstanding.threads:
             if thread is not self_thread:
               thread.cancel()
-          if not isinstance(exc, CancelTrainingException):
+          if is_first_exception:
             with Outstanding.cond:  # So that we don't mix up multiple on sys.stderr.
               # This would normally dump it on sys.stderr so it's fine.
               sys.excepthook(*sys.exc_info())
 
+    def train_rung(rung_idx, individuals):
+      """
+      Trains all the individuals in parallel in the worker processes, on the train data of the rung.
+
+      :param int rung_idx: successive halving rung
+      :param list[Individual] individuals:
+      """
+      if not individuals:
+        return
+      rung_start_time = time.time()
+      Outstanding.exit = False
+      Outstanding.population = list(individuals)
+      Outstanding.threads = [
+        WorkerThread(rung_idx=rung_idx, gpu_ids={i % num_gpus})
+        for i in range(min(self.num_workers, len(individuals)))]
+      try:
+        while True:
+          with Outstanding.cond:
+            if all([thread.finished for thread in Outstanding.threads]) or Outstanding.exception:
+              break
+            complete_frac = max(len(individuals) - len(Outstanding.population) - len(Outstanding.threads), 0)
+            complete_frac += sum([thread.get_complete_frac() for thread in Outstanding.threads])
+            complete_frac /= float(len(individuals))
+            remaining_str = ""
+            if complete_frac > 0:
+              start_elapsed = time.time() - rung_start_time
+              total_time_estimated = start_elapsed / complete_frac
+              remaining_estimated = total_time_estimated - start_elapsed
+              remaining_str = hms(remaining_estimated)
+            if interactive:
+              progress_bar(complete_frac, prefix=remaining_str, file=sys.__stdout__)
+            else:
+              print(
+                "Progress: %.02f%%" % (complete_frac * 100),
+                "remaining:", remaining_str or "unknown", file=sys.__stdout__)
+              sys.__stdout__.flush()
+            Outstanding.cond.wait(1 if interactive else 10)
+        for thread in Outstanding.threads:
+          thread.join()
+      finally:
+        Outstanding.exit = True
+        for thread in Outstanding.threads:
+          thread.cancel(join=True)
+      Outstanding.threads = []
+      if Outstanding.exception:
+        raise Outstanding.exception
+      assert not Outstanding.population
+
     best_individuals = []
     population = []
     canceled = False
@@ -484,9 +607,14 @@ class Optimization:
     print("Num available GPUs:", num_gpus)
     num_gpus = num_gpus or 1  # Would be ignored anyway.
     interactive = is_tty()
+    self.shared_train_data = _SharedTrainData(self.train_data)
     try:
       print("Population of %i individuals (hyper param setting instances), running for %i evaluation iterations." % (
         self.num_individuals, self.num_iterations), file=log.v2)
+      if self.num_rungs > 1:
+        print("Successive halving with %i rungs, eta %i, train seq ranges %r." % (
+          self.num_rungs, self.successive_halving_eta,
+          [self.get_rung_seq_range(i) for i in range(self.num_rungs)]), file=log.v2)
       for cur_iteration_idx in range(1, self.num_iterations + 1):
         print("Starting iteration %i." % cur_iteration_idx, file=log.v2)
         if cur_iteration_idx == 1:
@@ -502,50 +630,40 @@ class Optimization:
           # Train first directly for testing and to see log output.
           # Later we will strip away all log output.
           print("Very first try with log output:", file=log.v2)
-          _IndividualTrainer(optim=self, individual=population[0], gpu_ids={0}).run()
-        print("Starting training with thread pool of %i threads." % self.num_threads)
+          self._train_individual_in_this_process(population[0])
+        print("Starting training with %i worker processes." % self.num_workers)
         iteration_start_time = time.time()
-        with wrap_log_streams(StreamDummy(), also_sys_stdout=True, tf_log_verbosity="WARN"):
-          Outstanding.exit = False
-          Outstanding.population = list(population)
-          Outstanding.threads = [WorkerThread(gpu_ids={i % num_gpus}) for i in range(self.num_threads)]
-          try:
-            while True:
-              with Outstanding.cond:
-                if all([thread.finished for thread in Outstanding.threads]) or Outstanding.exception:
-                  break
-                complete_frac = max(len(population) - len(Outstanding.population) - len(Outstanding.threads), 0)
-                complete_frac += sum([thread.get_complete_frac() for thread in Outstanding.threads])
-                complete_frac /= float(len(population))
-                remaining_str = ""
-                if complete_frac > 0:
-                  start_elapsed = time.time() - iteration_start_time
-                  total_time_estimated = start_elapsed / complete_frac
-                  remaining_estimated = total_time_estimated - start_elapsed
-                  remaining_str = hms(remaining_estimated)
-                if interactive:
-                  progress_bar(complete_frac, prefix=remaining_str, file=sys.__stdout__)
-                else:
-                  print(
-                    "Progress: %.02f%%" % (complete_frac * 100),
-                    "remaining:", remaining_str or "unknown", file=sys.__stdout__)
-                  sys.__stdout__.flush()
-                Outstanding.cond.wait(1 if interactive else 10)
-            for thread in Outstanding.threads:
-              thread.join()
-          finally:
-            Outstanding.exit = True
-            for thread in Outstanding.threads:
-              thread.cancel(join=True)
-        Outstanding.threads = []
+        rung_individuals = []  # type: list[Individual]
+        for individual in population:
+          if individual.num_trained_rungs < self.num_rungs:  # e.g. stopped early in an earlier iteration
+            individual.cost = None
+            individual.num_trained_rungs = 0
+            if individual not in rung_individuals:
+              rung_individuals.append(individual)
+        Outstanding.worker_procs = {}
+        try:
+          for rung_idx in range(self.num_rungs):
+            if self.num_rungs > 1:
+              print("Successive halving rung %i, training %i individuals on train seqs %i-%i." % (
+                (rung_idx, len(rung_individuals)) + self.get_rung_seq_range(rung_idx)))
+            train_rung(rung_idx=rung_idx, individuals=rung_individuals)
+            if rung_idx < self.num_rungs - 1:
+              rung_individuals, stopped_individuals = self.select_rung_survivors(rung_individuals)
+              for individual in stopped_individuals:
+                Outstanding.worker_procs.pop(individual).finish()
+              print("Stopped %i individuals, best cost %s, worst continued cost %s." % (
+                len(stopped_individuals),
+                rung_individuals[0].cost if rung_individuals else None,
+                rung_individuals[-1].cost if rung_individuals else None))
+        finally:
+          for worker_proc in Outstanding.worker_procs.values():
+            worker_proc.finish()
+          Outstanding.worker_procs = {}
         print("Training iteration elapsed time:", hms(time.time() - iteration_start_time))
-        if Outstanding.exception:
-          raise Outstanding.exception
-        assert not Outstanding.population
         print("Training iteration finished.")
-        population.sort(key=lambda p: p.cost)
+        population.sort(key=lambda p: (-p.num_trained_rungs, p.cost))
         del population[-self.num_kill_individuals:]
-        best_individuals.extend(population)
+        best_individuals.extend([p for p in population if p.num_trained_rungs == self.num_rungs])
         best_individuals.sort(key=lambda p: p.cost)
         del best_individuals[self.num_best:]
         population = best_individuals[:self.num_kill_individuals // 4] + population
@@ -555,6 +673,8 @@ class Optimization:
     except KeyboardInterrupt:
       print("KeyboardInterrupt, canceled search.")
       canceled = True
+    finally:
+      self.shared_train_data.remove()
 
     print("Best %i settings:" % len(best_individuals))
     for individual in best_individuals:
@@ -562,32 +682,133 @@ class Optimization:
       for p in self.hyper_params:
         print(" %s -> %s" % (p.description(), individual.hyper_param_mapping[p]))
 
+  def _train_individual_in_this_process(self, individual):
+    """
+    Trains the individual through all successive halving rungs, in this process, with log output.
+
+    :param Individual individual:
+    """
+    start_time = time.time()
+    print("Training %r using hyper params:" % individual.name, file=log.v2)
+    for p in self.hyper_params:
+      print(" %s -> %s" % (p.description(), individual.hyper_param_mapping[p]), file=log.v2)
+    config = self.create_config_instance(individual.hyper_param_mapping, gpu_ids={0})
+    trainer = _IndividualTrainer(name=individual.name, config=config, train_data=self.train_data)
+    try:
+      for rung_idx in range(self.num_rungs):
+        individual.cost = trainer.train(*self.get_rung_seq_range(rung_idx))
+        individual.num_trained_rungs = rung_idx + 1
+    finally:
+      trainer.finalize()
+    print(
+      "Individual %s:" % individual.name,
+      "Train cost:", individual.cost,
+      "elapsed time:", hms_fraction(time.time() - start_time),
+      file=self.log)
+
+
+class _SharedTrainData:
+  """
+  The train data in files in shared memory (``/dev/shm``), which the worker processes map read-only.
+  I.e. there is only a single copy of the data in memory, and it is not sent to the worker processes.
+  """
+
+  def __init__(self, dataset):
+    """
+    :param StaticDataset dataset:
+    """
+    import tempfile
+    shm_dir = "/dev/shm" if os.path.isdir("/dev/shm") else None
+    self.dirname = tempfile.mkdtemp(prefix="returnn-hyper-param-tuning-", dir=shm_dir)
+    self.data_keys = dataset.get_data_keys()
+    self.target_list = dataset.get_target_list()
+    self.output_dim = dataset.num_outputs
+    self.input_dim = dataset.num_inputs
+    self.seq_lens = {}  # type: dict[str,list[int]]  # data key -> seq lens. small, thus pickled
+    for i, key in enumerate(self.data_keys):
+      self.seq_lens[key] = [seq[key].shape[0] for seq in dataset.data]
+      numpy.save(self._get_filename(i), numpy.concatenate([seq[key] for seq in dataset.data], axis=0))
+
+  def _get_filename(self, key_idx):
+    """
+    :param int key_idx:
+    :rtype: str
+    """
+    return "%s/%i.npy" % (self.dirname, key_idx)
+
+  def get_dataset(self, start_seq_idx=0, end_seq_idx=None):
+    """
+    :param int start_seq_idx:
+    :param int|None end_seq_idx:
+    :return: dataset with read-only views on the shared memory
+    :rtype: StaticDataset
+    """
+    data = None  # type: typing.Optional[typing.List[typing.Dict[str,numpy.ndarray]]]
+    for i, key in enumerate(self.data_keys):
+      values = numpy.load(self._get_filename(i), mmap_mode="r")
+      if data is None:
+        data = [{} for _ in self.seq_lens[key]]
+      offset = 0
+      for seq, seq_len in zip(data, self.seq_lens[key]):
+        seq[key] = values[offset:offset + seq_len]
+        offset += seq_len
+    return StaticDataset(
+      data=data[start_seq_idx:end_seq_idx], target_list=self.target_list,
+      output_dim=self.output_dim, input_dim=self.input_dim)
+
+  def remove(self):
+    """
+    Removes the files. Worker processes which have it already mapped can still use it.
+    """
+    import shutil
+    shutil.rmtree(self.dirname, ignore_errors=True)
+
 
 class _IndividualTrainer:
-  def __init__(self, optim, individual, gpu_ids):
+  """
+  Trains one individual in this process.
+  The engine is kept, such that the training can be continued on further train data (successive halving).
+  """
+
+  def __init__(self, name, config, train_data):
     """
-    :param Optimization optim:
-    :param Individual individual:
-    :param set[int] gpu_ids:
+    :param str name: of the individual
+    :param Config config: with the hyper params applied, see :func:`Optimization.create_config_instance`
+    :param StaticDataset train_data: we will not modify it
     """
-    self.optim = optim
-    self.individual = individual
+    self.name = name
+    self.config = config
+    self.train_data = train_data
+    self.engine = None  # type: Engine
     self.runner = None  # type: Runner
-    self.gpu_ids = gpu_ids
-    self.cancel_flag = False
 
-  def run(self):
-    if self.individual.cost is not None:
-      return self.individual.cost
-    start_time = time.time()
-    hyper_param_mapping = self.individual.hyper_param_mapping
-    print("Training %r using hyper params:" % self.individual.name, file=log.v2)
-    for p in self.optim.hyper_params:
-      print(" %s -> %s" % (p.description(), hyper_param_mapping[p]), file=log.v2)
-    config = self.optim.create_config_instance(hyper_param_mapping, gpu_ids=self.gpu_ids)
-    engine = Engine(config=config)
-    train_data = StaticDataset.copy_from_dataset(self.optim.train_data)
-    engine.init_train_from_config(config=config, train_data=train_data)
+  def get_complete_frac(self):
+    """
+    :return: of the current :func:`train` call
+    :rtype: float
+    """
+    runner = self.runner
+    if runner:
+      return runner.data_provider.get_complete_frac()
+    return 0.0
+
+  def train(self, start_seq_idx, end_seq_idx):
+    """
+    Continues training on the given seqs.
+
+    :param int start_seq_idx:
+    :param int end_seq_idx:
+    :return: train cost on these seqs
+    :rtype: float
+    """
+    train_data = StaticDataset(
+      data=self.train_data.data[start_seq_idx:end_seq_idx], target_list=self.train_data.get_target_list(),
+      output_dim=self.train_data.num_outputs, input_dim=self.train_data.num_inputs)
+    if not self.engine:
+      self.engine = Engine(config=self.config)
+      self.engine.init_train_from_config(config=self.config, train_data=train_data)
+      self.engine.updater.set_learning_rate(self.engine.learning_rate, session=self.engine.tf_session)
+    engine = self.engine
     # Not directly calling train() as we want to have full control.
     engine.epoch = 1
     train_data.init_seq_order(epoch=engine.epoch)
@@ -599,22 +820,139 @@ class _IndividualTrainer:
       seq_drop=engine.seq_drop,
       shuffle_batches=engine.shuffle_batches,
       used_data_keys=engine.network.used_data_keys)
-    engine.updater.set_learning_rate(engine.learning_rate, session=engine.tf_session)
     trainer = Runner(engine=engine, dataset=train_data, batches=batches, train=True)
     self.runner = trainer
-    if self.cancel_flag:
-      raise CancelTrainingException("Trainer cancel flag is set")
-    trainer.run(report_prefix="hyper param tune train %r" % self.individual.name)
+    trainer.run(report_prefix="hyper param tune train %r" % self.name)
+    self.runner = None
     if not trainer.finalized:
       print("Trainer exception:", trainer.run_exception, file=log.v1)
       raise trainer.run_exception
-    cost = trainer.score["cost:output"]
-    print(
-      "Individual %s:" % self.individual.name,
-      "Train cost:", cost,
-      "elapsed time:", hms_fraction(time.time() - start_time),
-      file=self.optim.log)
-    self.individual.cost = cost
+    return trainer.score["cost:output"]
+
+  def finalize(self):
+    """
+    Frees the engine.
+    """
+    if self.engine:
+      self.engine.finalize()
+      self.engine = None
+
+
+class _IndividualWorkerProcess:
+  """
+  Runs an :class:`_IndividualTrainer` in a separate process (fork+exec), with its own thread budget.
+  See :func:`_individual_worker_process_main` for the other side.
+  """
+
+  def __init__(self, optim, individual, gpu_ids):
+    """
+    :param Optimization optim:
+    :param Individual individual:
+    :param set[int] gpu_ids:
+    """
+    from TaskSystem import AsyncTask
+    self.name = individual.name
+    self.complete_frac = 0.0
+    config = optim.create_config_instance(individual.hyper_param_mapping, gpu_ids=gpu_ids)
+    self.proc = AsyncTask(
+      func=_individual_worker_process_main,
+      name="Hyper param tune %s" % individual.name,
+      mustExec=True,  # we cannot fork TF
+      env_update={"OMP_NUM_THREADS": str(optim.num_threads_per_worker), "TF_CPP_MIN_LOG_LEVEL": "1"})
+    self.proc.put((individual.name, config, optim.shared_train_data, optim.num_threads_per_worker))
+    self.canceled = False
+
+  def train(self, start_seq_idx, end_seq_idx):
+    """
+    :param int start_seq_idx:
+    :param int end_seq_idx:
+    :return: train cost on these seqs
+    :rtype: float
+    """
+    self.complete_frac = 0.0
+    self.proc.put(("train", start_seq_idx, end_seq_idx))
+    while True:
+      msg = self.proc.get()
+      if msg[0] == "progress":
+        self.complete_frac = msg[1]
+      elif msg[0] == "result":
+        self.complete_frac = 1.0
+        return msg[1]
+      elif msg[0] == "exception":
+        raise TrainException("Individual %s: %s" % (self.name, msg[1]))
+      else:
+        raise Exception("Individual %s: unexpected message %r" % (self.name, msg))
+
+  def cancel(self):
+    """
+    Kills the process.
+    """
+    if not self.canceled:
+      self.canceled = True
+      self.proc.terminate()
+
+  def finish(self):
+    """
+    Lets the process exit, and waits for it.
+    """
+    from TaskSystem import ProcConnectionDied
+    if not self.canceled:
+      try:
+        self.proc.put(("exit",))
+      except ProcConnectionDied:
+        pass  # already exited
+    self.proc.join()
+
+
+def _individual_worker_process_main(async_task):
+  """
+  This is the worker process, i.e. the other side of :class:`_IndividualWorkerProcess`.
+
+  :param TaskSystem.AsyncTask async_task:
+  """
+  from threading import Thread, Lock, Event
+  from Log import wrap_log_streams, StreamDummy
+  from TFUtil import setup_tf_thread_pools
+  import rnn
+  name, config, shared_train_data, num_threads = async_task.get()
+  assert isinstance(shared_train_data, _SharedTrainData)
+  rnn.init_better_exchook()
+  rnn.config = config
+  log.initialize(verbosity=[0])
+  setup_tf_thread_pools(num_threads=num_threads)
+  trainer = _IndividualTrainer(name=name, config=config, train_data=shared_train_data.get_dataset())
+  send_lock = Lock()
+
+  def report_progress(stop_event):
+    """
+    :param threading.Event stop_event:
+    """
+    while not stop_event.wait(1.0):
+      with send_lock:
+        async_task.put(("progress", trainer.get_complete_frac()))
+
+  with wrap_log_streams(StreamDummy(), also_sys_stdout=True, tf_log_verbosity="WARN"):
+    while True:
+      msg = async_task.get()
+      if msg[0] == "exit":
+        break
+      assert msg[0] == "train"
+      progress_stop_event = Event()
+      progress_thread = Thread(target=report_progress, args=(progress_stop_event,), name="progress")
+      progress_thread.daemon = True
+      progress_thread.start()
+      try:
+        result = ("result", trainer.train(start_seq_idx=msg[1], end_seq_idx=msg[2]))
+      except Exception as exc:
+        sys.excepthook(*sys.exc_info())
+        result = ("exception", "%s: %s" % (type(exc).__name__, exc))
+      progress_stop_event.set()
+      progress_thread.join()
+      with send_lock:
+        async_task.put(result)
+      if result[0] == "exception":
+        break
+  trainer.finalize()
 
 
 class _AttribOrKey:
@@ -107,6 +107,7 @@ class LearningRateControl(object):
     self.min_num_epochs_per_new_learning_rate = min_num_epochs_per_new_learning_rate
     self.relative_error_div_by_old = relative_error_div_by_old
     self.filename = filename
+    self._pending_epoch_errors = {}  # type: typing.Dict[int,typing.Callable[[],None]]  # epoch -> wait func
     if filename:
       if os.path.exists(filename):
         print("Learning-rate-control: loading file %s" % filename, file=log.v4)
@@ -264,16 +265,51 @@ class LearningRateControl(object):
           error[k + "_" + k1] = v1
     for v in error.values():
       assert isinstance(v, float)
+    self._pending_epoch_errors.pop(epoch, None)
     self.epoch_data[epoch].error.update(error)
     if epoch == 1:
       print("Learning-rate-control: error key %r from %r" % (self.get_error_key(epoch), error), file=log.v4)
 
+  def set_epoch_error_pending(self, epoch, wait_func):
+    """
+    Some error for this epoch (e.g. the dev score) is still being calculated, e.g. in another process,
+    and will be set later via :func:`set_epoch_error`.
+    As soon as the errors of this epoch are needed, we call ``wait_func``, which must set it.
+
+    :param int epoch:
+    :param ()->None wait_func:
+    """
+    self._pending_epoch_errors[epoch] = wait_func
+
+  def has_pending_epoch_errors(self):
+    """
+    :return: whether there is some epoch where we wait for the error, see :func:`set_epoch_error_pending`
+    :rtype: bool
+    """
+    return bool(self._pending_epoch_errors)
+
+  def get_pending_epochs(self):
+    """
+    :return: epochs where we wait for the error, see :func:`set_epoch_error_pending`
+    :rtype: list[int]
+    """
+    return sorted(self._pending_epoch_errors.keys())
+
+  def _wait_for_pending_epoch_error(self, epoch):
+    """
+    :param int epoch:
+    """
+    wait_func = self._pending_epoch_errors.pop(epoch, None)
+    if wait_func:
+      wait_func()
+
   def get_error_key(self, epoch):
     """
     :param int epoch:
     :return: key which we should look in scores/errors, for this epoch
     :rtype: str
     """
+    self._wait_for_pending_epoch_error(epoch)
     if epoch not in self.epoch_data:
       if isinstance(self.error_measure_key, list):
         return self.error_measure_key[0]
@@ -315,6 +351,7 @@ class LearningRateControl(object):
     :param int epoch:
     :rtype: dict[str,float]
     """
+    self._wait_for_pending_epoch_error(epoch)
     if epoch not in self.epoch_data:
       return {}
     return self.epoch_data[epoch].error
@@ -0,0 +1,365 @@
+"""
+Local data-parallel training, i.e. multiple worker processes on a single machine, without Horovod/MPI.
+
+All the worker processes run the same code (like the ranks with Horovod),
+and each of them trains on a disjoint shard of the batches (``batch_slice``, see :func:`get_batch_slice`).
+The gradients or the params are averaged via shared memory (see :func:`LocalDataParallel.allreduce`).
+Rank 0 is the main process. It does the saving of the models.
+
+The config options are:
+
+  * ``local_data_parallel``: number of worker processes (including the main process). <= 1 disables it.
+  * ``local_data_parallel_reduce_type``: like ``horovod_reduce_type``, either "grad" (default) or "param".
+    With "grad", the gradients are averaged in every step, and all workers apply the same update.
+    With "param", each worker updates its params independently, and the params are averaged every N steps.
+  * ``local_data_parallel_param_sync_step``: N for reduce type "param", like ``horovod_param_sync_step``.
+
+The workers are forked in :func:`init`, which is called early in ``rnn.py``, before TF is imported,
+because forking a process with an initialized TF runtime is not safe.
+That is why this module does not depend on TF.
+If any worker fails, all the other workers will fail as well, as soon as they wait for it
+(see :class:`LocalDataParallelError`).
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import typing
+import numpy
+
+
+class LocalDataParallelError(Exception):
+  """
+  Some other worker failed, or we got aborted.
+  """
+
+
+class _Barrier(object):
+  """
+  Reusable barrier for processes, which works for forked processes (in contrast to the threading Barrier),
+  and also with Python 2 (in contrast to ``multiprocessing.Barrier``).
+  It can be aborted, and it checks whether the other processes are still alive while waiting.
+  """
+
+  def __init__(self, num_parties, poll_interval=1.0):
+    """
+    :param int num_parties:
+    :param float poll_interval: in seconds. how often to check the other processes
+    """
+    import multiprocessing
+    self.num_parties = num_parties
+    self.poll_interval = poll_interval
+    self._cond = multiprocessing.Condition()
+    self._count = multiprocessing.RawValue("i", 0)
+    self._generation = multiprocessing.RawValue("i", 0)
+    self._broken = multiprocessing.RawValue("i", 0)
+
+  def wait(self, check_alive):
+    """
+    :param ()->bool check_alive: whether all the other processes are still alive
+    """
+    with self._cond:
+      if self._broken.value:
+        raise LocalDataParallelError("barrier broken, some other worker failed")
+      generation = self._generation.value
+      self._count.value += 1
+      if self._count.value == self.num_parties:
+        self._count.value = 0
+        self._generation.value += 1
+        self._cond.notify_all()
+        return
+      while generation == self._generation.value:
+        self._cond.wait(self.poll_interval)
+        if self._broken.value:
+          raise LocalDataParallelError("barrier broken, some other worker failed")
+        if generation == self._generation.value and not check_alive():
+          self._broken.value = 1
+          self._cond.notify_all()
+          raise LocalDataParallelError("some other worker died")
+
+  def abort(self):
+    """
+    All current and future waits will raise :class:`LocalDataParallelError`.
+    """
+    with self._cond:
+      self._broken.value = 1
+      self._cond.notify_all()
+
+
+class LocalDataParallel(object):
+  """
+  Manages the worker processes, and provides the collective operations on them.
+  All collective operations must be called by all the workers in the same order.
+  """
+
+  def __init__(self, num_workers):
+    """
+    :param int num_workers: including the main process
+    """
+    assert num_workers >= 1
+    self.size = num_workers
+    self.rank = 0
+    self._parent_pid = os.getpid()
+    self._child_pids = []  # type: typing.List[int]  # only in rank 0
+    self._child_exit_codes = {}  # type: typing.Dict[int,int]  # pid -> exit code. only in rank 0
+    self._barrier = _Barrier(num_parties=num_workers)
+    shm_dir = "/dev/shm" if os.path.isdir("/dev/shm") else None
+    if not shm_dir:
+      import tempfile
+      shm_dir = tempfile.gettempdir()
+    self._buffer_filename_prefix = "%s/returnn-local-data-parallel-%i" % (shm_dir, self._parent_pid)
+    self._buffers = {}  # type: typing.Dict[str,numpy.ndarray]  # name -> shared array
+    self._buffers_generation = {}  # type: typing.Dict[str,int]  # name -> counter
+    self._aborted = False
+
+  def __repr__(self):
+    return "<%s rank %i, size %i>" % (self.__class__.__name__, self.rank, self.size)
+
+  def start_workers(self):
+    """
+    Forks the other workers. This returns in all the workers, with :attr:`rank` set.
+    """
+    assert self.rank == 0 and not self._child_pids and os.getpid() == self._parent_pid
+    sys.stdout.flush()
+    sys.stderr.flush()
+    for rank in range(1, self.size):
+      pid = os.fork()
+      if pid == 0:  # child
+        self.rank = rank
+        self._child_pids = []
+        return
+      self._child_pids.append(pid)
+
+  def is_main(self):
+    """
+    :return: whether this is the main process (rank 0)
+    :rtype: bool
+    """
+    return self.rank == 0
+
+  def _check_alive(self):
+    """
+    :return: whether all the other workers are alive
+    :rtype: bool
+    """
+    if self.rank != 0:
+      return os.getppid() == self._parent_pid  # the main process checks the other workers
+    for pid in self._child_pids:
+      if pid in self._child_exit_codes:
+        return False
+      pid_, status = os.waitpid(pid, os.WNOHANG)
+      if pid_ == pid:
+        self._child_exit_codes[pid] = os.WEXITSTATUS(status) if os.WIFEXITED(status) else -1
+        return False
+    return True
+
+  def barrier(self):
+    """
+    Waits until all the workers reached this point.
+    """
+    if self._aborted:
+      raise LocalDataParallelError("aborted before")
+    self._barrier.wait(check_alive=self._check_alive)
+
+  def abort(self):
+    """
+    Call this on an error. All other workers will raise :class:`LocalDataParallelError` in the next collective op.
+    """
+    self._aborted = True
+    self._barrier.abort()
+
+  def _get_buffer(self, name, shape, dtype):
+    """
+    :param str name:
+    :param tuple[int] shape:
+    :param numpy.dtype|str dtype:
+    :return: array in shared memory, the same in all workers
+    :rtype: numpy.ndarray
+    """
+    dtype = numpy.dtype(dtype)
+    buffer = self._buffers.get(name)
+    if buffer is not None and buffer.shape == shape and buffer.dtype == dtype:
+      return buffer
+    # (Re)create it. All workers do this at the same time, as this is part of a collective op.
+    generation = self._buffers_generation.get(name, 0) + 1
+    self._buffers_generation[name] = generation
+    filename = "%s-%s-%i" % (self._buffer_filename_prefix, name, generation)
+    if self.rank == 0:
+      buffer = numpy.memmap(filename, dtype=dtype, mode="w+", shape=shape)
+    self.barrier()
+    if self.rank != 0:
+      buffer = numpy.memmap(filename, dtype=dtype, mode="r+", shape=shape)
+    self.barrier()
+    if self.rank == 0:
+      os.unlink(filename)  # all workers have it mapped now
+    self._buffers[name] = buffer
+    return buffer
+
+  def allreduce(self, name, value, average=True):
+    """
+    Sum (or average) of ``value`` over all the workers.
+    Each worker reduces one part of the array.
+
+    :param str name: identifies the shared buffer. use the same for values of the same shape for efficiency
+    :param numpy.ndarray|list|int|float value: must have the same shape and dtype in all workers
+    :param bool average: if False, the sum
+    :return: the same in all workers
+    :rtype: numpy.ndarray
+    """
+    value = numpy.asarray(value)
+    if value.size == 0:
+      return value.copy()  # nothing to do. also, we cannot mmap empty buffers
+    buffer_in = self._get_buffer("%s.in" % name, shape=(self.size,) + value.shape, dtype=value.dtype)
+    buffer_out = self._get_buffer("%s.out" % name, shape=value.shape, dtype=value.dtype)
+    buffer_in[self.rank] = value
+    self.barrier()
+    flat_in = buffer_in.reshape((self.size, -1))
+    flat_out = buffer_out.reshape((-1,))
+    part_size = -(-flat_out.shape[0] // self.size)  # ceil div
+    part = slice(self.rank * part_size, (self.rank + 1) * part_size)
+    if average:
+      flat_out[part] = numpy.mean(flat_in[:, part], axis=0)
+    else:
+      flat_out[part] = numpy.sum(flat_in[:, part], axis=0)
+    self.barrier()
+    return numpy.array(buffer_out)
+
+  def broadcast(self, name, value, root=0):
+    """
+    :param str name: identifies the shared buffer
+    :param numpy.ndarray|list|int|float value: must have the same shape and dtype in all workers
+    :param int root: the rank from which we take the value
+    :return: value from the root rank
+    :rtype: numpy.ndarray
+    """
+    value = numpy.asarray(value)
+    if value.size == 0:
+      return value.copy()
+    buffer = self._get_buffer("%s.bcast" % name, shape=value.shape, dtype=value.dtype)
+    if self.rank == root:
+      buffer[...] = value
+    self.barrier()
+    result = numpy.array(buffer)
+    self.barrier()
+    return result
+
+  def allreduce_multiple(self, name, values, average=True):
+    """
+    Like :func:`allreduce`, for multiple arrays at once (all with the same dtype).
+    We concatenate them, such that we need only a single :func:`allreduce`.
+
+    :param str name:
+    :param list[numpy.ndarray] values:
+    :param bool average:
+    :rtype: list[numpy.ndarray]
+    """
+    values = [numpy.asarray(v) for v in values]
+    if not values:
+      return []
+    flat = numpy.concatenate([v.reshape((-1,)) for v in values])
+    flat = self.allreduce(name=name, value=flat, average=average)
+    return self._split_flat(flat, values)
+
+  def broadcast_multiple(self, name, values, root=0):
+    """
+    Like :func:`broadcast`, for multiple arrays at once (all with the same dtype).
+
+    :param str name:
+    :param list[numpy.ndarray] values:
+    :param int root:
+    :rtype: list[numpy.ndarray]
+    """
+    values = [numpy.asarray(v) for v in values]
+    if not values:
+      return []
+    flat = numpy.concatenate([v.reshape((-1,)) for v in values])
+    flat = self.broadcast(name=name, value=flat, root=root)
+    return self._split_flat(flat, values)
+
+  @staticmethod
+  def _split_flat(flat, values):
+    """
+    :param numpy.ndarray flat: concatenated values
+    :param list[numpy.ndarray] values: for the shapes
+    :rtype: list[numpy.ndarray]
+    """
+    results = []
+    offset = 0
+    for v in values:
+      results.append(flat[offset:offset + v.size].reshape(v.shape))
+      offset += v.size
+    assert offset == flat.size
+    return results
+
+  def finish(self):
+    """
+    In the main process (rank 0), waits for all other workers to finish.
+
+    :raises LocalDataParallelError: if some other worker failed
+    """
+    if self.rank != 0:
+      return
+    failed = []
+    for pid in self._child_pids:
+      if pid not in self._child_exit_codes:
+        _, status = os.waitpid(pid, 0)
+        self._child_exit_codes[pid] = os.WEXITSTATUS(status) if os.WIFEXITED(status) else -1
+      if self._child_exit_codes[pid] != 0:
+        failed.append(pid)
+    self._child_pids = []
+    if failed:
+      raise LocalDataParallelError("workers with pids %r failed, exit codes %r" % (
+        failed, [self._child_exit_codes[pid] for pid in failed]))
+
+
+_instance = None  # type: typing.Optional[LocalDataParallel]
+
+
+def init(config):
+  """
+  Starts the workers, if enabled via the config (``local_data_parallel``).
+  This must be called before TF is imported. See the module docstring.
+
+  :param Config.Config config:
+  """
+  global _instance
+  num_workers = config.int("local_data_parallel", 0)
+  if num_workers <= 1:
+    return
+  assert not _instance, "init called twice"
+  assert "tensorflow" not in sys.modules, "LocalDataParallel.init must be called before TF is imported"
+  assert not config.is_true("use_horovod"), "local_data_parallel and use_horovod cannot be used together"
+  reduce_type = config.value("local_data_parallel_reduce_type", "grad")
+  assert reduce_type in ["grad", "param"], "config option 'local_data_parallel_reduce_type' invalid"
+  _instance = LocalDataParallel(num_workers=num_workers)
+  _instance.start_workers()
+
+
+def get_instance():
+  """
+  :return: the instance, if we use local data parallel training, else None
+  :rtype: LocalDataParallel|None
+  """
+  return _instance
+
+
+def get_batch_slice():
+  """
+  :return: the shard of the batches for this worker, like with Horovod, or None if not enabled
+  :rtype: slice|None
+  """
+  if not _instance:
+    return None
+  return slice(_instance.rank, None, _instance.size)
+
+
+def finish():
+  """
+  At exit. In the main process, waits for all the other workers.
+  """
+  global _instance
+  if not _instance:
+    return
+  instance, _instance = _instance, None
+  instance.finish()
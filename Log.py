@@ -171,6 +171,16 @@ class Log:
         fn_ext = ".horovod-%i-%i%s" % (hvd.rank(), hvd.size(), fn_ext)
         new_logs.append(fn_prefix + fn_ext)
       logs = new_logs
+    if config.int("local_data_parallel", 0) > 1:
+      import LocalDataParallel
+      local_data_parallel = LocalDataParallel.get_instance()
+      if local_data_parallel:  # not initialized e.g. in tools which just use the config
+        new_logs = []
+        for fn in logs:
+          fn_prefix, fn_ext = os.path.splitext(fn)
+          fn_ext = ".local-data-parallel-%i-%i%s" % (local_data_parallel.rank, local_data_parallel.size, fn_ext)
+          new_logs.append(fn_prefix + fn_ext)
+        logs = new_logs
     self.initialize(logs=logs, verbosity=log_verbosity, formatter=log_format)
 
 
@@ -29,7 +29,9 @@ from Util import NumbersDict, load_json
 from Log import log
 from random import Random
 import numpy
+import os
 import sys
+import time
 import typing
 
 
@@ -108,6 +110,190 @@ class EpochWiseFilter:
     return seq_order
 
 
+class SeqTagIndex(object):
+  """
+  Compact tag -> index mapping for a list of seq tags, as used by :class:`MetaDataset`.
+  All tags are stored as a single utf8 byte array with offsets, together with a 64 bit hash per tag.
+  Lookups are done via binary search over the sorted hashes, which also works vectorized
+  for another whole :class:`SeqTagIndex` (:func:`get_indices_of`).
+  A match is always verified by comparing the tag bytes, so hash collisions are handled correctly.
+  This needs much less memory than a list of str plus a dict,
+  and it can be saved to and loaded from a single npz file quickly.
+  """
+
+  def __init__(self, tag_data, offsets, hashes):
+    """
+    :param numpy.ndarray tag_data: uint8, all tags in utf8 concatenated
+    :param numpy.ndarray offsets: int64, shape (num_tags + 1,), tag i is tag_data[offsets[i]:offsets[i + 1]]
+    :param numpy.ndarray hashes: uint64, shape (num_tags,). see :func:`hash_tag`
+    """
+    assert len(offsets) == len(hashes) + 1
+    self.tag_data = tag_data
+    self.offsets = offsets
+    self.hashes = hashes
+    self._sorted_idxs = numpy.argsort(hashes, kind="stable")
+    self._sorted_hashes = hashes[self._sorted_idxs]
+
+  def __repr__(self):
+    return "<%s with %i tags>" % (self.__class__.__name__, len(self))
+
+  def __len__(self):
+    return len(self.hashes)
+
+  @staticmethod
+  def hash_tag(tag):
+    """
+    :param bytes tag: utf8
+    :return: 64 bit hash. This must be deterministic (unlike hash()), as we store it.
+    :rtype: int
+    """
+    import hashlib
+    import struct
+    return struct.unpack("<Q", hashlib.md5(tag).digest()[:8])[0]
+
+  @staticmethod
+  def _encode_tag(tag):
+    """
+    :param str|unicode|bytes tag:
+    :return: utf8
+    :rtype: bytes
+    """
+    if isinstance(tag, bytes):  # e.g. str in Python 2
+      return tag
+    return tag.encode("utf8")
+
+  @classmethod
+  def from_tags(cls, tags):
+    """
+    :param list[str] tags:
+    :rtype: SeqTagIndex
+    """
+    encoded_tags = [cls._encode_tag(tag) for tag in tags]
+    offsets = numpy.zeros((len(encoded_tags) + 1,), dtype="int64")
+    offsets[1:] = numpy.cumsum(numpy.fromiter(map(len, encoded_tags), dtype="int64", count=len(encoded_tags)))
+    tag_data = numpy.frombuffer(b"".join(encoded_tags), dtype="uint8")
+    hashes = numpy.fromiter(map(cls.hash_tag, encoded_tags), dtype="uint64", count=len(encoded_tags))
+    return cls(tag_data=tag_data, offsets=offsets, hashes=hashes)
+
+  @classmethod
+  def from_arrays(cls, arrays, prefix=""):
+    """
+    :param dict[str,numpy.ndarray]|numpy.lib.npyio.NpzFile arrays: via :func:`get_arrays`
+    :param str prefix:
+    :rtype: SeqTagIndex
+    """
+    return cls(
+      tag_data=arrays[prefix + "tag_data"], offsets=arrays[prefix + "offsets"], hashes=arrays[prefix + "hashes"])
+
+  def get_arrays(self, prefix=""):
+    """
+    :param str prefix:
+    :return: all the data, e.g. for numpy.savez
+    :rtype: dict[str,numpy.ndarray]
+    """
+    return {prefix + "tag_data": self.tag_data, prefix + "offsets": self.offsets, prefix + "hashes": self.hashes}
+
+  @classmethod
+  def load(cls, filename):
+    """
+    :param str filename: npz, via :func:`save`
+    :rtype: SeqTagIndex
+    """
+    with numpy.load(filename) as f:
+      return cls.from_arrays(f)
+
+  def save(self, filename):
+    """
+    :param str filename: npz
+    """
+    assert filename.endswith(".npz")
+    numpy.savez(filename, **self.get_arrays())
+
+  def get_tag(self, idx):
+    """
+    :param int idx:
+    :rtype: str
+    """
+    return self._get_tag_bytes(idx).decode("utf8")
+
+  def _get_tag_bytes(self, idx):
+    """
+    :param int idx:
+    :return: utf8
+    :rtype: bytes
+    """
+    return self.tag_data[self.offsets[idx]:self.offsets[idx + 1]].tobytes()
+
+  def get_tags(self, idxs=None):
+    """
+    :param list[int]|numpy.ndarray|None idxs: all if None
+    :rtype: list[str]
+    """
+    if idxs is None:
+      idxs = range(len(self))
+    return [self.get_tag(idx) for idx in idxs]
+
+  def get_index(self, tag):
+    """
+    :param str tag:
+    :return: idx such that self.get_tag(idx) == tag. the first one if there are multiple
+    :rtype: int
+    :raises KeyError: if not found
+    """
+    encoded_tag = self._encode_tag(tag)
+    tag_hash = numpy.uint64(self.hash_tag(encoded_tag))
+    pos = int(numpy.searchsorted(self._sorted_hashes, tag_hash))
+    while pos < len(self) and self._sorted_hashes[pos] == tag_hash:
+      idx = int(self._sorted_idxs[pos])
+      if self._get_tag_bytes(idx) == encoded_tag:
+        return idx
+      pos += 1
+    raise KeyError(tag)
+
+  def get_indices_of(self, other):
+    """
+    Vectorized lookup of all the tags of another index.
+    We take the first entry with the same hash, and verify it by comparing the tag bytes.
+    Only the tags where this fails (e.g. hash collisions) are looked up one by one via :func:`get_index`.
+
+    :param SeqTagIndex other:
+    :return: int64 array, shape (len(other),), idx into self for each tag in other
+    :rtype: numpy.ndarray
+    :raises KeyError: if some tag of other is not found
+    """
+    if self.is_same_as(other):
+      return numpy.arange(len(self), dtype="int64")
+    idxs = numpy.zeros((len(other),), dtype="int64")
+    found = numpy.zeros((len(other),), dtype="bool")
+    if len(self):
+      pos = numpy.minimum(numpy.searchsorted(self._sorted_hashes, other.hashes), len(self) - 1)
+      idxs = self._sorted_idxs[pos].astype("int64")
+      other_lens = numpy.diff(other.offsets)
+      found = (self._sorted_hashes[pos] == other.hashes) & (numpy.diff(self.offsets)[idxs] == other_lens)
+      # Compare the tag bytes of the candidates.
+      byte_tag_idxs = numpy.repeat(numpy.arange(len(other)), other_lens)  # other tag idx for each byte in other
+      byte_mask = found[byte_tag_idxs]
+      byte_tag_idxs = byte_tag_idxs[byte_mask]
+      byte_pos = (
+        numpy.arange(len(other.tag_data))[byte_mask] - other.offsets[byte_tag_idxs] + self.offsets[idxs[byte_tag_idxs]])
+      found[byte_tag_idxs[self.tag_data[byte_pos] != other.tag_data[byte_mask]]] = False
+    for i in numpy.nonzero(~found)[0]:
+      idxs[i] = self.get_index(other.get_tag(int(i)))  # raises KeyError if not found
+    return idxs
+
+  def is_same_as(self, other):
+    """
+    :param SeqTagIndex other:
+    :return: whether both contain the same tags in the same order
+    :rtype: bool
+    """
+    if self is other:
+      return True
+    return (
+      len(self) == len(other) and numpy.array_equal(self.hashes, other.hashes) and
+      numpy.array_equal(self.offsets, other.offsets) and numpy.array_equal(self.tag_data, other.tag_data))
+
+
 class MetaDataset(CachedDataset2):
   """
   The MetaDataset is to be used in the case of **Multimodality**.
@@ -163,12 +349,23 @@ class MetaDataset(CachedDataset2):
   This combines a SprintDataset and a TranslationDataset.
   These are defined as ``"train_sprint"`` and ``"train_translation"`` separately.
   *Note that the current implementation expects one input feature to be called "data".*
+
+  Internally, the sequence lists are kept as :class:`SeqTagIndex`, and the order of each epoch as indices.
+  Sub-datasets which support it (see :func:`Dataset.supports_seq_order`, e.g. the HDFDataset)
+  get these indices directly in ``init_seq_order``, otherwise we pass the tags as usual.
+  For big corpora, set ``"seq_list_index_file"`` (``.npz``),
+  which persists the sequence lists in this compact format,
+  so that the pickle does not need to be loaded again.
+  If you don't have a ``"seq_lens_file"`` but want a length-based ``seq_ordering``,
+  set ``"seq_len_index_dir"`` (see :class:`CachedDataset2`),
+  so that the seqs need to be loaded only once to get their lengths.
   """
 
   def __init__(self,
                datasets,
                data_map,
                seq_list_file=None,
+               seq_list_index_file=None,
                seq_order_control_dataset=None,
                seq_lens_file=None,
                data_dims=None,
@@ -182,6 +379,9 @@ class MetaDataset(CachedDataset2):
       Can be None if tag format is the same for all datasets.
         Then the sequence list will be default sequence order of default dataset (``data_map["data"][0]``),
         or seq_order_control_dataset.
+    :param str|None seq_list_index_file: filename. npz. If it exists and was created from the same seq_list_file
+      (same filename, mtime and size), we load the seq lists from it, and seq_list_file is not loaded.
+      Otherwise we (re)create it from the seq lists.
     :param str|None seq_order_control_dataset: if set, this dataset will define the order for each epoch.
     :param str|None seq_lens_file: filename. json. dict[str,dict[str,int]], seq-tag -> data-key -> len.
       Use if getting sequence length from loading data is too costly.
@@ -206,12 +406,21 @@ class MetaDataset(CachedDataset2):
       key: init_dataset(datasets[key], extra_kwargs={"name": "%s_%s" % (self.name, key)})
       for key in self.dataset_keys}  # type: typing.Dict[str,Dataset]
 
-    self.seq_list_original = self._load_seq_list(seq_list_file)
-    self.num_total_seqs = len(self.seq_list_original[self.default_dataset_key])
+    start_time = time.time()
+    self.seq_tag_indices = None  # type: typing.Optional[typing.Dict[str,SeqTagIndex]]
+    if seq_list_index_file and os.path.exists(seq_list_index_file):
+      self.seq_tag_indices = self._load_seq_tag_indices(seq_list_index_file, seq_list_file=seq_list_file)
+    if self.seq_tag_indices is None:
+      self.seq_tag_indices = self._make_seq_tag_indices(self._load_seq_list(seq_list_file))
+      if seq_list_index_file:
+        self._save_seq_tag_indices(seq_list_index_file, seq_list_file=seq_list_file)
+    self.num_total_seqs = len(self.seq_tag_indices[self.default_dataset_key])
     for key in self.dataset_keys:
-      assert len(self.seq_list_original[key]) == self.num_total_seqs
-
-    self.tag_idx = {tag: idx for (idx, tag) in enumerate(self.seq_list_original[self.default_dataset_key])}
+      assert len(self.seq_tag_indices[key]) == self.num_total_seqs
+    print("MetaDataset %r: seq lists with %i seqs, loaded in %.3f secs." % (
+      self.name, self.num_total_seqs, time.time() - start_time), file=log.v4)
+    # dataset-key -> seq list idx -> corpus seq idx in the sub-dataset, for sub-datasets which support seq_order.
+    self._dataset_corpus_idxs = {}  # type: typing.Dict[str,numpy.ndarray]
 
     self._seq_lens = None  # type: typing.Optional[typing.Dict[str,NumbersDict]]
     self._num_timesteps = None  # type: typing.Optional[NumbersDict]
@@ -220,7 +429,8 @@ class MetaDataset(CachedDataset2):
       assert isinstance(seq_lens, dict)
       # dict[str,NumbersDict], seq-tag -> data-key -> len
       self._seq_lens = {tag: NumbersDict(l) for (tag, l) in seq_lens.items()}
-      self._num_timesteps = sum([self._seq_lens[s] for s in self.seq_list_original[self.default_dataset_key]])
+      self._num_timesteps = sum([
+        self._seq_lens[s] for s in self.seq_tag_indices[self.default_dataset_key].get_tags()])
 
     if data_dims:
       data_dims = convert_data_dims(data_dims)
@@ -244,7 +454,7 @@ class MetaDataset(CachedDataset2):
 
     self.data_dtypes = {data_key: _select_dtype(data_key, self.data_dims, data_dtypes) for data_key in self.data_keys}
     self.orig_seq_order_is_initialized = False
-    self.seq_list_ordered = None  # type: typing.Optional[typing.Dict[str,typing.List[str]]]
+    self.seq_order = None  # type: typing.Optional[numpy.ndarray]  # sorted seq idx -> seq list idx
 
   def _is_same_seq_name_for_each_dataset(self):
     """
@@ -252,12 +462,102 @@ class MetaDataset(CachedDataset2):
 
     :rtype: bool
     """
-    main_list = self.seq_list_original[self.default_dataset_key]
-    for key, other_list in self.seq_list_original.items():
-      if main_list is not other_list:
+    main_index = self.seq_tag_indices[self.default_dataset_key]
+    for key, other_index in self.seq_tag_indices.items():
+      if main_index is not other_index:
         return False
     return True
 
+  def _make_seq_tag_indices(self, seq_list):
+    """
+    :param dict[str,list[str]] seq_list: dataset key -> seq list
+    :return: dataset key -> index. identical seq lists share the same index
+    :rtype: dict[str,SeqTagIndex]
+    """
+    indices = {}  # type: typing.Dict[int,SeqTagIndex]  # id(seq list) -> index
+    for key in sorted(self.dataset_keys):
+      if id(seq_list[key]) not in indices:
+        indices[id(seq_list[key])] = SeqTagIndex.from_tags(seq_list[key])
+    return {key: indices[id(seq_list[key])] for key in self.dataset_keys}
+
+  @staticmethod
+  def _get_seq_list_file_stamp(seq_list_file):
+    """
+    :param str|None seq_list_file:
+    :return: arrays which identify the version of the seq_list_file, stored in the seq_list_index_file
+    :rtype: dict[str,numpy.ndarray]
+    """
+    if not seq_list_file:
+      return {"seq_list_file": numpy.array(""), "seq_list_file_stat": numpy.array([0, 0], dtype="float64")}
+    st = os.stat(seq_list_file)
+    return {
+      "seq_list_file": numpy.array(seq_list_file),
+      "seq_list_file_stat": numpy.array([st.st_mtime, st.st_size], dtype="float64")}
+
+  def _save_seq_tag_indices(self, filename, seq_list_file):
+    """
+    :param str filename: npz
+    :param str|None seq_list_file: the source of the seq lists. its mtime and size is stored along
+    """
+    assert filename.endswith(".npz")
+    unique_indices = []  # type: typing.List[SeqTagIndex]
+    dataset_keys = sorted(self.dataset_keys)
+    for key in dataset_keys:
+      if not any(index is self.seq_tag_indices[key] for index in unique_indices):
+        unique_indices.append(self.seq_tag_indices[key])
+    arrays = {
+      "dataset_keys": numpy.array(dataset_keys),
+      "dataset_index": numpy.array([
+        [index is self.seq_tag_indices[key] for index in unique_indices].index(True) for key in dataset_keys])}
+    arrays.update(self._get_seq_list_file_stamp(seq_list_file))
+    for i, index in enumerate(unique_indices):
+      arrays.update(index.get_arrays(prefix="index%i." % i))
+    # Write to a temp file first, as other jobs might read it in parallel.
+    tmp_filename = "%s.tmp-%i.npz" % (filename[:-len(".npz")], os.getpid())
+    numpy.savez(tmp_filename, **arrays)
+    os.rename(tmp_filename, filename)
+    print("MetaDataset %r: saved seq lists to %r." % (self.name, filename), file=log.v4)
+
+  def _load_seq_tag_indices(self, filename, seq_list_file):
+    """
+    :param str filename: npz, via :func:`_save_seq_tag_indices`
+    :param str|None seq_list_file: the source of the seq lists
+    :return: dataset key -> index, or None if the file was not created from the same seq_list_file
+    :rtype: dict[str,SeqTagIndex]|None
+    """
+    print("MetaDataset %r: load seq lists from %r." % (self.name, filename), file=log.v4)
+    with numpy.load(filename) as f:
+      stamp = self._get_seq_list_file_stamp(seq_list_file)
+      if any(key not in f or not numpy.array_equal(f[key], value) for (key, value) in stamp.items()):
+        print("MetaDataset %r: %r is outdated or not from seq list file %r, recreate it." % (
+          self.name, filename, seq_list_file), file=log.v3)
+        return None
+      dataset_keys = [str(key) for key in f["dataset_keys"]]
+      assert set(dataset_keys) == self.dataset_keys, "%r: datasets %r do not match %r" % (
+        filename, dataset_keys, self.dataset_keys)
+      indices = {}  # type: typing.Dict[int,SeqTagIndex]
+      for key, i in zip(dataset_keys, f["dataset_index"].tolist()):
+        if i not in indices:
+          indices[i] = SeqTagIndex.from_arrays(f, prefix="index%i." % i)
+      return {key: indices[i] for (key, i) in zip(dataset_keys, f["dataset_index"].tolist())}
+
+  def _init_dataset_seq_order(self, dataset_key, epoch, seq_order):
+    """
+    :param str dataset_key:
+    :param int|None epoch:
+    :param numpy.ndarray seq_order: seq list idxs
+    """
+    dataset = self.datasets[dataset_key]
+    tag_index = self.seq_tag_indices[dataset_key]
+    if dataset.supports_seq_order():
+      if dataset_key not in self._dataset_corpus_idxs:
+        # Only done once. Afterwards, every epoch just needs an array lookup.
+        dataset_tag_index = SeqTagIndex.from_tags(dataset.get_all_tags())
+        self._dataset_corpus_idxs[dataset_key] = dataset_tag_index.get_indices_of(tag_index)
+      dataset.init_seq_order(epoch=epoch, seq_order=self._dataset_corpus_idxs[dataset_key][seq_order])
+    else:
+      dataset.init_seq_order(epoch=epoch, seq_list=tag_index.get_tags(seq_order))
+
   def _load_seq_list(self, seq_list_file=None):
     """
     :param str seq_list_file:
@@ -310,8 +610,8 @@ class MetaDataset(CachedDataset2):
     if not self.orig_seq_order_is_initialized:
       # To use get_seq_length() we first have to init the sequence order once in original order.
       # If sequence lengths are not needed by get_seq_order_for_epoch this is never executed.
-      self.datasets[self.default_dataset_key].init_seq_order(
-        epoch=self.epoch, seq_list=self.seq_list_original[self.default_dataset_key])
+      self._init_dataset_seq_order(
+        self.default_dataset_key, epoch=self.epoch, seq_order=numpy.arange(self.num_total_seqs))
       self.orig_seq_order_is_initialized = True
 
     return self.datasets[self.default_dataset_key].get_seq_length(seq_idx)["data"]
@@ -326,12 +626,13 @@ class MetaDataset(CachedDataset2):
     super(MetaDataset, self).init_seq_order(epoch=epoch, seq_list=seq_list)
 
     if not need_reinit:
-      self._num_seqs = len(self.seq_list_ordered[self.default_dataset_key])
+      self._num_seqs = len(self.seq_order)
       return False
 
     seq_order_dataset = None
     if seq_list:
-      seq_index = [self.tag_idx[tag] for tag in seq_list]
+      default_index = self.seq_tag_indices[self.default_dataset_key]
+      seq_index = [default_index.get_index(tag) for tag in seq_list]
     elif self.seq_order_control_dataset:
       seq_order_dataset = self.datasets[self.seq_order_control_dataset]
       assert isinstance(seq_order_dataset, Dataset)
@@ -344,19 +645,19 @@ class MetaDataset(CachedDataset2):
           :param int s:
           :rtype: int
           """
-          return self._seq_lens[self.seq_list_original[self.default_dataset_key][s]]["data"]
+          return self._seq_lens[self.seq_tag_indices[self.default_dataset_key].get_tag(s)]["data"]
       else:
         self.orig_seq_order_is_initialized = False
         get_seq_len = self._get_dataset_seq_length
       seq_index = self.get_seq_order_for_epoch(epoch, self.num_total_seqs, get_seq_len)
-    self._num_seqs = len(seq_index)
-    self.seq_list_ordered = {key: [ls[s] for s in seq_index] for (key, ls) in self.seq_list_original.items()}
+    self.seq_order = numpy.array(seq_index, dtype="int64")
+    self._num_seqs = len(self.seq_order)
 
     for dataset_key, dataset in self.datasets.items():
       assert isinstance(dataset, Dataset)
       if dataset is seq_order_dataset:
         continue
-      dataset.init_seq_order(epoch=epoch, seq_list=self.seq_list_ordered[dataset_key])
+      self._init_dataset_seq_order(dataset_key, epoch=epoch, seq_order=self.seq_order)
     return True
 
   def _load_seqs(self, start, end):
@@ -372,7 +673,7 @@ class MetaDataset(CachedDataset2):
     :param int seq_idx:
     """
     dataset_seq_tag = self.datasets[dataset_key].get_tag(seq_idx)
-    self_seq_tag = self.seq_list_ordered[dataset_key][seq_idx]
+    self_seq_tag = self.seq_tag_indices[dataset_key].get_tag(self.seq_order[seq_idx])
     assert dataset_seq_tag == self_seq_tag
 
   def _get_data(self, seq_idx, data_key):
@@ -390,7 +691,7 @@ class MetaDataset(CachedDataset2):
     :type seq_idx: int
     :rtype: DatasetSeq
     """
-    seq_tag = self.seq_list_ordered[self.default_dataset_key][seq_idx]
+    seq_tag = self.get_tag(seq_idx)
     features = self._get_data(seq_idx, "data")
     targets = {target: self._get_data(seq_idx, target) for target in self.target_list}
     return DatasetSeq(seq_idx=seq_idx, seq_tag=seq_tag, features=features, targets=targets)
@@ -401,7 +702,7 @@ class MetaDataset(CachedDataset2):
     :rtype: NumbersDict
     """
     if self._seq_lens:
-      return self._seq_lens[self.seq_list_ordered[self.default_dataset_key][sorted_seq_idx]]
+      return self._seq_lens[self.get_tag(sorted_seq_idx)]
     return super(MetaDataset, self).get_seq_length(sorted_seq_idx)
 
   def get_tag(self, sorted_seq_idx):
@@ -409,7 +710,25 @@ class MetaDataset(CachedDataset2):
     :param int sorted_seq_idx:
     :rtype: str
     """
-    return self.seq_list_ordered[self.default_dataset_key][sorted_seq_idx]
+    return self.seq_tag_indices[self.default_dataset_key].get_tag(self.seq_order[sorted_seq_idx])
+
+  def supports_seq_len_index(self):
+    """
+    We don't set :func:`have_corpus_seq_idx`, as that would change e.g. the seq order in forwarding.
+
+    :rtype: bool
+    """
+    return True
+
+  def get_corpus_seq_idx(self, seq_idx):
+    """
+    Only used for the seq len index, see :func:`supports_seq_len_index`.
+
+    :param int seq_idx:
+    :return: idx in the seq list of the default dataset
+    :rtype: int
+    """
+    return int(self.seq_order[seq_idx])
 
   def get_target_list(self):
     """
@@ -778,7 +1097,7 @@ class CombinedDataset(CachedDataset2):
     super(CombinedDataset, self).__init__(**kwargs)
     assert self.shuffle_frames_of_nseqs == 0  # not implemented. anyway only for non-recurrent nets
 
-    self.rnd = Random(self.epoch)
+    self.rnd = numpy.random.RandomState(self.epoch)
     self.dataset_keys = set([m[0] for m in data_map.keys()]); ":type: set[str]"
     self.dataset_idx2key_map = dict(enumerate(sorted(self.dataset_keys)))  # idx -> dataset-key
     self.data_keys = set(data_map.values()); ":type: set[str]"
@@ -832,10 +1151,16 @@ class CombinedDataset(CachedDataset2):
 
     self.data_dtypes = {data_key: _select_dtype(data_key, self.data_dims, data_dtypes) for data_key in self.data_keys}
 
-    self.dataset_seq_idx_list = None  # type: typing.Optional[typing.List[typing.Tuple[int,int]]]
-    self.seq_order = None  # type: typing.Optional[typing.List[int]]
-    self.dataset_sorted_seq_idx_list = None  # type: typing.Optional[typing.List[typing.Tuple[int,int]]]
+    # The index tables below are numpy arrays of shape (num_seqs, 2), with entries (dataset-idx, dataset-seq-idx).
+    self.dataset_seq_idx_list = None  # type: typing.Optional[numpy.ndarray]
+    self.seq_order = None  # type: typing.Optional[numpy.ndarray]
+    self.dataset_sorted_seq_idx_list = None  # type: typing.Optional[numpy.ndarray]
+    # Only if not know_num_seqs_beforehand. dataset_sorted_seq_idx_list is a view into this.
+    self._dataset_sorted_seq_idx_buffer = None  # type: typing.Optional[numpy.ndarray]
     self.used_num_seqs_per_subset = None  # type: typing.Optional[typing.List[int]]
+    # For random_dataset if not know_num_seqs_beforehand: shuffled dataset-idxs according to the estimated num seqs.
+    self._random_dataset_plan = None  # type: typing.Optional[numpy.ndarray]
+    self._random_dataset_plan_pos = 0
 
   def init_seq_order(self, epoch=None, seq_list=None):
     """
@@ -864,36 +1189,33 @@ class CombinedDataset(CachedDataset2):
       if self.seq_ordering == "random_dataset":
         self.seq_order = self._get_random_dataset_seq_order()
       else:
-        self.seq_order = self.get_seq_order_for_epoch(
-            epoch=epoch, num_seqs=len(self.dataset_seq_idx_list), get_seq_len=self._get_seq_length)
+        self.seq_order = numpy.array(self.get_seq_order_for_epoch(
+            epoch=epoch, num_seqs=len(self.dataset_seq_idx_list), get_seq_len=self._get_seq_length), dtype="int64")
       self._num_seqs = len(self.seq_order)
 
       # We only want to load those sequences in the sub-datasets that appear in self.seq_order. For this, we extract
       # sequence lists containing the subset of sequences for each dataset from self.seq_order.
-      seq_lists = [[] for _ in self.datasets]
-      for seq_idx in self.seq_order:
-        dataset_idx, dataset_seq_idx = self.dataset_seq_idx_list[seq_idx]
-        dataset = self.datasets[self.dataset_idx2key_map[dataset_idx]]
-        seq_tag = dataset.get_tag(dataset_seq_idx)
-        seq_lists[dataset_idx].append(seq_tag)
-
-      # Re-initialize sequence orders of sub-datasets with created sequence list.
+      selected_seq_idxs = self.dataset_seq_idx_list[self.seq_order]
       for dataset_idx, dataset_key in self.dataset_idx2key_map.items():
-        self.datasets[dataset_key].init_seq_order(epoch=epoch, seq_list=seq_lists[dataset_idx])
+        dataset = self.datasets[dataset_key]
+        dataset_seq_idxs = selected_seq_idxs[selected_seq_idxs[:, 0] == dataset_idx, 1]
+        seq_list = [dataset.get_tag(dataset_seq_idx) for dataset_seq_idx in dataset_seq_idxs.tolist()]
+        # Re-initialize sequence orders of sub-datasets with created sequence list.
+        dataset.init_seq_order(epoch=epoch, seq_list=seq_list)
 
       # Apply seq_order to self.dataset_seq_idx.
-      # We have to re-calculate the seq_idx's because we sorted the datasets in the previous step.
-      self.dataset_sorted_seq_idx_list = []
-      counters = [0] * len(self.datasets)
-      for seq_idx in self.seq_order:
-        dataset_idx, _ = self.dataset_seq_idx_list[seq_idx]
-        dataset_seq_idx = counters[dataset_idx]
-        counters[dataset_idx] += 1
-        self.dataset_sorted_seq_idx_list.append((dataset_idx, dataset_seq_idx))
+      # We have to re-calculate the seq_idx's because we sorted the datasets in the previous step,
+      # i.e. the n-th seq of some dataset in the seq order gets dataset-seq-idx n.
+      selected_dataset_idxs = selected_seq_idxs[:, 0]
+      self.dataset_sorted_seq_idx_list = numpy.stack(
+        [selected_dataset_idxs, self._get_rank_within_dataset(selected_dataset_idxs)], axis=1)
 
     else:
-      self.dataset_sorted_seq_idx_list = []  # We will fill this as we go
+      self._dataset_sorted_seq_idx_buffer = numpy.zeros((1024, 2), dtype="int64")
+      self.dataset_sorted_seq_idx_list = self._dataset_sorted_seq_idx_buffer[:0]  # We will fill this as we go
       self.used_num_seqs_per_subset = [0] * len(self.datasets)
+      if self.seq_ordering == "random_dataset":
+        self._init_random_dataset_plan()
 
     return True
 
@@ -903,57 +1225,82 @@ class CombinedDataset(CachedDataset2):
     It contains the index of the dataset and the sequence index within the dataset for every sequence.
     The sequences appear sorted by dataset first.
 
-    :returns: list of (dataset-idx, dataset-seq-idx)
-    :rtype: list[(int,int)]
+    :returns: array of shape (num_seqs, 2), with entries (dataset-idx, dataset-seq-idx)
+    :rtype: numpy.ndarray
     """
-    dataset_seq_idxs = []
-    for dataset_idx in range(len(self.datasets)):
-      dataset = self.datasets[self.dataset_idx2key_map[dataset_idx]]
-      for dataset_seq_idx in range(dataset.num_seqs):
-        dataset_seq_idxs.append((dataset_idx, dataset_seq_idx))
+    num_seqs_per_dataset = [
+      self.datasets[self.dataset_idx2key_map[dataset_idx]].num_seqs for dataset_idx in range(len(self.datasets))]
+    dataset_idxs = numpy.repeat(numpy.arange(len(self.datasets), dtype="int64"), num_seqs_per_dataset)
+    return numpy.stack([dataset_idxs, self._get_rank_within_dataset(dataset_idxs)], axis=1)
 
-    return dataset_seq_idxs
+  def _get_rank_within_dataset(self, dataset_idxs):
+    """
+    :param numpy.ndarray dataset_idxs: shape (num_seqs,), dataset-idx for every seq
+    :return: shape (num_seqs,), for every seq, the number of previous seqs with the same dataset-idx
+    :rtype: numpy.ndarray
+    """
+    num_seqs_per_dataset = numpy.bincount(dataset_idxs, minlength=len(self.datasets))
+    dataset_offsets = numpy.cumsum(num_seqs_per_dataset) - num_seqs_per_dataset
+    # With a stable sort, the n-th seq of a dataset ends up at position dataset_offset + n.
+    sorted_idxs = numpy.argsort(dataset_idxs, kind="stable")
+    ranks = numpy.empty_like(dataset_idxs)
+    ranks[sorted_idxs] = numpy.arange(len(dataset_idxs)) - dataset_offsets[dataset_idxs[sorted_idxs]]
+    return ranks
 
   def _get_random_dataset_seq_order(self):
     """
     Choose datasets randomly but preserve order within each dataset. This sorting method is unique to CombinedDataset.
-    """
-    # Create a list containing each dataset_idx dataset.num_seqs-times and shuffle it.
-    dataset_ids = [idx_tuple[0] for idx_tuple in self.dataset_seq_idx_list]
-    self.rnd.shuffle(dataset_ids)
 
-    # Calculate the offset for all datasets (i.e. the index where sequences of a given dataset start
-    # in self.dataset_seq_idx_list).
-    dataset_offsets = [0]
-    for dataset_idx in range(len(self.datasets)):
-      dataset = self.datasets[self.dataset_idx2key_map[dataset_idx]]
-      dataset_offsets.append(dataset_offsets[-1] + dataset.num_seqs)
-
-    # Create the actual seq_order list.
-    # We want to keep the order within the sub-datasets, thus we assign seq_ids by simply counting up for each dataset.
-    # We however have to account for the different offsets needed when accessing self.dataset_seq_idx_list later.
-    seq_order = []
-    counters = [0] * len(self.datasets)
-    for dataset_idx in dataset_ids:
-      seq_order.append(counters[dataset_idx] + dataset_offsets[dataset_idx])
-      counters[dataset_idx] += 1
+    :rtype: numpy.ndarray
+    """
+    # Create an array containing each dataset_idx dataset.num_seqs-times and shuffle it.
+    dataset_ids = self.rnd.permutation(self.dataset_seq_idx_list[:, 0])
 
-    total_num_seqs = len(self.dataset_seq_idx_list)
-    assert sum(counters) == total_num_seqs
+    # Create the actual seq_order.
+    # We want to keep the order within the sub-datasets, thus the n-th occurrence of a dataset gets the n-th seq
+    # of this dataset. self.dataset_seq_idx_list is sorted by dataset, thus the n-th seq of dataset i
+    # is at the offset of dataset i plus n, which is exactly the position of this occurrence after a stable sort.
+    seq_order = numpy.empty_like(dataset_ids)
+    seq_order[numpy.argsort(dataset_ids, kind="stable")] = numpy.arange(len(dataset_ids))
 
     if self.partition_epoch:
       seq_order = self._apply_partition_epoch(seq_order, self.partition_epoch, self.epoch)
     if self.repeat_epoch:
-      seq_order = seq_order * self.repeat_epoch
+      seq_order = numpy.tile(seq_order, self.repeat_epoch)
 
     return seq_order
 
   def _get_seq_length(self, seq_idx):
-    dataset_idx, dataset_seq_idx = self.dataset_seq_idx_list[seq_idx]
+    dataset_idx, dataset_seq_idx = self.dataset_seq_idx_list[seq_idx].tolist()
     dataset = self.datasets[self.dataset_idx2key_map[dataset_idx]]
 
     return dataset.get_seq_length(dataset_seq_idx)["data"]
 
+  def _init_random_dataset_plan(self):
+    """
+    For random_dataset, if we do not know the num seqs beforehand.
+    Sampling the dataset for each seq with probabilities proportional to the expected remaining seqs
+    is the same as taking a random permutation of all the expected seqs, so we do this in bulk here.
+    """
+    self._random_dataset_plan = self.rnd.permutation(numpy.repeat(
+      numpy.arange(len(self.datasets), dtype="int64"), [max(n, 0) for n in self.estimated_num_seq_per_subset]))
+    self._random_dataset_plan_pos = 0
+
+  def _append_dataset_sorted_seq_idx(self, dataset_idx, dataset_seq_idx):
+    """
+    If we do not know the num seqs beforehand, we fill self.dataset_sorted_seq_idx_list as we go.
+
+    :param int dataset_idx:
+    :param int dataset_seq_idx:
+    """
+    buffer = self._dataset_sorted_seq_idx_buffer
+    num_seqs = len(self.dataset_sorted_seq_idx_list)
+    if num_seqs >= len(buffer):
+      buffer = numpy.concatenate([buffer, numpy.zeros_like(buffer)], axis=0)  # grow geometrically
+      self._dataset_sorted_seq_idx_buffer = buffer
+    buffer[num_seqs] = (dataset_idx, dataset_seq_idx)
+    self.dataset_sorted_seq_idx_list = buffer[:num_seqs + 1]
+
   def _expand_dataset_sec_idxs(self, num_values):
     """
     :param num_values: int Add num_values entries to the dataset-segment-idx mapping table
@@ -982,38 +1329,36 @@ class CombinedDataset(CachedDataset2):
 
       elif self.seq_ordering == "random_dataset":
         while True:
-          # Build probability table
-          expected_remaining_seqs = [
-            estimated - used
-            for estimated, used in zip(self.estimated_num_seq_per_subset, self.used_num_seqs_per_subset)]
-          total_remaining = float(sum(expected_remaining_seqs))
-
-          if total_remaining < 0.1:  # We expect no more data, but try anyway
+          if self._random_dataset_plan_pos >= len(self._random_dataset_plan):  # We expect no more data, but try anyway
             nonempty_datasets = []
             for j, k in enumerate(sorted(self.datasets.keys())):
               if self.datasets[k].is_less_than_num_seqs(self.used_num_seqs_per_subset[j]):
                 nonempty_datasets.append(j)
             if not nonempty_datasets:
               return False  # No more data to add
-            dataset_idx = numpy.random.choice(nonempty_datasets)
+            dataset_idx = int(self.rnd.choice(nonempty_datasets))
             self.estimated_num_seq_per_subset[dataset_idx] += 1
             break
 
-          else:  # We sample from all sets which should contain more data
-            prob_table = [remaining / total_remaining for remaining in expected_remaining_seqs]
-            dataset_idx = numpy.random.choice(len(self.datasets), p=prob_table)
+          else:  # We take the next dataset from the plan, i.e. from all sets which should contain more data
+            dataset_idx = int(self._random_dataset_plan[self._random_dataset_plan_pos])
+            self._random_dataset_plan_pos += 1
             if self.datasets[self.dataset_idx2key_map[dataset_idx]].is_less_than_num_seqs(
                   self.used_num_seqs_per_subset[dataset_idx]):
               break  # Found good Data
             else:
+              # This dataset has less seqs than estimated. Remove it from the remaining plan.
               self.estimated_num_seq_per_subset[dataset_idx] = self.used_num_seqs_per_subset[dataset_idx]
+              remaining_plan = self._random_dataset_plan[self._random_dataset_plan_pos:]
+              self._random_dataset_plan = remaining_plan[remaining_plan != dataset_idx]
+              self._random_dataset_plan_pos = 0
 
       else:
         raise Exception("The sorting method '{}' is not implemented for the case that number of sequences"
                         "is not known in advance.".format(self.seq_ordering))
 
       # We now have a valid dataset index to take the next segment from
-      self.dataset_sorted_seq_idx_list.append((dataset_idx, self.used_num_seqs_per_subset[dataset_idx]))
+      self._append_dataset_sorted_seq_idx(dataset_idx, self.used_num_seqs_per_subset[dataset_idx])
       self.used_num_seqs_per_subset[dataset_idx] += 1
     return True
 
@@ -1026,10 +1371,10 @@ class CombinedDataset(CachedDataset2):
 
     for dataset_idx in range(len(self.datasets)):
       dataset = self.datasets[self.dataset_idx2key_map[dataset_idx]]
-      sub_requested_seqs = [s[1] for s in requested_seqs if s[0] == dataset_idx]
-      if not sub_requested_seqs:
+      sub_requested_seqs = requested_seqs[requested_seqs[:, 0] == dataset_idx, 1]
+      if len(sub_requested_seqs) == 0:
         continue
-      sub_start, sub_end = min(sub_requested_seqs), max(sub_requested_seqs)
+      sub_start, sub_end = int(numpy.min(sub_requested_seqs)), int(numpy.max(sub_requested_seqs))
       dataset.load_seqs(sub_start, sub_end + 1)
     super(CombinedDataset, self)._load_seqs(start=start, end=end)
 
@@ -1054,7 +1399,7 @@ class CombinedDataset(CachedDataset2):
     """
     if not self.is_less_than_num_seqs(seq_idx):
       return None
-    dataset_idx, dataset_seq_idx = self.dataset_sorted_seq_idx_list[seq_idx]
+    dataset_idx, dataset_seq_idx = self.dataset_sorted_seq_idx_list[seq_idx].tolist()
     dataset_key = self.dataset_idx2key_map[dataset_idx]
     dataset = self.datasets[dataset_key]
 
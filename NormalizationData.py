@@ -1,5 +1,5 @@
 import os
-import six
+import multiprocessing
 import h5py
 import numpy as np
 
@@ -22,11 +22,12 @@ class NormalizationData(object):
   DATASET_TIME_DIMENSION_INDEX = 0
   DATASET_FEATURE_DIMENSION_INDEX = 1
 
-  SUMMATION_PRECISION = 1e-5
+  DEFAULT_CHUNK_SIZE = 10000  # number of time frames which we read at once
 
   @staticmethod
   def createNormalizationFile(bundleFilePath, outputFilePath, dtype=np.float64,
-                              flag_includeOutputs=True):
+                              flag_includeOutputs=True, numWorkers=None,
+                              chunkSize=DEFAULT_CHUNK_SIZE):
     """Calculates means over inputs and outputs of datasets in the HDF files
     described by the given bundle file.
 
@@ -46,6 +47,13 @@ class NormalizationData(object):
     Availability of means and variances depends on whether the corresponding
     groups are available in the input dataset HDF files.
 
+    The HDF files are processed in parallel by a pool of worker processes,
+    and each dataset is read in chunks of at most chunkSize time frames,
+    so that the memory consumption is bounded.
+    Each worker calculates the count, mean and sum of squared deviations
+    (partial moments), and these are merged with the numerically stable
+    parallel variance algorithm.
+
     !!! IMPORTANT !!!
     General rule of thumb: if one dataset file has both input and output
     groups then you should make sure that all the dataset files have them.
@@ -62,82 +70,92 @@ class NormalizationData(object):
     :type flag_includeOutputs: bool
     :param flag_includeOutputs: if True then normalization data will be
                                 calculated for outputs (targets) as well.
+    :type numWorkers: int | None
+    :param numWorkers: number of worker processes. None means the number of
+                       CPUs. With 1, everything is done in this process.
+    :type chunkSize: int
+    :param chunkSize: maximum number of time frames read at once.
     """
+    groupNames = [NormalizationData.GROUP_INPUTS]
+    if flag_includeOutputs:
+      groupNames.append(NormalizationData.GROUP_OUTPUTS)
     NormalizationData._calculateNormalizationData(
       bundleFilePath,
       outputFilePath,
-      NormalizationData.GROUP_INPUTS,
-      dtype=dtype
+      groupNames,
+      dtype=dtype,
+      numWorkers=numWorkers,
+      chunkSize=chunkSize
     )
-    if flag_includeOutputs:
-      NormalizationData._calculateNormalizationData(
-        bundleFilePath,
-        outputFilePath,
-        NormalizationData.GROUP_OUTPUTS,
-        dtype=dtype
-      )
 
   @staticmethod
-  def _calculateNormalizationData(bundleFilePath, outputFilePath, groupName,
-                                  dtype=np.float64):
+  def _calculateNormalizationData(bundleFilePath, outputFilePath, groupNames,
+                                  dtype=np.float64, numWorkers=None,
+                                  chunkSize=DEFAULT_CHUNK_SIZE):
     """Helper method.
     Calculates and writes into the output HDF file mean, mean of squares,
     variance and total number of frames for the datasets in the given HDF
-    group.
+    groups.
 
     :type bundleFilePath: str
     :param bundleFilePath: path to the bundle file. :see: BundleFile.BundleFile
     :type outputFilePath: str
     :param outputFilePath: path to the output HDF normalization file. If file
                            already exists it will not be truncated.
-    :type groupName: str
-    :param groupName: name of the HDF group for which normalization data
-                      should be calculated. Also, a group with this name will
-                      be created in the output HDF file to store the calculated
-                      normalization data.
+    :type groupNames: list[str]
+    :param groupNames: names of the HDF groups for which normalization data
+                       should be calculated. Also, groups with these names
+                       will be created in the output HDF file to store the
+                       calculated normalization data.
     :type dtype: numpy.dtype
     :param dtype: type of data to use during calculations.
+    :type numWorkers: int | None
+    :param numWorkers: number of worker processes, None means number of CPUs.
+    :type chunkSize: int
+    :param chunkSize: maximum number of time frames read at once.
     """
-    accumulatedSum = None
-    accumulatedSumOfSqr = None
-    totalFrames = 0 if six.PY3 else long()  # python 2/3 compatibility
     bundle = BundleFile(bundleFilePath)
-    for filePath in bundle.datasetFilePaths:
-      with h5py.File(filePath, mode='r') as datasetFile:
-        intermSum, intermSumOfSqr, intermTotalFrames = \
-          NormalizationData._accumulateSums(
-            datasetFile,
-            groupName,
-            dtype=dtype
+    filePaths = list(bundle.datasetFilePaths)
+    jobs = [(filePath, groupNames, dtype, chunkSize) for filePath in filePaths]
+    if numWorkers is None:
+      numWorkers = multiprocessing.cpu_count()
+    numWorkers = max(min(numWorkers, len(jobs)), 1)
+    totalMoments = {groupName: None for groupName in groupNames}
+    if numWorkers == 1:
+      fileMomentsIter = map(_accumulateMomentsForFile, jobs)
+      pool = None
+    else:
+      pool = multiprocessing.Pool(numWorkers)
+      # imap keeps the order of the files, so the result is deterministic.
+      fileMomentsIter = pool.imap(_accumulateMomentsForFile, jobs)
+    try:
+      for fileMoments in fileMomentsIter:
+        for groupName in groupNames:
+          totalMoments[groupName] = NormalizationData._mergeMoments(
+            totalMoments[groupName],
+            fileMoments[groupName]
           )
-        accumulatedSum = NormalizationData._updateTotalSum(
-          accumulatedSum,
-          intermSum
-        )
-        accumulatedSumOfSqr = NormalizationData._updateTotalSum(
-          accumulatedSumOfSqr,
-          intermSumOfSqr
+    finally:
+      if pool:
+        pool.terminate()
+        pool.join()
+
+    for groupName in groupNames:
+      mean, meanOfSquares, variance, totalFrames = \
+        NormalizationData._calculateMeans(totalMoments[groupName])
+      with h5py.File(outputFilePath, mode='a') as out:
+        NormalizationData._writeData(
+          out, groupName,
+          mean, meanOfSquares, variance, totalFrames,
+          dtype=dtype
         )
-        totalFrames += intermTotalFrames
-
-    mean, meanOfSquares, variance = \
-      NormalizationData._calculateMeans(
-        accumulatedSum,
-        accumulatedSumOfSqr,
-        totalFrames
-      )
-
-    with h5py.File(outputFilePath, mode='a') as out:
-      NormalizationData._writeData(
-        out, groupName,
-        mean, meanOfSquares, variance, totalFrames,
-        dtype=dtype
-      )
 
   @staticmethod
-  def _accumulateSums(f, groupName, dtype=np.float64):
+  def _accumulateMoments(f, groupName, dtype=np.float64,
+                         chunkSize=DEFAULT_CHUNK_SIZE):
     """Helper method.
-    Accumulate sums and sums of squares over feature vectors for a given group.
+    Accumulates the moments over feature vectors for a given group.
+    The datasets are read in chunks of at most chunkSize time frames.
 
     :type f: h5py.File
     :param f: handle to an opened HDF file with datasets
@@ -145,94 +163,85 @@ class NormalizationData(object):
     :param groupName: HDF group containing datasets
     :type dtype: numpy.dtype
     :param dtype: type of data to use during calculations.
-    :rtype: tuple (numpy.ndarray | None, numpy.ndarray | None, long)
-    :return: tuple (sum, sum of squares, total number of time frames)
-             if they are available
+    :type chunkSize: int
+    :param chunkSize: maximum number of time frames read at once.
+    :rtype: tuple (int, numpy.ndarray, numpy.ndarray) | None
+    :return: tuple (number of time frames, mean, sum of squared deviations
+             from the mean) if they are available
     """
-    sum = None
-    sumOfSqr = None
-    totalFrames = np.int64(0)
+    moments = None
     if groupName not in f:
-      return sum, sumOfSqr, totalFrames
+      return moments
     group = f[groupName]
-    datasetNames = group.keys()
-    if len(datasetNames) == 0:
-      return sum, sumOfSqr, totalFrames
-    featDims = group[datasetNames[0]].shape[
-      NormalizationData.DATASET_FEATURE_DIMENSION_INDEX
-    ]
-    sum = np.zeros(featDims, dtype=dtype)
-    sumOfSqr = np.zeros(featDims, dtype=dtype)
-    for dsName in datasetNames:
-      dataset = group[dsName][...]
-      sum += np.sum(
-        dataset,
-        axis=NormalizationData.DATASET_TIME_DIMENSION_INDEX
-      )
-      sumOfSqr += np.sum(
-        np.square(dataset),
-        axis=NormalizationData.DATASET_TIME_DIMENSION_INDEX
-      )
-      totalFrames += dataset.shape[
-        NormalizationData.DATASET_TIME_DIMENSION_INDEX
-      ]
-    return sum, sumOfSqr, totalFrames
+    for dsName in group.keys():
+      dataset = group[dsName]
+      numFrames = dataset.shape[NormalizationData.DATASET_TIME_DIMENSION_INDEX]
+      for start in range(0, numFrames, chunkSize):
+        chunk = np.asarray(dataset[start:start + chunkSize], dtype=dtype)
+        chunkMean = np.mean(
+          chunk,
+          axis=NormalizationData.DATASET_TIME_DIMENSION_INDEX
+        )
+        chunkM2 = np.sum(
+          np.square(chunk - chunkMean),
+          axis=NormalizationData.DATASET_TIME_DIMENSION_INDEX
+        )
+        moments = NormalizationData._mergeMoments(
+          moments,
+          (chunk.shape[NormalizationData.DATASET_TIME_DIMENSION_INDEX],
+           chunkMean, chunkM2)
+        )
+    return moments
 
   @staticmethod
-  def _updateTotalSum(totalSum, intermediateSum):
+  def _mergeMoments(moments, otherMoments):
     """Helper method.
-    Updates total sum with intermediate sum if the latter is available.
+    Merges two partial moments with the parallel algorithm by Chan et al.
+    This is numerically stable, unlike accumulating sums of squares.
 
-    :type totalSum: numpy.ndarray | None
-    :param totalSum: total sum
-    :type intermediateSum: numpy.ndarray | None
-    :param intermediateSum: intermediate sum
-    :rtype: numpy.ndarray | None
-    :return: updated total sum if available
+    :see: https://en.wikipedia.org/wiki/Algorithms_for_calculating_variance
+
+    :type moments: tuple (int, numpy.ndarray, numpy.ndarray) | None
+    :param moments: tuple (count, mean, sum of squared deviations)
+    :type otherMoments: tuple (int, numpy.ndarray, numpy.ndarray) | None
+    :param otherMoments: tuple (count, mean, sum of squared deviations)
+    :rtype: tuple (int, numpy.ndarray, numpy.ndarray) | None
+    :return: merged moments if available
     """
-    if totalSum is None and intermediateSum is None:
-      return None
-    if totalSum is None:
-      return intermediateSum
-    if intermediateSum is None:
-      return totalSum
-    # floating point summation check
-    oldSum = totalSum
-    newSum = np.add(totalSum, intermediateSum)
-    sumErr = np.sum(np.abs(newSum - oldSum - intermediateSum))
-    if sumErr > NormalizationData.SUMMATION_PRECISION:
-      raise FloatingPointError(
-        'sums have very different orders of magnitude.'
-        ' summation error = {}'.format(sumErr)
-      )
-    return newSum
+    if moments is None:
+      return otherMoments
+    if otherMoments is None:
+      return moments
+    countA, meanA, m2A = moments
+    countB, meanB, m2B = otherMoments
+    if countB == 0:
+      return moments
+    if countA == 0:
+      return otherMoments
+    count = countA + countB
+    delta = meanB - meanA
+    mean = meanA + delta * (float(countB) / count)
+    m2 = m2A + m2B + np.square(delta) * (float(countA) * countB / count)
+    return count, mean, m2
 
   @staticmethod
-  def _calculateMeans(totalSum, totalSumOfSqr, totalFrames):
+  def _calculateMeans(moments):
     """Helper method.
     Calculate mean, mean of squares and variance if they are available.
 
-    :type totalSum: numpy.ndarray | None
-    :param totalSum: total sum of features
-    :type totalSumOfSqr: numpy.ndarray | None
-    :param totalSumOfSqr: total sum of squares of features
-    :type totalFrames: long
-    :param totalFrames: total number of timeframes
-    :rtype: tuple (numpy.ndarray | None, numpy.ndarray | None, numpy.ndarray | None)
-    :return: tuple (mean, mean of squares, variance) if they are available
+    :type moments: tuple (int, numpy.ndarray, numpy.ndarray) | None
+    :param moments: tuple (count, mean, sum of squared deviations)
+    :rtype: tuple (numpy.ndarray | None, numpy.ndarray | None, numpy.ndarray | None, int)
+    :return: tuple (mean, mean of squares, variance, total number of frames)
+             if they are available
     """
-    mean = None
-    meanOfSquares = None
-    variance = None
-    if totalSum is not None:
-      assert totalFrames > 0
-      mean = totalSum / totalFrames
-    if mean is not None and totalSumOfSqr is not None:
-      assert totalFrames > 0
-      meanOfSquares = totalSumOfSqr / totalFrames
-      # Var[X] = E[X ^ 2] - (E[X]) ^ 2
-      variance = meanOfSquares - np.square(mean)
-    return mean, meanOfSquares, variance
+    if moments is None or moments[0] == 0:
+      return None, None, None, 0
+    totalFrames, mean, m2 = moments
+    variance = m2 / totalFrames
+    # E[X ^ 2] = Var[X] + (E[X]) ^ 2
+    meanOfSquares = variance + np.square(mean)
+    return mean, meanOfSquares, variance, totalFrames
 
   @staticmethod
   def _writeData(f, groupName, mean, meanOfSqr, variance, totalFrames,
@@ -397,3 +406,26 @@ class NormalizationData(object):
     :return: Variance of the output data if it is available or None otherwise.
     """
     return self._outputVariance
+
+
+def _accumulateMomentsForFile(args):
+  """Helper function for NormalizationData._calculateNormalizationData,
+  executed in the worker processes.
+  This is a module-level function (and not a staticmethod),
+  because the multiprocessing pool needs to pickle it, which does not work for staticmethods in Python 2.
+
+  :type args: (str, list[str], numpy.dtype, int)
+  :param args: tuple (file path, group names, dtype, chunk size)
+  :rtype: dict[str, tuple (int, numpy.ndarray, numpy.ndarray) | None]
+  :return: group name -> moments. see NormalizationData._accumulateMoments
+  """
+  filePath, groupNames, dtype, chunkSize = args
+  with h5py.File(filePath, mode='r') as datasetFile:
+    return {
+      groupName: NormalizationData._accumulateMoments(
+        datasetFile,
+        groupName,
+        dtype=dtype,
+        chunkSize=chunkSize
+      )
+      for groupName in groupNames}
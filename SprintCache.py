@@ -119,11 +119,14 @@ class FileArchive:
     return res
 
   # write routines
-  def write_str(self, s):
+  def write_str(self, s, enc='ascii'):
     """
-    :param str s:
+    :param str|bytes s:
+    :param str enc: used if s is not bytes already
     :rtype: int
     """
+    if not isinstance(s, bytes):
+      s = s.encode(enc)
     return self.f.write(pack("%ds" % len(s), s))
 
   def write_char(self, i):
@@ -780,16 +780,37 @@ class ExternSprintDataset(SprintDatasetBase):
         "--*.corpus.segment-order=%s" % self.seq_list_file]
     return args
 
+  def _read_out_of_band_buffer(self):
+    """
+    The data of a Numpy array, which comes after the pickled stream. See SprintExternInterface.
+
+    :rtype: bytearray
+    """
+    import struct
+    size_raw = self.pipe_c2p[0].read(8)
+    if len(size_raw) < 8:
+      raise EOFError
+    size, = struct.unpack("<q", size_raw)
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    read_size = 0
+    while read_size < size:
+      n = self.pipe_c2p[0].readinto(view[read_size:])
+      if not n:
+        raise EOFError("%s: expected to read %i bytes but got EOF after %i bytes" % (self, size, read_size))
+      read_size += n
+    return buffer
+
   def _read_next_raw(self):
     """
     :return: (data_type, args)
     :rtype: (str, object)
     """
     import struct
-    size_raw = self.pipe_c2p[0].read(4)
-    if len(size_raw) < 4:
+    header_raw = self.pipe_c2p[0].read(8)
+    if len(header_raw) < 8:
       raise EOFError
-    size, = struct.unpack("<i", size_raw)
+    size, num_buffers = struct.unpack("<ii", header_raw)
     assert size > 0, "%s: We expect to get some non-empty package. Invalid Python mod in Sprint?" % (self,)
     stream = BytesIO()
     read_size = 0
@@ -800,13 +821,15 @@ class ExternSprintDataset(SprintDatasetBase):
       read_size += len(data_raw)
       stream.write(data_raw)
     stream.seek(0)
+    # Read the whole package before unpickling, such that we are not out of sync if that fails.
+    buffers = [self._read_out_of_band_buffer() for _ in range(num_buffers)]
     try:
       if PY3:
         # encoding is for converting Python2 strings to Python3.
         # Cannot use utf8 because Numpy will also encode the data as strings and there we need it as bytes.
-        data_type, args = Unpickler(stream, encoding="bytes").load()
+        data_type, args = Unpickler(stream, encoding="bytes", buffers=buffers).load()
       else:
-        data_type, args = Unpickler(stream).load()
+        data_type, args = Unpickler(stream, buffers=buffers).load()
     except EOFError:
       raise Exception("%s: parse error of %i bytes (%r)" % (self, size, stream.getvalue()))
     return data_type, args
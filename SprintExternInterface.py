@@ -329,11 +329,17 @@ class ExternSprintDatasetSource:
     assert data_type is not None
     import struct
     stream = BytesIO()
-    Pickler(stream).dump((data_type, args))
+    buffers = []
+    Pickler(stream, buffer_callback=buffers.append).dump((data_type, args))
     raw_data = stream.getvalue()
     assert len(raw_data) > 0
-    self.pipe_c2p.write(struct.pack("<i", len(raw_data)))
+    # The number of out-of-band buffers is in the header, such that the reader can read the whole package first.
+    self.pipe_c2p.write(struct.pack("<ii", len(raw_data), len(buffers)))
     self.pipe_c2p.write(raw_data)
+    # The data of the Numpy arrays (out-of-band), see ExternSprintDataset._read_next_raw.
+    for buffer in buffers:
+      self.pipe_c2p.write(struct.pack("<q", buffer.nbytes))
+      self.pipe_c2p.write(buffer)
     self.pipe_c2p.flush()
 
   def add_new_data(self, segment_name, features, targets):
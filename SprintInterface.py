@@ -14,6 +14,7 @@ from __future__ import print_function
 import os
 import sys
 import time
+import bisect
 from threading import Event, Thread
 import typing
 import numpy
@@ -120,6 +121,16 @@ def init_python_feature_scorer(config, **kwargs):
 class PythonFeatureScorer(object):
   """
   Sprint API.
+
+  By default, all features of a segment are collected, and forwarded at once in :func:`compute`.
+  With ``sprint_feature_scorer_chunk_size`` in the config, we forward fixed-size chunks
+  as soon as enough features arrived (including the right context),
+  so the scores of the first frames are available early (low latency for online decoding),
+  and we do not need to keep all the features of long segments.
+  The context frames are forwarded together with the chunk, but their outputs are dropped.
+  With ``sprint_feature_scorer_chunk_keep_state``, we instead carry over the state from the previous chunk
+  via the network epoch step, which needs ``initial_state="keep_over_epoch"`` in the rec layers
+  (only supported with TensorFlow).
   """
 
   def __init__(self, callback, version_number, sprint_opts, **kwargs):
@@ -138,6 +149,23 @@ class PythonFeatureScorer(object):
     self.segment_count = 0
     self.features = []  # type: typing.List[numpy.ndarray]
     self.scores = None  # type: typing.Optional[numpy.ndarray]
+    self.chunk_size = self.config.int("sprint_feature_scorer_chunk_size", 0)  # 0 -> disabled, whole segment
+    self.chunk_left_context = self.config.int("sprint_feature_scorer_chunk_left_context", 0)
+    self.chunk_right_context = self.config.int("sprint_feature_scorer_chunk_right_context", 0)
+    self.chunk_keep_state = self.config.bool("sprint_feature_scorer_chunk_keep_state", False)
+    if self.chunk_keep_state:
+      assert self.chunk_size > 0, "sprint_feature_scorer_chunk_keep_state needs sprint_feature_scorer_chunk_size"
+      assert self.chunk_left_context == self.chunk_right_context == 0, (
+        "with keep_state, the state is carried over, so the context frames would be forwarded twice")
+    # In chunked mode, self.features only contains the features starting from frame self.features_start_time,
+    # and self.scores is not used. See _forward_chunks().
+    self.features_start_time = 0
+    self.num_frames = 0
+    self.num_frames_scored = 0
+    self.score_chunks = []  # type: typing.List[numpy.ndarray]  # each (output_dim,time)
+    self.score_chunk_start_times = []  # type: typing.List[int]
+    self.first_score_latency = None  # type: typing.Optional[float]  # secs, after the first add_feature
+    self.segment_start_time = None  # type: typing.Optional[float]
 
   def init(self, input_dim, output_dim):
     """
@@ -205,9 +233,14 @@ class PythonFeatureScorer(object):
     :param numpy.ndarray feature: shape (input_dim,)
     :param int time:
     """
-    assert time == len(self.features)
+    assert time == self.num_frames
     assert feature.shape == (self.input_dim,)
+    if self.num_frames == 0:
+      self._segment_started()
     self.features.append(feature)
+    self.num_frames += 1
+    if self.chunk_size > 0:
+      self._forward_chunks()
 
   def reset(self, num_frames):
     """
@@ -218,9 +251,15 @@ class PythonFeatureScorer(object):
     """
     if num_frames > 0:
       self.segment_count += 1
-    assert num_frames == len(self.features)
+    assert num_frames == self.num_frames
     del self.features[:]
     self.scores = None
+    self.features_start_time = 0
+    self.num_frames = 0
+    self.num_frames_scored = 0
+    del self.score_chunks[:]
+    del self.score_chunk_start_times[:]
+    self.segment_start_time = None
 
   def get_segment_name(self):
     """
@@ -284,25 +323,96 @@ class PythonFeatureScorer(object):
 
     :param int num_frames:
     """
-    assert 0 < num_frames == len(self.features)
+    assert 0 < num_frames == self.num_frames
+    if self.chunk_size > 0:
+      self._forward_chunks(flush=True)
+      return
     posteriors = self.get_posteriors(num_frames=num_frames)
     assert posteriors.shape == (self.output_dim, num_frames)
+    self.scores = self.posteriors_to_scores(posteriors)
+    self._got_first_scores()
+
+  def posteriors_to_scores(self, posteriors):
+    """
+    :param numpy.ndarray posteriors: shape (output_dim, time)
+    :return: scores in -log space, shape (output_dim, time), with priors applied
+    :rtype: numpy.ndarray
+    """
     scores = -numpy.log(posteriors)  # transfer to -log space
     if self.priors is not None:
       scores -= numpy.expand_dims(self.priors, axis=1)
     # We must return in -log space.
-    self.scores = scores
+    return scores
+
+  def _segment_started(self):
+    self.segment_start_time = time.time()
+
+  def _got_first_scores(self):
+    if self.segment_start_time is not None:
+      self.first_score_latency = time.time() - self.segment_start_time
+      self.segment_start_time = None
+
+  def _forward_chunks(self, flush=False):
+    """
+    Forwards all chunks for which we have enough features, including the right context.
+
+    :param bool flush: also forward the remaining features, even if less than a chunk, or the right context is missing.
+      Note that the chunks are then not aligned to the chunk size anymore, which is fine.
+    """
+    while True:
+      start = self.num_frames_scored
+      end = min(start + self.chunk_size, self.num_frames)
+      if end <= start:
+        break
+      if not flush and self.num_frames < start + self.chunk_size + self.chunk_right_context:
+        break
+      self._forward_chunk(start=start, end=end)
+
+  def _forward_chunk(self, start, end):
+    """
+    :param int start: first frame of the chunk, == self.num_frames_scored
+    :param int end: end frame of the chunk (excluding)
+    """
+    assert start == self.num_frames_scored < end <= self.num_frames
+    ctx_start = max(start - self.chunk_left_context, self.features_start_time)
+    ctx_end = min(end + self.chunk_right_context, self.num_frames)
+    features = numpy.stack(
+      self.features[ctx_start - self.features_start_time:ctx_end - self.features_start_time], axis=1)
+    epoch_step = None
+    if self.chunk_keep_state:
+      epoch_step = len(self.score_chunks)  # 0 for the first chunk of the segment -> reset state
+    posteriors = _forward(
+      segment_name="%s.%i-%i" % (self.get_segment_name(), start, end), features=features, epoch_step=epoch_step)
+    assert posteriors.shape == (self.output_dim, ctx_end - ctx_start)
+    posteriors = posteriors[:, start - ctx_start:end - ctx_start]
+    self.score_chunks.append(self.posteriors_to_scores(posteriors))
+    self.score_chunk_start_times.append(start)
+    self.num_frames_scored = end
+    self._got_first_scores()
+    # We do not need the features anymore which are before the left context of the next chunk.
+    num_drop = end - self.chunk_left_context - self.features_start_time
+    if num_drop > 0:
+      del self.features[:num_drop]
+      self.features_start_time += num_drop
 
   # noinspection PyShadowingNames
   def get_scores(self, time):
     """
     Called by Sprint.
+    In chunked mode, this can also be called before :func:`compute`, for all frames which are already scored.
+    If the frame is not scored yet, we forward the remaining features (without the full right context).
 
     :param int time:
     :return: shape (output_dim,)
     :rtype: numpy.ndarray
     """
     # print("get scores, time", time, "max_frames", self.scores.shape[1])
+    if self.chunk_size > 0:
+      if time >= self.num_frames_scored:
+        self._forward_chunks(flush=True)
+      assert 0 <= time < self.num_frames_scored
+      chunk_idx = bisect.bisect_right(self.score_chunk_start_times, time) - 1
+      return self.score_chunks[chunk_idx][:, time - self.score_chunk_start_times[chunk_idx]]
     return self.scores[:, time]
 
 # }
@@ -898,9 +1008,11 @@ def features_to_dataset(features, segment_name):
   return sprintDataset, seq
 
 
-def _forward(segment_name, features):
+def _forward(segment_name, features, epoch_step=None):
   """
+  :param str segment_name:
   :param numpy.ndarray features: format (input-feature,time) (via Sprint)
+  :param int|None epoch_step: for stateful forwarding of chunks. see :func:`TFEngine.Engine.forward_single`
   :return: format (output-dim,time)
   :rtype: numpy.ndarray
   """
@@ -915,6 +1027,7 @@ def _forward(segment_name, features):
   dataset, seq_idx = features_to_dataset(features=features, segment_name=segment_name)
 
   if BackendEngine.is_theano_selected():
+    assert epoch_step is None, "stateful forwarding only supported with TensorFlow"
     # Prepare data for device.
     device = engine.devices[0]
     success = assign_dev_data_single_seq(device, dataset=dataset, seq=seq_idx)
@@ -928,7 +1041,7 @@ def _forward(segment_name, features):
     posteriors = result[0]
 
   elif BackendEngine.is_tensorflow_selected():
-    posteriors = engine.forward_single(dataset=dataset, seq_idx=seq_idx)
+    posteriors = engine.forward_single(dataset=dataset, seq_idx=seq_idx, epoch_step=epoch_step)
 
   else:
     raise NotImplementedError("unknown backend engine")
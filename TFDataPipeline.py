@@ -89,7 +89,14 @@ Also, instead of finishing this, probably using the tf.dataset is the better app
 Implementation via new tf.dataset API
 -------------------------------------
 
-This is planned, but not yet started.
+This is implemented in :class:`TFDataInput` and :class:`TFDataDataProvider`,
+and enabled via ``data_provider = "tf_data"`` in the config.
+A thread goes over the Dataset (like in :class:`FeedDictDataProvider`) and loads the data of each batch slice
+(i.e. seq or chunk, the batches are defined by the :class:`BatchSetGenerator`, as usual).
+A ``tf.data`` pipeline reads these, optionally does some per-sequence preprocessing via a parallel ``map``,
+then padded batching and prefetching, optionally directly onto the compute device.
+The extern data placeholders are replaced by the outputs of the ``tf.data`` iterator,
+thus this must be set up before the network construction.
 
 
 Some use case
@@ -141,6 +148,7 @@ except ImportError:
   # noinspection PyCompatibility,PyUnresolvedReferences
   from queue import Queue
 from threading import Thread, Condition
+from collections import deque
 
 import numpy
 import tensorflow as tf
@@ -148,7 +156,7 @@ from tensorflow.python.ops.data_flow_ops import StagingArea
 
 from Dataset import Dataset, BatchSetGenerator
 from TFNetwork import ExternData, Data
-from Util import NumbersDict
+from Util import NumbersDict, PhaseTimer
 from Log import log
 
 
@@ -851,6 +859,218 @@ class CpuToDefaultDevStage(object):
         session.run(self.stage_put_op)
 
 
+class InGraphChunking(object):
+  """
+  Chunking of the extern data in the graph, via :func:`TFNativeOp.chunk`.
+  This is enabled via ``chunking_in_graph = "size:step"`` in the config,
+  where the dataset provides whole seqs (no ``chunking``) or long spans.
+  With ``chunking`` in the dataset, overlapping frames are copied (and transferred to the device) for every chunk,
+  whereas here, every frame is fed only once.
+
+  The chunks are as with the chunking in the dataset (with ``min_chunk_size`` 0),
+  i.e. a chunk starts every chunk step frames, as long as the start is inside the seq.
+  The losses are calculated on the chunks, i.e. overlapping frames count for every chunk, as before.
+  In a batch, chunks which are only padding (of shorter seqs) get seq length 0.
+  All data with a time axis must be frame-aligned (i.e. have the same time dimension),
+  such that we get the same number of chunks for every data key.
+  Data without a time axis (e.g. "seq_idx" or "seq_tag") is repeated for every chunk.
+  Outputs can be unchunked again via :func:`unchunk`, e.g. via the ``time_unchunking`` layer.
+
+  :class:`ExternData` gets the chunked data, and keeps the original data in ``feed_data``,
+  which is used by the data providers.
+  """
+
+  def __init__(self, extern_data, chunk_size, chunk_step, train_flag, chunk_eval=False):
+    """
+    :param ExternData extern_data: will be modified inplace
+    :param int chunk_size:
+    :param int chunk_step:
+    :param bool|tf.Tensor train_flag:
+    :param bool chunk_eval: whether to also do the chunking if train_flag is not set
+    """
+    assert chunk_size > 0 and chunk_step > 0
+    assert not extern_data.chunking
+    self.extern_data = extern_data
+    self.chunk_size = chunk_size
+    self.chunk_step = chunk_step
+    self.enabled = True if chunk_eval else train_flag  # type: typing.Union[bool,tf.Tensor]
+    # The number of chunks is determined by this data key. All data with a time axis must be frame-aligned to it.
+    self.ref_key = None  # type: typing.Optional[str]
+    for key in sorted(extern_data.data.keys()):
+      if extern_data.data[key].have_time_axis():
+        self.ref_key = key
+        break
+    self._num_chunks = None  # type: typing.Optional[tf.Tensor]
+    extern_data.chunking = self
+    for key in sorted(extern_data.data.keys()):
+      self.chunk_extern_data_key(key)
+
+  @classmethod
+  def from_config(cls, config, extern_data, train_flag):
+    """
+    :param Config.Config config:
+    :param ExternData extern_data:
+    :param bool|tf.Tensor train_flag:
+    :rtype: InGraphChunking
+    """
+    chunking = config.typed_value("chunking_in_graph")
+    if isinstance(chunking, str):
+      chunking = tuple(map(int, chunking.split(":"))) if ":" in chunking else int(chunking)
+    if isinstance(chunking, int):
+      chunking = (chunking, chunking)
+    chunk_size, chunk_step = chunking
+    return cls(
+      extern_data=extern_data, chunk_size=chunk_size, chunk_step=chunk_step, train_flag=train_flag,
+      chunk_eval=config.bool("chunking_in_graph_eval", False))
+
+  def get_num_chunks(self):
+    """
+    :return: number of chunks per seq, scalar. 1 if the chunking is not enabled
+    :rtype: tf.Tensor
+    """
+    if self._num_chunks is None:
+      from TFUtil import cond
+      with tf.name_scope("extern_data/chunked/"):
+        if not self.ref_key:
+          self._num_chunks = tf.constant(1, name="num_chunks")
+        else:
+          n_time = tf.shape(self.extern_data.get_feed_data(self.ref_key).placeholder)[1] + self._get_time_padding()
+          self._num_chunks = tf.identity(cond(
+            self.enabled,
+            lambda: tf.maximum(n_time - self.chunk_size + self.chunk_step - 1, 0) // self.chunk_step + 1,
+            lambda: tf.constant(1)), name="num_chunks")
+    return self._num_chunks
+
+  def _get_time_padding(self):
+    """
+    :func:`TFNativeOp.chunk` gives us the chunks such that the last chunk ends at or after the end.
+    The dataset chunking gives us every chunk which starts before the end.
+    We add this padding to the time dim such that we get the same chunks.
+
+    :rtype: int
+    """
+    return max(self.chunk_size - self.chunk_step, 0)
+
+  def chunk_extern_data_key(self, key):
+    """
+    Replaces the data in extern data by the chunked data. The original data goes into ``feed_data``.
+
+    :param str key:
+    """
+    if key not in self.extern_data.data:
+      return
+    if key in self.extern_data.extra_added_keys or key in self.extern_data.feed_data:
+      return
+    from TFUtil import cond, DimensionTag
+    data = self.extern_data.data[key]
+    assert data.batch_dim_axis == 0, "%s: in-graph chunking expects batch-major data" % data
+    chunked = data.copy_template()
+    with tf.name_scope("extern_data/chunked/%s/" % key):
+      if data.have_time_axis():
+        assert data.time_dim_axis == 1 and data.batch_ndim in (2, 3), "%s: in-graph chunking not supported" % data
+        x, seq_lens = cond(
+          self.enabled,
+          lambda: self._chunk(data),
+          lambda: (data.placeholder, data.get_sequence_lengths()))
+        tag = DimensionTag(description="spatial:0:extern_data/chunked/%s" % key, kind=DimensionTag.Types.Spatial)
+        tag.set_tag_on_size_tensor(seq_lens)
+        chunked.size_placeholder = {0: seq_lens}
+      else:
+        x = cond(self.enabled, lambda: self._repeat_for_chunks(data.placeholder), lambda: data.placeholder)
+      x.set_shape(data.batch_shape)
+      chunked.placeholder = x
+    self.extern_data.feed_data[key] = data
+    self.extern_data.data[key] = chunked
+
+  def _chunk(self, data):
+    """
+    :param Data data: batch-major, (batch,time) or (batch,time,dim)
+    :return: chunked x, (batch * num_chunks, chunk_size[, dim]), and seq lens, (batch * num_chunks,)
+    :rtype: (tf.Tensor, tf.Tensor)
+    """
+    from TFNativeOp import chunk
+    x = data.placeholder
+    if data.batch_ndim == 2:
+      x = tf.expand_dims(x, axis=2)
+    x = tf.transpose(tf.cast(x, tf.float32), [1, 0, 2])  # (time,batch,dim). the op only supports float32
+    x = tf.pad(x, [[0, self._get_time_padding()], [0, 0], [0, 0]])
+    index = tf.transpose(tf.sequence_mask(data.get_sequence_lengths(), maxlen=tf.shape(x)[0], dtype=tf.float32))
+    out, oindex = chunk(x, index=index, chunk_size=self.chunk_size, chunk_step=self.chunk_step)
+    out = tf.transpose(out, [1, 0, 2])  # (batch * num_chunks,chunk_size,dim)
+    if data.batch_ndim == 2:
+      out = tf.squeeze(out, axis=2)
+    out = tf.cast(out, data.dtype)
+    seq_lens = tf.cast(tf.reduce_sum(oindex, axis=0), data.size_dtype)
+    return out, seq_lens
+
+  def _repeat_for_chunks(self, x):
+    """
+    :param tf.Tensor x: (batch,...)
+    :return: (batch * num_chunks,...), in the order of :func:`TFNativeOp.chunk`, i.e. all chunks of a seq together
+    :rtype: tf.Tensor
+    """
+    num_chunks = self.get_num_chunks()
+    ndim = x.get_shape().ndims
+    x = tf.tile(tf.expand_dims(x, axis=1), [1, num_chunks] + [1] * (ndim - 1))  # (batch,num_chunks,...)
+    return tf.reshape(x, tf.concat([[-1], tf.shape(x)[2:]], axis=0))
+
+  def unchunk(self, data):
+    """
+    The inverse of the chunking, via :func:`TFNativeOp.unchunk`.
+    Overlapping frames are averaged.
+
+    :param Data data: chunked, e.g. some output of the network, (batch * num_chunks,chunk_size,dim) (or time-major)
+    :return: the unchunked data, time-major, (time,batch,dim), with the seq lens of the original data
+    :rtype: Data
+    """
+    from TFNativeOp import unchunk
+    from TFUtil import cond
+    assert self.ref_key, "%s: no data with time axis" % self
+    ref_data = self.extern_data.get_feed_data(self.ref_key)
+    x = data.copy_as_time_major()
+    assert x.batch_shape == (None, None, x.dim), "%s: unchunk only supported for dense 3D data" % data
+
+    def unchunk_func():
+      """
+      :rtype: tf.Tensor
+      """
+      orig_shape = tf.shape(ref_data.placeholder)
+      index = tf.cast(x.get_sequence_mask(), tf.float32)
+      out, _, _ = unchunk(
+        x.placeholder, index=index, chunk_size=self.chunk_size, chunk_step=self.chunk_step,
+        n_time=orig_shape[1] + self._get_time_padding(), n_batch=orig_shape[0])
+      return out[:orig_shape[1]]
+
+    out = x.copy_template(name="%s_unchunked" % data.name)
+    with tf.name_scope("unchunk"):
+      out.placeholder = cond(self.enabled, unchunk_func, lambda: x.placeholder)
+    out.placeholder.set_shape(x.batch_shape)
+    out.size_placeholder = {0: ref_data.get_sequence_lengths()}
+    return out
+
+
+def is_batch_in_slice(batch_idx, batch_slice):
+  """
+  :param int batch_idx:
+  :param slice|None batch_slice: select a subset of the batches, e.g. for Horovod
+  :return: whether this batch should be used
+  :rtype: bool
+  """
+  if batch_slice is None:
+    return True
+  assert (batch_slice.start or 0) >= 0
+  start = batch_slice.start or 0
+  assert (batch_slice.step or 1) >= 1
+  step = batch_slice.step or 1
+  if batch_idx < start:
+    return False
+  if batch_slice.stop is not None and batch_idx >= batch_slice.stop:
+    return False
+  if step > 1 and (batch_idx - start) % step != 0:
+    return False
+  return True
+
+
 class DataProviderBase(object):
   """
   Base class which wraps up the logic in this class. See derived classes.
@@ -866,6 +1086,7 @@ class DataProviderBase(object):
     if data_keys is None:
       data_keys = extern_data.data.keys()
     self.data_keys = sorted(data_keys)  # type: typing.List[str]
+    self.timer = PhaseTimer()  # the runner will set its own instance. phases in our threads use in_step=False
 
   def start_threads(self):
     """
@@ -993,17 +1214,8 @@ class FeedDictDataProvider(DataProviderBase):
     cur_batch_idx = self.cur_batch_idx
     batch, = self.batches.peek_next_n(1)
     self.cur_batch_idx += 1
-    if consider_batch_slice and self.batch_slice is not None:
-      assert (self.batch_slice.start or 0) >= 0
-      start = self.batch_slice.start or 0
-      assert (self.batch_slice.step or 1) >= 1
-      step = self.batch_slice.step or 1
-      if cur_batch_idx < start:
-        return None
-      if self.batch_slice.stop is not None and cur_batch_idx >= self.batch_slice.stop:
-        return None
-      if step > 1 and (cur_batch_idx - start) % step != 0:
-        return None
+    if consider_batch_slice and not is_batch_in_slice(batch_idx=cur_batch_idx, batch_slice=self.batch_slice):
+      return None
     from Dataset import Batch, shapes_for_batches
     assert isinstance(batch, Batch)
     # In Returnn with Theano, we usually have the shape (time,batch,feature).
@@ -1062,12 +1274,15 @@ class FeedDictDataProvider(DataProviderBase):
       better_exchook.install()
 
       while self.batches.has_more() and not self.coord.should_stop():
-        enqueue_args = self.get_next_batch(consider_batch_slice=True)
+        with self.timer.phase("load_batch", in_step=False):
+          enqueue_args = self.get_next_batch(consider_batch_slice=True)
         if enqueue_args is not None:
-          if self.queue:
-            self.queue.put(enqueue_args)
-          else:
-            self.tf_queue.enqueue(tf_session=self.tf_session, data=enqueue_args)
+          # This blocks when the queue is full, i.e. when the data provider is faster than the consumer.
+          with self.timer.phase("enqueue_batch", in_step=False):
+            if self.queue:
+              self.queue.put(enqueue_args)
+            else:
+              self.tf_queue.enqueue(tf_session=self.tf_session, data=enqueue_args)
         with self.state_change_cond:
           self.state_change_cond.notifyAll()
         self.batches.advance(1)
@@ -1138,14 +1353,14 @@ class FeedDictDataProvider(DataProviderBase):
     assert isinstance(output, dict)
     # The data itself.
     d = {
-      self.extern_data.get_data(k).placeholder: output[k]
+      self.extern_data.get_feed_data(k).placeholder: output[k]
       for k in self.data_keys
       if k not in self.extern_data.extra_added_keys}
     # And seq lengths info.
     for k in self.data_keys:
       if k in self.extern_data.extra_added_keys:
         continue
-      data = self.extern_data.get_data(k)
+      data = self.extern_data.get_feed_data(k)
       for dim, len_placeholder in data.size_placeholder.items():
         if dim == 0:  # time-dim
           d[len_placeholder] = output["%s_seq_lens" % k]
@@ -1174,6 +1389,341 @@ class FeedDictDataProvider(DataProviderBase):
     return self.batches.completed_frac()
 
 
+class TFDataInput(object):
+  """
+  The input of the network via the ``tf.data`` API.
+  This replaces the placeholders of the extern data by the outputs of a ``tf.data`` iterator,
+  thus this must be created before the network construction, once per graph.
+  See :func:`TFEngine.Engine._init_network`.
+  The data itself is provided by :class:`TFDataDataProvider`, which also (re)initializes the iterator.
+
+  The pipeline:
+
+  #. A Python generator, which yields the batch slices (i.e. seqs or chunks) as loaded by
+     the thread of :class:`TFDataDataProvider`.
+  #. Optional per-sequence preprocessing, via a parallel ``map``.
+  #. Padded batching. The batches are exactly as defined by the :class:`BatchSetGenerator`.
+     This is via ``group_by_window``, where the key encodes the batch index and the number of slices of the batch.
+  #. Prefetching, optionally directly onto the compute device.
+
+  The placeholders are replaced by ``tf.placeholder_with_default``,
+  thus it is still possible to explicitly feed the data, e.g. via :class:`FeedDictDataProvider`.
+  """
+
+  MaxBatchNumSlices = 2 ** 20
+
+  def __init__(self, extern_data, prefetch_capacity=10, prefetch_device=None,
+               seq_map_func=None, num_parallel_calls=4):
+    """
+    :param ExternData extern_data: we will replace the placeholders in there
+    :param int prefetch_capacity: number of batches
+    :param str|None prefetch_device: e.g. "/gpu:0". if not given, the prefetching is on the CPU
+    :param ((dict[str,tf.Tensor])->dict[str,tf.Tensor])|None seq_map_func: per-sequence preprocessing.
+      Gets and returns a dict with the data keys, and "<key>_seq_lens" (scalar) for data with a time axis.
+      Other entries ("seq_idx", "seq_tag", "batch_key") must be kept as they are.
+      The output shapes must still match the extern data.
+    :param int num_parallel_calls: for seq_map_func
+    """
+    self.extern_data = extern_data
+    self.data_keys = sorted(extern_data.data.keys())  # type: typing.List[str]
+    for key in self.data_keys:
+      data = extern_data.data[key]
+      assert data.batch_dim_axis == 0, "%s: batch-dim-axis 0 expected" % data
+      if data.have_time_axis():
+        assert data.time_dim_axis_excluding_batch == 0 and data.get_axes_with_size() == [0], (
+          "%s: only a dynamic time-dim-axis as first axis (excluding batch) is supported" % data)
+      else:
+        assert not data.get_axes_with_size(), "%s: only a dynamic time-dim-axis is supported" % data
+    self.provider = None  # type: typing.Optional[TFDataDataProvider]  # set by the provider, used by the generator
+    experimental = getattr(tf.data, "experimental", None) or tf.contrib.data
+    seq_types, seq_shapes = self._get_seq_structure()
+    with tf.name_scope("tf_data_input"):
+      with tf.device("/cpu:0"):
+        dataset = tf.data.Dataset.from_generator(
+          self._generate_seqs, output_types=seq_types, output_shapes=seq_shapes)
+        if seq_map_func:
+          dataset = dataset.map(seq_map_func, num_parallel_calls=num_parallel_calls)
+        dataset = dataset.apply(experimental.group_by_window(
+          key_func=lambda d: d["batch_key"],
+          reduce_func=lambda key, window: window.padded_batch(
+            key % self.MaxBatchNumSlices, padded_shapes=seq_shapes),
+          window_size_func=lambda key: key % self.MaxBatchNumSlices))
+        dataset = dataset.map(lambda d: {k: v for (k, v) in d.items() if k != "batch_key"})
+        if not prefetch_device:
+          dataset = dataset.prefetch(prefetch_capacity)
+      if prefetch_device:
+        dataset = dataset.apply(experimental.prefetch_to_device(prefetch_device, buffer_size=prefetch_capacity))
+      self.iterator = dataset.make_initializable_iterator()
+      self.output = self.iterator.get_next()  # type: typing.Dict[str,tf.Tensor]
+    self._replace_placeholders()
+
+  def _get_seq_structure(self):
+    """
+    :return: types and shapes of the single seqs (or chunks), as yielded by :func:`_generate_seqs`
+    :rtype: (dict[str,tf.DType],dict[str,tf.TensorShape])
+    """
+    types = {"seq_idx": tf.int32, "seq_tag": tf.string, "batch_key": tf.int64}
+    shapes = {"seq_idx": tf.TensorShape(()), "seq_tag": tf.TensorShape(()), "batch_key": tf.TensorShape(())}
+    for key in self.data_keys:
+      data = self.extern_data.data[key]
+      types[key] = tf.as_dtype(data.dtype)
+      shapes[key] = tf.TensorShape(data.shape)
+      if data.have_time_axis():
+        types["%s_seq_lens" % key] = tf.as_dtype(data.size_dtype)
+        shapes["%s_seq_lens" % key] = tf.TensorShape(())
+    return types, shapes
+
+  def _replace_placeholders(self):
+    from TFUtil import DimensionTag
+    for key in self.data_keys:
+      data = self.extern_data.data[key]
+      with tf.name_scope("extern_data/placeholders/%s/" % key):
+        data.placeholder = tf.placeholder_with_default(
+          self.output[key], shape=data.batch_shape, name="%s_from_tf_data" % key)
+        if data.have_time_axis():
+          size = tf.placeholder_with_default(
+            self.output["%s_seq_lens" % key], shape=(None,), name="%s_dim0_size_from_tf_data" % key)
+          tag = DimensionTag(
+            description="spatial:0:extern_data/placeholders/%s" % key, kind=DimensionTag.Types.Spatial)
+          tag.set_tag_on_size_tensor(size)
+          data.size_placeholder = {0: size}
+
+  def _generate_seqs(self):
+    """
+    This is called by TF, once for every iterator initialization.
+
+    :return: yields the single seqs (or chunks) from the batches of the current provider
+    :rtype: typing.Iterator[dict[str,numpy.ndarray|int|str]]
+    """
+    provider = self.provider
+    assert provider, "%s: no provider set" % self
+    while True:
+      seqs = provider.queue.get()
+      if seqs is None:  # end of epoch
+        return
+      for seq in seqs:
+        yield seq
+
+
+class TFDataDataProvider(DataProviderBase):
+  """
+  Provides the data via :class:`TFDataInput`, i.e. via the ``tf.data`` API.
+  Like in :class:`FeedDictDataProvider`, a thread goes over the batches and loads the data from the dataset,
+  but the padding, the batching and the copy to the device is done by TF,
+  asynchronously to the session runs.
+  Thus :func:`get_feed_dict` only returns the feed dict for the "seq_idx" and "seq_tag" if needed.
+  Every ``session.run`` must get exactly one batch from the iterator (i.e. depend on some data).
+  """
+
+  def __init__(self, tf_data_input, tf_session, dataset, batches, enforce_min_len1=False, capacity=10,
+               batch_slice=None, **kwargs):
+    """
+    :param TFDataInput tf_data_input:
+    :param tf.Session|tf.InteractiveSession tf_session:
+    :param Dataset dataset:
+    :param BatchSetGenerator batches:
+    :param bool enforce_min_len1:
+    :param ExternData extern_data:
+    :param set(str)|None data_keys:
+    :param int capacity: number of batches in our queue
+    :param slice|None batch_slice: select a subset of the batches
+    """
+    super(TFDataDataProvider, self).__init__(**kwargs)
+    self.tf_data_input = tf_data_input
+    self.tf_session = tf_session
+    self.dataset = dataset
+    self.batches = batches
+    self.enforce_min_len1 = enforce_min_len1
+    self.batch_slice = batch_slice
+    self.state_change_cond = Condition()
+    self.queue = Queue(maxsize=capacity)  # list of seqs (or chunks) for each batch, None at the end
+    self.meta_step_infos = deque()  # for each batch in the queue or in the TF pipeline, dict with seq_idx, seq_tag
+    self.thread = None  # type: typing.Optional[Thread]
+    self.thread_finished = False
+    self.num_batches_loaded = 0
+    self.num_batches_taken = 0
+    self.reached_end = False
+
+  def start_threads(self):
+    """
+    Initializes the TF iterator with this provider, and starts the thread.
+    """
+    self.tf_data_input.provider = self
+    self.tf_session.run(self.tf_data_input.iterator.initializer)
+    thread = Thread(target=self._thread_main, name="TFDataDataProvider thread")
+    thread.daemon = True  # Thread will close when parent quits.
+    thread.start()
+    self.thread = thread
+
+  def stop_threads(self):
+    """
+    Stop the thread.
+    """
+    if not self.thread:
+      return
+    self.coord.request_stop()
+    while self.thread.is_alive():
+      # The thread could block in the queue put if it was full.
+      while not self.queue.empty():
+        self.queue.get()
+      self.thread.join(timeout=0.1)
+    if self.queue.empty():
+      self.queue.put(None)  # the TF generator might still wait for data
+    if self.tf_data_input.provider is self:
+      self.tf_data_input.provider = None
+
+  def get_batch_seqs(self, batch, batch_idx):
+    """
+    :param Dataset.Batch batch:
+    :param int batch_idx:
+    :return: for each batch slice (i.e. seq or chunk, or multiple seqs if not recurrent), the data,
+      as expected by :class:`TFDataInput`
+    :rtype: list[dict[str,numpy.ndarray|int|str]]
+    """
+    extern_data = self.extern_data
+    batch_key = batch_idx * TFDataInput.MaxBatchNumSlices + batch.num_slices
+    assert batch.num_slices < TFDataInput.MaxBatchNumSlices
+    seqs = [{"seq_idx": -1, "seq_tag": "", "batch_key": batch_key} for _ in range(batch.num_slices)]
+    # For each batch slice, data key -> list of (frame offset, data).
+    parts = [{} for _ in range(batch.num_slices)]  # type: typing.List[typing.Dict[str,typing.List]]
+    self.dataset.load_seqs(batch.start_seq, batch.end_seq)
+    from Util import slice_pad_zeros
+    with self.dataset.lock:
+      for seq in batch.seqs:
+        o = seq.batch_frame_offset
+        q = seq.batch_slice
+        length = seq.frame_length
+        for k in self.tf_data_input.data_keys:
+          if k not in self.data_keys:
+            continue  # not used by the network, will stay empty
+          data = extern_data.data[k]
+          if data.have_time_axis():
+            if length.get(k) in [0, None]:
+              continue
+          v = self.dataset.get_data(seq.seq_idx, k)
+          if data.have_time_axis():
+            v = slice_pad_zeros(v, begin=seq.seq_start_frame[k], end=seq.seq_end_frame[k])
+            if v.shape[0] != length[k]:
+              raise Exception("got shape[0]: %i, expected: %i, start/end: %r/%r, seq_idx: %i, seq len: %r" % (
+                v.shape[0], length[k], seq.seq_start_frame, seq.seq_end_frame, seq.seq_idx,
+                self.dataset.get_seq_length(seq.seq_idx)))
+            parts[q].setdefault(k, []).append((o[k], v))
+          else:  # no time-axis
+            parts[q][k] = [(0, v)]
+        seqs[q]["seq_idx"] = seq.seq_idx
+        seqs[q]["seq_tag"] = self.dataset.get_tag(seq.seq_idx)
+    for q in range(batch.num_slices):
+      for k in self.tf_data_input.data_keys:
+        data = extern_data.data[k]
+        if data.have_time_axis():
+          seq_len = max([offset + v.shape[0] for (offset, v) in parts[q].get(k, [])] or [0])
+          value = numpy.zeros(
+            shape=(max(seq_len, 1 if self.enforce_min_len1 else 0),) + data.shape[1:], dtype=data.dtype)
+          for offset, v in parts[q].get(k, []):
+            value[offset:offset + v.shape[0]] = v
+          seqs[q][k] = value
+          seqs[q]["%s_seq_lens" % k] = seq_len
+        elif k in parts[q]:
+          seqs[q][k] = parts[q][k][0][1]
+        elif data.dtype == "string":
+          seqs[q][k] = ""
+        else:
+          seqs[q][k] = numpy.zeros(shape=data.shape, dtype=data.dtype)
+    return seqs
+
+  def _thread_main(self):
+    try:
+      import better_exchook
+      better_exchook.install()
+
+      batch_idx = 0
+      while self.batches.has_more() and not self.coord.should_stop():
+        if is_batch_in_slice(batch_idx=batch_idx, batch_slice=self.batch_slice):
+          batch, = self.batches.peek_next_n(1)
+          with self.timer.phase("load_batch", in_step=False):
+            seqs = self.get_batch_seqs(batch=batch, batch_idx=batch_idx)
+          self.meta_step_infos.append({
+            "seq_idx": [seq["seq_idx"] for seq in seqs], "seq_tag": [seq["seq_tag"] for seq in seqs]})
+          # This blocks when the queue is full, i.e. when the data provider is faster than the consumer.
+          with self.timer.phase("enqueue_batch", in_step=False):
+            self.queue.put(seqs)
+          with self.state_change_cond:
+            self.num_batches_loaded += 1
+            self.state_change_cond.notifyAll()
+        self.batches.advance(1)
+        batch_idx += 1
+
+      self.reached_end = not self.batches.has_more()
+
+    except Exception as exc:
+      print("Exception in TFDataDataProvider thread: %r" % exc, file=log.v1)
+      sys.excepthook(*sys.exc_info())
+
+    finally:
+      with self.state_change_cond:
+        self.thread_finished = True
+        self.state_change_cond.notifyAll()
+      if not self.coord.should_stop():
+        self.queue.put(None)  # end of epoch for the TF generator
+
+  def have_more_data(self, session):
+    """
+    :param tf.Session|None session:
+    :return: whether the next ``session.run`` can get another batch from the iterator
+    :rtype: bool
+    """
+    with self.state_change_cond:
+      while True:
+        if self.num_batches_loaded > self.num_batches_taken:
+          return True
+        if self.thread_finished:
+          return False
+        if not self.thread.is_alive():
+          return False
+        # The thread is alive and working. Wait for a change.
+        self.state_change_cond.wait()
+
+  def get_feed_dict(self, single_threaded=False):
+    """
+    The data comes via the iterator of :class:`TFDataInput`.
+    This assumes that the next ``session.run`` gets the next batch from it.
+
+    :param bool single_threaded: not supported. use :class:`FeedDictDataProvider`
+    :returns: the feed dict for other data placeholders (e.g. "seq_idx", "seq_tag"), and the meta information
+    :rtype: (dict[tf.Tensor,numpy.ndarray|list],dict[str])
+    """
+    assert not single_threaded, "%s: single_threaded not supported" % self
+    with self.state_change_cond:
+      assert self.num_batches_loaded > self.num_batches_taken
+      self.num_batches_taken += 1
+    meta_step_info = self.meta_step_infos.popleft()
+    d = {}
+    for k in self.data_keys:
+      if k in self.tf_data_input.data_keys:
+        continue  # via the iterator
+      if k in ["seq_idx", "seq_tag"]:
+        d[self.extern_data.get_feed_data(k).placeholder] = meta_step_info[k]
+    return d, meta_step_info
+
+  def get_dataset_name(self):
+    """
+    :rtype: str
+    """
+    return self.dataset.name
+
+  def have_reached_end(self):
+    """
+    :rtype: bool
+    """
+    return self.reached_end
+
+  def get_complete_frac(self):
+    """
+    :rtype: float
+    """
+    return self.batches.completed_frac()
+
+
 class QueueDataProvider(DataProviderBase):
   """
   This class is supposed to encapsulate all the logic of this module and to be used by the TF engine.
@@ -32,9 +32,9 @@ from Dataset import Dataset, Batch, BatchSetGenerator
 from LearningRateControl import load_learning_rate_control_from_config, LearningRateControl
 from Log import log
 from Pretrain import pretrain_from_config
-from TFNetwork import TFNetwork, help_on_tf_exception
+from TFNetwork import TFNetwork, AsyncCheckpointSaver, help_on_tf_exception
 from TFUpdater import Updater
-from Util import hms, NumbersDict, PY3, BackendEngine
+from Util import hms, hms_fraction, NumbersDict, PY3, BackendEngine, PhaseTimer, dummy_noop_ctx
 from pprint import pprint
 
 
@@ -44,6 +44,122 @@ class CancelTrainingException(Exception):
   """
 
 
+class InGraphAccumulators(object):
+  """
+  Sums up values (e.g. the losses) in the graph over multiple ``session.run`` steps,
+  such that we only need to fetch the sums every N steps.
+  Sizes (the values for "size:...", i.e. seq lengths) are summed up over the batch.
+  The loss norm factors ("loss_norm_factor:...") are accumulated as sums of their reciprocals,
+  like the ``_inv_norm_accumulated`` in :class:`Runner`.
+  The instances are cached per graph, see :func:`get_for_values`.
+  """
+
+  _collection_name = "_returnn_in_graph_accumulators"
+
+  def __init__(self, values):
+    """
+    :param dict[str,tf.Tensor] values:
+    """
+    self.values = values
+    self.signature = self._get_signature(values)
+    self.vars = {}  # type: typing.Dict[str,tf.Variable]
+    adds = []
+    with tf.name_scope("in_graph_accumulators"):
+      for i, (key, value) in enumerate(sorted(values.items())):
+        if key.startswith("size:"):
+          value = tf.cast(tf.reduce_sum(value), tf.int64)
+        elif key.startswith("loss_norm_factor:"):
+          value = tf.cast(tf.reciprocal(value), tf.float64)
+        else:
+          value = tf.cast(value, tf.float64)
+        value.set_shape(())
+        # Resource variables, because we read and reset them in the same session.run.
+        # For a ref variable, the read value would share the buffer with the variable,
+        # which is then overwritten in-place by the reset, i.e. we might fetch the reset value.
+        var = tf.Variable(
+          initial_value=tf.zeros((), dtype=value.dtype), trainable=False, use_resource=True,
+          collections=[tf.GraphKeys.LOCAL_VARIABLES], name="accumulator_%i" % i)
+        self.vars[key] = var
+        adds.append(var.assign_add(value, read_value=False))
+      self.accumulate_op = tf.group(*adds, name="accumulate")
+      self.reset_op = tf.group(
+        *[var.assign(tf.zeros_like(var), read_value=False) for var in self.vars.values()], name="reset")
+      with tf.control_dependencies([self.accumulate_op]):
+        self.accumulated_after_step = {key: var.read_value() for (key, var) in self.vars.items()}
+      with tf.control_dependencies(list(self.accumulated_after_step.values())):
+        self.reset_after_step_op = tf.group(
+          *[var.assign(tf.zeros_like(var), read_value=False) for var in self.vars.values()], name="reset_after_step")
+      self.accumulated = {key: var.read_value() for (key, var) in self.vars.items()}
+      with tf.control_dependencies(list(self.accumulated.values())):
+        self.reset_after_read_op = tf.group(
+          *[var.assign(tf.zeros_like(var), read_value=False) for var in self.vars.values()], name="reset_after_read")
+
+  @staticmethod
+  def _get_signature(values):
+    """
+    :param dict[str,tf.Tensor] values:
+    :rtype: tuple[(str,str)]
+    """
+    return tuple(sorted((key, value.name) for (key, value) in values.items()))
+
+  @classmethod
+  def get_for_values(cls, values):
+    """
+    :param dict[str,tf.Tensor] values:
+    :return: cached instance for the current graph, or a new instance (with new uninitialized local variables)
+    :rtype: InGraphAccumulators
+    """
+    signature = cls._get_signature(values)
+    instances = tf.get_default_graph().get_collection_ref(cls._collection_name)
+    for instance in instances:
+      assert isinstance(instance, InGraphAccumulators)
+      if instance.signature == signature:
+        return instance
+    instance = cls(values=values)
+    instances.append(instance)
+    return instance
+
+  @staticmethod
+  def is_accumulated_key(key):
+    """
+    :param str key: key of :func:`TFNetwork.TFNetwork.get_fetches_dict`
+    :return: whether this value can be accumulated by this class
+    :rtype: bool
+    """
+    if key == "loss" or key.startswith("cost:") or key.startswith("error:") or key.startswith("loss_norm_factor:"):
+      return True
+    if key.startswith("size:") and key.endswith(":0"):
+      return True
+    return False
+
+  def get_step_fetches(self, fetches_dict, fetch_accumulated):
+    """
+    :param dict[str,tf.Tensor|tf.Operation] fetches_dict: see :func:`Runner._get_fetches_dict`
+    :param bool fetch_accumulated: if False, we only fetch the ops (e.g. the optimizer), and no tensors.
+      Otherwise, we fetch all the other tensors, and the accumulated values (after this step) with prefix
+      "accumulated:", and reset the accumulators.
+    :return: fetches for one step
+    :rtype: dict[str,tf.Tensor|tf.Operation]
+    """
+    if fetch_accumulated:
+      d = {key: value for (key, value) in fetches_dict.items() if key not in self.values}
+      d.update({"accumulated:%s" % key: value for (key, value) in self.accumulated_after_step.items()})
+      d["accumulators_reset"] = self.reset_after_step_op
+    else:
+      d = {key: value for (key, value) in fetches_dict.items() if not isinstance(value, tf.Tensor)}
+      d["accumulate"] = self.accumulate_op
+    return d
+
+  def get_flush_fetches(self):
+    """
+    :return: fetches to get the accumulated values (with prefix "accumulated:") and reset the accumulators
+    :rtype: dict[str,tf.Tensor|tf.Operation]
+    """
+    d = {"accumulated:%s" % key: value for (key, value) in self.accumulated.items()}
+    d["accumulators_reset"] = self.reset_after_read_op
+    return d
+
+
 class Runner(object):
   """
   This encapsulates the logic around TF ``session.run``, i.e. iterating over the dataset.
@@ -51,7 +167,7 @@ class Runner(object):
 
   # noinspection PyShadowingBuiltins
   def __init__(self, engine, dataset, batches, train, eval=True, train_flag=None,
-               extra_fetches=None, extra_fetches_callback=None):
+               extra_fetches=None, extra_fetches_callback=None, accumulators=None):
     """
     :param Engine engine:
     :param Dataset.Dataset dataset:
@@ -64,13 +180,16 @@ class Runner(object):
       where each item corresponds to the batch-seq.
       It might also be useful to add `network.get_extern_data("seq_idx")` and `network.get_extern_data("seq_tag")`.
     :param (**dict[str,numpy.ndarray|str|list[numpy.ndarray|str])->None extra_fetches_callback: called if extra_fetches
+    :param list[TFUtil.InGraphReduction]|None accumulators: reduced in the graph in every step (sum, count, min/max,
+      histogram), and only fetched at the end of the epoch, into `self.accumulated`.
+      This is much cheaper than getting the values via `extra_fetches` in every step.
     """
     from TFDataPipeline import DataProviderBase
     engine.network.extern_data.check_matched_dataset(
       dataset=dataset, used_data_keys=engine.network.used_data_keys)
     self.engine = engine
     # noinspection PyProtectedMember
-    self.data_provider = self.engine._get_new_data_provider(dataset=dataset, batches=batches)
+    self.data_provider = self.engine._get_new_data_provider(dataset=dataset, batches=batches, train=train)
     assert isinstance(self.data_provider, DataProviderBase)
     if train_flag is None:
       train_flag = train
@@ -97,7 +216,24 @@ class Runner(object):
     if extra_fetches is not None:
       assert extra_fetches_callback
     self.extra_fetches_callback = extra_fetches_callback
+    self.accumulators = list(accumulators or [])  # type: typing.List['TFUtil.InGraphReduction']
+    assert len(set([acc.name for acc in self.accumulators])) == len(self.accumulators), (
+      "accumulator names not unique: %r" % self.accumulators)
+    self.accumulated = {}  # type: typing.Dict[str,numpy.ndarray]  # accumulator name -> value, after the epoch
     self._horovod_stopped_runner = False
+    self._local_data_parallel_stopped_runner = False
+    # Time spent in the phases of each step, and in the data provider thread.
+    # "store_step_timing_trace" will write a trace of all these events (Chrome trace format) to the log dir.
+    self.timer = PhaseTimer(
+      window=engine.config.int("step_timing_window", 100),
+      collect_trace=engine.config.bool("store_step_timing_trace", False))
+    self.data_provider.timer = self.timer
+    # "steps_per_fetch" N > 1 will sum up the losses/errors in the graph (see :class:`InGraphAccumulators`),
+    # and only fetch them every N steps (and at the end of the epoch). The epoch scores are the same.
+    self.steps_per_fetch = engine.config.int("steps_per_fetch", 1)
+    assert self.steps_per_fetch >= 1
+    if extra_fetches is not None:
+      self.steps_per_fetch = 1  # we need the extra fetches in every step
 
     from Util import terminal_size
     terminal_width, _ = terminal_size()
@@ -146,6 +282,9 @@ class Runner(object):
         for i, s in v.size_placeholder.items():
           d["extra:%s:size_%i" % (k, i)] = s
 
+    for acc in self.accumulators:
+      d["accumulator_update:%s" % acc.name] = acc.update_op
+
     return d
 
   def _print_process(self, report_prefix, step, step_duration, eval_info):
@@ -171,6 +310,7 @@ class Runner(object):
         info += ["%s %s" % item for item in sorted(eval_info.items())]
       info += [
         "%.3f sec/step" % step_duration,
+        self.timer.get_percentiles_str(),
         "elapsed %s" % hms(start_elapsed),
         "exp. remaining %s" % hms(remaining_estimated),
         "complete %.02f%%" % (complete * 100)]
@@ -310,7 +450,54 @@ class Runner(object):
         eval_info["num_seqs"] = len(v)
         eval_info["max_size:%s" % k[len("size:"):-len(":0")]] = max(v)
 
-    # Add raw stats.
+    self._collect_stats(fetches_results=fetches_results, eval_info=eval_info)
+    return eval_info
+
+  def _collect_accumulated_eval_info(self, fetches_results, num_steps):
+    """
+    Like :func:`_collect_eval_info`, but for the values summed up via :class:`InGraphAccumulators`.
+
+    :param dict[str,numpy.ndarray|None] fetches_results: with keys like "accumulated:cost:output",
+      see :func:`InGraphAccumulators.get_step_fetches`
+    :param int num_steps: number of steps which were accumulated
+    :return: dict for printing the step stats, see self._print_process(), e.g. {"cost:output": 2.3}
+    :rtype: dict[str,float]
+    """
+    prefix = "accumulated:"
+    accumulated = {k[len(prefix):]: v for (k, v) in fetches_results.items() if k.startswith(prefix)}
+    keys = [k for k in accumulated.keys() if k.startswith("cost:") or k.startswith("error:") or k == "loss"]
+    step_seq_lens = {
+      k[len("size:"):-2]: v for (k, v) in accumulated.items() if k.startswith("size:") and k.endswith(":0")}
+    # These are already the sums of the reciprocals.
+    inv_loss_norm_factors = NumbersDict({
+      k[len("loss_norm_factor:"):]: v for (k, v) in accumulated.items() if k.startswith("loss_norm_factor:")})
+
+    # Accumulate for epoch stats.
+    self._results_accumulated += NumbersDict({key: accumulated[key] for key in keys})
+    self._inv_norm_accumulated += inv_loss_norm_factors
+    self.num_frames_accumulated += NumbersDict(step_seq_lens)
+
+    # Prepare eval info stats for the accumulated batch runs.
+    eval_info = {}
+    for key in keys:
+      value = accumulated[key]
+      if key == "loss":
+        value = value / num_steps  # not normalized, thus the mean over the steps
+      else:
+        value = self._normalize_loss(value, key, inv_loss_norm_factors)
+      eval_info[key] = value
+      if self.engine.config.bool("calculate_exp_loss", False) and key.startswith("cost:"):
+        eval_info[key + ":exp"] = numpy.exp(value)
+    eval_info["num_accumulated_steps"] = num_steps
+
+    self._collect_stats(fetches_results=fetches_results, eval_info=eval_info)
+    return eval_info
+
+  def _collect_stats(self, fetches_results, eval_info):
+    """
+    :param dict[str,numpy.ndarray|None] fetches_results: results of calculations, see self._get_fetches_dict()
+    :param dict[str] eval_info: will add the raw stats here
+    """
     for k, v in fetches_results.items():
       if k.startswith("stats:"):
         if v.ndim == 1:
@@ -323,8 +510,6 @@ class Runner(object):
         self.stats[k].collect([v])
         eval_info[k] = human_bytes_size(int(v))
 
-    return eval_info
-
   def _maybe_handle_extra_fetches(self, fetches_results):
     """
     :param dict[str,numpy.ndarray|str] fetches_results: results of calculations, see self._get_fetches_dict()
@@ -357,6 +542,27 @@ class Runner(object):
         d[k] = list(r)
     self.extra_fetches_callback(**d)
 
+  def _report_step_timing(self, report_prefix, writer, logdir, step):
+    """
+    Called at the end of an epoch. Reports the summary of :class:`Util.PhaseTimer`.
+
+    :param str report_prefix:
+    :param tf.summary.FileWriter|None writer:
+    :param str|None logdir:
+    :param int step: global train step
+    """
+    print("%s, step timing: %s" % (report_prefix, self.timer.get_summary_str()), file=log.v4)
+    if writer:
+      values = []
+      for name, info in sorted(self.timer.get_summary().items()):
+        values.append(tf.Summary.Value(tag="step_timing/%s/mean" % name, simple_value=info["mean"]))
+        values.append(tf.Summary.Value(tag="step_timing/%s/frac" % name, simple_value=info["frac"]))
+      writer.add_summary(tf.Summary(value=values), step)
+    if self.timer.collect_trace and logdir:
+      trace_path = os.path.join(logdir, "step_timing.trace.json")
+      self.timer.write_chrome_trace(trace_path)
+      print("%s, step timing trace written to %s" % (report_prefix, trace_path), file=log.v4)
+
   def _horovod_finish_data(self):
     self._horovod_signal_broadcast(have_more_data=False)
 
@@ -452,6 +658,59 @@ class Runner(object):
     self.engine.tf_session.run(assign_ops)
     return time.time() - start_time
 
+  def _local_data_parallel_signal_have_more_data(self, have_more_data=True):
+    """
+    Like :func:`_horovod_signal_broadcast`, for :mod:`LocalDataParallel`.
+    Errors are not signaled here. Instead, a failing worker aborts, and all others fail as well.
+
+    :param bool have_more_data: whether we have more data in this worker
+    :return: whether to stop (because some other worker does not have more data)
+    :rtype: bool
+    """
+    import LocalDataParallel
+    local_data_parallel = LocalDataParallel.get_instance()
+    if not local_data_parallel:
+      return False
+    # Stopped before? Keep in sync -> Don't send anything anymore, other workers do not expect it.
+    if self._local_data_parallel_stopped_runner:
+      return True
+    sum_have_data = local_data_parallel.allreduce(
+      "have_more_data", numpy.array(1 if have_more_data else 0, dtype="int32"), average=False)
+    if sum_have_data < local_data_parallel.size:
+      self._local_data_parallel_stopped_runner = True
+      return True
+    return False
+
+  def _local_data_parallel_sync_params(self, local_step, is_final=False):
+    """
+    Like :func:`_horovod_sync_params`, for :mod:`LocalDataParallel` with reduce type 'param'.
+
+    :param int local_step: step of this epoch
+    :param bool is_final:
+    :return: runtime
+    :rtype: float
+    """
+    import LocalDataParallel
+    local_data_parallel = LocalDataParallel.get_instance()
+    if not local_data_parallel:
+      return 0.0
+    if self.engine.config.value("local_data_parallel_reduce_type", "grad") != "param":
+      return 0.0
+    if not self._should_train:
+      return 0.0
+    sync_step = self.engine.config.int("local_data_parallel_param_sync_step", 1)
+    assert sync_step >= 1
+    if not is_final and local_step % sync_step != sync_step - 1:
+      return 0.0
+    start_time = time.time()
+    session = self.engine.tf_session
+    trainable_vars = self.engine.updater.trainable_vars
+    values = local_data_parallel.allreduce_multiple("params", session.run(trainable_vars), average=True)
+    with self.engine.network.batched_var_assigns(session=session):
+      for var, value in zip(trainable_vars, values):
+        self.engine.network.assign_var_value(var, value, session=session)
+    return time.time() - start_time
+
   def run(self, report_prefix):
     """
     :param str report_prefix: prefix for logging, e.g. "train"
@@ -504,20 +763,50 @@ class Runner(object):
       # step is like mini-batch in our usual terminology
       step = 0
       fetches_dict = self._get_fetches_dict()
+      accumulators = None
+      fetches_dict_accumulate = fetches_dict_fetch = fetches_dict
+      num_accumulated_steps = 0
+      if self.steps_per_fetch > 1:
+        accumulators = InGraphAccumulators.get_for_values({
+          k: v for (k, v) in fetches_dict.items()
+          if InGraphAccumulators.is_accumulated_key(k) and isinstance(v, tf.Tensor)})
+        fetches_dict_accumulate = accumulators.get_step_fetches(fetches_dict, fetch_accumulated=False)
+        fetches_dict_fetch = accumulators.get_step_fetches(fetches_dict, fetch_accumulated=True)
+      if accumulators or self.accumulators:
+        self.engine._checked_uninitialized_vars = False  # the accumulator vars might be new
       # After get_fetches_dict, maybe some new uninitialized vars. Last check.
       self.engine.check_uninitialized_vars()
+      if accumulators:
+        sess.run(accumulators.reset_op)  # in case some previous run was interrupted
+      if self.accumulators:
+        sess.run([acc.reset_op for acc in self.accumulators])
       # Also, add graph to summary here because the updater/optimizer might not have been created before.
       if writer:
         writer.add_graph(sess.graph)
       hvd_stop = hvd_error = False
-      while self.data_provider.have_more_data(session=sess):
-        hvd_stop, hvd_error = self._horovod_signal_have_more_data()
+      use_horovod = self.engine.config.is_true("use_horovod")
+      local_data_parallel_stop = False
+      import LocalDataParallel
+      use_local_data_parallel = bool(LocalDataParallel.get_instance())
+      self.timer.start_steps()
+      while True:
+        with self.timer.phase("have_more_data"):
+          if not self.data_provider.have_more_data(session=sess):
+            break
+        with self.timer.phase("horovod") if use_horovod else dummy_noop_ctx():
+          hvd_stop, hvd_error = self._horovod_signal_have_more_data()
         if hvd_error:
           raise Exception("Some other Horovod peer failed.")
         if hvd_stop:
           # Some other peer does not have data anymore, but no error occurred.
           break
-        feed_dict, meta_step_info = self.data_provider.get_feed_dict()
+        with self.timer.phase("local_data_parallel") if use_local_data_parallel else dummy_noop_ctx():
+          local_data_parallel_stop = self._local_data_parallel_signal_have_more_data()
+        if local_data_parallel_stop:
+          # Some other worker does not have data anymore.
+          break
+        with self.timer.phase("get_feed_dict"):
+          feed_dict, meta_step_info = self.data_provider.get_feed_dict()
         if isinstance(self.engine.network.train_flag, tf.Tensor):
           feed_dict[self.engine.network.train_flag] = self._train_flag
         if isinstance(self.engine.network.epoch_step, tf.Tensor):
@@ -543,8 +832,11 @@ class Runner(object):
           Debug.debug_shell(user_ns=locals(), user_global_ns=globals(), exit_afterwards=False)
 
         # Now do one calculation step. Optionally with metadata.
+        store_metadata = bool(self.store_metadata_mod_step and step % self.store_metadata_mod_step == 0)
+        is_fetch_step = (step + 1) % self.steps_per_fetch == 0 or store_metadata
+        step_fetches_dict = fetches_dict_fetch if is_fetch_step else fetches_dict_accumulate
         try:
-          if self.store_metadata_mod_step and step % self.store_metadata_mod_step == 0:
+          if store_metadata:
             # Slow run that stores extra information for debugging.
             print('Storing metadata', file=log.v5)
             run_options = tf.RunOptions(
@@ -552,11 +844,13 @@ class Runner(object):
             # We could use tfdbg.add_debug_tensor_watch here.
             session_run_start_time = time.time()
             fetches_results = sess.run(
-              fetches_dict,
+              step_fetches_dict,
               feed_dict=feed_dict,
               options=run_options,
               run_metadata=run_metadata)  # type: typing.Dict[str,typing.Union[numpy.ndarray,str]]
-            elapsed_time_tf += time.time() - session_run_start_time
+            session_run_duration = time.time() - session_run_start_time
+            elapsed_time_tf += session_run_duration
+            self.timer.add("session_run", duration=session_run_duration, start_time=session_run_start_time)
             writer.add_summary(fetches_results["summary"], step + step_offset)
             writer.add_run_metadata(run_metadata, 'step_{:04d}'.format(step + step_offset))
             tl = timeline.Timeline(run_metadata.step_stats)
@@ -566,27 +860,52 @@ class Runner(object):
           else:
             session_run_start_time = time.time()
             fetches_results = sess.run(
-              fetches_dict, feed_dict=feed_dict)  # type: typing.Dict[str,typing.Union[numpy.ndarray,str]]
-            elapsed_time_tf += time.time() - session_run_start_time
+              step_fetches_dict, feed_dict=feed_dict)  # type: typing.Dict[str,typing.Union[numpy.ndarray,str]]
+            session_run_duration = time.time() - session_run_start_time
+            elapsed_time_tf += session_run_duration
+            self.timer.add("session_run", duration=session_run_duration, start_time=session_run_start_time)
             if writer and "summary" in fetches_results:
-              writer.add_summary(fetches_results["summary"], step + step_offset)
+              with self.timer.phase("write_summary"):
+                writer.add_summary(fetches_results["summary"], step + step_offset)
         except tf.errors.OpError as exc:
           print("TensorFlow exception:", exc, file=log.v1)
           # Extra info will be printed below.
           raise
 
-        eval_info = self._collect_eval_info(fetches_results=fetches_results)
-        self._maybe_handle_extra_fetches(fetches_results)
-        elapsed_time_tf += self._horovod_sync_params(local_step=step)
+        num_accumulated_steps += 1
+        eval_info = None
+        with self.timer.phase("collect_eval_info"):
+          if not accumulators:
+            eval_info = self._collect_eval_info(fetches_results=fetches_results)
+          elif is_fetch_step:
+            eval_info = self._collect_accumulated_eval_info(
+              fetches_results=fetches_results, num_steps=num_accumulated_steps)
+            num_accumulated_steps = 0
+        if self.extra_fetches is not None:
+          with self.timer.phase("extra_fetches_callback"):
+            self._maybe_handle_extra_fetches(fetches_results)
+        with self.timer.phase("horovod") if use_horovod else dummy_noop_ctx():
+          elapsed_time_tf += self._horovod_sync_params(local_step=step)
+        with self.timer.phase("local_data_parallel") if use_local_data_parallel else dummy_noop_ctx():
+          elapsed_time_tf += self._local_data_parallel_sync_params(local_step=step)
         duration = time.time() - start_time
-        self._print_process(report_prefix=report_prefix, step=step, step_duration=duration, eval_info=eval_info)
+        self.timer.end_step()
+        if eval_info is not None:
+          self._print_process(report_prefix=report_prefix, step=step, step_duration=duration, eval_info=eval_info)
         step += 1
         if self.cancel_flag:
           raise CancelTrainingException("cancel_flag is set")
 
       self._print_finish_process()
 
-      if not hvd_stop and not self.data_provider.have_reached_end():
+      if accumulators and num_accumulated_steps > 0:
+        # Remaining steps since the last fetch.
+        fetches_results = sess.run(accumulators.get_flush_fetches())
+        self._collect_accumulated_eval_info(fetches_results=fetches_results, num_steps=num_accumulated_steps)
+      if self.accumulators:
+        self.accumulated = sess.run({acc.name: acc.value for acc in self.accumulators})
+
+      if not hvd_stop and not local_data_parallel_stop and not self.data_provider.have_reached_end():
         raise Exception("Did not successfully reached the end of the dataset.")
 
       if self._should_train:
@@ -596,6 +915,8 @@ class Runner(object):
       self._finalize(num_steps=step)
       self._horovod_finish_data()
       self._horovod_sync_params(local_step=step, is_final=True)
+      self._local_data_parallel_signal_have_more_data(have_more_data=False)
+      self._local_data_parallel_sync_params(local_step=step, is_final=True)
 
       if self.stats:
         print("Stats:", file=log.v1)
@@ -605,6 +926,7 @@ class Runner(object):
       elapsed_tf_percentage = (elapsed_time_tf / elapsed) if (elapsed > 0) else 0.0
       print("%s, finished after %i steps, %s elapsed (%.1f%% computing time)" % (
         report_prefix, step, hms(elapsed), (elapsed_tf_percentage * 100.)), file=log.v3)
+      self._report_step_timing(report_prefix=report_prefix, writer=writer, logdir=logdir, step=step + step_offset)
 
     except KeyboardInterrupt as exc:
       print("KeyboardInterrupt in step %r." % step)
@@ -625,6 +947,10 @@ class Runner(object):
       from Util import try_and_ignore_exception
       from TFUtil import stop_event_writer_thread
       try_and_ignore_exception(self._horovod_signal_error)  # ignored if _horovod_finish_data was called before
+      if self.run_exception is not None:
+        import LocalDataParallel
+        if LocalDataParallel.get_instance():
+          try_and_ignore_exception(LocalDataParallel.get_instance().abort)  # all other workers will fail
       if writer:
         try_and_ignore_exception(writer.close)
         try_and_ignore_exception(lambda: stop_event_writer_thread(writer.event_writer))
@@ -634,6 +960,246 @@ class Runner(object):
       self.elapsed = time.time() - self.start_time
 
 
+class NetworkConstructionCache(object):
+  """
+  Keeps the last constructed networks, together with their graph and TF session,
+  such that a network with the same network dict and config does not need to be constructed again,
+  e.g. in pretraining, or when the engine is initialized again with the same network.
+  Enabled via the config option ``network_construction_cache`` (max num of networks to keep).
+  Note that each cached network keeps its graph and params in memory (e.g. on the GPU).
+  """
+
+  class Entry(object):
+    """
+    A constructed network, with everything in :class:`Engine` which depends on its graph.
+    """
+
+    def __init__(self, key, engine):
+      """
+      :param str key: via :func:`NetworkConstructionCache.get_key`
+      :param Engine engine:
+      """
+      self.key = key
+      self.graph = engine.tf_session.graph
+      self.tf_session = engine.tf_session
+      self.network = engine.network
+      self.updater = engine.updater
+      self.tf_data_input = engine.tf_data_input
+      # noinspection PyProtectedMember
+      self.const_cache = engine._const_cache
+      # noinspection PyProtectedMember
+      self.merge_all_summaries = engine._merge_all_summaries
+
+    def close(self):
+      """
+      Closes the session, and the session of the async checkpoint saver of the network (if there is one).
+      """
+      self.network.reset_saver()
+      self.tf_session.close()
+
+  def __init__(self, max_size):
+    """
+    :param int max_size:
+    """
+    self.max_size = max_size
+    self.entries = []  # type: typing.List[NetworkConstructionCache.Entry]  # last is the most recent
+
+  @staticmethod
+  def get_key(net_dict, config, flags):
+    """
+    :param dict[str,dict[str]] net_dict:
+    :param Config.Config config:
+    :param tuple flags: e.g. the train/eval/search flags of the engine
+    :return: hash of the normalized network dict, the config and the flags
+    :rtype: str
+    """
+    import hashlib
+    from Util import better_repr
+    # better_repr is deterministic (sorted dict keys). It also covers the config entries which are functions,
+    # which is fine here, as we do not need to be deterministic across processes.
+    s = better_repr((net_dict, config.typed_dict, config.dict, flags))
+    return hashlib.sha1(s.encode("utf8")).hexdigest()
+
+  def add(self, entry):
+    """
+    :param NetworkConstructionCache.Entry entry:
+    """
+    self.entries.append(entry)
+    while len(self.entries) > self.max_size:
+      self.entries.pop(0).close()
+
+  def pop(self, key):
+    """
+    :param str key:
+    :return: the entry with this key (removed from the cache, as it becomes the active network), or None
+    :rtype: NetworkConstructionCache.Entry|None
+    """
+    for i, entry in enumerate(self.entries):
+      if entry.key == key:
+        del self.entries[i]
+        return entry
+    return None
+
+  def clear(self):
+    """
+    Closes all the sessions.
+    """
+    for entry in self.entries:
+      entry.close()
+    del self.entries[:]
+
+
+class EvalSideProcess(object):
+  """
+  Evaluates the saved checkpoints on the eval datasets (dev, eval) in a separate process,
+  with its own TF session and thread budget, while the training continues.
+  Enabled via the config option ``eval_in_side_process``. Further options:
+
+    * ``eval_side_process_device``: "cpu" (default) or "gpu". The training usually occupies the GPU memory.
+    * ``eval_side_process_num_threads``: thread budget of the side process (default 1).
+
+  The process is started via fork+exec (:class:`TaskSystem.AsyncTask`), as we cannot fork TF.
+  It loads the eval datasets itself. The requests are handled in order.
+  The results are merged into the :class:`LearningRateControl` by the engine as soon as they are available,
+  and the learning rate control waits for them when it needs them (see :func:`Engine._eval_model_in_side_process`).
+  """
+
+  def __init__(self, config):
+    """
+    :param Config.Config config:
+    """
+    from TaskSystem import AsyncTask
+    self.num_threads = config.int("eval_side_process_num_threads", 1)
+    self.device = config.value("eval_side_process_device", "cpu")
+    env_update = {"OMP_NUM_THREADS": str(self.num_threads)}
+    if self.device == "cpu":
+      env_update["CUDA_VISIBLE_DEVICES"] = ""  # do not even create a CUDA context
+    self.proc = AsyncTask(
+      func=_eval_side_process_main, name="eval side process", mustExec=True, env_update=env_update)
+    self.proc.put((config, self.num_threads, self.device))
+    self.pending_epochs = []  # type: typing.List[int]  # requested, in order
+    self.results = {}  # type: typing.Dict[int,typing.Dict[str,typing.Dict[str,typing.Dict[str,float]]]]
+
+  def eval(self, epoch, model_filename, net_dict):
+    """
+    Non-blocking. Get the results via :func:`poll_results` or :func:`wait_results`.
+
+    :param int epoch:
+    :param str model_filename: checkpoint, must be saved already
+    :param dict[str,dict[str]] net_dict: for this epoch (e.g. in pretraining, it can differ per epoch)
+    """
+    self.proc.put(("eval", epoch, model_filename, net_dict))
+    self.pending_epochs.append(epoch)
+
+  def _receive(self):
+    from TaskSystem import ProcConnectionDied
+    try:
+      msg = self.proc.get()
+    except ProcConnectionDied as exc:
+      raise Exception("eval side process died, pending epochs %r: %s" % (self.pending_epochs, exc))
+    if msg[0] == "exception":
+      raise Exception("eval side process, epoch %i: %s" % (msg[1], msg[2]))
+    assert msg[0] == "result"
+    _, epoch, results = msg
+    assert self.pending_epochs and self.pending_epochs[0] == epoch
+    self.pending_epochs.pop(0)
+    self.results[epoch] = results
+
+  def poll_results(self):
+    """
+    Non-blocking.
+
+    :return: epoch -> dataset name -> {"score": ..., "error": ...}, for all epochs finished since the last call
+    :rtype: dict[int,dict[str,dict[str,dict[str,float]]]]
+    """
+    while self.pending_epochs and self.proc.conn.poll():
+      self._receive()
+    results, self.results = self.results, {}
+    return results
+
+  def wait_results(self, epoch=None):
+    """
+    Blocks until the results of the epoch are available.
+
+    :param int|None epoch: if None, wait for all
+    :return: like :func:`poll_results`
+    :rtype: dict[int,dict[str,dict[str,dict[str,float]]]]
+    """
+    while self.pending_epochs and (epoch is None or epoch in self.pending_epochs):
+      self._receive()
+    return self.poll_results()
+
+  def finish(self):
+    """
+    Lets the process exit (when it is finished with the pending requests), and waits for it.
+    """
+    from TaskSystem import ProcConnectionDied
+    try:
+      self.proc.put(("exit",))
+    except ProcConnectionDied:
+      pass  # already exited
+    self.proc.join()
+
+  def terminate(self):
+    """
+    Kills the process.
+    """
+    self.proc.terminate()
+    self.proc.join()
+
+
+def _eval_side_process_main(async_task):
+  """
+  This is the process of :class:`EvalSideProcess`.
+
+  :param TaskSystem.AsyncTask async_task:
+  """
+  import rnn
+  from TFUtil import setup_tf_thread_pools
+  config, num_threads, device = async_task.get()
+  rnn.init_better_exchook()
+  config.set("device", device)
+  config.set("train", None)  # we only need dev/eval
+  rnn.config = config
+  # Separate log files. Only errors to stdout, as we share it with the main process, which prints the results.
+  logs, log_verbosity = [], []
+  config_log_verbosity = config.int_list("log_verbosity", [])
+  for i, fn in enumerate(config.list("log", [])):
+    if fn == "stdout" or fn.startswith("|"):
+      continue
+    logs.append("%s.eval-side-process%s" % os.path.splitext(fn))
+    log_verbosity.append(
+      config_log_verbosity[i] if i < len(config_log_verbosity) else
+      (config_log_verbosity[0] if len(config_log_verbosity) == 1 else 3))
+  log.initialize(logs=logs + ["stdout"], verbosity=log_verbosity + [0])
+  print("Eval side process, pid %i, device %s, num threads %i." % (os.getpid(), device, num_threads), file=log.v3)
+  setup_tf_thread_pools(num_threads=num_threads, log_file=log.v3)
+  rnn.init_data()
+  engine = Engine(config=config)
+  engine.init_train_from_config(config=config, dev_data=rnn.dev_data, eval_data=rnn.eval_data)
+  engine.learning_rate_control.filename = None  # the main process owns the file
+  while True:
+    msg = async_task.get()
+    if msg[0] == "exit":
+      break
+    assert msg[0] == "eval"
+    _, epoch, model_filename, net_dict = msg
+    try:
+      engine.epoch = epoch
+      if engine.network.layers_desc != net_dict:
+        # noinspection PyProtectedMember
+        engine._init_network(net_desc=net_dict, epoch=epoch)
+      engine.load_model(filename=model_filename)
+      for dataset in engine.get_eval_datasets().values():
+        dataset.init_seq_order(epoch=epoch)
+      async_task.put(("result", epoch, engine.eval_model()))
+    except Exception as exc:
+      sys.excepthook(*sys.exc_info())
+      async_task.put(("exception", epoch, "%s: %s" % (type(exc).__name__, exc)))
+      break
+  engine.finalize()
+
+
 class Engine(EngineBase):
   """
   TF backend engine.
@@ -658,6 +1224,7 @@ class Engine(EngineBase):
     self._check_devices()
     self.tf_session = None  # type: typing.Optional[tf.Session]
     self.network = None  # type: typing.Optional[TFNetwork]
+    self.tf_data_input = None  # type: typing.Optional[TFDataPipeline.TFDataInput]  # if data_provider="tf_data"
     self.updater = None  # type: typing.Optional[Updater]
     self.learning_rate_control = None  # type: typing.Optional[LearningRateControl]
     self._checked_uninitialized_vars = False
@@ -672,11 +1239,27 @@ class Engine(EngineBase):
     self._const_cache = {}  # type: typing.Dict[str,tf.Tensor]
     self.preload_from_files = None  # type: typing.Optional[typing.Dict[str,typing.Dict[str]]]
     self.max_seqs = None  # type: typing.Optional[int]
+    self._async_checkpoint_saver = None  # type: typing.Optional[AsyncCheckpointSaver]
+    self._network_construction_cache = None  # type: typing.Optional[NetworkConstructionCache]
+    if config.int("network_construction_cache", 0) > 0:
+      self._network_construction_cache = NetworkConstructionCache(max_size=config.int("network_construction_cache", 0))
+    self._network_construction_key = None  # type: typing.Optional[str]  # of the current network, if cached
+    self.network_construction_time = 0.0  # accumulated time in _init_network, reset after each train epoch
+    self._eval_side_process = None  # type: typing.Optional[EvalSideProcess]
 
   def finalize(self):
     """
     Finalizes the TF session, network, graph.
     """
+    self.wait_for_async_save_model()
+    if self._eval_side_process:  # normally finished in train(). this is e.g. after an exception
+      self._eval_side_process.terminate()
+      self._eval_side_process = None
+    if self._network_construction_cache:
+      self._network_construction_cache.clear()
+    self._network_construction_key = None
+    if self.network:
+      self.network.reset_saver()  # closes the session of its AsyncCheckpointSaver
     self._close_tf_session()
     tf.reset_default_graph()
     self.network = None
@@ -759,7 +1342,7 @@ class Engine(EngineBase):
     tf.reset_default_graph()
     self._checked_uninitialized_vars = False
     self._merge_all_summaries = None
-    self._const_cache.clear()
+    self._const_cache = {}  # new instance, the old one might be in the NetworkConstructionCache
 
   def get_eval_datasets(self):
     """
@@ -783,6 +1366,7 @@ class Engine(EngineBase):
       assert not filename
       filename = self.get_epoch_model_filename(epoch=epoch)
     print("Load model %s" % (filename,), file=log.v4)
+    self.wait_for_async_save_model()
     self.network.load_params_from_file(filename, session=self.tf_session)
 
   def save_model(self, filename=None):
@@ -793,8 +1377,23 @@ class Engine(EngineBase):
       return
     if not filename:
       filename = self.get_epoch_model_filename()
-    print("Save model under %s" % (filename,), file=log.v4)
-    self.network.save_params_to_file(filename, session=self.tf_session)
+    self.wait_for_async_save_model()
+    if self.config.bool("save_model_async", False):
+      # The params are copied to host memory now, and the checkpoint is written in the background.
+      print("Save model under %s (async)" % (filename,), file=log.v4)
+      self._async_checkpoint_saver = self.network.save_params_to_file_async(filename, session=self.tf_session)
+    else:
+      print("Save model under %s" % (filename,), file=log.v4)
+      self.network.save_params_to_file(filename, session=self.tf_session)
+
+  def wait_for_async_save_model(self):
+    """
+    Barrier for :func:`save_model` with ``save_model_async``,
+    i.e. waits until the pending checkpoint is completely written.
+    """
+    if self._async_checkpoint_saver:
+      saver, self._async_checkpoint_saver = self._async_checkpoint_saver, None
+      saver.wait()
 
   @staticmethod
   def delete_model(filename):
@@ -1002,9 +1601,27 @@ class Engine(EngineBase):
     """
     if epoch is None:
       epoch = self.epoch
+    start_time = time.time()
+    self._maybe_update_config(net_desc=net_desc, epoch=epoch)
+    if self._network_construction_cache:
+      if self._network_construction_key and self.network:
+        # Keep the current network (and its session) in the cache, instead of closing it.
+        self._network_construction_cache.add(NetworkConstructionCache.Entry(self._network_construction_key, self))
+        self.tf_session = None
+        self.network = None
+      self._network_construction_key = NetworkConstructionCache.get_key(
+        net_dict=net_desc, config=self.config,
+        flags=(self.use_dynamic_train_flag, self.use_eval_flag, self.use_search_flag))
+      cache_entry = self._network_construction_cache.pop(self._network_construction_key)
+      if cache_entry:
+        self._use_cached_network(cache_entry)
+        self._init_network_params()
+        self._log_network_construction_time(start_time=start_time, cached=True)
+        return
+    if self.network:
+      self.network.reset_saver()  # closes the session of its AsyncCheckpointSaver
     self._close_tf_session()
     self._reset_graph()
-    self._maybe_update_config(net_desc=net_desc, epoch=epoch)
     # The new session will by default use the newly created default graph.
     self._make_tf_session()
     tf_random_seed = 42
@@ -1019,16 +1636,78 @@ class Engine(EngineBase):
       train_flag = get_global_train_flag_placeholder()
     else:
       train_flag = False
-    # if False:  # TODO ...
-    #   extern_data = ExternData()
-    #   extern_data.init_from_config(self.config)
-    #   TODO...
+    extern_data = None
+    self.tf_data_input = None
+    if self.config.value("data_provider", "feed_dict") == "tf_data":
+      # The tf.data iterator replaces the extern data placeholders, thus this must be before the network.
+      from TFNetwork import ExternData
+      from TFDataPipeline import TFDataInput
+      extern_data = ExternData()
+      extern_data.init_from_config(self.config)
+      self.tf_data_input = TFDataInput(
+        extern_data=extern_data,
+        prefetch_capacity=self.config.int("tf_data_prefetch_capacity", 10),
+        prefetch_device=self.config.value("tf_data_prefetch_device", None),
+        seq_map_func=self.config.typed_value("tf_data_seq_map_func", None),
+        num_parallel_calls=self.config.int("tf_data_num_parallel_calls", 4))
+    else:
+      assert self.config.value("data_provider", "feed_dict") == "feed_dict", (
+        "invalid data_provider %r" % self.config.value("data_provider", None))
+    if self.config.typed_value("chunking_in_graph", None):
+      # Replaces the extern data by the chunked data, thus also before the network.
+      from TFDataPipeline import InGraphChunking
+      if extern_data is None:
+        from TFNetwork import ExternData
+        extern_data = ExternData()
+        extern_data.init_from_config(self.config)
+      InGraphChunking.from_config(config=self.config, extern_data=extern_data, train_flag=train_flag)
     self.network, self.updater = self.create_network(
       config=self.config,
+      extern_data=extern_data,
       rnd_seed=net_random_seed,
       train_flag=train_flag, eval_flag=self.use_eval_flag, search_flag=self.use_search_flag,
       initial_learning_rate=getattr(self, "initial_learning_rate", None),
       net_dict=net_desc)
+    from Util import NativeCodeCompiler
+    if NativeCodeCompiler.Stats["cache_hits"] or NativeCodeCompiler.Stats["compiles"]:
+      print("Native code compiler: %s." % NativeCodeCompiler.get_stats_str(), file=log.v4)
+    self._init_network_params()
+    self._log_network_construction_time(start_time=start_time, cached=False)
+
+  def _use_cached_network(self, cache_entry):
+    """
+    Makes the cached network the current one, including its graph and session.
+
+    :param NetworkConstructionCache.Entry cache_entry:
+    """
+    from TFUtil import set_global_default_graph
+    self._close_tf_session()
+    set_global_default_graph(cache_entry.graph)
+    self.tf_session = cache_entry.tf_session
+    self.network = cache_entry.network
+    self.updater = cache_entry.updater
+    self.tf_data_input = cache_entry.tf_data_input
+    self._const_cache = cache_entry.const_cache
+    self._merge_all_summaries = cache_entry.merge_all_summaries
+    self._checked_uninitialized_vars = False
+    if self.updater and self.updater.optim_op is not None:
+      # Like for a new network. Also the optimizer state of the previous usage should not be kept.
+      self.updater.init_optimizer_vars(session=self.tf_session)
+
+  def _log_network_construction_time(self, start_time, cached):
+    """
+    :param float start_time:
+    :param bool cached: whether the network came from the :class:`NetworkConstructionCache`
+    """
+    elapsed = time.time() - start_time
+    self.network_construction_time += elapsed
+    print("Network %s took %s." % (
+      "reused from the construction cache" if cached else "construction", hms_fraction(elapsed)), file=log.v3)
+
+  def _init_network_params(self):
+    """
+    Initializes the params of the (new) network.
+    """
     self.network.initialize_params(session=self.tf_session)
     if self.config.is_true("use_horovod"):
       # Note: Might not be needed as it should be deterministic. But just to be sure...
@@ -1039,9 +1718,19 @@ class Engine(EngineBase):
         tf.assign(var, hvd.broadcast(var, root_rank=0))
         for var in self.network.get_params_list() + self.network.get_auxiliary_params()])
       self.tf_session.run(bcast_op)
+    import LocalDataParallel
+    local_data_parallel = LocalDataParallel.get_instance()
+    if local_data_parallel:
+      # Like for Horovod above.
+      params = self.network.get_params_list() + self.network.get_auxiliary_params()
+      values = local_data_parallel.broadcast_multiple("init_params", self.tf_session.run(params))
+      with self.network.batched_var_assigns(session=self.tf_session):
+        for param, value in zip(params, values):
+          self.network.assign_var_value(param, value, session=self.tf_session)
 
   @classmethod
-  def create_network(cls, config, rnd_seed, train_flag, eval_flag, search_flag, net_dict, initial_learning_rate=1.0):
+  def create_network(cls, config, rnd_seed, train_flag, eval_flag, search_flag, net_dict, initial_learning_rate=1.0,
+                     extern_data=None):
     """
     :param Config.Config config:
     :param int rnd_seed:
@@ -1050,12 +1739,14 @@ class Engine(EngineBase):
     :param bool eval_flag:
     :param bool search_flag:
     :param dict[str,dict[str]] net_dict:
+    :param TFNetwork.ExternData|None extern_data: by default from config
     :return: network, updater
     :rtype: (TFNetwork, Updater|None)
     """
     network = TFNetwork(
       name="root",
       config=config,
+      extern_data=extern_data,
       rnd_seed=rnd_seed,
       train_flag=train_flag,
       eval_flag=eval_flag,
@@ -1113,11 +1804,13 @@ class Engine(EngineBase):
     # In pretraining it can happen, that the dimension of output parameters of the previous epoch is
     # not equal to the dimension in the current epoch, due to difference in layer size.
     # In that case initialize output parameters randomly.
+    start_time = time.time()
     self.network.set_params_by_serialized(
       old_network_params, session=self.tf_session,
       ignore_wrong_shape=self.is_pretrain_epoch(),
       copy_param_mode=self.pretrain.copy_param_mode if self.is_pretrain_epoch() else None,
       ignore_non_existing=self.is_pretrain_epoch())
+    print("Copying the params to the new network took %s." % hms_fraction(time.time() - start_time), file=log.v4)
 
   def train(self):
     """
@@ -1162,11 +1855,18 @@ class Engine(EngineBase):
       self.train_epoch()
       epoch += 1
 
+    if self._eval_side_process:
+      self._finish_eval_side_process()
+
     if self.start_epoch <= self.final_epoch:  # We did train at least one epoch.
       assert self.epoch
       # Save last model, in case it was not saved yet (depends on save_model_epoch_interval).
       if self.model_filename:
         self.save_model(self.get_epoch_model_filename())
+      self.wait_for_async_save_model()
+      if self.config.bool_or_other("cleanup_old_models", None):
+        # After all pending evals and saves, which the cleanup in the epochs did not wait for.
+        self.cleanup_old_models()
 
       if self.epoch != self.final_epoch:
         print("Stopped after epoch %i and not %i as planned." % (self.epoch, self.final_epoch), file=log.v3)
@@ -1235,6 +1935,8 @@ class Engine(EngineBase):
     Train a single epoch (self.epoch).
     """
     print("start", self.get_epoch_str(), "with learning rate", self.learning_rate, "...", file=log.v4)
+    if self._eval_side_process:
+      self._merge_eval_side_process_results(self._eval_side_process.poll_results())
 
     if self.epoch == 1 and self.save_epoch1_initial_model:
       epoch0_model_filename = self.epoch_model_filename(self.model_filename, 0, self.is_pretrain_epoch())
@@ -1261,6 +1963,7 @@ class Engine(EngineBase):
     if not trainer.finalized:
       if trainer.device_crash_batch is not None:  # Otherwise we got an unexpected exception - a bug in our code.
         self.save_model(self.get_epoch_model_filename() + ".crash_%i" % trainer.device_crash_batch)
+        self.wait_for_async_save_model()
       print("Trainer not finalized, quitting.", file=log.v1)
       sys.exit(1)
 
@@ -1268,6 +1971,7 @@ class Engine(EngineBase):
       print("Model seems broken, got inf or nan final score: %s" % trainer.score, file=log.v1)
       if self.config.bool("stop_on_nonfinite_train_score", True):
         self.save_model(self.get_epoch_model_filename() + ".broken")
+        self.wait_for_async_save_model()
         sys.exit(1)
 
     if self.model_filename and (self.epoch % self.save_model_epoch_interval == 0):
@@ -1278,10 +1982,83 @@ class Engine(EngineBase):
 
     print(
       self.get_epoch_str(), "score:", self.format_score(trainer.score), "elapsed:", hms(trainer.elapsed), file=log.v1)
-    self.eval_model()
+    if self.network_construction_time:
+      print(self.get_epoch_str(), "network (re)construction time:", hms_fraction(self.network_construction_time),
+            file=log.v3)
+      self.network_construction_time = 0.0
+    if self._use_eval_side_process():
+      self._eval_model_in_side_process()
+    else:
+      self.eval_model()
 
     if self.config.bool_or_other("cleanup_old_models", None):
-      self.cleanup_old_models()
+      # Do not wait for the side process, and do not delete models it still needs.
+      # Their dev scores are not known yet, thus we keep them in any case, and decide in a later epoch.
+      # Also do not wait for the async save. The model being saved is not seen yet, see get_existing_models.
+      self.cleanup_old_models(
+        extra_keep_epochs=self.learning_rate_control.get_pending_epochs(), wait_for_save=False)
+
+  def _use_eval_side_process(self):
+    """
+    :return: whether to eval the current epoch in the side process. see :class:`EvalSideProcess`
+    :rtype: bool
+    """
+    if not self.config.bool("eval_in_side_process", False):
+      return False
+    if not self.get_eval_datasets():
+      return False
+    import LocalDataParallel
+    if self.config.is_true("use_horovod") or LocalDataParallel.get_instance():
+      return False  # all ranks need the same learning rate, which depends on the dev score
+    if not self.model_filename or self.epoch % self.save_model_epoch_interval != 0 or not self._do_save():
+      return False  # the side process needs the checkpoint of this epoch
+    return True
+
+  def _eval_model_in_side_process(self):
+    """
+    Like :func:`eval_model`, but in the side process, and non-blocking.
+    The learning rate control will wait for the results when it needs them.
+    """
+    if not self._eval_side_process:
+      self._eval_side_process = EvalSideProcess(config=self.config)
+    self.wait_for_async_save_model()  # the side process loads the checkpoint
+    epoch = self.epoch
+    self._eval_side_process.eval(
+      epoch=epoch, model_filename=self.get_epoch_model_filename(), net_dict=self.network.layers_desc)
+    self.learning_rate_control.set_epoch_error_pending(epoch, lambda: self._wait_for_eval_side_process(epoch))
+
+  def _wait_for_eval_side_process(self, epoch=None):
+    """
+    :param int|None epoch: if None, waits for all
+    """
+    start_time = time.time()
+    results = self._eval_side_process.wait_results(epoch=epoch)
+    print("Waited %s for the eval side process." % hms_fraction(time.time() - start_time), file=log.v3)
+    self._merge_eval_side_process_results(results)
+
+  def _merge_eval_side_process_results(self, results):
+    """
+    :param dict[int,dict[str,dict[str,dict[str,float]]]] results: epoch -> like :func:`eval_model`
+    """
+    for epoch, epoch_results in sorted(results.items()):
+      print("epoch %i eval (side process):" % epoch, " ".join([
+        "%s: score %s error %s" % (
+          dataset_name, self.format_score(dataset_results["score"]), self.format_score(dataset_results["error"]))
+        for (dataset_name, dataset_results) in sorted(epoch_results.items())]), file=log.v1)
+      dev_error = {}
+      if "dev" in epoch_results:
+        dev_error = {"dev_score": epoch_results["dev"]["score"], "dev_error": epoch_results["dev"]["error"]}
+      self.learning_rate_control.set_epoch_error(epoch, dev_error)  # also done if empty, to remove the pending
+      if self._do_save():
+        self.learning_rate_control.save()
+
+  def _finish_eval_side_process(self):
+    """
+    At the end of training. Waits for all pending evals and lets the process exit.
+    """
+    self._wait_for_eval_side_process()
+    self._eval_side_process.finish()
+    self._eval_side_process = None
 
   # noinspection PyMethodMayBeStatic
   def format_score(self, score):
@@ -1337,6 +2114,9 @@ class Engine(EngineBase):
       import horovod.tensorflow as hvd
       if hvd.rank() != 0:
         return False
+    import LocalDataParallel
+    if LocalDataParallel.get_instance() and not LocalDataParallel.get_instance().is_main():
+      return False
     if self.config.is_true("dry_run"):
       return False
     return True
@@ -1354,7 +2134,8 @@ class Engine(EngineBase):
       which properties of `loss_name` should be written to `output_per_seq_file`.
       allowed_outputs = {"seq_tag", "seq_len", "score", "error", "pos_score", "pos_error"}.
     :param str output_per_seq_file_format: "txt" or "py"
-    :return: nothing
+    :return: dataset name -> {"score": ..., "error": ...}
+    :rtype: dict[str,dict[str,dict[str,float]]]
     """
     extra_fetches = None
 
@@ -1502,6 +2283,7 @@ class Engine(EngineBase):
           f.write("}\n")
         else:
           assert False, output_per_seq_file_format
+    return results
 
   def check_last_epoch(self):
     """
@@ -1520,12 +2302,17 @@ class Engine(EngineBase):
           print("Last epoch model not yet evaluated on dev. Doing that now.", file=log.v4)
           self.eval_model()
 
-  def cleanup_old_models(self, ask_for_confirmation=False):
+  def cleanup_old_models(self, ask_for_confirmation=False, extra_keep_epochs=(), wait_for_save=True):
     """
     :param bool ask_for_confirmation: if True, will ask the user interactively to confirm
+    :param typing.Iterable[int] extra_keep_epochs: these are kept in any case, e.g. when the eval is still pending
+    :param bool wait_for_save: wait for the async save (``save_model_async``), such that we consider the last model.
+      otherwise, the model being saved is simply not considered (its index file is written last)
     """
     if not self._do_save():
       return
+    if wait_for_save:
+      self.wait_for_async_save_model()  # the last model should be complete before we decide
     from Util import CollectionReadCheckCovered, human_bytes_size, confirm
     from itertools import count
     opts = CollectionReadCheckCovered(self.config.get_of_type("cleanup_old_models", dict, {}))
@@ -1573,6 +2360,7 @@ class Engine(EngineBase):
       default_keep_pattern.add(n)
     keep_epochs.update(opts.get("keep", default_keep_pattern))
     keep_epochs.update(epochs[-keep_last_n:])
+    keep_epochs.update(extra_keep_epochs)
     score_keys = set()  # e.g. "dev_error", "dev_score", etc.
     # Collect all possible score keys. Note that we could have different ones for different epochs.
     for data in lr_control.epoch_data.values():
@@ -1647,17 +2435,34 @@ class Engine(EngineBase):
         self.tf_session.run(tf.variables_initializer(uninitialized_vars))
       self._checked_uninitialized_vars = True
 
-  def _get_new_data_provider(self, dataset, batches):
+  def _get_new_data_provider(self, dataset, batches, use_feed_dict=False, train=False):
     """
     :param Dataset.Dataset dataset:
     :param BatchSetGenerator batches:
-    :rtype: TFDataPipeline.FeedDictDataProvider
+    :param bool use_feed_dict: use FeedDictDataProvider even if "data_provider" is "tf_data"
+    :param bool train: whether we train on it. with local_data_parallel, only the training is distributed
+    :rtype: TFDataPipeline.FeedDictDataProvider|TFDataPipeline.TFDataDataProvider
     """
     batch_slice = None
     if self.config.is_true("use_horovod"):
       # noinspection PyPackageRequirements,PyUnresolvedReferences
       import horovod.tensorflow as hvd
       batch_slice = slice(hvd.rank(), None, hvd.size())
+    import LocalDataParallel
+    if LocalDataParallel.get_instance() and train:
+      # Eval, forward and search results are not reduced over the workers,
+      # and all workers need e.g. the same dev scores, thus each worker processes all the data there.
+      batch_slice = LocalDataParallel.get_batch_slice()
+    if self.tf_data_input and not use_feed_dict:
+      from TFDataPipeline import TFDataDataProvider
+      return TFDataDataProvider(
+        tf_data_input=self.tf_data_input,
+        tf_session=self.tf_session, extern_data=self.network.extern_data,
+        data_keys=self.network.used_data_keys,
+        dataset=dataset, batches=batches,
+        batch_slice=batch_slice,
+        capacity=self.config.int("tf_data_prefetch_capacity", 10),
+        enforce_min_len1=self.config.is_true("enforce_min_len1", False))
     from TFDataPipeline import FeedDictDataProvider
     data_provider = FeedDictDataProvider(
       tf_session=self.tf_session, extern_data=self.network.extern_data,
@@ -1686,7 +2491,7 @@ class Engine(EngineBase):
       batch.init_with_one_full_sequence(seq_idx=seq_idx, dataset=dataset)
     batch_generator = iter([batch])
     batches = BatchSetGenerator(dataset, generator=batch_generator)
-    data_provider = self._get_new_data_provider(dataset=dataset, batches=batches)
+    data_provider = self._get_new_data_provider(dataset=dataset, batches=batches, use_feed_dict=True)
     feed_dict, _ = data_provider.get_feed_dict(single_threaded=True)
     return feed_dict
 
@@ -1721,7 +2526,7 @@ class Engine(EngineBase):
       output_layer_name, ','.join(self.network.layers.keys()))
     return self.network.layers[output_layer_name]
 
-  def forward_single(self, dataset, seq_idx, output_layer_name=None):
+  def forward_single(self, dataset, seq_idx, output_layer_name=None, epoch_step=None):
     """
     Forwards a single sequence.
     If you want to perform search, and get a number of hyps out, use :func:`search_single`.
@@ -1729,12 +2534,23 @@ class Engine(EngineBase):
     :param Dataset.Dataset dataset:
     :param int seq_idx:
     :param str|None output_layer_name: e.g. "output". if not set, will read from config "forward_output_layer"
+    :param int|None epoch_step: if set, feeds this as the network epoch step, and also runs the post control deps.
+      This is for stateful forwarding, e.g. with ``initial_state="keep_over_epoch"`` in a rec layer,
+      where the state is carried over from the previous call, and reset when ``epoch_step == 0``.
     :return: numpy array, output in time major format (time,dim)
     :rtype: numpy.ndarray
     """
     output_data = self._get_output_layer(output_layer_name).output
     out = output_data.get_placeholder_as_time_major()
-    out_d = self.run_single(dataset=dataset, seq_idx=seq_idx, output_dict={"out": out})
+    output_dict = {"out": out}
+    ext_feed_dict = None
+    if epoch_step is not None:
+      if self.network.epoch_step is not None:
+        ext_feed_dict = {self.network.epoch_step: epoch_step}
+      post_control_deps = self.network.get_post_control_dependencies()
+      if post_control_deps:
+        output_dict["post_control_dependencies"] = post_control_deps
+    out_d = self.run_single(dataset=dataset, seq_idx=seq_idx, output_dict=output_dict, ext_feed_dict=ext_feed_dict)
     output_value = out_d["out"]
     assert output_value.shape[1] == 1  # batch-dim
     return output_value[:, 0]  # remove batch-dim
@@ -1770,7 +2586,10 @@ class Engine(EngineBase):
     assert not os.path.exists(output_file)
     print("Forwarding to HDF file: %s" % output_file, file=log.v2)
     print("Forward output:", output, file=log.v3)
-    writer = SimpleHDFWriter(filename=output_file, dim=output.dim, ndim=output.ndim, labels=labels)
+    writer_opts = {}
+    if self.config.has("forward_hdf_max_buffer_size"):
+      writer_opts["max_buffer_size"] = self.config.int("forward_hdf_max_buffer_size", 0)
+    writer = SimpleHDFWriter(filename=output_file, dim=output.dim, ndim=output.ndim, labels=labels, **writer_opts)
 
     def extra_fetches_cb(inputs, seq_tag, **kwargs):
       """
@@ -1820,13 +2639,17 @@ class Engine(EngineBase):
     """
     print("Analyze with network on %r." % data, file=log.v1)
 
+    from TFNetworkLayer import FramewiseStatisticsLayer
     if "analyze" not in self.network.layers:
-      from TFNetworkLayer import FramewiseStatisticsLayer
       assert self.config.has("sil_label_idx")
       self.network.add_layer(
         name="analyze", layer_class=FramewiseStatisticsLayer,
         sil_label_idx=self.config.int("sil_label_idx", 0),
         sources=self.network.get_output_layers())
+    analyze_layer = self.network.layers["analyze"]
+    accumulators = None
+    if isinstance(analyze_layer, FramewiseStatisticsLayer):
+      accumulators = analyze_layer.accumulators
 
     # It's constructed lazily and it will set used_data_keys, so make sure that we have it now.
     self.network.maybe_construct_objective()
@@ -1843,8 +2666,11 @@ class Engine(EngineBase):
       max_seqs=max_seqs,
       max_seq_length=max_seq_length,
       used_data_keys=self.network.used_data_keys)
-    analyzer = Runner(engine=self, dataset=data, batches=batches, train=False)
+    analyzer = Runner(engine=self, dataset=data, batches=batches, train=False, accumulators=accumulators)
     analyzer.run(report_prefix=self.get_epoch_str() + " analyze")
+    if accumulators and analyzer.finalized:
+      for k, v in analyze_layer.get_accumulated_stats(analyzer.accumulated).items():
+        analyzer.stats["stats:%s:%s" % (analyze_layer.name, k)] = v
 
     print("Finished analyzing of the dataset %r." % data, file=log.v1)
     print("elapsed:", hms(analyzer.elapsed), file=log.v1)
@@ -2170,33 +2996,16 @@ class Engine(EngineBase):
     assert not os.path.exists(output_file), "Already existing output file %r." % output_file
     print("Compute priors, using output layer %r, writing to %r." % (output_layer, output_file), file=log.v2)
 
-    class Accumulator(object):
-      """
-      Also see PriorEstimationTaskThread for reference.
-      """
-
-      def __init__(self):
-        self.sum_posteriors = numpy.zeros(int(output_layer.output.dim))
-        self.seq_len = 0
-
-      def __call__(self, outputs):
-        """
-        Called via extra_fetches_callback from the Runner.
-
-        :param numpy.ndarray outputs: shape=(time,data)|(time,), depending if dense or sparse, flattened over batches
-        """
-        seq_len = outputs.shape[0]
-        if output_layer.output.sparse:
-          assert outputs.shape == (seq_len,)
-        else:
-          assert outputs.shape == (seq_len, output_layer.output.dim)
-        if output_layer.output.sparse:
-          from Util import class_idx_seq_to_1_of_k
-          outputs = class_idx_seq_to_1_of_k(outputs, num_classes=output_layer.output.dim)
-        self.sum_posteriors += numpy.sum(outputs, axis=0)
-        self.seq_len += seq_len
-
-    accumulator = Accumulator()
+    # Also see PriorEstimationTaskThread for reference.
+    # The sums are calculated in the graph, and fetched only once at the end.
+    from TFUtil import InGraphReduction
+    output = output_layer.output
+    with tf.name_scope("compute_priors"):
+      outputs_flat = output.get_placeholder_flattened()  # (time,data)|(time,), flattened over batches
+      if output.sparse:
+        outputs_flat = tf.one_hot(outputs_flat, depth=output.dim, dtype=tf.float32)
+      sum_posteriors = InGraphReduction("sum_posteriors", outputs_flat, reduce="sum", axis=0)
+      num_frames = InGraphReduction("num_frames", outputs_flat, reduce="count", axis=0)
     batch_size = config.int('batch_size', 1)
     max_seqs = config.int('max_seqs', -1)
     epoch = config.int('epoch', 1)
@@ -2213,16 +3022,13 @@ class Engine(EngineBase):
     forwarder = Runner(
       engine=self, dataset=dataset, batches=batches,
       train=False, eval=False,
-      extra_fetches={
-        'outputs': output_layer.output.get_placeholder_flattened()
-      },
-      extra_fetches_callback=accumulator)
+      accumulators=[sum_posteriors, num_frames])
     forwarder.run(report_prefix=self.get_epoch_str() + " forward")
     if not forwarder.finalized:
       print("Error happened. Exit now.")
       sys.exit(1)
 
-    average_posterior = accumulator.sum_posteriors / accumulator.seq_len
+    average_posterior = forwarder.accumulated["sum_posteriors"] / forwarder.accumulated["num_frames"]
     avg_sum = numpy.sum(average_posterior)
     assert numpy.isfinite(avg_sum)
     print("Prior sum in std-space (should be close to 1.0):", avg_sum, file=log.v1)
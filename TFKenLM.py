@@ -19,6 +19,8 @@ kenlm_dir = returnn_dir + "/extern/kenlm"
 # https://github.com/tensorflow/tensorflow/blob/master/tensorflow/core/lib/strings/str_util.h
 _src_code = """
 #include <exception>
+#include <unordered_map>
+#include <utility>
 #include "tensorflow/core/framework/op.h"
 #include "tensorflow/core/framework/op_kernel.h"
 #include "tensorflow/core/framework/shape_inference.h"
@@ -88,6 +90,50 @@ REGISTER_OP("KenLmAbsScoreBpeStringsDense")
   " dense output, for all possible succeeding labels.");
 
 
+REGISTER_OP("KenLmAdvanceBpeStrings")
+.Input("handle: resource")
+.Input("bpe_merge_symbol: string")
+.Input("states: string")
+.Input("strings: string")
+.Output("new_states: string")
+.Output("scores: float32")
+.SetShapeFn([](::tensorflow::shape_inference::InferenceContext* c) {
+  ::tensorflow::shape_inference::ShapeHandle shape;
+  TF_RETURN_IF_ERROR(c->Merge(c->input(2), c->input(3), &shape));
+  c->set_output(0, shape);
+  c->set_output(1, shape);
+  return Status::OK();
+})
+.Doc("KenLmAdvanceBpeStrings: stateful variant of KenLmAbsScoreBpeStrings."
+  " states are serialized KenLM states (empty string is the begin of sentence),"
+  " strings are the text pieces which are appended to each state."
+  " returns the new states and the absolute scores in +log space (natural log, not base 10),"
+  " which are exactly the same as KenLmAbsScoreBpeStrings on the accumulated text.");
+
+
+REGISTER_OP("KenLmAdvanceBpeStringsDense")
+.Input("handle: resource")
+.Input("bpe_merge_symbol: string")
+.Input("states: string")
+.Input("strings: string")
+.Input("labels: string")
+.Output("new_states: string")
+.Output("scores: float32")
+.Output("dense_scores: float32")
+.SetShapeFn([](::tensorflow::shape_inference::InferenceContext* c) {
+  ::tensorflow::shape_inference::ShapeHandle shape;
+  TF_RETURN_IF_ERROR(c->Merge(c->input(2), c->input(3), &shape));
+  c->set_output(0, shape);
+  c->set_output(1, shape);
+  ::tensorflow::shape_inference::ShapeHandle out_shape;
+  TF_RETURN_IF_ERROR(c->Concatenate(shape, c->input(4), &out_shape));
+  c->set_output(2, out_shape);
+  return Status::OK();
+})
+.Doc("KenLmAdvanceBpeStringsDense: stateful variant of KenLmAbsScoreBpeStringsDense."
+  " See KenLmAdvanceBpeStrings.");
+
+
 // https://github.com/kpu/kenlm/blob/master/lm/model.hh
 // https://github.com/kpu/kenlm/blob/master/lm/virtual_interface.hh
 // https://github.com/kpu/kenlm/blob/master/python/kenlm.pyx
@@ -151,13 +197,137 @@ struct KenLmModel : public ResourceBase {
     return total_score * logf(10.);
   }
 
+  // Stateful scoring. See KenLmAdvanceBpeStrings.
+  // The per-hypothesis state is kept outside, serialized in a TF string tensor,
+  // such that the rec layer can reorder it with the beam backpointers like any other state.
+  // We keep the KenLM state after all completed words, the (+log10) score of the completed words,
+  // and the last (incomplete) word.
+  struct HypState {
+    lm::ngram::State state;
+    float total_score;
+    string last_word;
+  };
+
+  bool decode_state(const string& s, HypState* hyp) EXCLUSIVE_LOCKS_REQUIRED(mu_) {
+    if(s.empty()) {  // initial state
+      model_.BeginSentenceWrite(&hyp->state);
+      hyp->state.ZeroRemaining();
+      hyp->total_score = 0;
+      hyp->last_word.clear();
+      return true;
+    }
+    const size_t header_size = sizeof(lm::ngram::State) + sizeof(float);
+    if(s.size() < header_size)
+      return false;
+    memcpy(&hyp->state, s.data(), sizeof(lm::ngram::State));
+    memcpy(&hyp->total_score, s.data() + sizeof(lm::ngram::State), sizeof(float));
+    hyp->last_word.assign(s.data() + header_size, s.size() - header_size);
+    return true;
+  }
+
+  static string encode_state(const HypState& hyp) {
+    string s;
+    s.reserve(sizeof(lm::ngram::State) + sizeof(float) + hyp.last_word.size());
+    s.append(reinterpret_cast<const char*>(&hyp.state), sizeof(lm::ngram::State));
+    s.append(reinterpret_cast<const char*>(&hyp.total_score), sizeof(float));
+    s.append(hyp.last_word);
+    return s;
+  }
+
+  // Same as model_.FullScore(in_state, index(word), *out_state).prob, but cached.
+  // Hypotheses in the beam mostly share their history, thus we get many cache hits.
+  float cached_score(const lm::ngram::State& in_state, const string& word, lm::ngram::State* out_state)
+      EXCLUSIVE_LOCKS_REQUIRED(mu_) {
+    // Only use the relevant part of the state for the key (not the remaining entries or padding).
+    string key(reinterpret_cast<const char*>(&in_state.length), 1);
+    key.append(reinterpret_cast<const char*>(in_state.words), sizeof(lm::WordIndex) * in_state.length);
+    key.append(reinterpret_cast<const char*>(in_state.backoff), sizeof(float) * in_state.length);
+    key += word;
+    auto it = score_cache_.find(key);
+    if(it != score_cache_.end()) {
+      *out_state = it->second.second;
+      return it->second.first;
+    }
+    auto word_idx = model_.BaseVocabulary().Index(word);
+    float score = model_.FullScore(in_state, word_idx, *out_state).prob;
+    if(score_cache_.size() >= kMaxScoreCacheSize)
+      score_cache_.clear();
+    score_cache_.emplace(std::move(key), std::make_pair(score, *out_state));
+    return score;
+  }
+
+  // Appends `text` to `hyp` (after BPE merging), and scores all new completed words.
+  // Words are completed by a following space, so the last word always stays in hyp->last_word.
+  void advance(HypState* hyp, const string& text, const string& bpe_merge_symbol) EXCLUSIVE_LOCKS_REQUIRED(mu_) {
+    string full_text = hyp->last_word + text;
+    if(!bpe_merge_symbol.empty())
+      full_text = tensorflow::str_util::StringReplace(
+        full_text, bpe_merge_symbol + " ", "", /* replace_all */ true);
+    std::vector<string> words = tensorflow::str_util::Split(full_text, ' ');
+    lm::ngram::State out_state;
+    for(int i = 0; i < (int) words.size() - 1; ++i) {
+      const string& word = words[i];
+      if(word.empty()) continue;
+      hyp->total_score += cached_score(hyp->state, word, &out_state);
+      hyp->state = out_state;
+    }
+    hyp->last_word = words.empty() ? "" : words[words.size() - 1];
+  }
+
+  // Equivalent to abs_score() on the accumulated text.
+  Status advance_score(
+        const string& state, const string& text, const string& bpe_merge_symbol,
+        string* new_state, float* score) {
+    mutex_lock l(mu_);
+    HypState hyp;
+    if(!decode_state(state, &hyp))
+      return errors::InvalidArgument("KenLM: invalid state of size ", state.size());
+    advance(&hyp, text, bpe_merge_symbol);
+    float total = hyp.total_score;
+    if(!hyp.last_word.empty()) {
+      lm::ngram::State out_state;
+      total += cached_score(hyp.state, hyp.last_word, &out_state);
+    }
+    *new_state = encode_state(hyp);
+    *score = total * logf(10.);
+    return Status::OK();
+  }
+
+  // Equivalent to abs_score_dense() on the accumulated text.
+  Status advance_score_dense(
+        const string& state, const string& text, const string& bpe_merge_symbol,
+        const TTypes<string>::ConstFlat labels, TTypes<float>::UnalignedFlat out_dense_scores,
+        string* new_state, float* score) {
+    assert(labels.size() == out_dense_scores.size());
+    mutex_lock l(mu_);
+    HypState hyp;
+    if(!decode_state(state, &hyp))
+      return errors::InvalidArgument("KenLM: invalid state of size ", state.size());
+    advance(&hyp, text, bpe_merge_symbol);
+    float total = hyp.total_score;
+    lm::ngram::State out_state;
+    for(int i = 0; i < labels.size(); ++i) {
+      float label_score = cached_score(hyp.state, hyp.last_word + labels(i), &out_state);
+      out_dense_scores(i) = (total + label_score) * logf(10.);
+    }
+    if(!hyp.last_word.empty())
+      total += cached_score(hyp.state, hyp.last_word + bpe_merge_symbol, &out_state);
+    *new_state = encode_state(hyp);
+    *score = total * logf(10.);
+    return Status::OK();
+  }
+
   string DebugString() override {
     return strings::StrCat("KenLmModel[", filename_, "]");
   }
 
+  static const size_t kMaxScoreCacheSize = 1000000;
+
   const string filename_;
   mutex mu_;
   lm::ngram::ProbingModel model_ GUARDED_BY(mu_);
+  // state + word -> (score, out state)
+  std::unordered_map<string, std::pair<float, lm::ngram::State>> score_cache_ GUARDED_BY(mu_);
 };
 
 
@@ -320,6 +490,112 @@ class KenLmAbsScoreBpeStringsDenseOp : public OpKernel {
 
 REGISTER_KERNEL_BUILDER(Name("KenLmAbsScoreBpeStringsDense").Device(DEVICE_CPU), KenLmAbsScoreBpeStringsDenseOp);
 
+
+class KenLmAdvanceBpeStringsOp : public OpKernel {
+ public:
+  using OpKernel::OpKernel;
+
+  void Compute(OpKernelContext* context) override {
+    KenLmModel* lm;
+    {
+      const Tensor* handle;
+      OP_REQUIRES_OK(context, context->input("handle", &handle));
+      OP_REQUIRES_OK(context, GetResourceFromContext(context, "handle", &lm));
+    }
+    core::ScopedUnref unref(lm);
+
+    OP_REQUIRES(context, context->input(1).NumElements() == 1,
+      errors::InvalidArgument(
+        "bpe_merge_symbol must be a single element but got shape ",
+        context->input(1).shape().DebugString()));
+    const string& bpe_merge_symbol = context->input(1).flat<string>()(0);
+
+    const Tensor& states_tensor = context->input(2);
+    const Tensor& input_tensor = context->input(3);
+    OP_REQUIRES(context, states_tensor.shape() == input_tensor.shape(),
+      errors::InvalidArgument(
+        "states shape ", states_tensor.shape().DebugString(),
+        " does not match strings shape ", input_tensor.shape().DebugString()));
+    auto states_flat = states_tensor.flat<string>();
+    auto input_flat = input_tensor.flat<string>();
+
+    Tensor* output_states_tensor = NULL;
+    OP_REQUIRES_OK(context, context->allocate_output(0, input_tensor.shape(), &output_states_tensor));
+    auto output_states_flat = output_states_tensor->flat<string>();
+    Tensor* output_tensor = NULL;
+    OP_REQUIRES_OK(context, context->allocate_output(1, input_tensor.shape(), &output_tensor));
+    auto output_flat = output_tensor->flat<float>();
+
+    for(int i = 0; i < input_flat.size(); ++i) {
+      OP_REQUIRES_OK(context, lm->advance_score(
+        states_flat(i), input_flat(i), bpe_merge_symbol, &output_states_flat(i), &output_flat(i)));
+    }
+  }
+};
+
+REGISTER_KERNEL_BUILDER(Name("KenLmAdvanceBpeStrings").Device(DEVICE_CPU), KenLmAdvanceBpeStringsOp);
+
+
+class KenLmAdvanceBpeStringsDenseOp : public OpKernel {
+ public:
+  using OpKernel::OpKernel;
+
+  void Compute(OpKernelContext* context) override {
+    KenLmModel* lm;
+    {
+      const Tensor* handle;
+      OP_REQUIRES_OK(context, context->input("handle", &handle));
+      OP_REQUIRES_OK(context, GetResourceFromContext(context, "handle", &lm));
+    }
+    core::ScopedUnref unref(lm);
+
+    OP_REQUIRES(context, context->input(1).NumElements() == 1,
+      errors::InvalidArgument(
+        "bpe_merge_symbol must be a single element but got shape ",
+        context->input(1).shape().DebugString()));
+    const string& bpe_merge_symbol = context->input(1).flat<string>()(0);
+
+    const Tensor& states_tensor = context->input(2);
+    const Tensor& input_tensor = context->input(3);
+    OP_REQUIRES(context, states_tensor.shape() == input_tensor.shape(),
+      errors::InvalidArgument(
+        "states shape ", states_tensor.shape().DebugString(),
+        " does not match strings shape ", input_tensor.shape().DebugString()));
+    auto states_flat = states_tensor.flat<string>();
+    auto input_flat = input_tensor.flat<string>();
+
+    const Tensor& labels_tensor = context->input(4);
+    auto labels_flat = labels_tensor.flat<string>();
+
+    Tensor* output_states_tensor = NULL;
+    OP_REQUIRES_OK(context, context->allocate_output(0, input_tensor.shape(), &output_states_tensor));
+    auto output_states_flat = output_states_tensor->flat<string>();
+    Tensor* output_tensor = NULL;
+    OP_REQUIRES_OK(context, context->allocate_output(1, input_tensor.shape(), &output_tensor));
+    auto output_flat = output_tensor->flat<float>();
+
+    Tensor* output_dense_tensor = NULL;
+    TensorShape output_dense_shape(input_tensor.shape());
+    output_dense_shape.AppendShape(labels_tensor.shape());
+    OP_REQUIRES_OK(context, context->allocate_output(2, output_dense_shape, &output_dense_tensor));
+    Tensor output_dense_flat_tensor;
+    OP_REQUIRES(context,
+      output_dense_flat_tensor.CopyFrom(
+        *output_dense_tensor,
+        TensorShape({input_tensor.NumElements(), labels_tensor.NumElements()})),
+      errors::Internal("CopyFrom failed"));
+
+    for(int i = 0; i < input_flat.size(); ++i) {
+      OP_REQUIRES_OK(context, lm->advance_score_dense(
+        states_flat(i), input_flat(i), bpe_merge_symbol,
+        labels_flat, output_dense_flat_tensor.Slice(i, i + 1).unaligned_flat<float>(),
+        &output_states_flat(i), &output_flat(i)));
+    }
+  }
+};
+
+REGISTER_KERNEL_BUILDER(Name("KenLmAdvanceBpeStringsDense").Device(DEVICE_CPU), KenLmAdvanceBpeStringsDenseOp);
+
 """
 
 _kenlm_src_code_workarounds = """
@@ -379,7 +655,7 @@ def get_tf_mod(verbose=False):
   src_code += _src_code
 
   compiler = OpCodeCompiler(
-    base_name="KenLM", code_version=1, code=src_code,
+    base_name="KenLM", code_version=2, code=src_code,
     include_paths=(kenlm_dir, kenlm_dir + "/util/double-conversion"),
     c_macro_defines={"NDEBUG": 1, "KENLM_MAX_ORDER": 6, "HAVE_ZLIB": 1},
     ld_flags=["-l%s" % lib for lib in libs],
@@ -435,6 +711,40 @@ def ken_lm_abs_score_bpe_strings_dense(handle, bpe_merge_symbol, strings, labels
     handle=handle, bpe_merge_symbol=bpe_merge_symbol, strings=strings, labels=labels)
 
 
+def ken_lm_advance_bpe_strings(handle, bpe_merge_symbol, states, strings):
+  """
+  Stateful variant of :func:`ken_lm_abs_score_bpe_strings`.
+  Instead of the whole accumulated text, we get only the new text piece for every state,
+  so the runtime does not depend on the length of the text so far.
+
+  :param tf.Tensor handle: TF resource handle returned by :func:`ken_lm_load`
+  :param str|tf.Tensor bpe_merge_symbol: e.g. "@@", or "" for no BPE merging
+  :param tf.Tensor states: serialized KenLM states, string. the empty string is the initial state
+  :param tf.Tensor strings: same shape as `states`. text pieces which get appended, e.g. "be@@ "
+  :return: (new_states, scores). same shape as `strings`. scores are absolute, i.e. for the whole text so far,
+    and exactly the same as :func:`ken_lm_abs_score_bpe_strings` on the accumulated text
+  :rtype: (tf.Tensor, tf.Tensor)
+  """
+  return get_tf_mod().ken_lm_advance_bpe_strings(
+    handle=handle, bpe_merge_symbol=bpe_merge_symbol, states=states, strings=strings)
+
+
+def ken_lm_advance_bpe_strings_dense(handle, bpe_merge_symbol, states, strings, labels):
+  """
+  Stateful variant of :func:`ken_lm_abs_score_bpe_strings_dense`.
+  See :func:`ken_lm_advance_bpe_strings`.
+
+  :param tf.Tensor handle: TF resource handle returned by :func:`ken_lm_load`
+  :param str|tf.Tensor bpe_merge_symbol: e.g. "@@", or "" for no BPE merging
+  :param tf.Tensor states: serialized KenLM states, string. the empty string is the initial state
+  :param tf.Tensor strings: same shape as `states`. text pieces which get appended
+  :param tf.Tensor|tf.Variable labels:
+  :return: (new_states, scores, dense_scores)
+  :rtype: (tf.Tensor, tf.Tensor, tf.Tensor)
+  """
+  return get_tf_mod().ken_lm_advance_bpe_strings_dense(
+    handle=handle, bpe_merge_symbol=bpe_merge_symbol, states=states, strings=strings, labels=labels)
+
 if __name__ == "__main__":
   import better_exchook
   better_exchook.install()
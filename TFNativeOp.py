@@ -444,6 +444,18 @@ class OpMaker(object):
   def _make_mod(self):
     if self.cache_key in self.mod_cache:
       return self.mod_cache[self.cache_key]
+    comp = self.make_compiler()
+    mod = comp.load_tf_module()
+    mod._op_compiler = comp
+    self.mod_cache[self.cache_key] = mod
+    return mod
+
+  def make_compiler(self):
+    """
+    This does not compile anything yet. See :func:`prebuild_ops`.
+
+    :rtype: TFUtil.OpCodeCompiler
+    """
     from Util import find_lib
     # Note about BLAS linkage:
     # TensorFlow (or its Eigen lib) likely has linked against some BLAS lib itself.
@@ -512,10 +524,7 @@ class OpMaker(object):
       ld_flags=ld_flags,
       use_cuda_if_available=self.with_cuda,
       **dict(self.compiler_opts))
-    mod = comp.load_tf_module()
-    mod._op_compiler = comp
-    self.mod_cache[self.cache_key] = mod
-    return mod
+    return comp
 
   def make_op(self, grad_func=None):
     """
@@ -622,6 +631,98 @@ def make_op(cls, **kwargs):
   return maker.make_op()
 
 
+def get_all_op_names():
+  """
+  :return: all ops from :mod:`NativeOp` which we can compile here
+  :rtype: list[str]
+  """
+  OpMaker._cls_init()
+  names = []
+  for name, cls in sorted(vars(NativeOp).items()):
+    if not isinstance(cls, type) or not issubclass(cls, NativeOp.NativeOpGenBase):
+      continue
+    if cls.c_fw_code is None or cls.in_info is None or cls.out_info is None:
+      continue
+    if not cls.cpu_support and not OpMaker.with_cuda:
+      continue
+    names.append(name)
+  return names
+
+
+# Used by get_op_names_from_network_dict().
+_OpNamesByLayerClass = {
+  "time_chunking": ["Chunking"],
+  "time_unchunking": ["UnChunking"],
+  "fast_bw": ["FastBaumWelchOp"],
+  "edit_distance_table": ["NextEditDistanceRowOp"],
+  "optimal_completions": ["NextEditDistanceReduceOp"],
+}
+_OpNamesByLoss = {
+  "fast_bw": ["FastBaumWelchOp"],
+}
+
+
+def get_op_names_from_network_dict(net_dict):
+  """
+  Statically determines which native ops a network will likely use, without constructing it.
+  This covers the common cases (native rec units, native CTC, fast_bw, ...),
+  but it is not necessarily complete.
+
+  :param dict[str,dict[str]] net_dict: layer name -> layer dict, like the "network" config option
+  :return: op names from :mod:`NativeOp`
+  :rtype: list[str]
+  """
+  from TFNetworkRecLayer import RecLayer
+  names = set()
+  for layer_dict in net_dict.values():
+    if not isinstance(layer_dict, dict):
+      continue
+    names.update(_OpNamesByLayerClass.get(layer_dict.get("class"), []))
+    unit = layer_dict.get("unit")
+    if layer_dict.get("class") == "rec" and isinstance(unit, dict):
+      names.update(get_op_names_from_network_dict(unit))
+    elif layer_dict.get("class") == "rec" and isinstance(unit, str):
+      try:
+        cell_class = RecLayer.get_rnn_cell_class(unit)
+      except Exception:
+        cell_class = None  # Ignore here, this will be properly handled when the network is constructed.
+      if isinstance(cell_class, type) and issubclass(cell_class, RecSeqCellOp) and cell_class.op_name:
+        names.add(cell_class.op_name)
+    if isinstance(layer_dict.get("subnetwork"), dict):
+      names.update(get_op_names_from_network_dict(layer_dict["subnetwork"]))
+    loss = layer_dict.get("loss")
+    names.update(_OpNamesByLoss.get(loss, []))
+    if loss == "ctc":
+      loss_opts = layer_dict.get("loss_opts") or {}
+      if loss_opts.get("use_viterbi"):
+        names.update(["GetCtcFsaFastBwOp", "FastViterbiOp"])
+      elif loss_opts.get("use_native"):
+        names.update(["GetCtcFsaFastBwOp", "FastBaumWelchOp"])
+  return sorted(names)
+
+
+def prebuild_ops(op_names, num_workers=None, **kwargs):
+  """
+  Compiles the given ops (and their gradient ops) ahead of time, in parallel.
+  This does not load them. A later :func:`make_op` will just find them in the cache.
+  See :func:`Util.NativeCodeCompiler.compile_parallel`.
+
+  :param list[str] op_names: e.g. ["NativeLstm2", "FastBaumWelchOp"]
+  :param int|None num_workers: number of parallel compile jobs. by default the number of CPUs
+  :param kwargs: passed to OpMaker
+  :return: the compilers
+  :rtype: list[TFUtil.OpCodeCompiler]
+  """
+  compilers = []
+  for op_name in op_names:
+    description = OpDescription.from_gen_base(getattr(NativeOp, op_name))
+    while description is not None:
+      compilers.append(OpMaker(description, **kwargs).make_compiler())
+      description = description.grad()
+  TFUtil.OpCodeCompiler.compile_parallel(compilers, num_workers=num_workers)
+  return compilers
+
+
 def make_lstm_op(**kwargs):
   """
   See :class:`NativeLstmCell` for usage.
@@ -639,6 +740,7 @@ class RecSeqCellOp(object):
   """
   does_input_projection = False
   does_direction_handling = False
+  op_name = None  # type: None|str  # from NativeOp, used by get_op_names_from_network_dict()
 
   def __init__(self, n_hidden, n_input_dim=None, n_input_dim_parts=None, input_is_sparse=False, step=None):
     """
@@ -682,6 +784,7 @@ class NativeLstmCell(RecSeqCellOp):
   """
   Native LSTM.
   """
+  op_name = "LstmGenericBase"
 
   def __init__(self, **kwargs):
     super(NativeLstmCell, self).__init__(**kwargs)
@@ -742,6 +845,7 @@ class NativeLstmLowMemCell(RecSeqCellOp):
   """
   Native LSTM, low mem variant.
   """
+  op_name = "LstmLowMem"
   does_input_projection = True
   does_direction_handling = True
 
@@ -805,6 +909,7 @@ class NativeLstm2(RecSeqCellOp):
   Native LSTM 2.
   See :class:`NativeOp.NativeLstm2`.
   """
+  op_name = "NativeLstm2"
   does_input_projection = False
   does_direction_handling = True
 
@@ -871,6 +976,7 @@ class TwoDNativeLstmCell(RecSeqCellOp):
   """
   Native 2D LSTM.
   """
+  op_name = "TwoDLSTM"
 
   does_input_projection = True
 
@@ -6,6 +6,7 @@ Defines the :class:`TFNetwork` and :class:`ExternData`.
 from __future__ import print_function
 
 import tensorflow as tf
+from tensorflow.python.training.saver import BaseSaverBuilder
 import sys
 import numpy
 import contextlib
@@ -31,6 +32,9 @@ class ExternData(object):
     if data:
       self.register_data_from_dict(data)
     self.extra_added_keys = set()  # set[str]
+    # With in-graph chunking, self.data has the chunked data, and this has the original data to be fed.
+    self.feed_data = {}  # type: typing.Dict[str,Data]
+    self.chunking = None  # type: typing.Optional[TFDataPipeline.InGraphChunking]
 
   def __repr__(self):
     return "<ExternData data=%r>" % self.data
@@ -147,6 +151,16 @@ class ExternData(object):
     """
     return self.data[name]
 
+  def get_feed_data(self, name):
+    """
+    :param str name:
+    :return: the data with the placeholders to be fed. this is the same as :func:`get_data` without in-graph chunking
+    :rtype: Data
+    """
+    if name in self.feed_data:
+      return self.feed_data[name]
+    return self.data[name]
+
   def get_default_input_data(self):
     """
     :rtype: Data
@@ -325,9 +339,11 @@ class TFNetwork(object):
         name="global_step", initial_value=0, dtype="int64", collections=[tf.GraphKeys.GLOBAL_STEP], trainable=False)
     self.epoch_step = None
     self.saver = None  # type: typing.Optional[tf.train.Saver]
+    self._async_checkpoint_saver = None  # type: typing.Optional[AsyncCheckpointSaver]
     self.extra_vars_to_save = []  # type: typing.List[tf.Variable]
     self.recurrent = False
     self._assigner_cache = {}  # type: typing.Dict[tf.Variable,VariableAssigner]
+    self._pending_var_assigns = None  # type: typing.Optional[typing.List[typing.Tuple[VariableAssigner,typing.Any]]]
     self.concat_sources_dropout_cache = {}  # type: typing.Dict[typing.Tuple[typing.Tuple[LayerBase,...],float,typing.Optional[typing.Tuple[typing.Optional[int],...]]],Data]  # nopep8
     self._batch_dim = None  # see get_batch_dim
     self._merge_all_summaries = None  # type: typing.Optional[tf.Tensor]
@@ -579,9 +595,10 @@ class TFNetwork(object):
     from Util import help_on_type_error_wrong_args
     from TFUtil import py_print
     layer_desc = self._create_layer_layer_desc(name=name, layer_desc=layer_desc)
-    debug_print_layer_output_template = self.get_config().bool("debug_print_layer_output_template", False)
-    debug_print_layer_output_shape = self.get_config().bool("debug_print_layer_output_shape", False)
-    debug_add_check_numerics_on_output = self.get_config().bool(
+    config = self.get_config()
+    debug_print_layer_output_template = config.bool("debug_print_layer_output_template", False)
+    debug_print_layer_output_shape = config.bool("debug_print_layer_output_shape", False)
+    debug_add_check_numerics_on_output = config.bool(
       "debug_add_check_numerics_on_output", False)  # also see debug_add_check_numerics_ops
     with reuse_name_scope(layer_class.cls_get_tf_scope_name(name)), self.register_network_scope():
       try:
@@ -659,6 +676,8 @@ class TFNetwork(object):
     if key == "seq_tag" and key not in self.extern_data.data:
       self.extern_data.data[key] = Data(
         name="seq_tag", shape=(), dtype="string", auto_create_placeholders=True)
+    if self.extern_data.chunking and key not in self.extern_data.feed_data:
+      self.extern_data.chunking.chunk_extern_data_key(key)
     return self.extern_data.get_data(key)
 
   def get_seq_tags(self, mark_data_key_as_used=True):
@@ -1119,6 +1138,43 @@ class TFNetwork(object):
     self._assigner_cache[var] = assigner
     return assigner
 
+  def assign_var_value(self, var, value, session):
+    """
+    Like ``get_var_assigner(var).assign(value, session)``,
+    but inside of :func:`batched_var_assigns`, the assign is delayed,
+    and all of them are done in a single ``session.run``.
+
+    :param tf.Variable var:
+    :param numpy.ndarray|int|float value:
+    :param tf.Session session:
+    """
+    root = self.get_root_network()
+    assigner = self.get_var_assigner(var)
+    if root._pending_var_assigns is not None:
+      root._pending_var_assigns.append((assigner, value))
+    else:
+      assigner.assign(value, session=session)
+
+  @contextlib.contextmanager
+  def batched_var_assigns(self, session):
+    """
+    All assigns via :func:`assign_var_value` inside this context are done together at the end,
+    in a single ``session.run``, which is much faster than one call per param for big networks.
+
+    :param tf.Session session:
+    """
+    root = self.get_root_network()
+    if root._pending_var_assigns is not None:  # already inside
+      yield
+      return
+    root._pending_var_assigns = []
+    try:
+      yield
+      assigns = root._pending_var_assigns
+    finally:
+      root._pending_var_assigns = None
+    VariableAssigner.assign_multiple(assigns, session=session)
+
   def get_param_values_dict(self, session):
     """
     :param tf.Session session:
@@ -1126,11 +1182,12 @@ class TFNetwork(object):
     :rtype: dict[str,dict[str,numpy.ndarray]]
     Note that this excludes auxiliary params.
     """
-    layers = {}  # type: typing.Dict[str,typing.Dict[str,numpy.ndarray]]
+    # Like LayerBase.get_param_values_dict, but a single session.run for all layers.
+    fetches = {}  # type: typing.Dict[str,typing.Dict[str,tf.Variable]]
     for layer_name, layer in self.layers.items():
       assert isinstance(layer, LayerBase)
-      layers[layer_name] = layer.get_param_values_dict(session)
-    return layers
+      fetches[layer_name] = layer.get_saveable_params_dict()
+    return session.run(fetches)
 
   def set_param_values_by_dict(self, values_dict, ignore_non_existing=False, **kwargs):
     """
@@ -1140,12 +1197,13 @@ class TFNetwork(object):
 
     Note that this excludes auxiliary params.
     """
-    for layer_name, layer_values_dict in values_dict.items():
-      if layer_values_dict:
-        if ignore_non_existing and layer_name not in self.layers:
-          print("Will not set layer %r because it does not exist." % (layer_name,), file=log.v3)
-          continue
-        self.layers[layer_name].set_param_values_by_dict(values_dict=layer_values_dict, **kwargs)
+    with self.batched_var_assigns(session=kwargs["session"]):
+      for layer_name, layer_values_dict in values_dict.items():
+        if layer_values_dict:
+          if ignore_non_existing and layer_name not in self.layers:
+            print("Will not set layer %r because it does not exist." % (layer_name,), file=log.v3)
+            continue
+          self.layers[layer_name].set_param_values_by_dict(values_dict=layer_values_dict, **kwargs)
 
   def get_auxiliary_params(self):
     """
@@ -1168,15 +1226,16 @@ class TFNetwork(object):
     :param tf.Session session:
     :param kwargs: passed to :func:`set_param_values_by_dict`
     """
-    self.set_param_values_by_dict(serialized.values_dict, session=session, **kwargs)
-    self.set_global_train_step(serialized.global_train_step, session=session)
+    with self.batched_var_assigns(session=session):
+      self.set_param_values_by_dict(serialized.values_dict, session=session, **kwargs)
+      self.set_global_train_step(serialized.global_train_step, session=session)
 
   def set_global_train_step(self, step, session):
     """
     :param int step:
     :param tf.Session session:
     """
-    self.get_var_assigner(self.global_train_step).assign(step, session=session)
+    self.assign_var_value(self.global_train_step, step, session=session)
 
   def get_global_train_step(self, session):
     """
@@ -1205,6 +1264,9 @@ class TFNetwork(object):
     Warning: Don't repeat that too often as it will always create new ops in the computation graph.
     """
     self.saver = None
+    if self._async_checkpoint_saver:
+      saver, self._async_checkpoint_saver = self._async_checkpoint_saver, None
+      saver.close()
 
   def _create_saver(self):
     # Saver for storing checkpoints of the model.
@@ -1241,6 +1303,24 @@ class TFNetwork(object):
           continue
         raise
 
+  def save_params_to_file_async(self, filename, session):
+    """
+    Like :func:`save_params_to_file`, but only takes a snapshot of the model parameters here,
+    and writes the file in the background.
+    See :class:`AsyncCheckpointSaver`.
+
+    :param str filename:
+    :param tf.Session session:
+    :return: the saver. call :func:`AsyncCheckpointSaver.wait` before you depend on the file
+    :rtype: AsyncCheckpointSaver
+    """
+    if not self.saver:
+      self._create_saver()
+    if not self._async_checkpoint_saver:
+      self._async_checkpoint_saver = AsyncCheckpointSaver(network=self)
+    self._async_checkpoint_saver.save(filename=filename, session=session)
+    return self._async_checkpoint_saver
+
   def load_params_from_file(self, filename, session):
     """
     Will load the model parameters from the filename.
@@ -2027,6 +2107,154 @@ def help_on_tf_exception(exception, feed_dict, meta_step_info, extern_data, file
     pprint(feed_dict, stream=file)
 
 
+class AsyncCheckpointSaver:
+  """
+  Saves the model parameters of a :class:`TFNetwork` in the same checkpoint format as :func:`TFNetwork.save_params_to_file`,
+  but the calling thread only takes a snapshot of all parameter values into host memory (a single ``session.run``).
+  The checkpoint is written by a background thread, via its own graph and session,
+  first to a temporary file prefix, which is then renamed (the ".index" file last),
+  such that a checkpoint is never seen partially written.
+
+  There is at most one pending save. :func:`wait` is the barrier,
+  which must be called before the checkpoint is used (e.g. loaded or deleted), and before exit.
+  :func:`close` must be called when the saver is not used anymore, to free its session.
+  """
+
+  def __init__(self, network):
+    """
+    :param TFNetwork network:
+    """
+    self.network = network
+    self._specs = []  # type: typing.List[typing.Tuple[str,tf.Tensor,str]]  # (name, tensor, slice_spec)
+    for param in network.get_saveable_params_list():
+      if isinstance(param, tf.Variable):
+        # noinspection PyProtectedMember
+        assert not param._save_slice_info, "%s: partitioned variables not supported: %s" % (self, param)
+        self._specs.append((param.op.name, param.value(), ""))
+      else:
+        assert isinstance(param, BaseSaverBuilder.SaveableObject)
+        for spec in param.specs:
+          self._specs.append((spec.name, spec.tensor, spec.slice_spec))
+    self._graph = tf.Graph()
+    with self._graph.as_default():
+      self._placeholders = []  # type: typing.List[tf.Tensor]
+      saveables = []
+      for i, (name, tensor, slice_spec) in enumerate(self._specs):
+        placeholder = tf.placeholder(
+          dtype=tensor.dtype.base_dtype, shape=tensor.get_shape(), name="param_%i" % i)
+        self._placeholders.append(placeholder)
+        saveables.append(_PlaceholderSaveable(placeholder=placeholder, slice_spec=slice_spec, name=name))
+      self._saver = tf.train.Saver(var_list=saveables, max_to_keep=2 ** 31 - 1)
+    self._session = tf.Session(graph=self._graph, config=tf.ConfigProto(device_count={"GPU": 0}))
+    self._thread = None  # type: typing.Optional["threading.Thread"]
+    self._exception = None  # type: typing.Optional[BaseException]
+
+  def __repr__(self):
+    return "<%s for %r>" % (self.__class__.__name__, self.network)
+
+  def save(self, filename, session):
+    """
+    Waits for the previous save, takes the snapshot, and starts writing in the background.
+
+    :param str filename:
+    :param tf.Session session: of the network
+    """
+    import os
+    import threading
+    self.wait()
+    filename = os.path.abspath(filename)  # TF needs absolute path
+    values = session.run([tensor for (_, tensor, _) in self._specs])
+    # The meta graph is about the network graph, thus we can only create it here, and not in the thread.
+    self.network.saver.export_meta_graph(filename + ".meta")
+    self._thread = threading.Thread(
+      target=self._save_thread_main, args=(filename, values), name="%s thread" % self.__class__.__name__)
+    self._thread.daemon = True
+    self._thread.start()
+
+  def wait(self):
+    """
+    Barrier. Waits until the pending save (if there is any) is written.
+    Raises an exception if the writing failed.
+    """
+    if self._thread:
+      self._thread.join()
+      self._thread = None
+    if self._exception:
+      exc, self._exception = self._exception, None
+      raise exc
+
+  def close(self):
+    """
+    Waits for the pending save (see :func:`wait`), and closes the session.
+    The saver cannot be used anymore after this.
+    """
+    try:
+      self.wait()
+    finally:
+      self._session.close()
+
+  def _save_thread_main(self, filename, values):
+    """
+    :param str filename:
+    :param list[numpy.ndarray] values:
+    """
+    import os
+    from glob import glob
+    # noinspection PyBroadException
+    try:
+      tmp_filename = filename + ".tmp-save"
+      feed_dict = {self._saver.saver_def.filename_tensor_name: tmp_filename}
+      feed_dict.update(zip(self._placeholders, values))
+      # Same try-again logic as in TFNetwork.save_params_to_file.
+      try_again_wait_time = 10
+      while True:
+        try:
+          self._session.run(self._saver.saver_def.save_tensor_name, feed_dict=feed_dict)
+          break
+        except IOError as e:
+          import errno
+          import time
+          if e.errno in [errno.EBUSY, errno.EDQUOT, errno.EIO, errno.ENOSPC]:
+            print("Exception while saving:", e, file=log.v3)
+            print("Trying again in %s secs." % try_again_wait_time, file=log.v3)
+            time.sleep(try_again_wait_time)
+            continue
+          raise
+      tmp_index_filename = tmp_filename + ".index"
+      assert os.path.exists(tmp_index_filename)
+      for fn in glob(tmp_filename + ".data*"):
+        os.rename(fn, filename + fn[len(tmp_filename):])
+      os.rename(tmp_index_filename, filename + ".index")  # last, because this is what we check for existence
+    except BaseException as exc:
+      print("%s: exception while saving %s: %r" % (self, filename, exc), file=log.v1)
+      self._exception = exc
+
+
+class _PlaceholderSaveable(BaseSaverBuilder.SaveableObject):
+  """
+  Saves the value fed into the placeholder. See :class:`AsyncCheckpointSaver`.
+  """
+
+  def __init__(self, placeholder, slice_spec, name):
+    """
+    :param tf.Tensor placeholder:
+    :param str slice_spec:
+    :param str name: name in the checkpoint
+    """
+    spec = BaseSaverBuilder.SaveSpec(tensor=placeholder, slice_spec=slice_spec, name=name)
+    super(_PlaceholderSaveable, self).__init__(op=placeholder, specs=[spec], name=name)
+
+  def restore(self, restored_tensors, restored_shapes):
+    """
+    Not supported. This is only used for saving.
+
+    :param list[tf.Tensor] restored_tensors:
+    :param list[tf.TensorShape]|None restored_shapes:
+    :rtype: tf.Operation
+    """
+    return tf.no_op()
+
+
 class CustomCheckpointLoader:
   """
   This uses `tf.train.NewCheckpointReader`.
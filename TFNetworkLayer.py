@@ -11,7 +11,7 @@ import contextlib
 import typing
 import TFUtil
 from Util import unicode, NotSpecified, CollectionReadCheckCovered
-from TFUtil import Data, OutputWithActivation, CustomUpdate, dimshuffle, swapaxes
+from TFUtil import Data, OutputWithActivation, CustomUpdate, InGraphReduction, dimshuffle, swapaxes
 from Log import log
 
 
@@ -830,7 +830,7 @@ class LayerBase(object):
           print(
             "Will not set param %r because its shape %s != %s." % (param, shape.as_list(), values.shape), file=log.v3)
           continue
-      self.network.get_var_assigner(param).assign(values, session=session)
+      self.network.assign_var_value(param, values, session=session)
 
   def get_param_values_dict(self, session):
     """
@@ -4442,16 +4442,24 @@ class TimeChunkingLayer(_ConcatInputLayer):
 
 class TimeUnChunkingLayer(_ConcatInputLayer):
   """
-  Performs chunking in time. See :func:`TFNativeOp.chunk`.
+  Performs unchunking in time. See :func:`TFNativeOp.unchunk`.
   """
   layer_class = "time_unchunking"
   recurrent = True
 
-  def __init__(self, chunking_layer, **kwargs):
+  def __init__(self, chunking_layer=None, **kwargs):
     """
-    :param TimeChunkingLayer chunking_layer:
+    :param TimeChunkingLayer|None chunking_layer: if not given, undoes the in-graph chunking of the extern data,
+      see ``chunking_in_graph`` and :class:`TFDataPipeline.InGraphChunking`
     """
     super(TimeUnChunkingLayer, self).__init__(**kwargs)
+    if chunking_layer is None:
+      chunking = self.network.get_root_network().extern_data.chunking
+      assert chunking, "%s: no chunking_layer given, and no in-graph chunking of the extern data" % self
+      out = chunking.unchunk(self.input_data)
+      self.output.placeholder = out.placeholder
+      self.output.size_placeholder = out.size_placeholder
+      return
     assert isinstance(chunking_layer, TimeChunkingLayer)
     chunk_size = chunking_layer.chunk_size
     chunk_step = chunking_layer.chunk_step
@@ -5922,7 +5930,9 @@ class AllophoneStateIdxParserLayer(LayerBase):
 class FramewiseStatisticsLayer(LayerBase):
   """
   Collects various statistics (such as FER, etc) on the sources.
-  The tensors will get stored in self.stats which will be collected by TFEngine.
+  The tensors of the current batch will get stored in self.stats which will be collected by TFEngine.
+  The stats over all batches are reduced in the graph via self.accumulators,
+  see :func:`get_accumulated_stats` and :func:`TFEngine.Engine.analyze`.
   """
   layer_class = "framewise_statistics"
 
@@ -5934,7 +5944,6 @@ class FramewiseStatisticsLayer(LayerBase):
     # We expect a framewise hard alignment, and calculate FER, CE, perplexity,
     # for all frames, frames without silence, and silence frames.
     from TFUtil import flatten_with_seq_len_mask
-    import numpy
     source = self.sources[0]
     output = source.output
     target = source._get_target_value()
@@ -5968,21 +5977,14 @@ class FramewiseStatisticsLayer(LayerBase):
     seq_len_sil = tf.reduce_sum(tf.cast(mask_sil, tf.int32))
     seq_len_no_sil = tf.reduce_sum(tf.cast(mask_no_sil, tf.int32))
 
-    with self.var_creation_scope():
-      accumulated_seq_len = tf.Variable(
-        initial_value=0, dtype=tf.int64, trainable=False, name="accumulated_seq_len")
-      accumulated_seq_len_sil = tf.Variable(
-        initial_value=0, dtype=tf.int64, trainable=False, name="accumulated_seq_len_sil")
-    accumulated_seq_len = tf.assign_add(accumulated_seq_len, tf.cast(seq_len, tf.int64))
-    accumulated_seq_len_sil = tf.assign_add(accumulated_seq_len_sil, tf.cast(seq_len_sil, tf.int64))
-    accumulated_seq_len_no_sil = accumulated_seq_len - accumulated_seq_len_sil
-
     self.stats["batch_seq_length"] = seq_len
     self.stats["batch_seq_length_sil"] = seq_len_sil
     self.stats["batch_seq_length_no_sil"] = seq_len_no_sil
-    self.stats["accumulated_seq_length"] = accumulated_seq_len
-    self.stats["accumulated_seq_length_sil"] = accumulated_seq_len_sil
-    self.stats["accumulated_seq_length_no_sil"] = accumulated_seq_len_no_sil
+
+    # The accumulated stats are reduced in the graph over all steps of a run, see Engine.analyze.
+    self.accumulators = [
+      InGraphReduction("%s:seq_length" % self.name, seq_len, reduce="sum", axis=None),
+      InGraphReduction("%s:seq_length_sil" % self.name, seq_len_sil, reduce="sum", axis=None)]
 
     for _k, _v in {
           "loss_ce": loss_ce,
@@ -5991,35 +5993,39 @@ class FramewiseStatisticsLayer(LayerBase):
       for _k2 in ["", "_sil", "_no_sil"]:
         k = _k + _k2
         v = _v
-        acc_seq_len = accumulated_seq_len
         if k.endswith("_no_sil"):
           v = tf.boolean_mask(v, mask_no_sil)
-          acc_seq_len = accumulated_seq_len_no_sil
         elif k.endswith("_sil"):
           v = tf.boolean_mask(v, mask_sil)
-          acc_seq_len = accumulated_seq_len_sil
         v_f32 = tf.cast(v, tf.float32)
         self.stats["batch_%s" % k] = tf.reduce_mean(v_f32, axis=0)
-        if v.dtype.is_floating:
-          acc_dtype = "float64"
-        else:
-          acc_dtype = "int64"
-        acc_shape = v.get_shape().as_list()[1:]
-        assert all(acc_shape)
-        with self.var_creation_scope():
-          acc_v = tf.Variable(
-            name="accumulated_%s" % k,
-            initial_value=numpy.zeros(acc_shape, dtype=acc_dtype), dtype=acc_dtype,
-            trainable=False)
-        acc_v = tf.assign_add(acc_v, tf.reduce_sum(tf.cast(v, acc_dtype), axis=0))
-        self.stats["accumulated_%s" % k] = tf.cast(acc_v, tf.float64) / tf.cast(acc_seq_len, tf.float64)
+        self.accumulators.append(InGraphReduction("%s:%s" % (self.name, k), v, reduce="sum", axis=0))
 
     self.stats["batch_loss_perplexity"] = tf.exp(self.stats["batch_loss_ce"])
     self.stats["batch_loss_perplexity_sil"] = tf.exp(self.stats["batch_loss_ce_sil"])
     self.stats["batch_loss_perplexity_no_sil"] = tf.exp(self.stats["batch_loss_ce_no_sil"])
-    self.stats["accumulated_loss_perplexity"] = tf.exp(self.stats["accumulated_loss_ce"])
-    self.stats["accumulated_loss_perplexity_sil"] = tf.exp(self.stats["accumulated_loss_ce_sil"])
-    self.stats["accumulated_loss_perplexity_no_sil"] = tf.exp(self.stats["accumulated_loss_ce_no_sil"])
+
+  def get_accumulated_stats(self, accumulated):
+    """
+    :param dict[str,numpy.ndarray] accumulated: :class:`TFEngine.Runner.accumulated`, via our `accumulators`
+    :return: stats over the whole run, e.g. "accumulated_loss_ce" (mean over all frames)
+    :rtype: dict[str,numpy.ndarray|int|float]
+    """
+    import numpy
+    seq_lens = {"": int(accumulated["%s:seq_length" % self.name])}
+    seq_lens["_sil"] = int(accumulated["%s:seq_length_sil" % self.name])
+    seq_lens["_no_sil"] = seq_lens[""] - seq_lens["_sil"]
+    stats = {}
+    for _k2, seq_len in seq_lens.items():
+      stats["accumulated_seq_length%s" % _k2] = seq_len
+    with numpy.errstate(divide="ignore", invalid="ignore"):  # e.g. no silence frames
+      for _k in ["loss_ce", "frame_error", "true_label_prob_histogram"]:
+        for _k2, seq_len in seq_lens.items():
+          k = _k + _k2
+          stats["accumulated_%s" % k] = accumulated["%s:%s" % (self.name, k)] / numpy.float64(seq_len)
+    for _k2 in seq_lens.keys():
+      stats["accumulated_loss_perplexity%s" % _k2] = numpy.exp(stats["accumulated_loss_ce%s" % _k2])
+    return stats
 
   @classmethod
   def get_out_data_from_opts(cls, **kwargs):
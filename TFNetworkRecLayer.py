@@ -921,6 +921,8 @@ class _SubnetworkRecCell(object):
       layers = []  # type: typing.List[_TemplateLayer]
       most_recent = None
       partially_finished = []  # type: typing.List[_TemplateLayer]
+      # Memoization of get_out_data_from_opts. See _get_template_out_data_cache_key.
+      out_data_cache = {}  # type: typing.Dict[tuple,typing.Tuple[typing.Dict[str],Data]]
 
     class GetLayer:
       """
@@ -967,7 +969,15 @@ class _SubnetworkRecCell(object):
         layer_.kwargs = layer_desc  # set it now already for better debugging
         if layer_ not in ConstructCtx.partially_finished:
           ConstructCtx.partially_finished.append(layer_)
-        output = layer_class.get_out_data_from_opts(**layer_desc)
+        # We construct the same layer multiple times (see get_layer_candidates and the reconstruct loop below),
+        # often with the same layer desc, so memoize the output template.
+        cache_key = self._get_template_out_data_cache_key(layer_class=layer_class, layer_desc=layer_desc)
+        if cache_key in ConstructCtx.out_data_cache:
+          output = ConstructCtx.out_data_cache[cache_key][1].copy()
+        else:
+          output = layer_class.get_out_data_from_opts(**layer_desc)
+          # Also keep layer_desc, such that all the objects which are referenced by id in the key stay alive.
+          ConstructCtx.out_data_cache[cache_key] = (layer_desc, output.copy())
         layer_.init(layer_class=layer_class, output=output, **layer_desc)
         if lself.returned_none_count == 0:
           ConstructCtx.partially_finished.remove(layer_)
@@ -1117,6 +1127,50 @@ class _SubnetworkRecCell(object):
       pprint(self.layer_data_templates)
       raise
 
+  @classmethod
+  def _get_template_out_data_cache_key(cls, layer_class, layer_desc):
+    """
+    In :func:`_construct_template`, we call ``layer_class.get_out_data_from_opts(**layer_desc)``
+    many times for the same layer, often with the same layer desc.
+    This returns a key for the memoization.
+    Layers and Data are covered by identity and their current output format,
+    everything else which is not a simple type only by identity.
+
+    :param type[LayerBase] layer_class:
+    :param dict[str] layer_desc: after transform_config_dict
+    :return: hashable key
+    :rtype: tuple
+    """
+    def _data_key(data):
+      """
+      :param Data data:
+      :rtype: tuple
+      """
+      return (
+        data.name, data.shape, data.dtype, data.sparse, data.dim,
+        data.batch_dim_axis, data.time_dim_axis, data.feature_dim_axis_or_unspecified,
+        data.available_for_inference, data.beam_size, id(data.vocab), id(data.placeholder),
+        tuple(sorted([(i, id(size)) for (i, size) in (data.size_placeholder or {}).items()])))
+
+    def _key(value):
+      """
+      :param value:
+      :rtype: object
+      """
+      if value is None or isinstance(value, (str, int, float, bool, type)):
+        return value
+      if isinstance(value, (list, tuple)):
+        return type(value), tuple([_key(v) for v in value])
+      if isinstance(value, dict):
+        return dict, tuple(sorted([(k, _key(v)) for (k, v) in value.items()], key=lambda item: repr(item[0])))
+      if isinstance(value, Data):
+        return Data, id(value), _data_key(value)
+      if isinstance(value, LayerBase):
+        return LayerBase, id(value), value.layer_class, _data_key(value.output), value.search_choices is not None
+      return object, id(value)
+
+    return layer_class, _key(layer_desc)
+
   def _construct(self, prev_outputs, prev_extra, i, data=None,
                  inputs_moved_out_tas=None, needed_outputs=("output",)):
     """
@@ -4746,12 +4800,17 @@ class KenLmStateLayer(_ConcatInputLayer):
   returns score (+log space, natural base e) of sequence,
   using KenLM (http://kheafield.com/code/kenlm/) (see :mod:`TFKenLM`).
   EOS (</s>) token must be used explicitly.
+
+  By default, the accumulated string is rescored in every step, which is quadratic in the output length.
+  With ``stateful=True``, we instead keep the KenLM state for every hypothesis
+  (reordered with the beam backpointers like any other rec state)
+  and advance it by one token per step. This gives exactly the same scores.
   """
   layer_class = "kenlm"
   recurrent = True
 
   def __init__(self, lm_file, vocab_file=None, vocab_unknown_label="UNK", bpe_merge_symbol=None,
-               input_step_offset=0, dense_output=False,
+               input_step_offset=0, dense_output=False, stateful=False,
                debug=False,
                **kwargs):
     """
@@ -4761,6 +4820,8 @@ class KenLmStateLayer(_ConcatInputLayer):
     :param str|None bpe_merge_symbol: e.g. "@@" if you want to apply BPE merging
     :param int input_step_offset: if provided, will consider the input only from this step onwards
     :param bool dense_output: whether we output the score for all possible succeeding tokens
+    :param bool stateful: advance the KenLM state per step instead of rescoring the accumulated string.
+      then "state" holds the serialized KenLM state instead of the string. see :func:`TFKenLM.ken_lm_advance_bpe_strings`
     :param bool debug: prints debug info
     """
     if callable(lm_file):
@@ -4803,26 +4864,47 @@ class KenLmStateLayer(_ConcatInputLayer):
       new_input = tf.where(
         tf.greater_equal(prev_step, input_step_offset),
         new_input, tf.zeros_like(new_input))
-    # See :class:`CumsumLayer` for comparison.
-    prev_strings = self._rec_previous_layer.rec_vars_outputs["state"]
-    next_strings = prev_strings + new_input
-    self.rec_vars_outputs["state"] = next_strings
     prev_scores = self._rec_previous_layer.rec_vars_outputs["scores"]
+    if stateful:
+      prev_states = self._rec_previous_layer.rec_vars_outputs["state"]
+      next_strings = new_input  # for debugging
+      if dense_output:
+        assert self.tf_vocab, "%s: provide vocab_file" % self
+        next_states, new_abs_scores, new_abs_scores_dense = TFKenLM.ken_lm_advance_bpe_strings_dense(
+          handle=self.lm_handle,
+          bpe_merge_symbol=bpe_merge_symbol or "",
+          states=prev_states,
+          strings=new_input,
+          labels=self.tf_vocab)
+      else:
+        next_states, new_abs_scores = TFKenLM.ken_lm_advance_bpe_strings(
+          handle=self.lm_handle,
+          bpe_merge_symbol=bpe_merge_symbol or "",
+          states=prev_states,
+          strings=new_input)
+      self.rec_vars_outputs["state"] = next_states
+    else:
+      # See :class:`CumsumLayer` for comparison.
+      prev_strings = self._rec_previous_layer.rec_vars_outputs["state"]
+      next_strings = prev_strings + new_input
+      self.rec_vars_outputs["state"] = next_strings
+      if dense_output:
+        assert self.tf_vocab, "%s: provide vocab_file" % self
+        new_abs_scores, new_abs_scores_dense = TFKenLM.ken_lm_abs_score_bpe_strings_dense(
+          handle=self.lm_handle,
+          bpe_merge_symbol=bpe_merge_symbol or "",
+          strings=next_strings,
+          labels=self.tf_vocab)
+      else:
+        new_abs_scores = TFKenLM.ken_lm_abs_score_bpe_strings(
+          handle=self.lm_handle,
+          bpe_merge_symbol=bpe_merge_symbol or "",
+          strings=next_strings)
     if dense_output:
-      assert self.tf_vocab, "%s: provide vocab_file" % self
-      new_abs_scores, new_abs_scores_dense = TFKenLM.ken_lm_abs_score_bpe_strings_dense(
-        handle=self.lm_handle,
-        bpe_merge_symbol=bpe_merge_symbol or "",
-        strings=next_strings,
-        labels=self.tf_vocab)
       new_abs_scores_bc = expand_multiple_dims(
         new_abs_scores, [i + new_abs_scores.get_shape().ndims for i in range(self.tf_vocab.get_shape().ndims)])
       new_rel_scores = new_abs_scores_dense - new_abs_scores_bc
     else:
-      new_abs_scores = TFKenLM.ken_lm_abs_score_bpe_strings(
-        handle=self.lm_handle,
-        bpe_merge_symbol=bpe_merge_symbol or "",
-        strings=next_strings)
       new_rel_scores = new_abs_scores - prev_scores
     if debug:
       # Print some info. Only for the first 3 steps because it will spam a lot.
@@ -372,6 +372,8 @@ class WrapOptimizer:
     self.use_locking = use_locking
     from collections import OrderedDict
     self.optimizers = OrderedDict()  # optimizer_opts|None -> tf.train.Optimizer
+    # In creation order. See _local_data_parallel_average_grads.
+    self._local_data_parallel_reductions = []  # type: typing.List[tf.Tensor]
 
   def get_default_optimizer(self):
     """
@@ -822,6 +824,40 @@ class WrapOptimizer:
       "opt_key": opt_key, "accum_grad_multiple_num_steps": accum_grad_multiple_num_steps}
     return grad, apply_grad_opts
 
+  def _local_data_parallel_average_grads(self, grads_and_vars):
+    """
+    Averages the gradients over all the workers, via :func:`LocalDataParallel.LocalDataParallel.allreduce`.
+    All the gradients are concatenated, such that we need only a single reduction per call.
+    This might be called multiple times (e.g. again for the meta losses), and these reductions can run
+    in the same ``session.run``. Each gets its own shared buffer, and depends on the reduction of the previous call,
+    such that all the workers do the reductions in the same order.
+
+    :param list[(tf.Tensor|tf.IndexedSlices|None,tf.Variable)] grads_and_vars:
+    :rtype: list[(tf.Tensor|None,tf.Variable)]
+    """
+    import LocalDataParallel
+    local_data_parallel = LocalDataParallel.get_instance()
+    grads_and_vars = [
+      (tf.convert_to_tensor(grad) if grad is not None else None, var) for (grad, var) in grads_and_vars]
+    grads = [grad for (grad, _) in grads_and_vars if grad is not None]
+    if not grads:
+      return grads_and_vars
+    with tf.name_scope("local_data_parallel_average_grads"):
+      flat = tf.concat([tf.reshape(tf.cast(grad, tf.float32), [-1]) for grad in grads], axis=0)
+      buffer_name = "grads%i" % len(self._local_data_parallel_reductions)
+      with tf.control_dependencies(self._local_data_parallel_reductions[-1:]):
+        flat_avg = tf.py_func(
+          lambda x: local_data_parallel.allreduce(buffer_name, x, average=True), [flat], tf.float32,
+          stateful=True, name="allreduce")
+      flat_avg.set_shape(flat.get_shape())
+      self._local_data_parallel_reductions.append(flat_avg)
+      sizes = [tf.size(grad) for grad in grads]
+      avg_grads = [
+        tf.cast(tf.reshape(part, tf.shape(grad)), grad.dtype)
+        for (part, grad) in zip(tf.split(flat_avg, tf.stack(sizes), num=len(grads), axis=0), grads)]
+    avg_grads_iter = iter(avg_grads)
+    return [(next(avg_grads_iter) if grad is not None else None, var) for (grad, var) in grads_and_vars]
+
   def get_apply_grads_op(self, loss, var_list):
     """
     :param tf.Tensor loss:
@@ -841,6 +877,10 @@ class WrapOptimizer:
       grads_and_vars = [
         (hvd.allreduce(grad, average=self.config.is_true("horovod_avg_grad")) if grad is not None else None, var)
         for (grad, var) in grads_and_vars]
+    import LocalDataParallel
+    if (LocalDataParallel.get_instance() and
+            self.config.value("local_data_parallel_reduce_type", "grad") == "grad"):
+      grads_and_vars = self._local_data_parallel_average_grads(grads_and_vars)
 
     var_grads = {var: grad for (grad, var) in grads_and_vars if grad is not None}
     if not var_grads:
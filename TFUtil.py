@@ -234,6 +234,13 @@ class Data(object):
 
   size_dtype = "int32"
 
+  # Using __slots__ makes the instances smaller and the attrib access faster,
+  # and allows for the cheap copy in :func:`_copy_attribs`.
+  # This matters for the network construction, where we create lots of copies.
+  __slots__ = (
+    "name", "sparse", "dtype", "batch_dim_axis", "shape", "_feature_dim_axis", "time_dim_axis", "dim",
+    "placeholder", "size_placeholder", "available_for_inference", "beam_size", "vocab")
+
   def __init__(self, name,
                shape=None, dtype=None,
                placeholder=None,
@@ -490,16 +497,36 @@ class Data(object):
   def __hash__(self):
     return id(self)
 
+  def _copy_attribs(self, with_placeholder):
+    """
+    This is equivalent to ``Data(**self.get_kwargs())`` (+ the placeholders if requested),
+    but it does not go through :func:`__init__`, which is much faster.
+
+    :param bool with_placeholder: whether to copy the placeholder and size_placeholder
+    :rtype: Data
+    """
+    data = object.__new__(Data)
+    for key in Data.__slots__:
+      setattr(data, key, getattr(self, key))
+    if with_placeholder and self.size_placeholder is not None:
+      data.size_placeholder = self.size_placeholder.copy()
+    else:
+      if not with_placeholder:
+        data.placeholder = None
+      # Like in __init__.
+      if self.ndim_dense <= 1 or all([d is not None for d in self.shape]):
+        data.size_placeholder = {}
+      else:
+        data.size_placeholder = None
+    return data
+
   def copy(self, name=None):
     """
     :param str name: if given, will overwrite this name
     :return: copy of myself, using self.get_kwargs(), and with placeholder and size_placeholder
     :rtype: Data
     """
-    data = Data(**self.get_kwargs())
-    data.placeholder = self.placeholder
-    if self.size_placeholder is not None:
-      data.size_placeholder = self.size_placeholder.copy()
+    data = self._copy_attribs(with_placeholder=True)
     if name:
       data.name = name
     return data
@@ -944,10 +971,10 @@ class Data(object):
     :return: copy of myself, using self.get_kwargs(), without placeholder
     :rtype: Data
     """
-    kwargs = self.get_kwargs()
+    data = self._copy_attribs(with_placeholder=False)
     if name:
-      kwargs["name"] = name
-    return Data(**kwargs)
+      data.name = name
+    return data
 
   def copy_template_excluding_spatial_dim(self, spatial_axis_num, name=None):
     """
@@ -2252,6 +2279,22 @@ def default_control_flow_ctx():
     yield dep
 
 
+def set_global_default_graph(graph):
+  """
+  Like :func:`tf.reset_default_graph`, which replaces the global default graph by a new graph,
+  but this sets the given (existing) graph as the global default graph.
+  Unlike ``graph.as_default()``, this is not bound to a context.
+
+  :param tf.Graph graph:
+  """
+  from tensorflow.python.framework import ops
+  # noinspection PyProtectedMember
+  default_graph_stack = ops._default_graph_stack
+  assert not default_graph_stack.stack, "must not be used inside of a graph.as_default() context"
+  # noinspection PyProtectedMember
+  default_graph_stack._global_default_graph = graph
+
+
 class FlipGradientBuilder(object):
   """
   Gradient Reversal Layer.
@@ -3811,6 +3854,91 @@ class VariableAssigner(object):
     """
     session.run(self.assign_op, feed_dict={self.assign_op.inputs[1]: value})
 
+  @staticmethod
+  def assign_multiple(assigns, session):
+    """
+    Like :func:`assign`, but for multiple vars in a single ``session.run``.
+
+    :param list[(VariableAssigner,numpy.ndarray|int|float|list[str])] assigns:
+    :param tf.Session session:
+    """
+    if not assigns:
+      return
+    session.run(
+      [assigner.assign_op for (assigner, _) in assigns],
+      feed_dict={assigner.assign_op.inputs[1]: value for (assigner, value) in assigns})
+
+
+class InGraphReduction(object):
+  """
+  Reduces some tensor over all the steps of a :class:`TFEngine.Runner` (e.g. a whole epoch) inside the graph.
+  The reduced value is kept in a local variable, which is updated in every step,
+  and it needs to be fetched only once at the end.
+  See the `accumulators` option of :class:`TFEngine.Runner`.
+  The ops are created here once, so the same instance can be used for multiple runs.
+  """
+
+  Reductions = ("sum", "count", "min", "max", "histogram")
+
+  def __init__(self, name, value, reduce="sum", axis=0, num_bins=None, value_range=None):
+    """
+    :param str name: used for the variable name, and as the key in :class:`TFEngine.Runner.accumulated`
+    :param tf.Tensor value: value of the current step
+    :param str reduce: "sum", "count", "min", "max" or "histogram".
+      "count" counts the number of reduced entries (e.g. the number of frames), and results in a scalar.
+      "histogram" counts the number of entries per bin over all axes, and results in shape (num_bins,).
+    :param int|list[int]|None axis: axis or axes to reduce in every step. None means all axes.
+      The remaining axes must have a static shape. Not used for "histogram".
+    :param int|None num_bins: for "histogram"
+    :param (float,float)|None value_range: for "histogram". values outside of the range go into the first/last bin
+    """
+    assert reduce in self.Reductions, "%s: invalid reduce %r" % (self.__class__.__name__, reduce)
+    self.name = name
+    self.reduce = reduce
+    with tf.name_scope("in_graph_reduction_%s" % get_valid_scope_name_from_str(name)):
+      value = tf.convert_to_tensor(value)
+      if reduce == "histogram":
+        assert num_bins and value_range, "%s: histogram needs num_bins and value_range" % self
+        step_value = tf.histogram_fixed_width(
+          tf.cast(value, tf.float64), value_range=[float(value_range[0]), float(value_range[1])],
+          nbins=num_bins, dtype=tf.int64)
+      elif reduce == "count":
+        if axis is None:
+          step_value = tf.size(value, out_type=tf.int64)
+        else:
+          axes = [axis] if isinstance(axis, int) else list(axis)
+          axes = [(a + value.get_shape().ndims) if a < 0 else a for a in axes]
+          step_value = tf.reduce_prod(tf.gather(tf.shape(value, out_type=tf.int64), tf.constant(axes, dtype=tf.int32)))
+      else:
+        dtype = tf.float64 if value.dtype.is_floating else tf.int64
+        reduce_func = {"sum": tf.reduce_sum, "min": tf.reduce_min, "max": tf.reduce_max}[reduce]
+        step_value = reduce_func(tf.cast(value, dtype), axis=axis)
+      shape = step_value.get_shape()
+      assert shape.is_fully_defined(), "%s: shape %s after reduction is not static" % (self, shape)
+      dtype = step_value.dtype
+      if reduce == "min":
+        neutral = float("inf") if dtype.is_floating else dtype.max
+      elif reduce == "max":
+        neutral = float("-inf") if dtype.is_floating else dtype.min
+      else:
+        neutral = 0
+      self.initial_value = tf.fill(shape.as_list(), tf.constant(neutral, dtype=dtype))
+      self.var = tf.Variable(
+        initial_value=self.initial_value, trainable=False,
+        collections=[tf.GraphKeys.LOCAL_VARIABLES], name="accumulated")
+      if reduce == "min":
+        update = tf.assign(self.var, tf.minimum(self.var, step_value))
+      elif reduce == "max":
+        update = tf.assign(self.var, tf.maximum(self.var, step_value))
+      else:
+        update = tf.assign_add(self.var, step_value)
+      self.update_op = update.op
+      self.reset_op = tf.assign(self.var, self.initial_value).op
+      self.value = self.var.read_value()
+
+  def __repr__(self):
+    return "<%s %r %s>" % (self.__class__.__name__, self.name, self.reduce)
+
 
 class CudaEnv(object):
   """
@@ -474,6 +474,144 @@ class SharedNumpyArray:
     return "<%s is_server=%r state=%r>" % (self.__class__.__name__, self.is_server, self.__getstate__())
 
 
+class SharedNumpyBuffer(object):
+  """
+  A persistent region in shared memory (a :class:`SharedNumpyArray`) which holds multiple Numpy arrays,
+  and which stays mapped by two processes: the writer, which creates it, and the reader.
+  In contrast to the automatic pickling of Numpy arrays via shared memory (:func:`use_shared_mem_for_numpy_array`),
+  the same memory is reused for all further transfers, and only a small message (:func:`get_message`,
+  the layout of the arrays) must be sent over the pipe.
+  The handle of the shared memory is only part of the message when the region was (re)allocated.
+
+  The writer calls :func:`alloc`, writes the data into the returned arrays, and sends :func:`get_message`.
+  The reader calls :func:`read` with that message, copies the data, and calls :func:`read_done`.
+  The next :func:`alloc` of the writer waits until the reader is done with the previous message.
+  """
+
+  HeaderBytes = 64  # the first uint64 is the id of the last message which was read
+  Alignment = 64
+
+  def __init__(self, name, check_alive=None):
+    """
+    :param str name: the reader can use this to identify the buffer
+    :param (()->bool)|None check_alive: for the writer, whether the reader is still alive
+    """
+    self.name = name
+    self.check_alive = check_alive
+    self.shared = None  # type: SharedNumpyArray|None
+    self._raw = None  # type: numpy.ndarray|None  # uint8, the whole region
+    self._header = None  # type: numpy.ndarray|None  # uint64
+    self._handle_sent = False
+    self._layout = None  # type: list[(str,int,tuple[int],str)]|None  # name, offset, shape, dtype
+    self._msg_id = 0  # writer: last sent message. reader: last received message
+
+  def __repr__(self):
+    return "<%s %r shared=%r>" % (self.__class__.__name__, self.name, self.shared)
+
+  def _set_shared(self, shared):
+    """
+    :param SharedNumpyArray shared:
+    """
+    self.shared = shared
+    self._raw = shared.create_numpy_array()
+    self._header = self._raw[:self.HeaderBytes].view(numpy.uint64)
+
+  def _realloc(self, size):
+    """
+    :param int size: in bytes, including the header
+    """
+    extra = SharedNumpyArray.ExtraSpaceBytes
+    mem_size = max(next_power_of_two(size + extra), SharedMemNumpyConfig["min_shared_mem_size"])
+    shared = SharedNumpyArray(shape=(mem_size - extra,), strides=None, typestr="|u1")
+    with SharedNumpyArray.ServerLock:
+      # This is persistently in use, thus it should not count as an instance of the pool of numpy_alloc().
+      SharedNumpyArray.ServerInstances.discard(shared)
+    # The old region will be freed once the arrays from it are not referenced anymore.
+    self._set_shared(shared)
+    self._header[0] = self._msg_id
+    self._handle_sent = False
+
+  def _wait_read_done(self):
+    if self.shared is None:
+      return
+    while self._header[0] < self._msg_id:
+      if self.check_alive and not self.check_alive():
+        raise ProcConnectionDied("%r: reader died" % self)
+      time.sleep(0.0001)
+
+  def _get_arrays(self):
+    """
+    :return: name -> array in the shared memory, by the current layout
+    :rtype: dict[str,numpy.ndarray]
+    """
+    arrays = {}
+    for name, offset, shape, dtype in self._layout:
+      dtype = numpy.dtype(dtype)
+      num_bytes = int(numpy.prod(shape)) * dtype.itemsize
+      arrays[name] = self._raw[offset:offset + num_bytes].view(dtype).reshape(shape)
+    return arrays
+
+  def alloc(self, specs):
+    """
+    Called by the writer. Waits until the reader is done with the previous message.
+
+    :param list[(str,tuple[int]|list[int],str|numpy.dtype)] specs: name, shape, dtype
+    :return: name -> array in the shared memory. write the data into these, and then send :func:`get_message`
+    :rtype: dict[str,numpy.ndarray]
+    :raises SharedMem.ShmException: if we cannot allocate the shared memory
+    """
+    self._wait_read_done()
+    layout = []
+    offset = self.HeaderBytes
+    for name, shape, dtype in specs:
+      dtype = numpy.dtype(dtype)
+      shape = tuple([int(d) for d in shape])
+      offset = -(-offset // self.Alignment) * self.Alignment  # ceil to alignment
+      layout.append((name, offset, shape, dtype.str))
+      offset += int(numpy.prod(shape)) * dtype.itemsize
+    if self.shared is None or offset > self._raw.nbytes:
+      self._realloc(offset)
+    self._layout = layout
+    return self._get_arrays()
+
+  def get_message(self):
+    """
+    Called by the writer, after the data was written to the arrays from :func:`alloc`.
+
+    :return: small picklable object, to be sent to the reader (:func:`read`)
+    :rtype: dict[str]
+    """
+    assert self._layout is not None, "%r: alloc() first" % self
+    self._msg_id += 1
+    msg = {"name": self.name, "id": self._msg_id, "layout": self._layout, "shared": None}
+    if not self._handle_sent:
+      msg["shared"] = self.shared
+      self._handle_sent = True
+    return msg
+
+  def read(self, msg):
+    """
+    Called by the reader.
+
+    :param dict[str] msg: from :func:`get_message`
+    :return: name -> array in the shared memory, only valid until :func:`read_done`. copy the data
+    :rtype: dict[str,numpy.ndarray]
+    """
+    assert msg["name"] == self.name
+    if msg["shared"] is not None:
+      self._set_shared(msg["shared"])
+    assert self.shared is not None, "%r: did not get the shared memory handle" % self
+    self._layout = msg["layout"]
+    self._msg_id = msg["id"]
+    return self._get_arrays()
+
+  def read_done(self):
+    """
+    Called by the reader, after the data from :func:`read` was copied. The writer can reuse the memory now.
+    """
+    self._header[0] = self._msg_id
+
+
 def attrChain(base, *attribs, **kwargs):
   default = kwargs.get("default", None)
   obj = base
@@ -490,7 +628,6 @@ def funcCall(attrChainArgs, args=()):
   return f(*args)
 
 
-Unpickler = pickle.Unpickler
 if PY3:
   def get_func_closure(f): return f.__closure__
   # (code, globals[, name[, argdefs[, closure]]])
@@ -595,7 +732,9 @@ def getNormalDict(d):
   return r
 
 def make_numpy_ndarray_fromstring(s, dtype, shape):
-  return numpy.fromstring(s, dtype=dtype).reshape(shape)
+  # frombuffer() instead of fromstring(), which does not support binary data anymore in newer Numpy versions.
+  # Copy such that we own the data and it is writeable, like fromstring() does.
+  return numpy.frombuffer(s, dtype=dtype).reshape(shape).copy()
 
 
 SharedMemNumpyConfig = {
@@ -678,9 +817,24 @@ class Pickler(_BasePickler):
   """
   We extend the standard Pickler to be able to pickle some more types,
   such as lambdas and functions, code, func cells, buffer and more.
+
+  Numpy arrays can be pickled out-of-band, similar as with pickle protocol 5 (PEP 574),
+  which we cannot use directly because we also support Python 2:
+  With ``buffer_callback``, the raw data of the arrays is not written into the stream,
+  but passed to the callback, and the stream only contains a reference (a persistent id).
+  The arrays are expected in the same order by :class:`Unpickler` via ``buffers``.
+  This avoids multiple copies of the data, and the raw data can be sent as-is,
+  e.g. via :func:`ExecingProcess_ConnectionWrapper.send`.
   """
 
   def __init__(self, *args, **kwargs):
+    """
+    :param file:
+    :param int protocol:
+    :param ((numpy.ndarray)->None)|None buffer_callback: called with the data (flat uint8 array)
+      of Numpy arrays, which are then pickled out-of-band
+    """
+    self.buffer_callback = kwargs.pop("buffer_callback", None)
     if not "protocol" in kwargs:
       kwargs["protocol"] = pickle.HIGHEST_PROTOCOL
     _BasePickler.__init__(self, *args, **kwargs)
@@ -783,9 +937,16 @@ class Pickler(_BasePickler):
         self.save(())
         self.write(pickle.REDUCE)
         return
+    if obj.dtype.hasobject:  # the raw data would be pointers. use the default Numpy reduce, which handles this
+      self.save_reduce(obj=obj, *obj.__reduce__())
+      return
+    if self.buffer_callback is not None and obj.dtype.fields is None:
+      self.buffer_callback(numpy.ascontiguousarray(obj).reshape((-1,)).view(numpy.uint8))
+      self.save_pers(("ndarray", obj.dtype.str, obj.shape))
+      return
     # For some reason, Numpy fromstring/tostring is faster than Numpy loads/dumps.
     self.save(make_numpy_ndarray_fromstring)
-    self.save((obj.tostring(), str(obj.dtype), obj.shape))
+    self.save((obj.tobytes(), str(obj.dtype), obj.shape))
     self.write(pickle.REDUCE)
   dispatch[numpy.ndarray] = save_ndarray
 
@@ -872,6 +1033,39 @@ class Pickler(_BasePickler):
   def __setstate__(self, state): pass
 
 
+class Unpickler(pickle.Unpickler):
+  """
+  Unpickler for streams from :class:`Pickler`.
+  """
+
+  def __init__(self, *args, **kwargs):
+    """
+    :param file:
+    :param typing.Iterable[bytes|bytearray|numpy.ndarray]|None buffers: the data of the out-of-band Numpy arrays,
+      in the same order as the ``buffer_callback`` of :class:`Pickler` got them.
+      We only consume them when needed, so this can read the data lazily.
+    """
+    buffers = kwargs.pop("buffers", None)
+    pickle.Unpickler.__init__(self, *args, **kwargs)
+    self.buffers = iter(buffers) if buffers is not None else None
+
+  def persistent_load(self, pid):
+    """
+    :param tuple pid: via :func:`Pickler.save_ndarray`
+    :rtype: numpy.ndarray
+    """
+    if PY3:  # with encoding="bytes" (e.g. Python 2 stream loaded in Python 3), we get bytes here
+      pid = tuple([x.decode("utf8") if isinstance(x, bytes) else x for x in pid])
+    if pid[0] != "ndarray":
+      raise pickle.UnpicklingError("unsupported persistent id %r" % (pid,))
+    assert self.buffers is not None, "stream contains out-of-band Numpy arrays, Unpickler needs buffers"
+    _, dtype, shape = pid
+    array = numpy.frombuffer(next(self.buffers), dtype=dtype).reshape(shape)
+    if not array.flags.writeable:  # e.g. from bytes
+      array = array.copy()
+    return array
+
+
 class ExecingProcess:
   """
   This is a replacement for multiprocessing.Process which always
@@ -1035,6 +1229,10 @@ class ExecingProcess_ConnectionWrapper(object):
   """
   Wrapper around multiprocessing.connection.Connection.
   This is needed to use our own Pickler.
+
+  A value is sent as multiple messages: first the number of out-of-band Numpy buffers and the pickled stream,
+  then each buffer. We lock while sending (and receiving) them, such that the messages of multiple threads
+  do not interleave.
   """
 
   def __init__(self, fd=None, conn=None):
@@ -1045,6 +1243,8 @@ class ExecingProcess_ConnectionWrapper(object):
       self.conn = conn
     else:
       self.conn = None
+    self._send_lock = Lock()
+    self._recv_lock = Lock()
 
   def __repr__(self):
     if self.conn is not None:
@@ -1101,8 +1301,13 @@ class ExecingProcess_ConnectionWrapper(object):
     self._check_closed()
     self._check_writable()
     buf = BytesIO()
-    Pickler(buf).dump(value)
-    self.send_bytes(buf.getvalue())
+    buffers = []
+    Pickler(buf, buffer_callback=buffers.append).dump(value)
+    # The data of Numpy arrays comes after the pickled stream, each as a separate message. See recv().
+    with self._send_lock:
+      self.send_bytes(struct.pack("<i", len(buffers)) + buf.getvalue())
+      for array_buf in buffers:
+        self.send_bytes(array_buf)
 
   def recv_bytes(self):
     while True:
@@ -1120,9 +1325,13 @@ class ExecingProcess_ConnectionWrapper(object):
   def recv(self):
     self._check_closed()
     self._check_readable()
-    buf = self.recv_bytes()
-    f = BytesIO(buf)
-    res = Unpickler(f).load()
+    with self._recv_lock:
+      buf = self.recv_bytes()
+      num_buffers, = struct.unpack("<i", buf[:4])
+      # Read all the messages of this value before unpickling, such that we are not out of sync if that fails.
+      buffers = [self.recv_bytes() for _ in range(num_buffers)]
+    f = BytesIO(buf[4:])
+    res = Unpickler(f, buffers=buffers).load()
     return res
 
 
@@ -9,7 +9,6 @@ from __future__ import division
 import subprocess
 from subprocess import CalledProcessError
 
-import h5py
 from collections import deque
 import inspect
 import os
@@ -277,13 +276,24 @@ def git_commit_date(commit="HEAD", gitdir="."):
 
 def git_describe_head_version(gitdir="."):
   """
+  This is used at startup (:func:`describe_returnn_version`), thus we want it to be fast.
+  We run the git calls in parallel, and get the commit date and rev via a single call.
+  Otherwise this is like ``git_commit_date()``, ``git_commit_rev()``, ``git_is_dirty()``.
+
   :param str gitdir:
   :rtype: str
   """
-  cdate = git_commit_date(gitdir=gitdir)
-  rev = git_commit_rev(gitdir=gitdir)
-  is_dirty = git_is_dirty(gitdir=gitdir)
-  return "%s--git-%s%s" % (cdate, rev, "-dirty" if is_dirty else "")
+  from subprocess import Popen, PIPE
+  dirty_proc = Popen(
+    ["git", "diff", "--no-ext-diff", "--quiet", "--exit-code"], cwd=gitdir, stdin=PIPE, stdout=PIPE, stderr=PIPE)
+  out = sysexec_out("git", "show", "-s", "--format=%ci %h", "HEAD", cwd=gitdir).strip()
+  dirty_proc.communicate()
+  if dirty_proc.returncode not in (0, 1):
+    raise CalledProcessError(dirty_proc.returncode, "git diff")
+  # E.g. "2019-07-11 15:37:52 +0200 ab2a1da".
+  cdate, ctime, _, rev = out.split()
+  cdate = "%s.%s" % (cdate.replace("-", ""), ctime.replace(":", ""))
+  return "%s--git-%s%s" % (cdate, rev, "-dirty" if dirty_proc.returncode == 1 else "")
 
 
 _returnn_version_info = None
@@ -423,6 +433,7 @@ def hdf5_dimension(filename, dimension):
   :param str dimension:
   :rtype: numpy.ndarray|int
   """
+  import h5py
   fin = h5py.File(filename, "r")
   if '/' in dimension:
     res = fin['/'.join(dimension.split('/')[:-1])].attrs[dimension.split('/')[-1]]
@@ -438,6 +449,7 @@ def hdf5_group(filename, dimension):
   :param str dimension:
   :rtype: dict[str]
   """
+  import h5py
   fin = h5py.File(filename, "r")
   res = {k: fin[dimension].attrs[k] for k in fin[dimension].attrs}
   fin.close()
@@ -450,6 +462,7 @@ def hdf5_shape(filename, dimension):
   :param dimension:
   :rtype: tuple[int]
   """
+  import h5py
   fin = h5py.File(filename, "r")
   res = fin[dimension].shape
   fin.close()
@@ -468,6 +481,7 @@ def hdf5_strings(handle, name, data):
     dset = handle.create_dataset(name, (len(data),), dtype="S" + str(s))
     dset[...] = data
   except Exception:
+    import h5py
     # noinspection PyUnresolvedReferences
     dt = h5py.special_dtype(vlen=unicode)
     del handle[name]
@@ -1042,7 +1056,7 @@ def init_thread_join_hack():
       # them for delayed handling to the main thread which hangs.
       # See CPython signalmodule.c.
       # Currently the best solution I can think of:
-      while thread_obj.isAlive():
+      while thread_obj.is_alive():
         join_orig(thread_obj, timeout=0.1)
     elif thread.get_ident() == main_thread_id and timeout > 0.1:
       # Limit the timeout. This should not matter for the underlying code.
@@ -1264,6 +1278,39 @@ def uniq(seq):
   return seq[idx]
 
 
+def edit_distance_batch(a, a_seq_lens, b, b_seq_lens):
+  """
+  Levenshtein distance for a batch of sequence pairs, i.e. like :func:`tf.edit_distance` with normalize=False,
+  or :class:`NativeOp.EditDistanceOp`, but in pure NumPy.
+  The DP is vectorized over the batch and over the positions of b,
+  where the insertions are covered by a cumulative minimum, i.e. we only loop over the positions of a.
+  Sort the seqs by length before, to avoid unnecessary computation on the padding.
+
+  :param np.ndarray a: (batch,max_len_a), int, padded
+  :param np.ndarray a_seq_lens: (batch,), int
+  :param np.ndarray b: (batch,max_len_b), int, padded
+  :param np.ndarray b_seq_lens: (batch,), int
+  :return: (batch,), int64, num of substitutions + deletions + insertions to get from a to b
+  :rtype: np.ndarray
+  """
+  n_batch, max_len_a = a.shape
+  max_len_b = b.shape[1]
+  assert b.shape[0] == a_seq_lens.shape[0] == b_seq_lens.shape[0] == n_batch
+  b_range = np.arange(max_len_b + 1, dtype="int64")
+  row = np.tile(b_range[None, :], (n_batch, 1))  # (batch,max_len_b+1), distance of a[:i] to b[:j], here for i=0
+  res = row[np.arange(n_batch), b_seq_lens]  # (batch,), for a_seq_lens == 0
+  for i in range(max_len_a):
+    new_row = np.empty_like(row)
+    new_row[:, 0] = i + 1
+    # Deletion, or substitution/match.
+    new_row[:, 1:] = np.minimum(row[:, 1:] + 1, row[:, :-1] + (a[:, i:i + 1] != b))
+    # Insertion: new_row[j] = min_{k <= j} (new_row[k] + j - k).
+    row = b_range[None, :] + np.minimum.accumulate(new_row - b_range[None, :], axis=1)
+    mask = a_seq_lens == i + 1
+    res[mask] = row[mask, b_seq_lens[mask]]
+  return res
+
+
 def slice_pad_zeros(x, begin, end, axis=0):
   """
   :param numpy.ndarray x: of shape (..., time, ...)
@@ -2990,7 +3037,12 @@ class NativeCodeCompiler(object):
   """
 
   CacheDirName = "returnn_native"
+  # If set, used instead of get_temp_dir(). This can e.g. be a shared dir for many jobs. See get_cache_base_dir().
+  CacheBaseDir = None  # type: None|str
   CollectedCompilers = None  # type: None|typing.List[NativeCodeCompiler]
+  # Shared over all (derived) compilers in this process. See get_stats_str().
+  Stats = {"cache_hits": 0, "compiles": 0, "compile_time": 0.0}
+  _stats_lock = threading.Lock()
 
   def __init__(self, base_name, code_version, code,
                is_cpp=True, c_macro_defines=None, ld_flags=None,
@@ -3017,7 +3069,7 @@ class NativeCodeCompiler(object):
     if self.CollectedCompilers is not None:
       self.CollectedCompilers.append(self)
     self.verbose = verbose
-    self.cache_dir = "%s/%s" % (get_temp_dir(), self.CacheDirName)
+    self.cache_dir = "%s/%s" % (self.get_cache_base_dir(), self.CacheDirName)
     self._include_paths = list(include_paths)
     self.base_name = base_name
     self.code_version = code_version
@@ -3041,6 +3093,75 @@ class NativeCodeCompiler(object):
   def __repr__(self):
     return "<%s %r in %r>" % (self.__class__.__name__, self.base_name, self._mod_path)
 
+  @classmethod
+  def get_cache_base_dir(cls):
+    """
+    The cache is content-addressed (see :func:`_make_hash`) and uses :class:`LockFile`,
+    thus it can be shared between many processes, or even between many hosts via a shared file system.
+
+    :return: CacheBaseDir if set, otherwise the env var RETURNN_NATIVE_CODE_CACHE_DIR, otherwise get_temp_dir()
+    :rtype: str
+    """
+    if cls.CacheBaseDir:
+      return cls.CacheBaseDir
+    return os.environ.get("RETURNN_NATIVE_CODE_CACHE_DIR") or get_temp_dir()
+
+  @classmethod
+  def _add_stats(cls, **kwargs):
+    """
+    :param int|float kwargs: key -> value to add to Stats
+    """
+    with cls._stats_lock:
+      for key, value in kwargs.items():
+        cls.Stats[key] += value
+
+  @classmethod
+  def get_stats_str(cls):
+    """
+    :return: cache hits and compile time of all compilers in this process so far
+    :rtype: str
+    """
+    with cls._stats_lock:
+      return "%i cache hits, %i compiled, compile time %s" % (
+        cls.Stats["cache_hits"], cls.Stats["compiles"], hms_fraction(cls.Stats["compile_time"]))
+
+  @classmethod
+  def compile_parallel(cls, compilers, num_workers=None):
+    """
+    Compiles all the given compilers (if not in the cache already), in parallel.
+    This does not load the libs, it just makes sure that they are in the cache.
+    Each compiler will use its own lock file, thus this is also safe
+    if other processes try to compile the same code at the same time.
+
+    :param list[NativeCodeCompiler] compilers:
+    :param int|None num_workers: number of parallel compile jobs. by default the number of CPUs
+    """
+    from multiprocessing.pool import ThreadPool
+    if not num_workers:
+      num_workers = get_number_available_cpus() or 1
+    num_workers = max(min(num_workers, len(compilers)), 1)
+    errors = []
+
+    def compile_func(compiler):
+      """
+      :param NativeCodeCompiler compiler:
+      """
+      try:
+        compiler._maybe_compile()
+      except Exception as exc:
+        print("%s: compiling %r failed: %s" % (cls.__name__, compiler, exc))
+        errors.append(exc)
+
+    # Threads are fine, as the real work is done in the compiler subprocess.
+    pool = ThreadPool(num_workers)
+    try:
+      pool.map(compile_func, compilers)
+    finally:
+      pool.close()
+      pool.join()
+    if errors:
+      raise errors[0]
+
   @property
   def _mod_path(self):
     return "%s/%s/%s" % (self.cache_dir, self.base_name, self.static_version_name or self._hash[:10])
@@ -3144,8 +3265,10 @@ class NativeCodeCompiler(object):
 
   def _save_info(self):
     filename = self._info_filename
-    with open(filename, "w") as f:
+    tmp_filename = "%s.tmp-%i" % (filename, os.getpid())
+    with open(tmp_filename, "w") as f:
       f.write("%s\n" % better_repr(self._info_dict))
+    os.rename(tmp_filename, filename)
 
   def _need_recompile(self):
     """
@@ -3178,17 +3301,27 @@ class NativeCodeCompiler(object):
     On successful return, self._so_filename should exist and be up-to-date.
     """
     if not self._need_recompile():
-      if self.verbose:
-        print("%s: No need to recompile: %s" % (self.__class__.__name__, self._so_filename))
-      # Touch it so that we can see that we used it recently.
-      os.utime(self._info_filename, None)
+      self._use_cached()
       return
     lock = LockFile(self._mod_path)
     if self._should_cleanup_old_mydir and not lock.is_locked():
       if os.path.exists(self._mod_path):
         self._cleanup_old_path(self._mod_path, reason="need recompile")
     with lock:
+      # Some other process or thread might have compiled it while we were waiting for the lock.
+      if not self._need_recompile():
+        self._use_cached()
+        return
+      start_time = time.time()
       self._maybe_compile_inner()
+      self._add_stats(compiles=1, compile_time=time.time() - start_time)
+
+  def _use_cached(self):
+    if self.verbose:
+      print("%s: No need to recompile: %s" % (self.__class__.__name__, self._so_filename))
+    # Touch it so that we can see that we used it recently.
+    os.utime(self._info_filename, None)
+    self._add_stats(cache_hits=1)
 
   def _get_compiler_bin(self):
     """
@@ -3222,7 +3355,10 @@ class NativeCodeCompiler(object):
     common_opts += ["-D_GLIBCXX_USE_CXX11_ABI=%i" % (1 if self.use_cxx11_abi else 0)]
     common_opts += ["-D%s=%s" % item for item in sorted(self.c_macro_defines.items())]
     common_opts += ["-g"]
-    opts = common_opts + [self._c_filename, "-o", self._so_filename]
+    # Write to a temp file first and rename it at the end,
+    # such that other processes (which do not hold the lock) never see an incomplete lib.
+    tmp_so_filename = "%s/%s.tmp-%i.so" % (self._mod_path, self.base_name, os.getpid())
+    opts = common_opts + [self._c_filename, "-o", tmp_so_filename]
     opts += self.ld_flags
     cmd_bin = self._get_compiler_bin()
     cmd_args = [cmd_bin] + opts
@@ -3240,13 +3376,14 @@ class NativeCodeCompiler(object):
         print("This might be the error: https://github.com/tensorflow/tensorflow/issues/22766")
         print()
       raise CalledProcessError(returncode=proc.returncode, cmd=cmd_args)
-    assert os.path.exists(self._so_filename)
+    assert os.path.exists(tmp_so_filename)
     with open("%s/compile.log" % self._mod_path, "wb") as f:
       if self.verbose:
         print("%s: write compile log to: %s" % (self.__class__.__name__, f.name))
       f.write(("+ %s\n" % " ".join(cmd_args)).encode("utf8"))
       f.write(stdout)
     self._save_info()
+    os.rename(tmp_so_filename, self._so_filename)
     assert not self._need_recompile()
 
   def load_lib_ctypes(self):
@@ -3416,6 +3553,35 @@ class Stats:
     self.mean_sq += delta_sq / new_total_data_len
     self.total_data_len = new_total_data_len
 
+  def merge(self, other):
+    """
+    Merges the stats of another instance into this one,
+    e.g. when the stats were collected in parallel over different parts of the data.
+    This uses the same parallel variance algorithm as :func:`collect`.
+
+    :param Stats other:
+    """
+    import numpy
+    if other.num_seqs == 0:
+      return
+    if self.num_seqs == 0:
+      self.mean, self.mean_sq, self.var = other.mean, other.mean_sq, other.var
+      self.min, self.max = other.min, other.max
+      self.total_data_len, self.num_seqs = other.total_data_len, other.num_seqs
+      return
+    self.min = numpy.minimum(self.min, other.min)
+    self.max = numpy.maximum(self.max, other.max)
+    new_total_data_len = self.total_data_len + other.total_data_len
+    mean_diff = other.mean - self.mean
+    m_a = self.var * self.total_data_len
+    m_b = other.var * other.total_data_len
+    m2 = m_a + m_b + mean_diff ** 2 * self.total_data_len * other.total_data_len / new_total_data_len
+    self.var = m2 / new_total_data_len
+    self.mean = self.mean + mean_diff * other.total_data_len / new_total_data_len
+    self.mean_sq = self.mean_sq + (other.mean_sq - self.mean_sq) * other.total_data_len / new_total_data_len
+    self.total_data_len = new_total_data_len
+    self.num_seqs += other.num_seqs
+
   def get_mean(self):
     """
     :return: mean, shape (dim,)
@@ -3459,6 +3625,187 @@ class Stats:
       numpy.savetxt("%s.std_dev.txt" % output_file_prefix, self.get_std_dev())
 
 
+class PhaseTimer:
+  """
+  Measures the time spent in named phases of some loop,
+  e.g. of the steps in :class:`TFEngine.Runner` (waiting for data, ``session.run``, etc).
+  Keeps the durations of the last steps for rolling percentiles, the totals,
+  and optionally all events, which can be exported in the Chrome trace event format
+  (view it via chrome://tracing or https://ui.perfetto.dev).
+  Phases can also be measured in other threads (e.g. the data provider thread) via ``in_step=False``.
+  """
+
+  def __init__(self, window=100, collect_trace=False, max_trace_events=1000000):
+    """
+    :param int window: number of last steps for the rolling percentiles
+    :param bool collect_trace: whether to keep all events for :func:`write_chrome_trace`
+    :param int max_trace_events: we stop collecting events after that many, to not run out of memory
+    """
+    self.window = window
+    self.collect_trace = collect_trace
+    self.max_trace_events = max_trace_events
+    self.trace_events = []  # type: typing.List[typing.Dict[str]]
+    self.start_time = time.time()
+    self.num_steps = 0
+    self.recent = {}  # type: typing.Dict[str,typing.Deque[float]]  # phase -> durations of the last steps
+    self.totals = {}  # type: typing.Dict[str,float]  # phase -> total duration
+    self.counts = {}  # type: typing.Dict[str,int]  # phase -> num of occurrences
+    self.maxs = {}  # type: typing.Dict[str,float]  # phase -> max duration (per step for in_step phases)
+    self.in_step_phases = []  # type: typing.List[str]  # in order of first occurrence
+    self._cur_step = {}  # type: typing.Dict[str,float]  # phase -> duration in the current step
+    self._steps_start_time = self.start_time
+    self._last_step_end_time = self.start_time
+    self._trace_thread_ids = set()
+
+  def _add_trace_event(self, name, start_time, duration, category, args=None):
+    """
+    :param str name:
+    :param float start_time: time.time()
+    :param float duration: in secs
+    :param str category:
+    :param dict[str]|None args:
+    """
+    if len(self.trace_events) >= self.max_trace_events:
+      return
+    thread_ = threading.current_thread()
+    if thread_.ident not in self._trace_thread_ids:
+      self._trace_thread_ids.add(thread_.ident)
+      self.trace_events.append({
+        "name": "thread_name", "ph": "M", "pid": os.getpid(), "tid": thread_.ident, "args": {"name": thread_.name}})
+    event = {
+      "name": name, "cat": category, "ph": "X", "pid": os.getpid(), "tid": thread_.ident,
+      "ts": int((start_time - self.start_time) * 1e6), "dur": int(duration * 1e6)}
+    if args:
+      event["args"] = args
+    self.trace_events.append(event)
+
+  def add(self, name, duration, start_time=None, in_step=True):
+    """
+    :param str name: phase name
+    :param float duration: in secs
+    :param float|None start_time: time.time() when the phase started. only needed for the trace
+    :param bool in_step: whether this is part of the current step (i.e. in the thread which calls :func:`end_step`).
+      Otherwise it only goes into the totals and the trace.
+    """
+    # Note: Can be called from different threads. We rely on the GIL for the dict updates.
+    self.totals[name] = self.totals.get(name, 0.0) + duration
+    self.counts[name] = self.counts.get(name, 0) + 1
+    if in_step:
+      if name not in self.recent:
+        self.recent[name] = deque(maxlen=self.window)
+        self.in_step_phases.append(name)
+      self._cur_step[name] = self._cur_step.get(name, 0.0) + duration
+    elif duration > self.maxs.get(name, 0.0):
+      self.maxs[name] = duration
+    if self.collect_trace:
+      if start_time is None:
+        start_time = time.time() - duration
+      self._add_trace_event(name=name, start_time=start_time, duration=duration, category="phase")
+
+  @contextlib.contextmanager
+  def phase(self, name, in_step=True):
+    """
+    Measures the duration of the with-block.
+
+    :param str name:
+    :param bool in_step: see :func:`add`
+    """
+    start_time = time.time()
+    try:
+      yield
+    finally:
+      self.add(name, duration=time.time() - start_time, start_time=start_time, in_step=in_step)
+
+  def start_steps(self):
+    """
+    Call this right before the first step, if there was some other work since the creation of this instance.
+    """
+    self._steps_start_time = self._last_step_end_time = time.time()
+
+  def end_step(self):
+    """
+    Call this at the end of each step.
+    The whole step duration is recorded as phase "step".
+    """
+    now = time.time()
+    self._cur_step["step"] = now - self._last_step_end_time
+    if self.collect_trace:
+      self._add_trace_event(
+        name="step", start_time=self._last_step_end_time, duration=self._cur_step["step"], category="step",
+        args={"step": self.num_steps})
+    self.totals["step"] = self.totals.get("step", 0.0) + self._cur_step["step"]
+    self.counts["step"] = self.counts.get("step", 0) + 1
+    if "step" not in self.recent:
+      self.recent["step"] = deque(maxlen=self.window)
+    for name, duration in self._cur_step.items():
+      self.recent[name].append(duration)
+      if duration > self.maxs.get(name, 0.0):
+        self.maxs[name] = duration
+    self._cur_step = {}
+    self._last_step_end_time = now
+    self.num_steps += 1
+
+  def get_percentiles_str(self, percentiles=(50, 90)):
+    """
+    :param tuple[int]|list[int] percentiles:
+    :return: e.g. "step p50/p90 0.105/0.130, session_run p50/p90 0.100/0.120", over the last steps, in secs
+    :rtype: str
+    """
+    import numpy
+    parts = []
+    for name in ["step"] + self.in_step_phases:
+      if not self.recent.get(name):
+        continue
+      values = numpy.percentile(self.recent[name], percentiles)
+      parts.append("%s %s %s" % (
+        name, "/".join(["p%i" % p for p in percentiles]), "/".join(["%.3f" % v for v in values])))
+    return ", ".join(parts)
+
+  def get_summary(self):
+    """
+    :return: phase -> dict with "total", "count", "mean" (per occurrence), "max", "frac" (of the whole elapsed time).
+      For in-step phases, "mean" and "max" are per step.
+    :rtype: dict[str,dict[str,float]]
+    """
+    elapsed = max(self._last_step_end_time - self._steps_start_time, 1e-10)
+    res = {}
+    for name, total in list(self.totals.items()):
+      count = self.counts[name]
+      if name in self.recent:
+        count = max(self.num_steps, 1)
+      res[name] = {
+        "total": total, "count": self.counts[name], "mean": total / count, "max": self.maxs.get(name, 0.0),
+        "frac": total / elapsed}
+    return res
+
+  def get_summary_str(self):
+    """
+    :return: e.g. "step 100 x 0.105 sec (max 0.300), session_run 95.2%, get_feed_dict 1.3%, ..."
+    :rtype: str
+    """
+    summary = self.get_summary()
+    if "step" not in summary:
+      return "no steps"
+    parts = ["%i steps, %.3f sec/step (max %.3f)" % (self.num_steps, summary["step"]["mean"], summary["step"]["max"])]
+    for name in self.in_step_phases:
+      parts.append("%s %.1f%% (mean %.3f, max %.3f)" % (
+        name, summary[name]["frac"] * 100., summary[name]["mean"], summary[name]["max"]))
+    for name in sorted(summary.keys()):
+      if name == "step" or name in self.in_step_phases:
+        continue
+      parts.append("%s (other thread) %.1f%% (%i x mean %.3f, max %.3f)" % (
+        name, summary[name]["frac"] * 100., summary[name]["count"], summary[name]["mean"], summary[name]["max"]))
+    return ", ".join(parts)
+
+  def write_chrome_trace(self, filename):
+    """
+    :param str filename: e.g. "step_timing.trace.json"
+    """
+    import json
+    with open(filename, "w") as f:
+      json.dump({"traceEvents": self.trace_events, "displayTimeUnit": "ms"}, f)
+
+
 def is_namedtuple(cls):
   """
   :param T cls: tuple, list or namedtuple type
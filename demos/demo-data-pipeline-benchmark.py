@@ -0,0 +1,583 @@
+#!/usr/bin/env python3
+
+"""
+Benchmarking the CPU hot paths of the data pipeline and the engine, on synthetic data:
+
+* ``hdf_load``: :class:`HDFDataset.HDFDataset` loading all seqs (without cache)
+* ``generate_batches``: :func:`Dataset.Dataset.generate_batches` over an epoch
+* ``feed_dict_provider``: :func:`TFDataPipeline.FeedDictDataProvider.get_next_batch` (needs TensorFlow, CPU is enough)
+* ``feed_dict_provider_session``: a whole epoch via :class:`TFDataPipeline.FeedDictDataProvider`,
+  with a cheap ``session.run`` for each batch (needs TensorFlow)
+* ``tf_data_provider_session``: the same via :class:`TFDataPipeline.TFDataDataProvider` (needs TensorFlow)
+* ``sprint_cache_read``: :class:`SprintCache.FileArchive` reading all feature segments
+* ``meta_dataset_epoch_init``: :func:`MetaDataset.MetaDataset.init_seq_order` with random seq order
+* ``vocab_encoding``: :func:`GeneratingDataset.Vocabulary.get_seq`
+* ``bpe_encoding``: :func:`GeneratingDataset.BytePairEncoding.get_seq`
+* ``search_output``: writing the search output in the "py" format, as in ``TFEngine.Engine.search``
+
+The synthetic data is created once. Each component runs in its own process, such that we can report its peak memory
+(peak RSS of the process, and the increase while running the component, via ``/proc/self/status``, i.e. Linux only).
+For each component, we take the best time of ``num_runs`` runs. No GPU is needed.
+
+The results can be stored as JSON (``--output``), and compared to an earlier run (``--compare``),
+e.g. to check for regressions between commits.
+"""
+
+from __future__ import print_function
+import sys
+import os
+import time
+import json
+import subprocess
+import tempfile
+import shutil
+from argparse import ArgumentParser
+from pprint import pprint
+
+my_dir = os.path.dirname(os.path.abspath(__file__))
+returnn_dir = os.path.dirname(my_dir)
+sys.path += [returnn_dir]
+
+import better_exchook
+from Util import hms_fraction, describe_returnn_version
+import numpy
+
+
+# You can play around with these. E.g. use "num_seqs=10000" as command-line args.
+base_settings = {
+  "num_seqs": 2000,
+  "seq_len": 200,  # mean, frames
+  "feature_dim": 40,
+  "num_classes": 100,
+  "batch_size": 5000,
+  "max_seqs": 40,
+  "sprint_num_segments": 200,
+  "num_sentences": 5000,
+  "sentence_len": 20,  # words
+  "num_words": 10000,  # vocab size
+  "num_epochs": 3,  # for meta_dataset_epoch_init
+  "beam_size": 12,  # for search_output
+  "num_runs": 3,
+}
+
+
+def make_seq_lens(num_seqs):
+  """
+  :param int num_seqs:
+  :rtype: list[int]
+  """
+  rnd = numpy.random.RandomState(42)
+  mean_len = base_settings["seq_len"]
+  return rnd.randint(mean_len // 2, mean_len * 3 // 2 + 1, size=(num_seqs,)).tolist()
+
+
+def make_words():
+  """
+  :return: synthetic words over a small alphabet, such that BPE merges are useful
+  :rtype: list[str]
+  """
+  rnd = numpy.random.RandomState(43)
+  letters = numpy.array(list("abcdefghij"))
+  words = set()
+  while len(words) < base_settings["num_words"] - 1:
+    words.add("".join(letters[rnd.randint(0, len(letters), size=(rnd.randint(3, 11),))]))
+  return sorted(words)
+
+
+def make_sentences():
+  """
+  :rtype: list[str]
+  """
+  rnd = numpy.random.RandomState(44)
+  words = numpy.array(make_words())
+  # Zipf-like distribution, as in real text.
+  probs = 1.0 / numpy.arange(1, len(words) + 1)
+  probs /= probs.sum()
+  return [
+    " ".join(words[rnd.choice(len(words), size=(base_settings["sentence_len"],), p=probs)])
+    for _ in range(base_settings["num_sentences"])]
+
+
+def create_data(data_dir):
+  """
+  :param str data_dir:
+  """
+  from GeneratingDataset import StaticDataset
+  from HDFDataset import HDFDatasetWriter
+  import SprintCache
+
+  rnd = numpy.random.RandomState(42)
+  dim = base_settings["feature_dim"]
+  seqs = []
+  for seq_len in make_seq_lens(base_settings["num_seqs"]):
+    seqs.append({
+      "data": rnd.normal(size=(seq_len, dim)).astype("float32"),
+      "classes": rnd.randint(0, base_settings["num_classes"], size=(seq_len,)).astype("int32")})
+  dataset = StaticDataset(
+    data=seqs, output_dim={"data": (dim, 2), "classes": (base_settings["num_classes"], 1)})
+  dataset.init_seq_order(epoch=1)
+  writer = HDFDatasetWriter("%s/data.hdf" % data_dir)
+  writer.dump_from_dataset(dataset)
+  writer.close()
+
+  archive = SprintCache.FileArchive("%s/features.cache" % data_dir, must_exists=False)
+  for i, seq_len in enumerate(make_seq_lens(base_settings["sprint_num_segments"])):
+    features = rnd.normal(size=(seq_len, dim)).astype("float32")
+    times = [(t * 0.01, (t + 1) * 0.01) for t in range(seq_len)]
+    archive.add_feature_cache("corpus/recording%i/segment%i" % (i // 10, i % 10), features, times)
+  archive.finalize()
+  del archive
+
+  words = make_words()
+  with open("%s/vocab.txt" % data_dir, "w") as f:
+    f.write(repr({label: i for (i, label) in enumerate(["UNK"] + words)}))
+  letters = sorted(set("".join(words)))
+  bpe_labels = ["UNK"] + letters + [x + "@@" for x in letters]
+  bpe_codes = []
+  for x in letters:
+    for y in letters:
+      bpe_codes.append("%s %s" % (x, y))
+      bpe_labels += [x + y, x + y + "@@"]
+  for x in letters:
+    for y in letters:
+      bpe_codes.append("%s %s</w>" % (x, y))
+  with open("%s/bpe.codes" % data_dir, "w") as f:
+    f.write("#version: 0.2\n")
+    f.write("".join(["%s\n" % code for code in bpe_codes]))
+  with open("%s/bpe.vocab" % data_dir, "w") as f:
+    f.write(repr({label: i for (i, label) in enumerate(sorted(set(bpe_labels)))}))
+  with open("%s/sentences.txt" % data_dir, "w") as f:
+    f.write("".join(["%s\n" % s for s in make_sentences()]))
+
+
+def best_time(func):
+  """
+  :param ()->int func: does the work, returns the num of processed items
+  :return: best time over num_runs, num items
+  :rtype: (float,int)
+  """
+  times = []
+  num_items = None
+  for _ in range(base_settings["num_runs"]):
+    start_time = time.time()
+    num_items = func()
+    times.append(time.time() - start_time)
+  return min(times), num_items
+
+
+def init_hdf_dataset(data_dir, **kwargs):
+  """
+  :param str data_dir:
+  :rtype: HDFDataset.HDFDataset
+  """
+  from Dataset import init_dataset
+  return init_dataset(dict({"class": "HDFDataset", "files": ["%s/data.hdf" % data_dir]}, **kwargs))
+
+
+def benchmark_hdf_load(data_dir):
+  """
+  :param str data_dir:
+  :rtype: (float,int,str)
+  """
+  dataset = init_hdf_dataset(data_dir, cache_byte_size=0)
+
+  def run():
+    """
+    :return: num frames
+    :rtype: int
+    """
+    dataset.init_seq_order(epoch=1)
+    num_frames = 0
+    seq_idx = 0
+    while dataset.is_less_than_num_seqs(seq_idx):
+      dataset.load_seqs(seq_idx, seq_idx + 1)
+      num_frames += dataset.get_data(seq_idx, "data").shape[0]
+      dataset.get_data(seq_idx, "classes")
+      seq_idx += 1
+    return num_frames
+
+  return best_time(run) + ("frames",)
+
+
+def benchmark_generate_batches(data_dir):
+  """
+  :param str data_dir:
+  :rtype: (float,int,str)
+  """
+  dataset = init_hdf_dataset(data_dir, seq_ordering="laplace:.100")
+
+  def run():
+    """
+    :return: num seqs
+    :rtype: int
+    """
+    dataset.init_seq_order(epoch=1)
+    batches = dataset.generate_batches(
+      recurrent_net=True, batch_size=base_settings["batch_size"], max_seqs=base_settings["max_seqs"])
+    num_seqs = 0
+    while batches.has_more():
+      batch, = batches.peek_next_n(1)
+      num_seqs += batch.get_num_seqs()
+      batches.advance(1)
+    return num_seqs
+
+  return best_time(run) + ("seqs",)
+
+
+def benchmark_feed_dict_provider(data_dir):
+  """
+  :param str data_dir:
+  :rtype: (float,int,str)
+  """
+  from TFNetwork import ExternData
+  from TFDataPipeline import FeedDictDataProvider
+  dataset = init_hdf_dataset(data_dir, cache_byte_size=0)
+  extern_data = ExternData()
+  extern_data.init_from_dataset(dataset)
+
+  def run():
+    """
+    :return: num frames
+    :rtype: int
+    """
+    dataset.init_seq_order(epoch=1)
+    batches = dataset.generate_batches(
+      recurrent_net=True, batch_size=base_settings["batch_size"], max_seqs=base_settings["max_seqs"])
+    data_provider = FeedDictDataProvider(
+      tf_session=None, dataset=dataset, batches=batches, extern_data=extern_data, data_keys=["data", "classes"])
+    num_frames = 0
+    while batches.has_more():
+      data = data_provider.get_next_batch(consider_batch_slice=False)
+      num_frames += int(numpy.sum(data["data_seq_lens"]))
+      batches.advance(1)
+    return num_frames
+
+  return best_time(run) + ("frames",)
+
+
+def benchmark_data_provider_session(data_dir, use_tf_data):
+  """
+  :param str data_dir:
+  :param bool use_tf_data: TFDataDataProvider, otherwise FeedDictDataProvider
+  :rtype: (float,int,str)
+  """
+  # noinspection PyUnresolvedReferences,PyPackageRequirements
+  import tensorflow as tf
+  from TFNetwork import ExternData
+  from TFDataPipeline import FeedDictDataProvider, TFDataInput, TFDataDataProvider
+  dataset = init_hdf_dataset(data_dir, cache_byte_size=0)
+  extern_data = ExternData()
+  extern_data.init_from_dataset(dataset)
+  tf_data_input = TFDataInput(extern_data=extern_data) if use_tf_data else None
+  # Some cheap calculation which depends on all the data, such that each step consumes one batch.
+  data, classes = extern_data.data["data"], extern_data.data["classes"]
+  with tf.control_dependencies([
+        tf.reduce_sum(data.placeholder), tf.reduce_sum(classes.placeholder), classes.size_placeholder[0]]):
+    num_frames_fetch = tf.reduce_sum(data.size_placeholder[0])
+  session = tf.Session(config=tf.ConfigProto(device_count={"GPU": 0}))
+
+  def run():
+    """
+    :return: num frames
+    :rtype: int
+    """
+    dataset.init_seq_order(epoch=1)
+    batches = dataset.generate_batches(
+      recurrent_net=True, batch_size=base_settings["batch_size"], max_seqs=base_settings["max_seqs"])
+    kwargs = dict(
+      tf_session=session, dataset=dataset, batches=batches, extern_data=extern_data, data_keys=["data", "classes"])
+    if tf_data_input:
+      data_provider = TFDataDataProvider(tf_data_input=tf_data_input, **kwargs)
+    else:
+      data_provider = FeedDictDataProvider(**kwargs)
+    data_provider.start_threads()
+    num_frames = 0
+    try:
+      while data_provider.have_more_data(session=session):
+        feed_dict, _ = data_provider.get_feed_dict()
+        num_frames += int(session.run(num_frames_fetch, feed_dict=feed_dict))
+    finally:
+      data_provider.stop_threads()
+    return num_frames
+
+  res = best_time(run) + ("frames",)
+  session.close()
+  return res
+
+
+def benchmark_feed_dict_provider_session(data_dir):
+  """
+  :param str data_dir:
+  :rtype: (float,int,str)
+  """
+  return benchmark_data_provider_session(data_dir, use_tf_data=False)
+
+
+def benchmark_tf_data_provider_session(data_dir):
+  """
+  :param str data_dir:
+  :rtype: (float,int,str)
+  """
+  return benchmark_data_provider_session(data_dir, use_tf_data=True)
+
+
+def benchmark_sprint_cache_read(data_dir):
+  """
+  :param str data_dir:
+  :rtype: (float,int,str)
+  """
+  import SprintCache
+
+  def run():
+    """
+    :return: num frames
+    :rtype: int
+    """
+    archive = SprintCache.FileArchive("%s/features.cache" % data_dir)
+    num_frames = 0
+    for name in archive.file_list():
+      if name.endswith(".attribs"):
+        continue
+      times, features = archive.read(name, "feat")
+      num_frames += len(features)
+    return num_frames
+
+  return best_time(run) + ("frames",)
+
+
+def benchmark_meta_dataset_epoch_init(data_dir):
+  """
+  :param str data_dir:
+  :rtype: (float,int,str)
+  """
+  from Dataset import init_dataset
+  sub_dataset = {"class": "HDFDataset", "files": ["%s/data.hdf" % data_dir]}
+  dataset = init_dataset({
+    "class": "MetaDataset", "datasets": {"a": sub_dataset, "b": sub_dataset},
+    "data_map": {"data": ("a", "data"), "classes": ("b", "classes")}, "seq_ordering": "random"})
+
+  def run():
+    """
+    :return: num epochs
+    :rtype: int
+    """
+    for epoch in range(1, base_settings["num_epochs"] + 1):
+      dataset.init_seq_order(epoch=epoch)
+    dataset.init_seq_order(epoch=None)  # reset, such that the next run does the work again
+    return base_settings["num_epochs"]
+
+  return best_time(run) + ("epochs",)
+
+
+def benchmark_vocab_encoding(data_dir):
+  """
+  :param str data_dir:
+  :rtype: (float,int,str)
+  """
+  from GeneratingDataset import Vocabulary
+  sentences = open("%s/sentences.txt" % data_dir).read().splitlines()
+  vocab = Vocabulary(vocab_file="%s/vocab.txt" % data_dir)
+
+  def run():
+    """
+    :return: num sentences
+    :rtype: int
+    """
+    for sentence in sentences:
+      vocab.get_seq(sentence)
+    return len(sentences)
+
+  return best_time(run) + ("sentences",)
+
+
+def benchmark_bpe_encoding(data_dir):
+  """
+  :param str data_dir:
+  :rtype: (float,int,str)
+  """
+  from GeneratingDataset import BytePairEncoding
+  sentences = open("%s/sentences.txt" % data_dir).read().splitlines()
+
+  def run():
+    """
+    :return: num sentences
+    :rtype: int
+    """
+    # New instance each time, such that we start with an empty cache.
+    bpe = BytePairEncoding(vocab_file="%s/bpe.vocab" % data_dir, bpe_file="%s/bpe.codes" % data_dir)
+    for sentence in sentences:
+      bpe.get_seq(sentence)
+    return len(sentences)
+
+  return best_time(run) + ("sentences",)
+
+
+def benchmark_search_output(data_dir):
+  """
+  :param str data_dir:
+  :rtype: (float,int,str)
+  """
+  from Util import better_repr
+  rnd = numpy.random.RandomState(42)
+  sentences = open("%s/sentences.txt" % data_dir).read().splitlines()
+  beam_size = base_settings["beam_size"]
+  num_seqs = base_settings["num_seqs"]
+  out_cache = {
+    i: [(float(rnd.normal()), sentences[(i * beam_size + b) % len(sentences)]) for b in range(beam_size)]
+    for i in range(num_seqs)}
+  seq_idx_to_tag = {i: "corpus/seq%i" % i for i in range(num_seqs)}
+  output_filename = "%s/search_output.py" % data_dir
+
+  def run():
+    """
+    :return: num seqs
+    :rtype: int
+    """
+    # Same format as Engine.search with output_file_format "py".
+    with open(output_filename, "w") as output_file:
+      output_file.write("{\n")
+      for i in range(len(out_cache)):
+        output_file.write("%r: %s,\n" % (seq_idx_to_tag[i], better_repr(out_cache[i])))
+      output_file.write("}\n")
+    return len(out_cache)
+
+  res = best_time(run) + ("seqs",)
+  os.remove(output_filename)
+  return res
+
+
+components = {
+  "hdf_load": benchmark_hdf_load,
+  "generate_batches": benchmark_generate_batches,
+  "feed_dict_provider": benchmark_feed_dict_provider,
+  "feed_dict_provider_session": benchmark_feed_dict_provider_session,
+  "tf_data_provider_session": benchmark_tf_data_provider_session,
+  "sprint_cache_read": benchmark_sprint_cache_read,
+  "meta_dataset_epoch_init": benchmark_meta_dataset_epoch_init,
+  "vocab_encoding": benchmark_vocab_encoding,
+  "bpe_encoding": benchmark_bpe_encoding,
+  "search_output": benchmark_search_output,
+}
+
+
+def get_mem_usage():
+  """
+  :return: current RSS, peak RSS of this process, in bytes
+  :rtype: (int,int)
+  """
+  # getrusage ru_maxrss would be inherited from the parent process via fork+exec, thus use VmHWM instead.
+  status = dict(line.split(":", 1) for line in open("/proc/self/status").read().splitlines() if ":" in line)
+  return int(status["VmRSS"].split()[0]) * 1024, int(status["VmHWM"].split()[0]) * 1024
+
+
+def run_component(name, data_dir):
+  """
+  Executed in a sub process.
+
+  :param str name:
+  :param str data_dir:
+  :rtype: dict[str]
+  """
+  from Log import log
+  log.initialize(verbosity=[0])
+  if name in ["feed_dict_provider", "feed_dict_provider_session", "tf_data_provider_session"]:
+    try:
+      # noinspection PyUnresolvedReferences,PyPackageRequirements
+      import tensorflow
+    except ImportError as exc:
+      return {"skipped": "TensorFlow not available: %s" % exc}
+  rss_before, _ = get_mem_usage()
+  elapsed, num_items, unit = components[name](data_dir)
+  _, peak_rss = get_mem_usage()
+  return {
+    "time": elapsed, "num_items": num_items, "unit": unit, "throughput": num_items / max(elapsed, 1e-10),
+    "peak_rss_mb": peak_rss / 1024. ** 2, "peak_rss_increase_mb": (peak_rss - rss_before) / 1024. ** 2}
+
+
+def format_result(res):
+  """
+  :param dict[str] res:
+  :rtype: str
+  """
+  if "skipped" in res:
+    return "skipped (%s)" % res["skipped"]
+  return "%s for %i %s, %.1f %s/sec, peak RSS %.1f MB (+%.1f MB)" % (
+    hms_fraction(res["time"]), res["num_items"], res["unit"], res["throughput"], res["unit"],
+    res["peak_rss_mb"], res["peak_rss_increase_mb"])
+
+
+def main():
+  arg_parser = ArgumentParser()
+  arg_parser.add_argument("cfg", nargs="*", help="opt=value, opt in %r" % sorted(base_settings.keys()))
+  arg_parser.add_argument("--components", help="comma-separated, from %r" % sorted(components.keys()))
+  arg_parser.add_argument("--output", help="store the results as JSON in this file")
+  arg_parser.add_argument("--compare", help="JSON file of an earlier run (via --output), to compare the throughput")
+  arg_parser.add_argument("--run_component", help="internal, run single component in sub process")
+  arg_parser.add_argument("--data_dir", help="internal, for --run_component")
+  args = arg_parser.parse_args()
+  for opt in args.cfg:
+    key, value = opt.split("=", 1)
+    assert key in base_settings
+    value_type = type(base_settings[key])
+    base_settings[key] = value_type(value)
+
+  if args.run_component:
+    print(json.dumps(run_component(args.run_component, data_dir=args.data_dir)))
+    return
+
+  print("Benchmarking the data pipeline.")
+  better_exchook.install()
+  print("Args:", " ".join(sys.argv))
+  print("Settings:")
+  pprint(base_settings)
+  component_names = args.components.split(",") if args.components else sorted(components.keys())
+  for name in component_names:
+    assert name in components, "unknown component %r, available: %r" % (name, sorted(components.keys()))
+
+  results = {}
+  data_dir = tempfile.mkdtemp(prefix="returnn-data-pipeline-benchmark-")
+  try:
+    print("Create data in %s." % data_dir)
+    start_time = time.time()
+    create_data(data_dir)
+    print("Took %s." % hms_fraction(time.time() - start_time))
+    for name in component_names:
+      print("Run %s." % name)
+      out = subprocess.check_output(
+        [sys.executable, os.path.abspath(__file__), "--run_component", name, "--data_dir", data_dir] +
+        ["%s=%s" % item for item in sorted(base_settings.items())], cwd=returnn_dir)
+      results[name] = json.loads(out.decode("utf8").splitlines()[-1])
+      print(">>> %s: %s" % (name, format_result(results[name])))
+  finally:
+    shutil.rmtree(data_dir)
+
+  if args.output:
+    with open(args.output, "w") as f:
+      json.dump({
+        "returnn_version": describe_returnn_version(), "settings": base_settings, "results": results},
+        f, indent=2, sort_keys=True)
+    print("Results stored in %s." % args.output)
+
+  print("-" * 20)
+  print("Settings:")
+  pprint(base_settings)
+  print("Final results:")
+  for name in component_names:
+    print("  %s: %s" % (name, format_result(results[name])))
+  if args.compare:
+    baseline = json.load(open(args.compare))
+    print("Throughput relative to %s (%s):" % (args.compare, baseline.get("returnn_version")))
+    if baseline.get("settings") != base_settings:
+      print("  (Warning: different settings: %r)" % baseline.get("settings"))
+    for name in component_names:
+      res, base_res = results[name], baseline["results"].get(name)
+      if not base_res or "skipped" in res or "skipped" in base_res:
+        print("  %s: n/a" % name)
+        continue
+      print("  %s: %.2fx, peak RSS %+.1f MB" % (
+        name, res["throughput"] / base_res["throughput"], res["peak_rss_mb"] - base_res["peak_rss_mb"]))
+  print("Done.")
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+
+"""
+Benchmarking the transfer of the batch data and the params between the host and the Theano device process,
+i.e. the pipe protocol (pickling of the Numpy arrays), vs. ``device_shared_mem_transfer``,
+where the data is written into persistent shared memory (:class:`TaskSystem.SharedNumpyBuffer`),
+and only small control messages go over the pipe.
+See :class:`Device.Device`.
+
+We don't need Theano or a GPU for this: the device process here is a mock on CPU,
+which follows the same protocol as :func:`Device.Device.process_inner`, and copies the data like it,
+but does no computation.
+"""
+
+from __future__ import print_function
+import sys
+import os
+import time
+from argparse import ArgumentParser
+from pprint import pprint
+
+my_dir = os.path.dirname(os.path.abspath(__file__))
+returnn_dir = os.path.dirname(my_dir)
+sys.path += [returnn_dir]
+
+import numpy
+import better_exchook
+from TaskSystem import AsyncTask, SharedMem, SharedNumpyBuffer
+from Util import hms_fraction
+
+
+# You can play around with these. E.g. use "num_seqs=100" as command-line args.
+base_settings = {
+  "num_batches": 50,
+  "num_time": 500,  # frames per seq
+  "num_seqs": 40,  # per batch
+  "num_inputs": 40,  # feature dim
+  "num_param_arrays": 20,
+  "num_params": 10 * 1000 * 1000,  # in total, over all param arrays
+  "num_param_transfers": 10,
+}
+
+data_keys = ["classes", "data"]
+
+
+def _mock_device_main(async_task):
+  """
+  The device process. Like :func:`Device.Device.process_inner`, but without any Theano.
+
+  :param AsyncTask async_task:
+  """
+  conn = async_task.conn
+  y = {}  # like Device.y, but just the copied values
+  j = {}  # like Device.j
+  params = []
+  shared_buffers = {}
+  train_params_buffer = SharedNumpyBuffer(name="train-params")
+  while True:
+    cmd = conn.recv()
+    if cmd == "stop":
+      conn.send("done")
+      break
+    elif cmd == "update-data":
+      target_keys = conn.recv()
+      for k in target_keys:
+        y[k] = conn.recv().astype("float32")
+      for k in target_keys:
+        j[k] = conn.recv().astype("int8")
+      conn.recv()  # tags
+    elif cmd == "update-data-shared":
+      msg, target_keys, _ = conn.recv()
+      if msg["name"] not in shared_buffers:
+        shared_buffers[msg["name"]] = SharedNumpyBuffer(name=msg["name"])
+      arrays = shared_buffers[msg["name"]].read(msg)
+      for k in target_keys:
+        y[k] = arrays["targets:%s" % k].astype("float32")
+      for k in target_keys:
+        j[k] = arrays["index:%s" % k].astype("int8")
+      shared_buffers[msg["name"]].read_done()
+    elif cmd == "set-net-params":
+      params_len = conn.recv()
+      params = [numpy.frombuffer(conn.recv_bytes(), dtype="float32") for _ in range(params_len)]
+      assert conn.recv() == "end-set-net-params"
+    elif cmd == "set-net-params-shared":
+      msg = conn.recv()
+      if msg["name"] not in shared_buffers:
+        shared_buffers[msg["name"]] = SharedNumpyBuffer(name=msg["name"])
+      arrays = shared_buffers[msg["name"]].read(msg)
+      params = [arrays["%i" % i].copy() for i in range(len(arrays))]
+      shared_buffers[msg["name"]].read_done()
+    elif cmd == "get-net-train-params":
+      conn.send("net-train-params")
+      conn.send(len(params))
+      for p in params:
+        conn.send_bytes(p.tobytes())
+      conn.send("end-get-net-train-params")
+    elif cmd == "get-net-train-params-shared":
+      arrays = train_params_buffer.alloc([("%i" % i, p.shape, "float32") for i, p in enumerate(params)])
+      for i, p in enumerate(params):
+        arrays["%i" % i][...] = p
+      conn.send("net-train-params-shared")
+      conn.send(train_params_buffer.get_message())
+    elif cmd == "task":
+      conn.recv()  # task
+      conn.send("task-result")
+      conn.send([numpy.array(float(numpy.sum(y["data"][0])))])
+      conn.send(["cost:output"])
+    else:
+      raise Exception("cmd %s unknown" % cmd)
+
+
+class MockDeviceHost:
+  """
+  The host side of the device, like :class:`Device.Device` in the main process.
+  """
+
+  def __init__(self, shared_mem_transfer):
+    """
+    :param bool shared_mem_transfer:
+    """
+    self.shared_mem_transfer = shared_mem_transfer
+    self.proc = AsyncTask(func=_mock_device_main, name="mock device proc", mustExec=True)
+    self.conn = self.proc.conn
+    self.shared_data_buffers = [SharedNumpyBuffer(name="data%i" % i, check_alive=self.proc.is_alive) for i in range(2)]
+    self.shared_params_buffer = SharedNumpyBuffer(name="params", check_alive=self.proc.is_alive)
+    self.shared_train_params_buffer = SharedNumpyBuffer(name="train-params")
+    self.targets = None  # type: dict[str,numpy.ndarray]
+    self.output_index = None  # type: dict[str,numpy.ndarray]
+
+  def alloc_data(self, shapes):
+    """
+    :param dict[str,tuple[int]] shapes:
+    """
+    if self.shared_mem_transfer:
+      self.shared_data_buffers.reverse()
+      arrays = self.shared_data_buffers[0].alloc(
+        [("targets:%s" % k, shapes[k], "float32") for k in data_keys] +
+        [("index:%s" % k, shapes[k][:2], "int8") for k in data_keys])
+      self.targets = {k: arrays["targets:%s" % k] for k in data_keys}
+      self.output_index = {k: arrays["index:%s" % k] for k in data_keys}
+    else:
+      self.targets = {k: numpy.zeros(shapes[k], dtype="float32") for k in data_keys}
+      self.output_index = {k: numpy.zeros(shapes[k][:2], dtype="int8") for k in data_keys}
+
+  def update_data_and_run(self):
+    """
+    Like :func:`Device.Device.run` (which calls :func:`Device.Device.update_data`) and then the result.
+    """
+    if self.shared_mem_transfer:
+      self.conn.send("update-data-shared")
+      self.conn.send((self.shared_data_buffers[0].get_message(), data_keys, ["tag"]))
+    else:
+      self.conn.send("update-data")
+      self.conn.send(data_keys)
+      for k in data_keys:
+        self.conn.send(self.targets[k])
+      for k in data_keys:
+        self.conn.send(self.output_index[k])
+      self.conn.send(["tag"])
+    self.conn.send("task")
+    self.conn.send("train")
+    assert self.conn.recv() == "task-result"
+    self.conn.recv()
+    self.conn.recv()
+
+  def set_net_encoded_params(self, network_params):
+    """
+    :param list[numpy.ndarray] network_params:
+    """
+    if self.shared_mem_transfer:
+      arrays = self.shared_params_buffer.alloc([("%i" % i, p.shape, "float32") for i, p in enumerate(network_params)])
+      for i, p in enumerate(network_params):
+        arrays["%i" % i][...] = p
+      self.conn.send("set-net-params-shared")
+      self.conn.send(self.shared_params_buffer.get_message())
+    else:
+      self.conn.send("set-net-params")
+      self.conn.send(len(network_params))
+      for p in network_params:
+        self.conn.send_bytes(p.astype("float32").tobytes())
+      self.conn.send("end-set-net-params")
+
+  def get_net_train_params(self, shapes):
+    """
+    :param list[tuple[int]] shapes:
+    :rtype: list[numpy.ndarray]
+    """
+    if self.shared_mem_transfer:
+      self.conn.send("get-net-train-params-shared")
+      assert self.conn.recv() == "net-train-params-shared"
+      arrays = self.shared_train_params_buffer.read(self.conn.recv())
+      res = [numpy.array(arrays["%i" % i]).reshape(shape) for i, shape in enumerate(shapes)]
+      self.shared_train_params_buffer.read_done()
+      return res
+    self.conn.send("get-net-train-params")
+    assert self.conn.recv() == "net-train-params"
+    assert self.conn.recv() == len(shapes)
+    res = [numpy.frombuffer(self.conn.recv_bytes(), dtype="float32").reshape(shape) for shape in shapes]
+    assert self.conn.recv() == "end-get-net-train-params"
+    return res
+
+  def terminate(self):
+    self.conn.send("stop")
+    assert self.conn.recv() == "done"
+    self.proc.join(timeout=10)
+    self.proc.terminate()
+
+
+def benchmark(shared_mem_transfer):
+  """
+  :param bool shared_mem_transfer:
+  :return: name -> time in seconds per transfer
+  :rtype: dict[str,float]
+  """
+  print("Benchmark with shared_mem_transfer=%r." % shared_mem_transfer)
+  rnd = numpy.random.RandomState(42)
+  num_time, num_seqs = base_settings["num_time"], base_settings["num_seqs"]
+  shapes = {"data": (num_time, num_seqs, base_settings["num_inputs"]), "classes": (num_time, num_seqs)}
+  data = {k: rnd.uniform(-1., 1., size=shapes[k]).astype("float32") for k in data_keys}
+  param_size = base_settings["num_params"] // base_settings["num_param_arrays"]
+  params = [rnd.uniform(-1., 1., size=(param_size,)).astype("float32")
+            for _ in range(base_settings["num_param_arrays"])]
+  device = MockDeviceHost(shared_mem_transfer=shared_mem_transfer)
+  try:
+    start_time = time.time()
+    for i in range(base_settings["num_batches"]):
+      device.alloc_data(shapes)  # like EngineUtil.assign_dev_data
+      for k in data_keys:
+        device.targets[k][...] = data[k]
+        device.output_index[k][...] = 1
+      device.update_data_and_run()
+    batch_time = (time.time() - start_time) / base_settings["num_batches"]
+    print("  batch: %s" % hms_fraction(batch_time))
+    start_time = time.time()
+    for i in range(base_settings["num_param_transfers"]):
+      device.set_net_encoded_params(params)
+      res = device.get_net_train_params([p.shape for p in params])
+      assert all([numpy.array_equal(p, q) for p, q in zip(params, res)])
+    params_time = (time.time() - start_time) / base_settings["num_param_transfers"]
+    print("  params set+get: %s" % hms_fraction(params_time))
+  finally:
+    device.terminate()
+  return {"batch": batch_time, "params set+get": params_time}
+
+
+def main():
+  print("Benchmarking the Theano device process data transfer.")
+  better_exchook.install()
+  print("Args:", " ".join(sys.argv))
+  arg_parser = ArgumentParser()
+  arg_parser.add_argument("cfg", nargs="*", help="opt=value, opt in %r" % sorted(base_settings.keys()))
+  args = arg_parser.parse_args()
+  for opt in args.cfg:
+    key, value = opt.split("=", 1)
+    assert key in base_settings
+    value_type = type(base_settings[key])
+    base_settings[key] = value_type(value)
+  print("Settings:")
+  pprint(base_settings)
+  assert SharedMem.is_shmget_functioning(), "shmget does not work"
+
+  results = {}
+  for shared_mem_transfer in [False, True]:
+    results[shared_mem_transfer] = benchmark(shared_mem_transfer=shared_mem_transfer)
+
+  print("-" * 20)
+  print("Settings:")
+  pprint(base_settings)
+  print("Final results:")
+  for name in sorted(results[False].keys()):
+    print("  %s: pipe %s, shared mem %s, speedup %.1fx" % (
+      name, hms_fraction(results[False][name]), hms_fraction(results[True][name]),
+      results[False][name] / max(results[True][name], 1e-10)))
+  print("Done.")
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+
+"""
+Benchmarking the sequence list handling of :class:`MetaDataset.MetaDataset` at startup and at epoch start,
+for the pickled seq lists (plain Python tag lists, and tag lookups in every sub-dataset),
+vs. the :class:`MetaDataset.SeqTagIndex` (``seq_list_index_file``), where sub-datasets get index arrays.
+We do not need any real sub-datasets for this, it only covers the seq list logic itself.
+Memory is measured via tracemalloc (which also covers numpy allocations).
+"""
+
+from __future__ import print_function
+import sys
+import os
+import time
+import pickle
+import tempfile
+import shutil
+import tracemalloc
+from argparse import ArgumentParser
+from pprint import pprint
+
+my_dir = os.path.dirname(os.path.abspath(__file__))
+returnn_dir = os.path.dirname(my_dir)
+sys.path += [returnn_dir]
+
+import better_exchook
+from Util import hms_fraction, human_bytes_size
+import numpy
+from MetaDataset import SeqTagIndex
+
+
+# You can play around with these. E.g. use "num_seqs=10000000" as command-line args.
+base_settings = {
+  "num_seqs": 1000000,
+  "num_datasets": 2,  # each with its own tag format
+  "num_epochs": 2,
+}
+
+
+def make_seq_lists():
+  """
+  :return: dataset key -> seq list
+  :rtype: dict[str,list[str]]
+  """
+  return {
+    "dataset%i" % i: [
+      "corpus%i/recording%i/segment%i" % (i, s // 100, s % 100) for s in range(base_settings["num_seqs"])]
+    for i in range(base_settings["num_datasets"])}
+
+
+def benchmark_pickle(tmp_dir):
+  """
+  What MetaDataset did with seq_list_file: load the pickle, build tag -> idx,
+  and per epoch, create the tag lists for every sub-dataset, which then looks up each tag.
+
+  :param str tmp_dir:
+  :return: dict of measurements
+  :rtype: dict[str,float]
+  """
+  seq_list_file = "%s/seq_list.pkl" % tmp_dir
+  with open(seq_list_file, "wb") as f:
+    pickle.dump(make_seq_lists(), f)
+  tracemalloc.start()
+  start_time = time.time()
+  with open(seq_list_file, "rb") as f:
+    seq_lists = pickle.load(f)
+  default_key = sorted(seq_lists.keys())[0]
+  tag_idx = {tag: idx for (idx, tag) in enumerate(seq_lists[default_key])}
+  sub_dataset_tag_idx = {key: {tag: idx for (idx, tag) in enumerate(ls)} for (key, ls) in seq_lists.items()}
+  load_time = time.time() - start_time
+  epoch_times = []
+  rnd = numpy.random.RandomState(42)
+  for epoch in range(base_settings["num_epochs"]):
+    start_time = time.time()
+    seq_index = rnd.permutation(len(tag_idx)).tolist()
+    seq_list_ordered = {key: [ls[s] for s in seq_index] for (key, ls) in seq_lists.items()}
+    for key, ls in seq_list_ordered.items():
+      sub_seq_index = [sub_dataset_tag_idx[key][tag] for tag in ls]
+      assert len(sub_seq_index) == len(seq_index)
+    epoch_times.append(time.time() - start_time)
+  mem_cur, mem_peak = tracemalloc.get_traced_memory()
+  tracemalloc.stop()
+  return {
+    "load_time": load_time, "epoch_time": sum(epoch_times) / len(epoch_times), "mem": mem_cur, "mem_peak": mem_peak}
+
+
+def benchmark_index(tmp_dir):
+  """
+  What MetaDataset does now with seq_list_index_file (once it exists):
+  load the indices, and per epoch, pass index arrays to the sub-datasets.
+
+  :param str tmp_dir:
+  :return: dict of measurements
+  :rtype: dict[str,float]
+  """
+  seq_lists = make_seq_lists()
+  index_files = {}
+  start_time = time.time()
+  for key, ls in seq_lists.items():
+    index_files[key] = "%s/seq_list.%s.npz" % (tmp_dir, key)
+    SeqTagIndex.from_tags(ls).save(index_files[key])
+  create_time = time.time() - start_time
+  del seq_lists
+  tracemalloc.start()
+  start_time = time.time()
+  indices = {key: SeqTagIndex.load(fn) for (key, fn) in index_files.items()}
+  # Corresponds to the sub-dataset corpus idxs. In this case, the identity.
+  sub_dataset_corpus_idxs = {key: index.get_indices_of(index) for (key, index) in indices.items()}
+  load_time = time.time() - start_time
+  epoch_times = []
+  rnd = numpy.random.RandomState(42)
+  num_seqs = len(indices[sorted(indices.keys())[0]])
+  for epoch in range(base_settings["num_epochs"]):
+    start_time = time.time()
+    seq_order = rnd.permutation(num_seqs)
+    for key in indices.keys():
+      sub_seq_order = sub_dataset_corpus_idxs[key][seq_order]
+      assert len(sub_seq_order) == len(seq_order)
+    epoch_times.append(time.time() - start_time)
+  mem_cur, mem_peak = tracemalloc.get_traced_memory()
+  tracemalloc.stop()
+  return {
+    "create_time": create_time, "load_time": load_time, "epoch_time": sum(epoch_times) / len(epoch_times),
+    "mem": mem_cur, "mem_peak": mem_peak}
+
+
+def main():
+  print("Benchmarking MetaDataset seq lists.")
+  better_exchook.install()
+  print("Args:", " ".join(sys.argv))
+  arg_parser = ArgumentParser()
+  arg_parser.add_argument("cfg", nargs="*", help="opt=value, opt in %r" % sorted(base_settings.keys()))
+  args = arg_parser.parse_args()
+  for opt in args.cfg:
+    key, value = opt.split("=", 1)
+    assert key in base_settings
+    value_type = type(base_settings[key])
+    base_settings[key] = value_type(value)
+  print("Settings:")
+  pprint(base_settings)
+
+  tmp_dir = tempfile.mkdtemp(prefix="returnn-meta-dataset-benchmark-")
+  try:
+    results = []
+    for name, func in [("pickle", benchmark_pickle), ("index", benchmark_index)]:
+      print("Run %s." % name)
+      res = func(tmp_dir)
+      print(">>> %s: %r" % (name, res))
+      results.append((name, res))
+  finally:
+    shutil.rmtree(tmp_dir)
+
+  print("-" * 20)
+  print("Settings:")
+  pprint(base_settings)
+  print("Final results:")
+  for name, res in results:
+    print("  %s: load %s, per epoch %s, mem %s (peak %s)" % (
+      name, hms_fraction(res["load_time"]), hms_fraction(res["epoch_time"]),
+      human_bytes_size(res["mem"]), human_bytes_size(res["mem_peak"])))
+  print("Done.")
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+
+"""
+Benchmarking the startup time of RETURNN for short jobs,
+i.e. ``rnn.py`` with ``task = "nop"``, and ``tools/dump-dataset.py`` on a small generated dataset.
+Each command is run multiple times in a fresh process, and we report the min and mean wall time.
+
+For a breakdown of a single run, use ``rnn.py <config> --profile-startup``
+or ``tools/dump-dataset.py <dataset> --profile_startup``.
+"""
+
+from __future__ import print_function
+import sys
+import os
+import time
+import subprocess
+from argparse import ArgumentParser
+from pprint import pprint
+
+my_dir = os.path.dirname(os.path.abspath(__file__))
+returnn_dir = os.path.dirname(my_dir)
+sys.path += [returnn_dir]
+
+import better_exchook
+from Util import hms_fraction
+
+
+# You can play around with these. E.g. use "num_runs=10" as command-line args.
+base_settings = {
+  "num_runs": 5,
+  "use_tensorflow": 1,  # backend for the nop task
+}
+
+
+def get_commands():
+  """
+  :return: name -> command
+  :rtype: dict[str,list[str]]
+  """
+  return {
+    "nop": [
+      sys.executable, "%s/rnn.py" % returnn_dir,
+      "++task", "nop", "++use_tensorflow", str(base_settings["use_tensorflow"]), "++log_verbosity", "2"],
+    "dump-dataset": [
+      sys.executable, "%s/tools/dump-dataset.py" % returnn_dir,
+      "{'class': 'Task12AXDataset', 'num_seqs': 5}", "--type", "null", "--endseq", "2", "--verbosity", "2"]}
+
+
+def benchmark(cmd):
+  """
+  :param list[str] cmd:
+  :return: wall time in seconds for each run
+  :rtype: list[float]
+  """
+  times = []
+  for _ in range(base_settings["num_runs"]):
+    start_time = time.time()
+    subprocess.check_call(cmd, cwd=returnn_dir, stdout=subprocess.DEVNULL)
+    times.append(time.time() - start_time)
+  return times
+
+
+def main():
+  print("Benchmarking RETURNN startup time.")
+  better_exchook.install()
+  print("Args:", " ".join(sys.argv))
+  arg_parser = ArgumentParser()
+  arg_parser.add_argument("cfg", nargs="*", help="opt=value, opt in %r" % sorted(base_settings.keys()))
+  args = arg_parser.parse_args()
+  for opt in args.cfg:
+    key, value = opt.split("=", 1)
+    assert key in base_settings
+    value_type = type(base_settings[key])
+    base_settings[key] = value_type(value)
+  print("Settings:")
+  pprint(base_settings)
+
+  results = []
+  for key, cmd in sorted(get_commands().items()):
+    print("Run %s: %s" % (key, " ".join(cmd)))
+    times = benchmark(cmd)
+    print(">>> Runtime of %s: min %s, mean %s" % (
+      key, hms_fraction(min(times)), hms_fraction(sum(times) / len(times))))
+    results.append((key, times))
+
+  print("-" * 20)
+  print("Settings:")
+  pprint(base_settings)
+  print("Final results:")
+  for key, times in results:
+    print("  %s: min %s, mean %s" % (key, hms_fraction(min(times)), hms_fraction(sum(times) / len(times))))
+  print("Done.")
+
+
+if __name__ == "__main__":
+  main()
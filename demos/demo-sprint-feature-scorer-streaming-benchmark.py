@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+
+"""
+Benchmarking the Sprint PythonFeatureScorer (:class:`SprintInterface.PythonFeatureScorer`) on a synthetic stream,
+i.e. features are added frame by frame, as it would be the case for online decoding.
+We measure the latency until the first scores are available, and the real time factor (RTF).
+
+Compare e.g.::
+
+  demo-sprint-feature-scorer-streaming-benchmark.py chunk_size=0
+  demo-sprint-feature-scorer-streaming-benchmark.py chunk_size=50 chunk_right_context=10
+  demo-sprint-feature-scorer-streaming-benchmark.py chunk_size=50 keep_state=1
+
+Each setting needs a fresh process, as the SprintInterface keeps a global config.
+"""
+
+from __future__ import print_function
+import sys
+import os
+import time
+import tempfile
+import shutil
+from argparse import ArgumentParser
+from pprint import pprint
+
+my_dir = os.path.dirname(os.path.abspath(__file__))
+returnn_dir = os.path.dirname(my_dir)
+sys.path += [returnn_dir]
+
+import better_exchook
+from Util import hms_fraction
+import numpy
+
+
+# You can play around with these. E.g. use "chunk_size=50" as command-line args.
+base_settings = {
+  "num_segments": 5,
+  "num_frames": 1000,  # per segment
+  "frame_shift": 0.01,  # secs, for the RTF
+  "realtime": 0,  # if set, simulate that the features arrive in real time
+  "num_inputs": 40,
+  "num_outputs": 1000,
+  "hidden_dim": 512,
+  "chunk_size": 0,  # 0 -> forward the whole segment at once in compute()
+  "chunk_left_context": 0,
+  "chunk_right_context": 0,
+  "keep_state": 0,  # carry over the LSTM state from chunk to chunk
+}
+
+
+def make_config(filename):
+  """
+  :param str filename: where we write the config to
+  """
+  lstm_opts = {}
+  if base_settings["keep_state"]:
+    lstm_opts["initial_state"] = "keep_over_epoch"
+  network = {
+    "lstm1": dict(
+      {"class": "rec", "unit": "lstm", "n_out": base_settings["hidden_dim"], "from": ["data"]}, **lstm_opts),
+    "lstm2": dict(
+      {"class": "rec", "unit": "lstm", "n_out": base_settings["hidden_dim"], "from": ["lstm1"]}, **lstm_opts),
+    "output": {"class": "softmax", "loss": "ce", "from": ["lstm2"]}}
+  config = {
+    "use_tensorflow": True,
+    "num_inputs": base_settings["num_inputs"],
+    "num_outputs": base_settings["num_outputs"],
+    "network": network,
+    "allow_random_model_init": True,
+    "log_verbosity": 2,
+    "sprint_feature_scorer_chunk_size": base_settings["chunk_size"],
+    "sprint_feature_scorer_chunk_left_context": base_settings["chunk_left_context"],
+    "sprint_feature_scorer_chunk_right_context": base_settings["chunk_right_context"],
+    "sprint_feature_scorer_chunk_keep_state": bool(base_settings["keep_state"]),
+  }
+  with open(filename, "w") as f:
+    f.write("#!rnn.py\n")
+    for key, value in sorted(config.items()):
+      f.write("%s = %r\n" % (key, value))
+
+
+def benchmark(scorer):
+  """
+  :param SprintInterface.PythonFeatureScorer scorer:
+  :return: (first score latencies, total compute times, audio durations), all in secs, per segment
+  :rtype: (list[float], list[float], list[float])
+  """
+  rnd = numpy.random.RandomState(42)
+  num_frames = base_settings["num_frames"]
+  frame_shift = base_settings["frame_shift"]
+  latencies, compute_times, durations = [], [], []
+  for seg in range(base_settings["num_segments"]):
+    features = rnd.normal(size=(num_frames, base_settings["num_inputs"])).astype("float32")
+    scorer.reset(0)
+    start_time = time.time()
+    idle_time = 0.
+    for t in range(num_frames):
+      if base_settings["realtime"]:
+        # Features arrive every frame_shift secs. Do not count the waiting as compute time.
+        wait_time = start_time + (t + 1) * frame_shift - time.time()
+        if wait_time > 0:
+          time.sleep(wait_time)
+          idle_time += wait_time
+      scorer.add_feature(features[t], t)
+    scorer.compute(num_frames)
+    for t in range(num_frames):
+      scorer.get_scores(t)
+    compute_times.append(time.time() - start_time - idle_time)
+    durations.append(num_frames * frame_shift)
+    latencies.append(scorer.first_score_latency)
+    scorer.reset(num_frames)
+    print("Segment %i: first score latency %s, RTF %.3f" % (
+      seg, hms_fraction(latencies[-1]), compute_times[-1] / durations[-1]))
+  return latencies, compute_times, durations
+
+
+def main():
+  print("Benchmarking Sprint PythonFeatureScorer streaming.")
+  better_exchook.install()
+  print("Args:", " ".join(sys.argv))
+  arg_parser = ArgumentParser()
+  arg_parser.add_argument("cfg", nargs="*", help="opt=value, opt in %r" % sorted(base_settings.keys()))
+  args = arg_parser.parse_args()
+  for opt in args.cfg:
+    key, value = opt.split("=", 1)
+    assert key in base_settings
+    value_type = type(base_settings[key])
+    base_settings[key] = value_type(value)
+  print("Settings:")
+  pprint(base_settings)
+
+  tmp_dir = tempfile.mkdtemp(prefix="returnn-sprint-streaming-benchmark-")
+  try:
+    config_filename = "%s/returnn.config" % tmp_dir
+    make_config(config_filename)
+    import SprintInterface
+    scorer = SprintInterface.init(
+      name="Sprint.PythonControl", sprint_unit="PythonFeatureScorer",
+      config="configfile:%s,prior_scale:0" % config_filename, callback=None, version_number=1)
+    scorer.init(input_dim=base_settings["num_inputs"], output_dim=base_settings["num_outputs"])
+    latencies, compute_times, durations = benchmark(scorer)
+  finally:
+    shutil.rmtree(tmp_dir)
+
+  print("-" * 20)
+  print("Settings:")
+  pprint(base_settings)
+  print("Final results:")
+  # Ignore the first segment for the average, as it includes the graph warmup.
+  if len(latencies) > 1:
+    latencies, compute_times, durations = latencies[1:], compute_times[1:], durations[1:]
+  print("  first score latency: mean %s, max %s" % (
+    hms_fraction(sum(latencies) / len(latencies)), hms_fraction(max(latencies))))
+  print("  RTF: %.3f" % (sum(compute_times) / sum(durations)))
+  print("Done.")
+
+
+if __name__ == "__main__":
+  main()
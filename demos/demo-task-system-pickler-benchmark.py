@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+
+"""
+Benchmarking the round-trip throughput of :class:`TaskSystem.Pickler` and :class:`TaskSystem.Unpickler`
+for typical feature batches, i.e. a dict with some Numpy arrays, like what we send to the Theano device process,
+or from Sprint (see SprintExternInterface).
+
+We compare the in-band pickling (the Numpy data is part of the pickled stream, the default)
+vs. the out-of-band pickling (``buffer_callback``, the data is sent as raw buffers),
+both in memory, and via a pipe (like :class:`TaskSystem.ExecingProcess_ConnectionWrapper`).
+"""
+
+from __future__ import print_function
+import sys
+import os
+import time
+import threading
+from argparse import ArgumentParser
+from pprint import pprint
+
+my_dir = os.path.dirname(os.path.abspath(__file__))
+returnn_dir = os.path.dirname(my_dir)
+sys.path += [returnn_dir]
+
+import numpy
+import better_exchook
+from TaskSystem import Pickler, Unpickler, ExecingProcess_Pipe
+from Util import BytesIO, human_bytes_size
+
+
+# You can play around with these. E.g. use "num_seqs=100" as command-line args.
+base_settings = {
+  "num_runs": 20,
+  "num_time": 500,  # frames per seq
+  "num_seqs": 40,  # per batch
+  "num_inputs": 40,  # feature dim
+}
+
+
+def make_batch():
+  """
+  :return: like the data for Device.update_data, or the data from Sprint for one segment
+  :rtype: dict[str]
+  """
+  rnd = numpy.random.RandomState(42)
+  num_time, num_seqs = base_settings["num_time"], base_settings["num_seqs"]
+  return {
+    "data": rnd.uniform(-1., 1., size=(num_time, num_seqs, base_settings["num_inputs"])).astype("float32"),
+    "classes": rnd.randint(0, 1000, size=(num_time, num_seqs)).astype("int32"),
+    "index": numpy.ones((num_time, num_seqs), dtype="int8"),
+    "tags": ["corpus/seq-%i" % i for i in range(num_seqs)]}
+
+
+def in_memory_in_band(obj):
+  """
+  :param object obj:
+  :rtype: object
+  """
+  stream = BytesIO()
+  Pickler(stream).dump(obj)
+  return Unpickler(BytesIO(stream.getvalue())).load()
+
+
+def in_memory_out_of_band(obj):
+  """
+  :param object obj:
+  :rtype: object
+  """
+  stream = BytesIO()
+  buffers = []
+  Pickler(stream, buffer_callback=buffers.append).dump(obj)
+  # Copy the buffers, as they would be copied when they are sent somewhere.
+  return Unpickler(BytesIO(stream.getvalue()), buffers=[bytes(bytearray(b)) for b in buffers]).load()
+
+
+class PipeRoundTrip:
+  """
+  Sends the obj over a pipe to another thread, which sends it back.
+  """
+
+  def __init__(self, out_of_band):
+    """
+    :param bool out_of_band: if False, the protocol as it was before, i.e. the Numpy data in-band
+    """
+    self.out_of_band = out_of_band
+    self.conn, self.other_conn = ExecingProcess_Pipe()
+    self.thread = threading.Thread(target=self._echo_loop)
+    self.thread.daemon = True
+    self.thread.start()
+
+  def _send(self, conn, obj):
+    if self.out_of_band:
+      conn.send(obj)  # this uses out-of-band buffers
+    else:
+      stream = BytesIO()
+      Pickler(stream).dump(obj)
+      conn.send_bytes(stream.getvalue())
+
+  def _recv(self, conn):
+    if self.out_of_band:
+      return conn.recv()
+    return Unpickler(BytesIO(conn.recv_bytes())).load()
+
+  def _echo_loop(self):
+    while True:
+      obj = self._recv(self.other_conn)
+      self._send(self.other_conn, obj)
+      if obj is None:
+        break
+
+  def __call__(self, obj):
+    """
+    :param object obj:
+    :rtype: object
+    """
+    self._send(self.conn, obj)
+    return self._recv(self.conn)
+
+  def close(self):
+    self(None)
+    self.thread.join()
+
+
+def benchmark(name, func, obj):
+  """
+  :param str name:
+  :param (object)->object func: round trip
+  :param dict[str] obj:
+  :return: time in seconds per round trip
+  :rtype: float
+  """
+  res = func(obj)  # warmup, and check
+  assert sorted(res.keys()) == sorted(obj.keys())
+  for key, value in obj.items():
+    assert numpy.array_equal(res[key], value)
+  start_time = time.time()
+  for i in range(base_settings["num_runs"]):
+    func(obj)
+  elapsed = (time.time() - start_time) / base_settings["num_runs"]
+  print("  %s: %.2f ms" % (name, elapsed * 1000.))
+  return elapsed
+
+
+def main():
+  print("Benchmarking TaskSystem Pickler round trip.")
+  better_exchook.install()
+  print("Args:", " ".join(sys.argv))
+  arg_parser = ArgumentParser()
+  arg_parser.add_argument("cfg", nargs="*", help="opt=value, opt in %r" % sorted(base_settings.keys()))
+  args = arg_parser.parse_args()
+  for opt in args.cfg:
+    key, value = opt.split("=", 1)
+    assert key in base_settings
+    value_type = type(base_settings[key])
+    base_settings[key] = value_type(value)
+  print("Settings:")
+  pprint(base_settings)
+
+  obj = make_batch()
+  num_bytes = sum([v.nbytes for v in obj.values() if isinstance(v, numpy.ndarray)])
+  print("Batch size: %s" % human_bytes_size(num_bytes))
+  results = {}
+  pipe_in_band = PipeRoundTrip(out_of_band=False)
+  pipe_out_of_band = PipeRoundTrip(out_of_band=True)
+  for name, func in [
+        ("in-memory in-band", in_memory_in_band),
+        ("in-memory out-of-band", in_memory_out_of_band),
+        ("pipe in-band", pipe_in_band),
+        ("pipe out-of-band", pipe_out_of_band)]:
+    results[name] = benchmark(name=name, func=func, obj=obj)
+  pipe_in_band.close()
+  pipe_out_of_band.close()
+
+  print("-" * 20)
+  print("Settings:")
+  pprint(base_settings)
+  print("Final results:")
+  for name, elapsed in sorted(results.items()):
+    print("  %s: %.2f ms, %s/sec" % (name, elapsed * 1000., human_bytes_size(int(num_bytes / max(elapsed, 1e-10)))))
+  for kind in ["in-memory", "pipe"]:
+    print("  %s speedup out-of-band vs in-band: %.1fx" % (
+      kind, results["%s in-band" % kind] / max(results["%s out-of-band" % kind], 1e-10)))
+  print("Done.")
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+
+"""
+Benchmarking KenLM scoring as used by :class:`KenLmStateLayer`,
+i.e. rescoring the accumulated string in every step (:func:`TFKenLM.ken_lm_abs_score_bpe_strings`)
+vs. advancing the KenLM state by one token per step (:func:`TFKenLM.ken_lm_advance_bpe_strings`),
+over different output lengths.
+
+The string-based variant is quadratic in the output length, the stateful variant is linear.
+"""
+
+from __future__ import print_function
+import sys
+import os
+import time
+from argparse import ArgumentParser
+from pprint import pprint
+
+sys.path += [os.path.dirname(os.path.dirname(os.path.abspath(__file__)))]
+
+import better_exchook
+import numpy
+import tensorflow as tf
+import TFKenLM
+from Util import hms_fraction
+
+
+# You can play around with these. E.g. use "beam_size=4" as command-line args.
+base_settings = {
+  "beam_size": 12,  # number of hypotheses per step
+  "output_lengths": "10,50,100,200",  # comma-separated
+  "dense": 0,  # whether to also get the dense scores for all words in the vocab
+  "num_vocab": 100,  # number of words to use from the LM vocab
+}
+
+
+def read_arpa_vocab(filename):
+  """
+  :param str filename: ARPA LM
+  :return: all words of the unigram section
+  :rtype: list[str]
+  """
+  words = []
+  in_unigrams = False
+  for line in open(filename):
+    line = line.strip()
+    if line == "\\1-grams:":
+      in_unigrams = True
+      continue
+    if not in_unigrams:
+      continue
+    if not line or line.startswith("\\"):
+      break
+    words.append(line.split("\t")[1])
+  return words
+
+
+def benchmark(lm_file, output_len, stateful):
+  """
+  :param str lm_file:
+  :param int output_len:
+  :param bool stateful:
+  :return: runtime in seconds for scoring all steps
+  :rtype: float
+  """
+  vocab = [w for w in read_arpa_vocab(lm_file) if w not in ["<s>"]][:base_settings["num_vocab"]]
+  rnd = numpy.random.RandomState(42)
+  beam_size = base_settings["beam_size"]
+  dense = bool(base_settings["dense"])
+  pieces = [[vocab[i] + " " for i in rnd.randint(0, len(vocab), size=(beam_size,))] for _ in range(output_len)]
+  with tf.Graph().as_default(), tf.Session() as session:
+    lm_tf = TFKenLM.ken_lm_load(filename=lm_file)
+    labels_tf = tf.constant(vocab)
+    states_tf = tf.placeholder(tf.string, [None])
+    pieces_tf = tf.placeholder(tf.string, [None])
+    if stateful:
+      if dense:
+        outputs_tf = TFKenLM.ken_lm_advance_bpe_strings_dense(
+          handle=lm_tf, bpe_merge_symbol="", states=states_tf, strings=pieces_tf, labels=labels_tf)
+      else:
+        outputs_tf = TFKenLM.ken_lm_advance_bpe_strings(
+          handle=lm_tf, bpe_merge_symbol="", states=states_tf, strings=pieces_tf)
+      new_states_tf = outputs_tf[0]
+    else:
+      new_states_tf = states_tf + pieces_tf
+      if dense:
+        outputs_tf = TFKenLM.ken_lm_abs_score_bpe_strings_dense(
+          handle=lm_tf, bpe_merge_symbol="", strings=new_states_tf, labels=labels_tf)
+      else:
+        outputs_tf = TFKenLM.ken_lm_abs_score_bpe_strings(
+          handle=lm_tf, bpe_merge_symbol="", strings=new_states_tf)
+    session.run(lm_tf.op)  # load the LM, not part of the benchmark
+    states = [""] * beam_size
+    start_time = time.time()
+    for t in range(output_len):
+      states, _ = session.run((new_states_tf, outputs_tf), feed_dict={states_tf: states, pieces_tf: pieces[t]})
+    return time.time() - start_time
+
+
+def main():
+  print("Benchmarking KenLM scoring.")
+  better_exchook.install()
+  print("Args:", " ".join(sys.argv))
+  arg_parser = ArgumentParser()
+  arg_parser.add_argument("cfg", nargs="*", help="opt=value, opt in %r" % sorted(base_settings.keys()))
+  arg_parser.add_argument("--lm", default=TFKenLM.kenlm_dir + "/lm/test.arpa", help="ARPA file")
+  args = arg_parser.parse_args()
+  for opt in args.cfg:
+    key, value = opt.split("=", 1)
+    assert key in base_settings
+    value_type = type(base_settings[key])
+    base_settings[key] = value_type(value)
+  print("Settings:")
+  pprint(base_settings)
+  TFKenLM.get_tf_mod(verbose=True)
+
+  results = []
+  for output_len in [int(n) for n in base_settings["output_lengths"].split(",")]:
+    for stateful in [False, True]:
+      runtime = benchmark(lm_file=args.lm, output_len=output_len, stateful=stateful)
+      key = "len %i, %s" % (output_len, "stateful" if stateful else "strings")
+      print(">>> Runtime of %s: %s" % (key, hms_fraction(runtime)))
+      results.append((key, runtime))
+
+  print("-" * 20)
+  print("Settings:")
+  pprint(base_settings)
+  print("Final results:")
+  for key, runtime in results:
+    print("  %s: %s" % (key, hms_fraction(runtime)))
+  print("Done.")
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+
+"""
+Benchmarking the TF network construction time, i.e. :func:`TFNetwork.construct_from_dict`,
+for a network with a big rec layer subnetwork (which needs the template construction)
+and a chain of feed-forward layers.
+The construction of the whole graph is done multiple times, each time in a new graph,
+and we report the min and mean time.
+Also, we measure copying :class:`TFUtil.Data`, which is done a lot during the construction.
+"""
+
+from __future__ import print_function
+import sys
+import os
+import time
+import timeit
+from argparse import ArgumentParser
+from pprint import pprint
+
+my_dir = os.path.dirname(os.path.abspath(__file__))
+returnn_dir = os.path.dirname(my_dir)
+sys.path += [returnn_dir]
+
+import better_exchook
+from Util import hms_fraction
+
+
+# You can play around with these. E.g. use "num_rec_layers=300" as command-line args.
+base_settings = {
+  "num_runs": 3,
+  "num_rec_layers": 100,  # in the rec layer subnetwork
+  "num_ff_layers": 50,  # outside, after the rec layer
+  "dim": 10,
+  "num_classes": 5,
+  "num_data_copies": 100000,
+}
+
+
+def make_net_dict():
+  """
+  :rtype: dict[str,dict[str]]
+  """
+  dim = base_settings["dim"]
+  subnet = {}
+  src = "data:source"
+  for i in range(base_settings["num_rec_layers"]):
+    name = "rec%i" % i
+    # Depend on the prev frame of itself, as in a typical decoder.
+    subnet[name] = {"class": "linear", "activation": "tanh", "n_out": dim, "from": [src, "prev:%s" % name]}
+    src = name
+  subnet["output"] = {"class": "copy", "from": src}
+  net_dict = {"rec": {"class": "rec", "from": "data", "unit": subnet}}
+  src = "rec"
+  for i in range(base_settings["num_ff_layers"]):
+    name = "ff%i" % i
+    net_dict[name] = {"class": "linear", "activation": "tanh", "n_out": dim, "from": src}
+    src = name
+  net_dict["output"] = {"class": "softmax", "loss": "ce", "from": src}
+  return net_dict
+
+
+def benchmark_network_construction():
+  """
+  :return: time in seconds for each run
+  :rtype: list[float]
+  """
+  import tensorflow as tf
+  from Config import Config
+  from TFNetwork import TFNetwork
+  config = Config({
+    "extern_data": {
+      "data": {"dim": base_settings["dim"]},
+      "classes": {"dim": base_settings["num_classes"], "sparse": True}}})
+  net_dict = make_net_dict()
+  times = []
+  for i in range(base_settings["num_runs"]):
+    with tf.Graph().as_default():
+      start_time = time.time()
+      network = TFNetwork(config=config, train_flag=True)
+      network.construct_from_dict(net_dict)
+      times.append(time.time() - start_time)
+    print("Run %i: %s" % (i, hms_fraction(times[-1])))
+  return times
+
+
+def benchmark_data_copy():
+  """
+  :return: name -> time in seconds for all copies
+  :rtype: dict[str,float]
+  """
+  from TFUtil import Data
+  data = Data(name="data", shape=(None, base_settings["dim"]))
+  num = base_settings["num_data_copies"]
+  return {
+    "Data(**get_kwargs())": timeit.timeit(lambda: Data(**data.get_kwargs()), number=num),
+    "copy_template": timeit.timeit(lambda: data.copy_template(), number=num),
+    "copy": timeit.timeit(lambda: data.copy(), number=num),
+    "copy_as_time_major": timeit.timeit(lambda: data.copy_as_time_major(), number=num)}
+
+
+def main():
+  print("Benchmarking TF network construction.")
+  better_exchook.install()
+  print("Args:", " ".join(sys.argv))
+  arg_parser = ArgumentParser()
+  arg_parser.add_argument("cfg", nargs="*", help="opt=value, opt in %r" % sorted(base_settings.keys()))
+  args = arg_parser.parse_args()
+  for opt in args.cfg:
+    key, value = opt.split("=", 1)
+    assert key in base_settings
+    value_type = type(base_settings[key])
+    base_settings[key] = value_type(value)
+  print("Settings:")
+  pprint(base_settings)
+
+  print("Data copy, %i times:" % base_settings["num_data_copies"])
+  data_copy_times = benchmark_data_copy()
+  for name, elapsed in sorted(data_copy_times.items()):
+    print("  %s: %s" % (name, hms_fraction(elapsed)))
+
+  print("Network construction:")
+  times = benchmark_network_construction()
+
+  print("-" * 20)
+  print("Settings:")
+  pprint(base_settings)
+  print("Final results:")
+  for name, elapsed in sorted(data_copy_times.items()):
+    print("  Data %s: %.1f copies/sec" % (name, base_settings["num_data_copies"] / max(elapsed, 1e-10)))
+  print("  network construction: min %s, mean %s" % (
+    hms_fraction(min(times)), hms_fraction(sum(times) / len(times))))
+  print("Done.")
+
+
+if __name__ == "__main__":
+  main()
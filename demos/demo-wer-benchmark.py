@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+
+"""
+Benchmarking ``tools/calculate-word-error-rate.py`` on a synthetic corpus.
+
+The refs are random sentences (Zipf-like word distribution),
+and the hyps are the refs with random substitutions, deletions and insertions.
+We run the tool with different settings, e.g. the TF backend with one seq per step (the old behavior),
+the TF backend with batches, and the NumPy backend with and without worker processes.
+All of them must produce exactly the same WER output.
+The variants with the TF backend are skipped if TensorFlow is not available.
+"""
+
+from __future__ import print_function
+import sys
+import os
+import time
+import subprocess
+import tempfile
+import shutil
+from argparse import ArgumentParser
+from pprint import pprint
+
+my_dir = os.path.dirname(os.path.abspath(__file__))
+returnn_dir = os.path.dirname(my_dir)
+sys.path += [returnn_dir]
+
+import better_exchook
+from Util import hms_fraction
+import numpy
+
+
+# You can play around with these. E.g. use "num_seqs=100000" as command-line args.
+base_settings = {
+  "num_seqs": 10000,
+  "sentence_len": 20,  # words, mean
+  "num_words": 5000,  # vocab size
+  "error_rate": 0.1,  # per word, for each of substitution, deletion, insertion
+  "batch_size": 1000,  # seqs per step
+  "num_workers": 4,
+}
+
+variants = {
+  "tf_single": ["--backend", "tf", "--batch_size", "1"],
+  "tf": ["--backend", "tf"],
+  "numpy": ["--backend", "numpy"],
+  "numpy_workers": ["--backend", "numpy", "--num_workers", "{num_workers}"],
+}
+
+
+def make_corpus():
+  """
+  :return: refs, hyps, both seq tag -> string
+  :rtype: (dict[str,str], dict[str,str])
+  """
+  rnd = numpy.random.RandomState(42)
+  num_words = base_settings["num_words"]
+  words = numpy.array(["w%i" % i for i in range(num_words)])
+  # Zipf-like distribution, as in real text.
+  probs = 1.0 / numpy.arange(1, num_words + 1)
+  probs /= probs.sum()
+  error_rate = base_settings["error_rate"]
+  refs, hyps = {}, {}
+  for i in range(base_settings["num_seqs"]):
+    seq_len = rnd.randint(0, base_settings["sentence_len"] * 2 + 1)
+    ref = list(words[rnd.choice(num_words, size=(seq_len,), p=probs)])
+    hyp = []
+    for word in ref:
+      r = rnd.uniform()
+      if r < error_rate:  # substitution
+        hyp.append(words[rnd.choice(num_words, p=probs)])
+      elif r < error_rate * 2:  # deletion
+        pass
+      else:
+        hyp.append(word)
+      if rnd.uniform() < error_rate:  # insertion
+        hyp.append(words[rnd.choice(num_words, p=probs)])
+    seq_tag = "corpus/seq%i" % i
+    refs[seq_tag] = " ".join(ref)
+    hyps[seq_tag] = " ".join(hyp)
+  return refs, hyps
+
+
+def have_tensorflow():
+  """
+  :rtype: bool
+  """
+  try:
+    # noinspection PyUnresolvedReferences,PyPackageRequirements
+    import tensorflow
+  except ImportError:
+    return False
+  return True
+
+
+def run_variant(name, data_dir):
+  """
+  :param str name:
+  :param str data_dir:
+  :return: time, WER output
+  :rtype: (float,str)
+  """
+  out_filename = "%s/%s.wer.txt" % (data_dir, name)
+  args = [
+    sys.executable, "%s/tools/calculate-word-error-rate.py" % returnn_dir,
+    "--refs", "%s/refs.py" % data_dir, "--hyps", "%s/hyps.py" % data_dir,
+    "--batch_size", str(base_settings["batch_size"]), "--verbosity", "2", "--out", out_filename]
+  args += [arg.format(**base_settings) for arg in variants[name]]
+  start_time = time.time()
+  subprocess.check_call(args, cwd=returnn_dir)
+  elapsed = time.time() - start_time
+  return elapsed, open(out_filename).read().strip()
+
+
+def main():
+  arg_parser = ArgumentParser()
+  arg_parser.add_argument("cfg", nargs="*", help="opt=value, opt in %r" % sorted(base_settings.keys()))
+  arg_parser.add_argument("--variants", help="comma-separated, from %r" % sorted(variants.keys()))
+  args = arg_parser.parse_args()
+  for opt in args.cfg:
+    key, value = opt.split("=", 1)
+    assert key in base_settings
+    value_type = type(base_settings[key])
+    base_settings[key] = value_type(value)
+
+  print("Benchmarking calculate-word-error-rate.py.")
+  better_exchook.install()
+  print("Args:", " ".join(sys.argv))
+  print("Settings:")
+  pprint(base_settings)
+  variant_names = args.variants.split(",") if args.variants else sorted(variants.keys())
+  for name in variant_names:
+    assert name in variants, "unknown variant %r, available: %r" % (name, sorted(variants.keys()))
+
+  results = {}
+  data_dir = tempfile.mkdtemp(prefix="returnn-wer-benchmark-")
+  try:
+    print("Create corpus in %s." % data_dir)
+    refs, hyps = make_corpus()
+    with open("%s/refs.py" % data_dir, "w") as f:
+      f.write(repr(refs))
+    with open("%s/hyps.py" % data_dir, "w") as f:
+      f.write(repr(hyps))
+    for name in variant_names:
+      if name.startswith("tf") and not have_tensorflow():
+        print("Skip %s, TensorFlow not available." % name)
+        continue
+      print("Run %s." % name)
+      results[name] = run_variant(name, data_dir)
+      print(">>> %s: %s, WER %s%%" % (name, hms_fraction(results[name][0]), results[name][1]))
+  finally:
+    shutil.rmtree(data_dir)
+
+  print("-" * 20)
+  print("Settings:")
+  pprint(base_settings)
+  print("Final results:")
+  for name in variant_names:
+    if name not in results:
+      print("  %s: skipped" % name)
+      continue
+    elapsed, wer = results[name]
+    print("  %s: %s, %.1f seqs/sec, WER %s%%" % (
+      name, hms_fraction(elapsed), base_settings["num_seqs"] / max(elapsed, 1e-10), wer))
+  wers = set([wer for (_, wer) in results.values()])
+  assert len(wers) <= 1, "WER output differs: %r" % results
+  print("Done.")
+
+
+if __name__ == "__main__":
+  main()
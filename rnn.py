@@ -22,15 +22,17 @@ __email__ = "doetsch@i6.informatik.rwth-aachen.de"
 import os
 import sys
 import time
+_startup_time = time.time()  # for --profile-startup, see startup_profile_phase()
+_startup_modules = set(sys.modules.keys())
 import typing
 import numpy
 from Log import log
 from Config import Config
 from Dataset import Dataset, init_dataset, init_dataset_via_str
-from HDFDataset import HDFDataset
+from CachedDataset import CachedDataset
 from Debug import init_ipython_kernel, init_better_exchook, init_faulthandler, init_cuda_not_in_main_proc_check
 from Util import init_thread_join_hack, describe_returnn_version, describe_theano_version, \
-  describe_tensorflow_version, BackendEngine, get_tensorflow_version_tuple
+  describe_tensorflow_version, BackendEngine, get_tensorflow_version_tuple, hms_fraction
 
 
 config = None  # type: typing.Optional[Config]
@@ -40,6 +42,56 @@ dev_data = None  # type: typing.Optional[Dataset]
 eval_data = None  # type: typing.Optional[Dataset]
 quit_returnn = False
 server = None
+startup_profile = None  # type: typing.Optional[typing.List[typing.Tuple[str,float,typing.List[str]]]]
+
+
+def startup_profile_phase(name):
+  """
+  Marks the end of a startup phase, for ``--profile-startup``.
+  The phase covers the time since the last call (or since the start of the rnn module import).
+
+  :param str name:
+  """
+  global _startup_time, _startup_modules
+  if startup_profile is None:
+    return
+  modules = set(sys.modules.keys())
+  startup_profile.append((name, time.time() - _startup_time, sorted(modules - _startup_modules)))
+  _startup_modules = modules
+  _startup_time = time.time()
+
+
+def print_startup_profile():
+  """
+  Prints the ``--profile-startup`` breakdown, i.e. time per phase, and the modules imported in each phase.
+  """
+  if not startup_profile:
+    return
+  import sysconfig
+  stdlib_dir = os.path.realpath(sysconfig.get_paths()["stdlib"])
+
+  def _is_relevant_package(mod_name):
+    """
+    :param str mod_name: top-level module name
+    :return: False for builtin and standard library modules
+    :rtype: bool
+    """
+    filename = getattr(sys.modules.get(mod_name), "__file__", None)
+    if not filename:
+      return False
+    filename = os.path.realpath(filename)
+    return not filename.startswith(stdlib_dir + os.sep) or "-packages" + os.sep in filename
+
+  print("Startup profile:", file=log.v1)
+  total = 0.0
+  for name, duration, modules in startup_profile:
+    total += duration
+    # Only the top-level packages, otherwise this would be too verbose.
+    packages = sorted(set([mod_name.split(".")[0] for mod_name in modules]))
+    packages = [mod_name for mod_name in packages if _is_relevant_package(mod_name)]
+    print("  %s: %s, %i new modules%s" % (
+      name, hms_fraction(duration), len(modules), (" (%s)" % ", ".join(packages)) if packages else ""), file=log.v1)
+  print("  total: %s" % hms_fraction(total), file=log.v1)
 
 
 def init_config(config_filename=None, command_line_options=(), default_config=None, extra_updates=None):
@@ -131,6 +183,32 @@ def init_config_json_network():
     config.network_topology_json = open(json_file).read()
 
 
+def init_native_ops():
+  """
+  Handles the native code compile cache options from the global config,
+  and maybe compiles the native ops ahead of time, in parallel.
+  Otherwise the ops are compiled lazily (serially) when the network is constructed.
+  """
+  from Util import NativeCodeCompiler
+  if config.value("native_code_cache_dir", None):
+    NativeCodeCompiler.CacheBaseDir = config.value("native_code_cache_dir", None)
+  print("Native code cache dir: %s" % NativeCodeCompiler.get_cache_base_dir(), file=log.v4)
+  prebuild = config.typed_value("native_ops_prebuild", False)  # bool or list of op names
+  if not prebuild or not BackendEngine.is_tensorflow_selected():
+    return
+  import TFNativeOp
+  if isinstance(prebuild, (list, tuple)):
+    op_names = list(prebuild)
+  else:
+    net_dict = config.typed_value("network", None)
+    op_names = TFNativeOp.get_op_names_from_network_dict(net_dict) if isinstance(net_dict, dict) else []
+  print("Prebuild native ops: %s" % (", ".join(op_names) or "(none)"), file=log.v3)
+  start_time = time.time()
+  TFNativeOp.prebuild_ops(op_names, num_workers=config.int("native_ops_prebuild_jobs", 0) or None)
+  print("Prebuild native ops took %s. Native code compiler: %s." % (
+    hms_fraction(time.time() - start_time), NativeCodeCompiler.get_stats_str()), file=log.v3)
+
+
 def init_theano_devices():
   """
   Only for Theano.
@@ -219,7 +297,7 @@ def load_data(config, cache_byte_size, files_config_key, **kwargs):
     config_str = config.value(files_config_key, "")
     data = init_dataset_via_str(config_str, config=config, cache_byte_size=cache_byte_size, **kwargs)
   cache_leftover = 0
-  if isinstance(data, HDFDataset):
+  if isinstance(data, CachedDataset):  # e.g. HDFDataset
     cache_leftover = data.definite_cache_leftover
   return data, cache_leftover
 
@@ -355,6 +433,31 @@ def init_backend_engine():
         assert horovod_reduce_type in ["grad", "param"], "config option 'horovod_reduce_type' invalid"
       if hvd.rank() == 0:  # Don't spam in all ranks.
         print("Horovod: Reduce type:", horovod_reduce_type, file=log.v3)
+    if config.int("local_data_parallel", 0) > 1:
+      import LocalDataParallel
+      local_data_parallel = LocalDataParallel.get_instance()
+      assert local_data_parallel, "LocalDataParallel.init not called"
+      session_opts = config.typed_dict.setdefault("tf_session_opts", {})
+      if "gpu" in config.value("device", "") or os.environ.get("CUDA_VISIBLE_DEVICES", ""):
+        gpu_opts = session_opts.setdefault("gpu_options", {})
+        assert "visible_device_list" not in gpu_opts
+        visible_devices = [d for d in os.environ.get("CUDA_VISIBLE_DEVICES", "").split(",") if d]
+        if visible_devices:
+          assert local_data_parallel.size <= len(visible_devices), "Local data parallel: %i workers but GPUs %r" % (
+            local_data_parallel.size, visible_devices)
+          # Each worker gets its device of the visible ones. CUDA is not initialized yet in this process.
+          os.environ["CUDA_VISIBLE_DEVICES"] = visible_devices[local_data_parallel.rank]
+          gpu_opts["visible_device_list"] = "0"
+        else:
+          gpu_opts["visible_device_list"] = str(local_data_parallel.rank)
+      else:
+        # Each worker gets its share of the CPU cores, if not specified otherwise.
+        from Util import guess_requested_max_num_threads
+        num_threads = max((guess_requested_max_num_threads() or 1) // local_data_parallel.size, 1)
+        session_opts.setdefault("intra_op_parallelism_threads", num_threads)
+        session_opts.setdefault("inter_op_parallelism_threads", num_threads)
+      print("Local data parallel: %r, reduce type %s, session opts %r." % (
+        local_data_parallel, config.value("local_data_parallel_reduce_type", "grad"), session_opts), file=log.v3)
     from TFUtil import debug_register_better_repr, setup_tf_thread_pools, print_available_devices
     tf_session_opts = config.typed_value("tf_session_opts", {})
     assert isinstance(tf_session_opts, dict)
@@ -380,11 +483,17 @@ def init(config_filename=None, command_line_options=(), config_updates=None, ext
   if config.bool("patch_atfork", False):
     from Util import maybe_restart_returnn_with_atfork_patch
     maybe_restart_returnn_with_atfork_patch()
+  if config.int("local_data_parallel", 0) > 1:
+    # This forks the workers, thus must be before TF is imported, and before the log is initialized.
+    import LocalDataParallel
+    LocalDataParallel.init(config)
   init_log()
+  startup_profile_phase("config and log")
   if extra_greeting:
     print(extra_greeting, file=log.v1)
   returnn_greeting(config_filename=config_filename, command_line_options=command_line_options)
   init_faulthandler()
+  startup_profile_phase("greeting")
   init_backend_engine()
   if BackendEngine.is_theano_selected():
     if config.value('task', 'train') == "theano_graph":
@@ -393,17 +502,24 @@ def init(config_filename=None, command_line_options=(), config_updates=None, ext
       init_cuda_not_in_main_proc_check()
   if config.bool('ipython', False):
     init_ipython_kernel()
+  startup_profile_phase("backend engine")
   init_config_json_network()
+  init_native_ops()
+  startup_profile_phase("native ops")
   devices = init_theano_devices()
+  startup_profile_phase("devices")
   if need_data():
     init_data()
   print_task_properties(devices)
+  startup_profile_phase("data")
   if config.value('task', 'train') == 'server':
     import Server
     global server
     server = Server.Server(config)
   else:
     init_engine(devices)
+  startup_profile_phase("engine")
+  print_startup_profile()
 
 
 def finalize():
@@ -421,6 +537,9 @@ def finalize():
   elif BackendEngine.is_tensorflow_selected():
     if engine:
       engine.finalize()
+  if config and config.int("local_data_parallel", 0) > 1:
+    import LocalDataParallel
+    LocalDataParallel.finish()
 
 
 def need_data():
@@ -635,6 +754,11 @@ def main(argv):
   :param list[str] argv:
   """
   return_code = 0
+  if "--profile-startup" in argv:
+    global startup_profile
+    startup_profile = []
+    argv = [arg for arg in argv if arg != "--profile-startup"]
+    startup_profile_phase("imports")
   try:
     assert len(argv) >= 2, "usage: %s <config>" % argv[0]
     init(command_line_options=argv[1:])
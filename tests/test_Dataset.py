@@ -326,6 +326,20 @@ def test_task12ax_window():
   assert_equal(list(data2a[-1, 2]), [0] * input_dim)  # zero-padded right
 
 
+def test_get_dataset_class_ascii_locale():
+  # get_dataset_class looks into the source files, some of them are not pure ASCII.
+  import os
+  from subprocess import check_output
+  env = dict(os.environ)
+  env.update({"LC_ALL": "C", "LANG": "C", "PYTHONUTF8": "0", "PYTHONCOERCECLOCALE": "0"})
+  env.pop("PYTHONIOENCODING", None)
+  returnn_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+  out = check_output(
+    [sys.executable, "-c", "from Dataset import get_dataset_class; print(get_dataset_class('DummyDataset').__name__)"],
+    cwd=returnn_dir, env=env)
+  assert_equal(out.decode("utf8").strip(), "DummyDataset")
+
+
 if __name__ == "__main__":
   better_exchook.install()
   if len(sys.argv) <= 1:
@@ -259,6 +259,43 @@ def test_SimpleHDFWriter_small():
     print(repr(gzip.compress(open(fn, "rb").read())))
 
 
+def test_SimpleHDFWriter_buffered():
+  n_dim = 5
+  rnd = numpy.random.RandomState(42)
+  batches = []
+  for i in range(10):
+    seq_lens = rnd.randint(1, 20, size=(rnd.randint(1, 5),)).tolist()
+    batches.append((
+      rnd.normal(size=(len(seq_lens), max(seq_lens), n_dim)).astype("float32"),
+      seq_lens,
+      rnd.randint(0, 10, size=(len(seq_lens), max(seq_lens))).astype("int32")))
+  for write_in_background in [False, True]:
+    fn = _get_tmp_file(suffix=".hdf")
+    # Small buffer size, such that we get multiple chunks, and multiple resizes.
+    writer = SimpleHDFWriter(filename=fn, dim=n_dim, max_buffer_size=1000, write_in_background=write_in_background)
+    seq_idx = 0
+    for data, seq_lens, classes in batches:
+      writer.insert_batch(
+        inputs=data, seq_len=seq_lens, seq_tag=["seq-%i" % (seq_idx + i) for i in range(len(seq_lens))],
+        extra={"classes": classes})
+      seq_idx += len(seq_lens)
+    writer.close()
+
+    dataset = HDFDataset(files=[fn])
+    reader = _DatasetReader(dataset=dataset)
+    reader.read_all()
+    assert reader.num_seqs == seq_idx
+    seq_idx = 0
+    for data, seq_lens, classes in batches:
+      for i, seq_len in enumerate(seq_lens):
+        assert reader.seq_tags[seq_idx] == "seq-%i" % seq_idx
+        assert reader.seq_lens[seq_idx]["data"] == seq_len
+        assert reader.seq_lens[seq_idx]["classes"] == max(seq_lens)  # extra data is not cut
+        numpy.testing.assert_array_equal(reader.data["data"][seq_idx], data[i, :seq_len])
+        numpy.testing.assert_array_equal(reader.data["classes"][seq_idx], classes[i])
+        seq_idx += 1
+
+
 def test_read_simple_hdf():
   if sys.version_info[0] <= 2:  # gzip.decompress is >=PY3
     raise unittest.SkipTest
@@ -423,6 +460,111 @@ def test_hdf_no_cache_iter():
   assert not dataset._preload_seqs.was_called
 
 
+def test_SeqSlabCache():
+  from CachedDataset import SeqSlabCache
+  cache = SeqSlabCache(num_blocks=5, block_size=2, frame_shape=[3], dtype="float32")
+  rnd = numpy.random.RandomState(42)
+  seqs = {i: rnd.normal(size=(n, 3)).astype("float32") for i, n in enumerate([3, 1, 4, 2, 11])}
+  cache.put(0, seqs[0], extra="a")  # 2 blocks
+  cache.put(1, seqs[1], extra="b")  # 1 block
+  assert cache.lookup(0)  # 0 is now the most recently used one
+  cache.put(2, seqs[2], extra="c")  # 2 blocks, cache is full now
+  assert_equal(cache.num_evictions, 0)
+  cache.put(3, seqs[3], extra="d")  # 1 block, evicts 1
+  assert_equal(cache.num_evictions, 1)
+  assert 1 not in cache and not cache.lookup(1)
+  for i in [0, 2, 3]:
+    data, extra = cache.get(i)
+    numpy.testing.assert_array_equal(data, seqs[i])
+    assert_equal(extra, "abcd"[i])
+  cache.put(1, seqs[1])  # evicts 0 (2 blocks), and uses one of those
+  cache.put(0, seqs[0])  # evicts 2, and gets non-contiguous blocks
+  assert 2 not in cache
+  for i in [0, 1, 3]:
+    numpy.testing.assert_array_equal(cache.get(i)[0], seqs[i])
+  cache.put(4, seqs[4])  # does not fit into the slab
+  numpy.testing.assert_array_equal(cache.get(4)[0], seqs[4])
+  assert_equal((cache.num_hits, cache.num_misses), (1, 1))
+  assert_equal(cache.num_evictions, 3)
+  cache.put(2, seqs[2][:1])  # 1 block, which is free, but evicts 4 anyway, as it does not fit
+  assert_equal(cache.num_evictions, 4)
+  assert 4 not in cache
+  for i in [0, 1, 3]:
+    numpy.testing.assert_array_equal(cache.get(i)[0], seqs[i])
+  numpy.testing.assert_array_equal(cache.get(2)[0], seqs[2][:1])
+  print(cache.get_stats_str())
+
+
+def test_SeqSlabCache_max_bytes():
+  from CachedDataset import SeqSlabCache
+  # Block size is 2 * 3 * 4 = 24 bytes.
+  cache = SeqSlabCache(num_blocks=5, block_size=2, frame_shape=[3], dtype="float32", max_bytes=100)
+  seqs = {i: numpy.full((2, 3), i, dtype="float32") for i in range(5)}
+  extra = {"classes": numpy.zeros((4,), dtype="int32")}  # 16 bytes
+  for i in range(3):
+    cache.put(i, seqs[i], extra=extra)  # 40 bytes each
+  # 120 bytes would be over the budget, although there are enough free blocks.
+  assert_equal(cache.num_evictions, 1)
+  assert 0 not in cache
+  assert_equal(cache.get_used_bytes(), 80)
+  cache.put(3, seqs[3], extra={"classes": numpy.zeros((20,), dtype="int32")})  # 104 bytes, over the budget
+  assert_equal(cache.num_evictions, 1)
+  numpy.testing.assert_array_equal(cache.get(3)[0], seqs[3])
+  assert_equal(cache.get_used_bytes(), 80 + 24 + 80)
+  cache.put(4, seqs[4], extra=extra)  # evicts 3 first, then 1
+  assert_equal(cache.num_evictions, 3)
+  assert_equal(sorted([i for i in range(5) if i in cache]), [2, 4])
+  assert_equal(cache.get_used_bytes(), 80)
+  assert cache.get_used_bytes() <= cache.max_bytes
+
+
+def test_hdf_slab_lru_cache_iter():
+  hdf_fn = generate_hdf_from_dummy()
+  ref_dataset = HDFDataset(files=[hdf_fn])
+  ref_dataset.initialize()
+  # 17 frames * 13 dims * 4 bytes, i.e. 1 block per seq, plus 17 * 4 bytes for the classes, fits 5 seqs.
+  dataset = HDFDataset(files=[hdf_fn], cache_byte_size=5 * (32 * 13 * 4 + 17 * 4), cache_backend="slab_lru")
+  dataset.initialize()
+  for epoch in [1, 2]:
+    ref_dataset.init_seq_order(epoch=epoch)
+    dataset.init_seq_order(epoch=epoch)
+    seq_idx = 0
+    while dataset.is_less_than_num_seqs(seq_idx):
+      ref_dataset.load_seqs(seq_idx, seq_idx + 1)
+      dataset.load_seqs(max(seq_idx - 1, 0), seq_idx + 1)
+      assert dataset.is_cached(seq_idx, seq_idx + 1)
+      for key in ["data", "classes"]:
+        numpy.testing.assert_array_equal(
+          dataset.get_data(seq_idx, key), ref_dataset.get_data(seq_idx, key))
+      seq_idx += 1
+    assert_equal(seq_idx, 23)
+    # Every seq is loaded once, and looked up again in the next step.
+    assert_equal(dataset._seq_cache.num_misses, 23)
+    assert_equal(dataset._seq_cache.num_hits, 22)
+    assert_equal(dataset._seq_cache.num_evictions, 23 - 5 + (5 if epoch > 1 else 0))
+
+
+def test_hdf_slab_lru_cache_unlimited():
+  hdf_fn = generate_hdf_from_dummy()
+  ref_dataset = HDFDataset(files=[hdf_fn])
+  ref_dataset.initialize()
+  dataset = HDFDataset(files=[hdf_fn], cache_byte_size=-1, cache_backend="slab_lru")
+  dataset.initialize()
+  for epoch in [1, 2]:
+    ref_dataset.init_seq_order(epoch=epoch)
+    dataset.init_seq_order(epoch=epoch)
+    dataset.load_seqs(0, 23)
+    for seq_idx in range(23):
+      ref_dataset.load_seqs(seq_idx, seq_idx + 1)
+      for key in ["data", "classes"]:
+        numpy.testing.assert_array_equal(
+          dataset.get_data(seq_idx, key), ref_dataset.get_data(seq_idx, key))
+    # Everything fits, and the data is read via the seq cache, not from the file.
+    assert_equal(dataset._seq_cache.num_misses, 23 if epoch == 1 else 0)
+    assert_equal(dataset._seq_cache.num_evictions, 0)
+    assert all([real_seq_idx in dataset._seq_cache for real_seq_idx in range(23)])
+
+
 def test_hdf_data_short_int_dtype():
   from GeneratingDataset import StaticDataset
   dataset = StaticDataset([
@@ -0,0 +1,139 @@
+
+from __future__ import print_function
+
+import sys
+sys.path += ["."]  # Python 3 hack
+
+import os
+import numpy
+from nose.tools import assert_equal, assert_true, assert_false, assert_is_instance
+from Config import Config
+from GeneratingDataset import StaticDataset
+from HyperParamTuning import HyperParam, Optimization, Individual, _SharedTrainData
+import better_exchook
+better_exchook.replace_traceback_format_tb()
+from Log import log
+log.initialize(verbosity=[5])
+
+
+def _make_train_data(num_seqs):
+  """
+  :param int num_seqs:
+  :return: seq i has i % 5 + 1 frames, and the data of frame t of seq i is [i, t]
+  :rtype: StaticDataset
+  """
+  data = []
+  for i in range(num_seqs):
+    seq_len = i % 5 + 1
+    data.append({
+      "data": numpy.array([[i, t] for t in range(seq_len)], dtype="float32"),
+      "classes": numpy.arange(seq_len, dtype="int32") + i})
+  return StaticDataset(data=data, output_dim={"data": (2, 2), "classes": (1000, 1)})
+
+
+def _make_optimization(num_seqs, num_rungs=1, eta=2):
+  """
+  :param int num_seqs:
+  :param int num_rungs:
+  :param int eta:
+  :rtype: Optimization
+  """
+  config = Config()
+  config.update({
+    "learning_rate": HyperParam(float, [1e-6, 1], log=True, default=0.01),
+    "hyper_param_tuning": {
+      "num_tune_iterations": 1, "num_individuals": 4, "num_train_steps": num_seqs,
+      "num_workers": 1, "num_threads_per_worker": 1,
+      "successive_halving_num_rungs": num_rungs, "successive_halving_eta": eta}})
+  return Optimization(config=config, train_data=_make_train_data(num_seqs))
+
+
+def test_Optimization_rung_seq_ranges():
+  optim = _make_optimization(num_seqs=90, num_rungs=3, eta=3)
+  assert_equal([optim.get_rung_seq_range(i) for i in range(3)], [(0, 10), (10, 30), (30, 90)])
+  # Each end is eta times the previous end, i.e. each rung is (eta - 1) times the previous rungs together.
+  assert_equal(optim.rung_seq_ends, [10, 30, 90])
+
+
+def test_Optimization_rung_seq_ranges_rounding():
+  optim = _make_optimization(num_seqs=21, num_rungs=3, eta=2)
+  assert_equal(optim.rung_seq_ends, [6, 11, 21])
+
+
+def test_Optimization_rung_seq_ranges_min_one_seq():
+  optim = _make_optimization(num_seqs=3, num_rungs=3, eta=4)
+  assert_equal([optim.get_rung_seq_range(i) for i in range(3)], [(0, 1), (1, 2), (2, 3)])
+
+
+def test_Optimization_single_rung():
+  optim = _make_optimization(num_seqs=7)
+  assert_equal([optim.get_rung_seq_range(i) for i in range(optim.num_rungs)], [(0, 7)])
+
+
+def test_Optimization_select_rung_survivors():
+  optim = _make_optimization(num_seqs=10, num_rungs=2, eta=3)
+  individuals = [Individual(hyper_param_mapping={}, name="i%i" % i) for i in range(7)]
+  for individual, cost in zip(individuals, [5., 1., 7., 3., 2., 6., 4.]):
+    individual.cost = cost
+  survivors, stopped = optim.select_rung_survivors(individuals)
+  assert_equal([p.name for p in survivors], ["i1", "i4"])  # 7 // 3, the best ones
+  assert_equal(sorted([p.name for p in stopped]), sorted(["i0", "i2", "i3", "i5", "i6"]))
+  survivors, stopped = optim.select_rung_survivors(survivors)
+  assert_equal([p.name for p in survivors], ["i1"])  # always at least one continues
+  assert_equal([p.name for p in stopped], ["i4"])
+
+
+def test_SharedTrainData_get_dataset():
+  dataset = _make_train_data(num_seqs=7)
+  shared = _SharedTrainData(dataset)
+  try:
+    assert_true(os.path.isdir(shared.dirname))
+    for start, end in [(0, None), (2, 5), (6, 7)]:
+      part = shared.get_dataset(start_seq_idx=start, end_seq_idx=end)
+      assert_is_instance(part, StaticDataset)
+      assert_equal(part.num_outputs, dataset.num_outputs)
+      expected = dataset.data[start:end]
+      assert_equal(len(part.data), len(expected))
+      for seq, expected_seq in zip(part.data, expected):
+        assert_equal(sorted(seq.keys()), ["classes", "data"])
+        for key in ["classes", "data"]:
+          assert_equal(seq[key].dtype, expected_seq[key].dtype)
+          numpy.testing.assert_array_equal(seq[key], expected_seq[key])
+          assert_false(seq[key].flags.writeable)  # read-only view on the shared file
+          assert_is_instance(seq[key].base, numpy.memmap)
+  finally:
+    shared.remove()
+  assert_false(os.path.exists(shared.dirname))
+
+
+def test_SharedTrainData_dataset_usable():
+  shared = _SharedTrainData(_make_train_data(num_seqs=4))
+  try:
+    part = shared.get_dataset(start_seq_idx=1, end_seq_idx=3)
+    part.init_seq_order(epoch=1)
+    part.load_seqs(0, 2)
+    assert_equal(part.get_seq_length(0)["data"], 2)
+    numpy.testing.assert_array_equal(part.get_data(1, "data"), [[2, 0], [2, 1], [2, 2]])
+    numpy.testing.assert_array_equal(part.get_data(1, "classes"), [2, 3, 4])
+  finally:
+    shared.remove()
+
+
+if __name__ == "__main__":
+  better_exchook.install()
+  if len(sys.argv) <= 1:
+    for k, v in sorted(globals().items()):
+      if k.startswith("test_"):
+        print("-" * 40)
+        print("Executing: %s" % k)
+        v()
+        print("-" * 40)
+    print("Finished all tests.")
+  else:
+    assert len(sys.argv) >= 2
+    for arg in sys.argv[1:]:
+      print("Executing: %s" % arg)
+      if arg in globals():
+        globals()[arg]()  # assume function and execute
+      else:
+        eval(arg)  # assume Python code and execute
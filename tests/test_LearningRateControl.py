@@ -184,6 +184,35 @@ def test_newbob_multi_epoch():
   assert_equal(lrc.get_learning_rate_for_epoch(2), lr)  # epoch 2 cannot be a different lr yet
 
 
+def test_newbob_pending_epoch_error():
+  lr = 0.01
+  config = Config()
+  config.update({"learning_rate_control": "newbob", "learning_rate": lr})
+  lrc = load_learning_rate_control_from_config(config)
+  waited_epochs = []
+
+  def make_wait_func(epoch, dev_score):
+    def wait_func():
+      waited_epochs.append(epoch)
+      lrc.set_epoch_error(epoch, {"dev_score": {'cost:output': dev_score}})
+    return wait_func
+
+  for epoch, (train_score, dev_score) in enumerate([(2.0, 2.1), (1.0, 2.5)], 1):
+    assert_equal(lrc.get_learning_rate_for_epoch(epoch), lr)
+    lrc.set_epoch_error(epoch, {"train_score": {'cost:output': train_score}})
+    lrc.set_epoch_error_pending(epoch, make_wait_func(epoch, dev_score))
+    assert lrc.has_pending_epoch_errors()
+    if epoch == 1:
+      lrc.set_epoch_error(1, {"dev_score": {'cost:output': dev_score}})  # arrived before it was needed
+      assert not lrc.has_pending_epoch_errors()
+  assert_equal(waited_epochs, [])
+  # The dev score got worse, so the lr decreases. This needs the pending dev score of epoch 2.
+  assert lrc.get_learning_rate_for_epoch(3) < lr
+  assert_equal(waited_epochs, [2])
+  assert not lrc.has_pending_epoch_errors()
+  assert_equal(lrc.get_error_key(2), "dev_score")
+
+
 if __name__ == "__main__":
   better_exchook.install()
   if len(sys.argv) <= 1:
@@ -0,0 +1,241 @@
+from __future__ import print_function
+
+import sys
+sys.path += ["."]  # Python 3 hack
+
+import os
+import time
+import unittest
+import numpy
+import numpy.testing
+from nose.tools import assert_equal, assert_raises
+from LocalDataParallel import LocalDataParallel, LocalDataParallelError
+import better_exchook
+better_exchook.replace_traceback_format_tb()
+
+
+def run_in_workers(num_workers, func):
+  """
+  :param int num_workers:
+  :param (LocalDataParallel)->None func: called in all the workers
+  """
+  local_data_parallel = LocalDataParallel(num_workers=num_workers)
+  local_data_parallel.start_workers()
+  if local_data_parallel.is_main():
+    try:
+      func(local_data_parallel)
+    except BaseException:
+      local_data_parallel.abort()
+      raise
+    finally:
+      local_data_parallel.finish()  # raises if some other worker failed
+  else:
+    # We must not return in the forked worker, as that would continue with the tests.
+    exit_code = 0
+    try:
+      func(local_data_parallel)
+    except LocalDataParallelError as exc:
+      print("Worker %r: %s" % (local_data_parallel, exc))
+      exit_code = 1
+    except BaseException:
+      better_exchook.better_exchook(*sys.exc_info())
+      local_data_parallel.abort()
+      exit_code = 1
+    sys.stdout.flush()
+    os._exit(exit_code)
+
+
+def run_in_subprocess(func_name):
+  """
+  For tests with TF: We cannot fork anymore after TF was used in this process (the TF threads would be missing
+  in the forked workers), thus we run such tests in a new process.
+
+  :param str func_name: in this module
+  """
+  import subprocess
+  my_dir = os.path.dirname(os.path.abspath(__file__))
+  subprocess.check_call(
+    [sys.executable, "%s/test_LocalDataParallel.py" % my_dir, func_name], cwd=os.path.dirname(my_dir))
+
+
+def test_allreduce():
+  def func(local_data_parallel):
+    """
+    :param LocalDataParallel local_data_parallel:
+    """
+    rank, size = local_data_parallel.rank, local_data_parallel.size
+    for i in range(3):  # reuse the buffers
+      res = local_data_parallel.allreduce("x", numpy.array([rank, 1., i], dtype="float32"), average=False)
+      numpy.testing.assert_array_equal(res, [sum(range(size)), size, i * size])
+    res = local_data_parallel.allreduce("x", numpy.arange(7, dtype="float32") * (rank + 1))
+    numpy.testing.assert_allclose(res, numpy.arange(7) * (size + 1) / 2.)
+    res = local_data_parallel.allreduce("scalar", numpy.array(rank, dtype="int32"), average=False)
+    assert_equal(res, sum(range(size)))
+
+  run_in_workers(num_workers=3, func=func)
+
+
+def test_allreduce_multiple_broadcast():
+  def func(local_data_parallel):
+    """
+    :param LocalDataParallel local_data_parallel:
+    """
+    rank = local_data_parallel.rank
+    values = [numpy.full((2, 3), rank, dtype="float32"), numpy.full((4,), 2 * rank, dtype="float32")]
+    res = local_data_parallel.allreduce_multiple("params", values)
+    assert_equal([v.shape for v in res], [(2, 3), (4,)])
+    numpy.testing.assert_allclose(res[0], 0.5)
+    numpy.testing.assert_allclose(res[1], 1.)
+    res = local_data_parallel.broadcast_multiple("init_params", [v + 1 for v in values])
+    numpy.testing.assert_array_equal(res[0], 1.)
+    numpy.testing.assert_array_equal(res[1], 1.)
+
+  run_in_workers(num_workers=2, func=func)
+
+
+def _check_WrapOptimizer_average_grads_twice_in_one_step():
+  def func(local_data_parallel):
+    """
+    :param LocalDataParallel local_data_parallel:
+    """
+    # Import TF only here, i.e. after the fork.
+    import tensorflow as tf
+    import LocalDataParallel as LocalDataParallelModule
+    from TFUpdater import WrapOptimizer
+    from Config import Config
+    rank = local_data_parallel.rank
+    LocalDataParallelModule._instance = local_data_parallel  # get_instance() is used by WrapOptimizer
+    try:
+      # Enough threads such that independent ops can run in parallel, independent of the num of CPUs.
+      session_config = tf.ConfigProto(inter_op_parallelism_threads=4)
+      with tf.Graph().as_default(), tf.Session(config=session_config) as session:
+        var1 = tf.Variable([0., 0.], name="var1")
+        var2 = tf.Variable([0., 0.], name="var2")
+        optimizer = WrapOptimizer(
+          config=Config(), learning_rate=tf.constant(1.), global_train_step=tf.Variable(0, trainable=False),
+          use_locking=False)
+        optimizer.create_all_needed_optimizers([var1, var2])
+        # Like for the meta losses: two separate reductions, which run in the same session.run.
+        # The grads of the first loss are delayed in one worker, and of the second loss in the other worker,
+        # such that the reductions would run in different order in the workers if they were not serialized.
+        def _make_scales(scales, delayed_rank):
+          def _get_scales():
+            if rank == delayed_rank:
+              time.sleep(0.1)
+            return numpy.array(scales, dtype="float32")
+          scales_ = tf.py_func(_get_scales, [], tf.float32, stateful=True)
+          scales_.set_shape((2,))
+          return scales_
+        loss1 = tf.reduce_sum(var1 * _make_scales([rank + 1., 1.], delayed_rank=0))  # grads [rank + 1, 1]
+        loss2 = tf.reduce_sum(var2 * _make_scales([1., 10. * (rank + 1.)], delayed_rank=1))  # grads [1, 10 (rank + 1)]
+        update_op = tf.group(
+          optimizer.get_apply_grads_op(loss1, [var1]), optimizer.get_apply_grads_op(loss2, [var2]))
+        session.run(tf.global_variables_initializer())
+        for step in range(3):
+          session.run(update_op)
+          # Averaged over 2 workers, and with learning rate 1.
+          numpy.testing.assert_allclose(session.run(var1), [-1.5 * (step + 1), -1. * (step + 1)])
+          numpy.testing.assert_allclose(session.run(var2), [-1. * (step + 1), -15. * (step + 1)])
+    finally:
+      LocalDataParallelModule._instance = None
+
+  run_in_workers(num_workers=2, func=func)
+
+
+def test_WrapOptimizer_average_grads_twice_in_one_step():
+  run_in_subprocess("_check_WrapOptimizer_average_grads_twice_in_one_step")
+
+
+def _check_Engine_eval_not_sliced():
+  def func(local_data_parallel):
+    """
+    :param LocalDataParallel local_data_parallel:
+    """
+    # Import TF only here, i.e. after the fork.
+    import LocalDataParallel as LocalDataParallelModule
+    from TFEngine import Engine
+    from Config import Config
+    from Dataset import init_dataset
+    LocalDataParallelModule._instance = local_data_parallel  # get_instance() is used by the Engine
+    try:
+      config = Config()
+      config.update({
+        "num_outputs": 2, "num_inputs": 9,
+        "network": {"output": {"class": "softmax", "loss": "ce"}},
+        "max_seqs": 1,  # one batch per seq, such that a slice would cover only some of the seqs
+        "start_epoch": 1, "num_epochs": 1})
+      train_data = init_dataset({"class": "Task12AXDataset", "num_seqs": 4})
+      dev_data = init_dataset({"class": "Task12AXDataset", "num_seqs": 5, "fixed_random_seed": 1})
+      engine = Engine(config=config)
+      engine.init_train_from_config(config=config, train_data=train_data, dev_data=dev_data, eval_data=None)
+      train_data.init_seq_order(epoch=1)
+      for train in [True, False]:
+        # noinspection PyProtectedMember
+        data_provider = engine._get_new_data_provider(
+          dataset=train_data, batches=train_data.generate_batches(recurrent_net=True, batch_size=0, max_seqs=1),
+          train=train)
+        assert_equal(
+          data_provider.batch_slice, slice(local_data_parallel.rank, None, local_data_parallel.size) if train else None)
+      score = engine.eval_model()["dev"]["score"]["cost:output"]
+      # All workers evaluated on all the dev data, i.e. they have the same score.
+      all_scores = local_data_parallel.allreduce_multiple(
+        "scores", [numpy.array(score if i == local_data_parallel.rank else 0., dtype="float64")
+                   for i in range(local_data_parallel.size)], average=False)
+      numpy.testing.assert_allclose(all_scores, [score] * local_data_parallel.size)
+      engine.finalize()
+    finally:
+      LocalDataParallelModule._instance = None
+
+  run_in_workers(num_workers=2, func=func)
+
+
+def test_Engine_eval_not_sliced():
+  run_in_subprocess("_check_Engine_eval_not_sliced")
+
+
+def test_worker_failure():
+  def func(local_data_parallel):
+    """
+    :param LocalDataParallel local_data_parallel:
+    """
+    local_data_parallel.barrier()
+    if local_data_parallel.rank == 1:
+      raise Exception("test_worker_failure: expected failure in worker 1")
+    local_data_parallel.barrier()  # should not hang
+
+  assert_raises(LocalDataParallelError, lambda: run_in_workers(num_workers=3, func=func))
+
+
+def test_worker_died():
+  def func(local_data_parallel):
+    """
+    :param LocalDataParallel local_data_parallel:
+    """
+    if local_data_parallel.rank == 1:
+      os._exit(1)  # no abort, just gone
+    local_data_parallel.barrier()  # should not hang
+
+  assert_raises(LocalDataParallelError, lambda: run_in_workers(num_workers=2, func=func))
+
+
+if __name__ == "__main__":
+  better_exchook.install()
+  if len(sys.argv) <= 1:
+    for k, v in sorted(globals().items()):
+      if k.startswith("test_"):
+        print("-" * 40)
+        print("Executing: %s" % k)
+        try:
+          v()
+        except unittest.SkipTest as exc:
+          print("SkipTest:", exc)
+        print("-" * 40)
+    print("Finished all tests.")
+  else:
+    assert len(sys.argv) >= 2
+    for arg in sys.argv[1:]:
+      print("Executing: %s" % arg)
+      if arg in globals():
+        globals()[arg]()  # assume function and execute
+      else:
+        eval(arg)  # assume Python code and execute
@@ -0,0 +1,279 @@
+import os
+import sys
+my_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, "%s/.." % my_dir)
+
+from MetaDataset import *
+from Dataset import get_dataset_config_hash
+from HDFDataset import HDFDataset
+from nose.tools import assert_equal, assert_raises
+import Util
+import numpy
+import better_exchook
+better_exchook.install()
+better_exchook.replace_traceback_format_tb()
+Util.init_thread_join_hack()
+
+from Log import log
+log.initialize(verbosity=[5])
+
+
+_hdf_cache = {}  # opts -> hdf fn
+
+
+def generate_hdf_from_other(opts):
+  """
+  :param dict[str] opts:
+  :return: hdf filename
+  :rtype: str
+  """
+  from Util import make_hashable
+  cache_key = make_hashable(opts)
+  if cache_key in _hdf_cache:
+    return _hdf_cache[cache_key]
+  import tempfile
+  import atexit
+  from HDFDataset import HDFDatasetWriter
+  f = tempfile.NamedTemporaryFile(suffix=".hdf", delete=False)
+  f.close()
+  fn = f.name
+  atexit.register(lambda: os.remove(fn))
+  dataset = init_dataset(opts)
+  hdf_dataset = HDFDatasetWriter(fn)
+  hdf_dataset.dump_from_dataset(dataset)
+  hdf_dataset.close()
+  _hdf_cache[cache_key] = fn
+  return fn
+
+
+def make_combined_dataset(num_seqs_a, num_seqs_b, **kwargs):
+  """
+  :param int num_seqs_a:
+  :param int num_seqs_b:
+  :rtype: CombinedDataset
+  """
+  datasets = {
+    key: {"class": "HDFDataset", "files": [generate_hdf_from_other(
+      {"class": "DummyDataset", "input_dim": 2, "output_dim": 3, "num_seqs": num_seqs, "seq_len": 5})]}
+    for (key, num_seqs) in [("a", num_seqs_a), ("b", num_seqs_b)]}
+  data_map = {
+    ("a", "data"): "data", ("a", "classes"): "classes",
+    ("b", "data"): "data", ("b", "classes"): "classes"}
+  return CombinedDataset(datasets=datasets, data_map=data_map, **kwargs)
+
+
+def get_dataset_seq_idxs(dataset):
+  """
+  :param CombinedDataset dataset:
+  :return: list of (dataset-key, seq tag) in the order of the combined dataset
+  :rtype: list[(str,str)]
+  """
+  res = []
+  seq_idx = 0
+  while dataset.is_less_than_num_seqs(seq_idx):
+    dataset.load_seqs(seq_idx, seq_idx + 1)
+    dataset_idx, dataset_seq_idx = dataset.dataset_sorted_seq_idx_list[seq_idx].tolist()
+    dataset_key = dataset.dataset_idx2key_map[dataset_idx]
+    assert_equal(dataset.get_tag(seq_idx), dataset.datasets[dataset_key].get_tag(dataset_seq_idx))
+    res.append((dataset_key, dataset.get_tag(seq_idx)))
+    seq_idx += 1
+  return res
+
+
+def test_CombinedDataset_default():
+  dataset = make_combined_dataset(num_seqs_a=3, num_seqs_b=5, seq_ordering="default")
+  dataset.init_seq_order(epoch=1)
+  res = get_dataset_seq_idxs(dataset)
+  assert_equal(res, [("a", "seq-%i" % i) for i in range(3)] + [("b", "seq-%i" % i) for i in range(5)])
+
+
+def test_CombinedDataset_random_dataset():
+  dataset = make_combined_dataset(num_seqs_a=7, num_seqs_b=13, seq_ordering="random_dataset")
+  for epoch in [1, 2]:
+    dataset.init_seq_order(epoch=epoch)
+    res = get_dataset_seq_idxs(dataset)
+    print("epoch %i:" % epoch, res)
+    assert_equal(len(res), 20)
+    # The order within each sub-dataset is kept.
+    assert_equal([tag for (key, tag) in res if key == "a"], ["seq-%i" % i for i in range(7)])
+    assert_equal([tag for (key, tag) in res if key == "b"], ["seq-%i" % i for i in range(13)])
+
+
+def test_CombinedDataset_random_dataset_distribution():
+  dataset = make_combined_dataset(num_seqs_a=10, num_seqs_b=30, seq_ordering="random_dataset")
+  # Every position should be from dataset a with probability 1/4.
+  counts = numpy.zeros((40,))
+  num_epochs = 200
+  for epoch in range(1, num_epochs + 1):
+    dataset.init_seq_order(epoch=epoch)
+    counts += (dataset.seq_order < 10)
+  freqs = counts / num_epochs
+  print("freqs:", freqs)
+  assert numpy.all(numpy.abs(freqs - 0.25) < 0.15)
+
+
+def test_SeqTagIndex():
+  tags = ["a/1", "a/2", "b/1", "\u00e4/3", ""]
+  index = SeqTagIndex.from_tags(tags)
+  assert_equal(len(index), len(tags))
+  assert_equal(index.get_tags(), tags)
+  for i, tag in enumerate(tags):
+    assert_equal(index.get_index(tag), i)
+  assert_raises(KeyError, lambda: index.get_index("c/1"))
+  other = SeqTagIndex.from_tags(["b/1", "a/1", ""])
+  assert_equal(index.get_indices_of(other).tolist(), [2, 0, 4])
+  assert_raises(KeyError, lambda: other.get_indices_of(index))
+  assert_equal(index.get_indices_of(SeqTagIndex.from_tags(tags)).tolist(), list(range(len(tags))))
+
+
+def test_SeqTagIndex_hash_collisions():
+  class CollidingSeqTagIndex(SeqTagIndex):
+    """
+    Weak hash, such that we get many collisions.
+    """
+    @staticmethod
+    def hash_tag(tag):
+      return len(tag)
+
+  tags = ["a/1", "a/2", "b/1", "bb/1", ""]
+  index = CollidingSeqTagIndex.from_tags(tags)
+  for i, tag in enumerate(tags):
+    assert_equal(index.get_index(tag), i)
+  assert_raises(KeyError, lambda: index.get_index("c/1"))
+  other = CollidingSeqTagIndex.from_tags(["b/1", "a/2", "bb/1", "", "a/1"])
+  assert_equal(index.get_indices_of(other).tolist(), [2, 1, 3, 4, 0])
+  assert_raises(KeyError, lambda: index.get_indices_of(CollidingSeqTagIndex.from_tags(["a/1", "c/1"])))
+
+
+def test_MetaDataset_seq_list_index_file():
+  import tempfile
+  import shutil
+  tmp_dir = tempfile.mkdtemp()
+  try:
+    hdf_fn = generate_hdf_from_other(
+      {"class": "DummyDataset", "input_dim": 2, "output_dim": 3, "num_seqs": 11, "seq_len": 5})
+    seq_list_index_file = "%s/seq_list.npz" % tmp_dir
+    opts = dict(
+      datasets={key: {"class": "HDFDataset", "files": [hdf_fn]} for key in ["a", "b"]},
+      data_map={"data": ("a", "data"), "classes": ("b", "classes")},
+      seq_list_index_file=seq_list_index_file, seq_ordering="random")
+    dataset = MetaDataset(**opts)
+    assert os.path.exists(seq_list_index_file)
+    assert dataset.seq_tag_indices["a"] is dataset.seq_tag_indices["b"]
+    dataset2 = MetaDataset(**opts)  # now loaded from seq_list_index_file
+    assert dataset2.seq_tag_indices["a"] is dataset2.seq_tag_indices["b"]
+    assert dataset2.seq_tag_indices["a"].is_same_as(dataset.seq_tag_indices["a"])
+    for epoch in [1, 2]:
+      dataset.init_seq_order(epoch=epoch)
+      dataset2.init_seq_order(epoch=epoch)
+      assert_equal(dataset.num_seqs, 11)
+      dataset.load_seqs(0, dataset.num_seqs)
+      dataset2.load_seqs(0, dataset2.num_seqs)
+      for seq_idx in range(dataset.num_seqs):
+        tag = dataset.get_tag(seq_idx)
+        assert_equal(tag, dataset2.get_tag(seq_idx))
+        assert_equal(tag, dataset.datasets["a"].get_tag(seq_idx))
+        assert_equal(tag, dataset.datasets["b"].get_tag(seq_idx))
+        numpy.testing.assert_array_equal(
+          dataset.get_data(seq_idx, "data"), dataset.datasets["a"].get_data(seq_idx, "data"))
+        numpy.testing.assert_array_equal(
+          dataset.get_data(seq_idx, "classes"), dataset2.get_data(seq_idx, "classes"))
+  finally:
+    shutil.rmtree(tmp_dir)
+
+
+def test_MetaDataset_seq_list_index_file_outdated():
+  import tempfile
+  import shutil
+  tmp_dir = tempfile.mkdtemp()
+  try:
+    hdf_fn = generate_hdf_from_other(
+      {"class": "DummyDataset", "input_dim": 2, "output_dim": 3, "num_seqs": 11, "seq_len": 5})
+    hdf_dataset = HDFDataset(files=[hdf_fn])
+    tags = hdf_dataset.get_all_tags()
+    seq_list_file = "%s/seq_list.txt" % tmp_dir
+    seq_list_index_file = "%s/seq_list.npz" % tmp_dir
+    opts = dict(
+      datasets={"a": {"class": "HDFDataset", "files": [hdf_fn]}}, data_map={"data": ("a", "data")},
+      seq_list_file=seq_list_file, seq_list_index_file=seq_list_index_file)
+    with open(seq_list_file, "w") as f:
+      f.write("\n".join(tags[:7]))
+    dataset = MetaDataset(**opts)
+    assert_equal(dataset.num_total_seqs, 7)
+    assert_equal(MetaDataset(**opts).num_total_seqs, 7)  # loaded from seq_list_index_file
+    with open(seq_list_file, "w") as f:
+      f.write("\n".join(tags[3:]))
+    dataset = MetaDataset(**opts)  # seq_list_file changed, thus recreates the seq_list_index_file
+    assert_equal(dataset.num_total_seqs, 8)
+    assert_equal(dataset.seq_tag_indices["a"].get_tags(), tags[3:])
+    opts.pop("seq_list_file")
+    dataset = MetaDataset(**opts)  # other seq list source, thus recreates the seq_list_index_file
+    assert_equal(dataset.num_total_seqs, 11)
+  finally:
+    shutil.rmtree(tmp_dir)
+
+
+def test_MetaDataset_seq_len_index_dir():
+  import tempfile
+  import shutil
+  tmp_dir = tempfile.mkdtemp()
+  try:
+    hdf_fn = generate_hdf_from_other({"class": "Task12AXDataset", "num_seqs": 11})
+    opts = {
+      "class": "MetaDataset",
+      "datasets": {key: {"class": "HDFDataset", "files": [hdf_fn]} for key in ["a", "b"]},
+      "data_map": {"data": ("a", "data"), "classes": ("b", "classes")},
+      "seq_ordering": "sorted", "seq_len_index_dir": tmp_dir}
+    dataset = init_dataset(opts)
+    assert isinstance(dataset, MetaDataset)
+    assert dataset.supports_seq_len_index()
+    assert not dataset.have_corpus_seq_idx()  # this would change other code paths, e.g. in forwarding
+    assert_equal(dataset.seq_len_index_key, get_dataset_config_hash(dict(opts, seq_ordering="random")))
+    dataset.init_seq_order(epoch=1)  # the index is not complete yet
+    dataset.load_seqs(0, dataset.num_seqs)
+    tags = [dataset.get_tag(seq_idx) for seq_idx in range(dataset.num_seqs)]
+    seq_lens = [dataset.get_seq_length(seq_idx)["data"] for seq_idx in range(dataset.num_seqs)]
+    assert_equal(seq_lens, sorted(seq_lens))
+    assert len(set(seq_lens)) > 1
+    assert os.path.exists("%s/%s.seq_lens.npz" % (tmp_dir, dataset.seq_len_index_key))
+
+    dataset2 = init_dataset(opts)
+    assert isinstance(dataset2, MetaDataset)
+
+    def _get_seq_length(seq_idx):
+      raise Exception("should use the seq len index, seq idx %i" % seq_idx)
+
+    dataset2.datasets["a"].get_seq_length = _get_seq_length
+    dataset2.init_seq_order(epoch=1)
+    assert_equal([dataset2.get_tag(seq_idx) for seq_idx in range(dataset2.num_seqs)], tags)
+
+    # Same index (the data key is not part of the hash), but ordered by the lengths of another data key.
+    dataset3 = init_dataset(dict(opts, seq_ordering="sorted_reverse", seq_len_index_data_key="classes"))
+    assert isinstance(dataset3, MetaDataset)
+    assert_equal(dataset3.seq_len_index_key, dataset.seq_len_index_key)
+    dataset3.datasets["a"].get_seq_length = _get_seq_length
+    dataset3.init_seq_order(epoch=1)
+    dataset3.load_seqs(0, dataset3.num_seqs)
+    seq_lens = [dataset3.get_seq_length(seq_idx)["classes"] for seq_idx in range(dataset3.num_seqs)]
+    assert_equal(seq_lens, sorted(seq_lens, reverse=True))
+  finally:
+    shutil.rmtree(tmp_dir)
+
+
+if __name__ == "__main__":
+  better_exchook.install()
+  if len(sys.argv) <= 1:
+    for k, v in sorted(globals().items()):
+      if k.startswith("test_"):
+        print("-" * 40)
+        print("Executing: %s" % k)
+        v()
+        print("-" * 40)
+  else:
+    assert len(sys.argv) >= 2
+    for arg in sys.argv[1:]:
+      print("Executing: %s" % arg)
+      if arg in globals():
+        globals()[arg]()  # assume function and execute
+      else:
+        eval(arg)  # assume Python code and execute
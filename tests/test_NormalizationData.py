@@ -0,0 +1,92 @@
+
+from __future__ import print_function
+
+import sys
+sys.path += ["."]  # Python 3 hack
+
+import os
+import shutil
+import tempfile
+import numpy
+import h5py
+from nose.tools import assert_equal
+from NormalizationData import NormalizationData
+import better_exchook
+better_exchook.replace_traceback_format_tb()
+
+
+def _create_normalization_file(num_workers):
+  """
+  :param int num_workers:
+  :return: normalization data, and the concatenated inputs and outputs of all the dataset files
+  :rtype: (NormalizationData, numpy.ndarray, numpy.ndarray)
+  """
+  rnd = numpy.random.RandomState(42)
+  tmp_dir = tempfile.mkdtemp("test-NormalizationData")
+  try:
+    all_inputs, all_outputs = [], []
+    filenames = []
+    for i in range(3):
+      filename = "%s/data%i.hdf" % (tmp_dir, i)
+      with h5py.File(filename, "w") as f:
+        for j, num_frames in enumerate([rnd.randint(1, 30), rnd.randint(1, 30)]):
+          inputs = rnd.normal(loc=3., scale=2., size=(num_frames, 5)).astype("float32")
+          outputs = rnd.uniform(-1., 5., size=(num_frames, 2)).astype("float32")
+          f.create_dataset("%s/seq%i" % (NormalizationData.GROUP_INPUTS, j), data=inputs)
+          f.create_dataset("%s/seq%i" % (NormalizationData.GROUP_OUTPUTS, j), data=outputs)
+          all_inputs.append(inputs)
+          all_outputs.append(outputs)
+      filenames.append(filename)
+    bundle_filename = "%s/files.bundle" % tmp_dir
+    with open(bundle_filename, "w") as f:
+      f.write("".join(["%s\n" % filename for filename in filenames]))
+    norm_filename = "%s/norm.hdf" % tmp_dir
+    NormalizationData.createNormalizationFile(
+      bundle_filename, norm_filename, numWorkers=num_workers, chunkSize=7)
+    norm_data = NormalizationData(norm_filename)
+  finally:
+    shutil.rmtree(tmp_dir)
+  return norm_data, numpy.concatenate(all_inputs, axis=0), numpy.concatenate(all_outputs, axis=0)
+
+
+def _check_normalization_data(num_workers):
+  """
+  :param int num_workers:
+  """
+  norm_data, inputs, outputs = _create_normalization_file(num_workers=num_workers)
+  inputs = inputs.astype("float64")
+  outputs = outputs.astype("float64")
+  assert_equal(norm_data.inputMean.shape, (5,))
+  numpy.testing.assert_allclose(norm_data.inputMean, numpy.mean(inputs, axis=0), rtol=1e-6)
+  numpy.testing.assert_allclose(norm_data.inputVariance, numpy.var(inputs, axis=0), rtol=1e-6)
+  assert_equal(norm_data.outputMean.shape, (2,))
+  numpy.testing.assert_allclose(norm_data.outputMean, numpy.mean(outputs, axis=0), rtol=1e-6)
+  numpy.testing.assert_allclose(norm_data.outputVariance, numpy.var(outputs, axis=0), rtol=1e-6)
+
+
+def test_NormalizationData_single_process():
+  _check_normalization_data(num_workers=1)
+
+
+def test_NormalizationData_worker_processes():
+  _check_normalization_data(num_workers=2)
+
+
+if __name__ == "__main__":
+  better_exchook.install()
+  if len(sys.argv) <= 1:
+    for k, v in sorted(globals().items()):
+      if k.startswith("test_"):
+        print("-" * 40)
+        print("Executing: %s" % k)
+        v()
+        print("-" * 40)
+    print("Finished all tests.")
+  else:
+    assert len(sys.argv) >= 2
+    for arg in sys.argv[1:]:
+      print("Executing: %s" % arg)
+      if arg in globals():
+        globals()[arg]()  # assume function and execute
+      else:
+        eval(arg)  # assume Python code and execute
@@ -0,0 +1,105 @@
+
+# Tests for the chunked forwarding of SprintInterface.PythonFeatureScorer.
+# Unlike test_SprintInterface.py, this does not need Theano or TF, as we replace the forwarding.
+
+from __future__ import print_function
+
+import sys
+sys.path += ["."]  # Python 3 hack
+
+from nose.tools import assert_equal
+import SprintInterface
+from Config import Config
+import numpy
+import better_exchook
+better_exchook.replace_traceback_format_tb()
+
+
+class _FeatureScorer(SprintInterface.PythonFeatureScorer):
+  """
+  Uses its own config instead of the global rnn.config.
+  """
+
+  def __init__(self, config_opts):
+    """
+    :param dict[str] config_opts:
+    """
+    self._config = Config()
+    self._config.update(config_opts)
+    super(_FeatureScorer, self).__init__(callback=None, version_number=1, sprint_opts={})
+    # Like init(), but without the forwarding setup.
+    self.input_dim = 2
+    self.output_dim = 3
+
+  @property
+  def config(self):
+    """
+    :rtype: Config
+    """
+    return self._config
+
+
+def _run_feature_scorer(num_frames, chunk_size, left_context=0, right_context=0, get_scores_early=False):
+  """
+  The features of frame t are [t, -t], and the fake forwarding returns posteriors exp(-(t + 1)),
+  i.e. the scores of frame t are t + 1, such that we can check that each frame gets the right scores.
+
+  :param int num_frames:
+  :param int chunk_size:
+  :param int left_context:
+  :param int right_context:
+  :param bool get_scores_early: call get_scores() right after each add_feature, for all scored frames
+  :return: list of forwarded frames (including context) per call to _forward,
+    and the num of buffered features after each add_feature
+  :rtype: (list[list[int]], list[int])
+  """
+  forwarded_frames = []  # type: list[list[int]]
+
+  def _forward(segment_name, features, epoch_step=None):
+    assert epoch_step is None
+    assert features.shape[0] == 2
+    frames = [int(t) for t in features[0]]
+    forwarded_frames.append(frames)
+    return numpy.exp(-numpy.tile(numpy.array(frames, dtype="float32")[None, :] + 1., (3, 1)))
+
+  scorer = _FeatureScorer({
+    "sprint_feature_scorer_chunk_size": chunk_size,
+    "sprint_feature_scorer_chunk_left_context": left_context,
+    "sprint_feature_scorer_chunk_right_context": right_context})
+  orig_forward = SprintInterface._forward
+  SprintInterface._forward = _forward
+  num_buffered = []
+  try:
+    for t in range(num_frames):
+      scorer.add_feature(numpy.array([t, -t], dtype="float32"), time=t)
+      num_buffered.append(len(scorer.features))
+      if get_scores_early:
+        for t_ in range(scorer.num_frames_scored):
+          numpy.testing.assert_allclose(scorer.get_scores(t_), [t_ + 1.] * 3, rtol=1e-5)
+    scorer.compute(num_frames)
+    for t in range(num_frames):
+      numpy.testing.assert_allclose(scorer.get_scores(t), [t + 1.] * 3, rtol=1e-5)
+    scorer.reset(num_frames)
+  finally:
+    SprintInterface._forward = orig_forward
+  return forwarded_frames, num_buffered
+
+
+def test_PythonFeatureScorer_chunks():
+  forwarded_frames, num_buffered = _run_feature_scorer(num_frames=10, chunk_size=4)
+  assert_equal(forwarded_frames, [[0, 1, 2, 3], [4, 5, 6, 7], [8, 9]])
+  assert_equal(max(num_buffered), 3)  # a full chunk is forwarded right away, and then freed
+
+
+def test_PythonFeatureScorer_chunks_context():
+  forwarded_frames, num_buffered = _run_feature_scorer(
+    num_frames=11, chunk_size=4, left_context=2, right_context=1, get_scores_early=True)
+  # Chunks are 0-4, 4-8, 8-11, each with the context frames around, as far as available.
+  assert_equal(forwarded_frames, [[0, 1, 2, 3, 4], [2, 3, 4, 5, 6, 7, 8], [6, 7, 8, 9, 10]])
+  # We only keep the left context for the next chunk, and the features until the chunk can be forwarded.
+  assert_equal(max(num_buffered), 2 + 4 + 1 - 1)
+
+
+def test_PythonFeatureScorer_get_scores_before_compute():
+  forwarded_frames, _ = _run_feature_scorer(num_frames=7, chunk_size=3, right_context=2, get_scores_early=True)
+  assert_equal(forwarded_frames, [[0, 1, 2, 3, 4], [3, 4, 5, 6], [6]])
@@ -17,7 +17,7 @@ from TFEngine import *
 import TFUtil
 from TFNetwork import ExternData
 from Config import Config
-from nose.tools import assert_equal, assert_is_instance
+from nose.tools import assert_equal, assert_is_instance, assert_in
 import unittest
 import numpy
 import numpy.testing
@@ -154,6 +154,190 @@ def test_engine_train():
   engine.finalize()
 
 
+def test_engine_train_save_model_async():
+  from GeneratingDataset import DummyDataset
+  import tempfile
+  model_tmp_dir = tempfile.mkdtemp("tmp-checkpoint")
+  seq_len = 5
+  n_data_dim = 2
+  n_classes_dim = 3
+  train_data = DummyDataset(input_dim=n_data_dim, output_dim=n_classes_dim, num_seqs=4, seq_len=seq_len)
+  train_data.init_seq_order(epoch=1)
+  cv_data = DummyDataset(input_dim=n_data_dim, output_dim=n_classes_dim, num_seqs=2, seq_len=seq_len)
+  cv_data.init_seq_order(epoch=1)
+
+  config = Config()
+  config.update({
+    "model": model_tmp_dir + "/model",
+    "save_model_async": True,
+    "cleanup_old_models": {"keep_last_n": 1, "keep_best_n": 0, "keep": []},
+    "num_outputs": n_classes_dim,
+    "num_inputs": n_data_dim,
+    "network": {"output": {"class": "softmax", "loss": "ce"}},
+    "start_epoch": 1,
+    "num_epochs": 3
+  })
+  engine = Engine(config=config)
+  engine.init_train_from_config(config=config, train_data=train_data, dev_data=cv_data, eval_data=None)
+  cleanup_save_pending = []  # type: typing.List[bool]
+  orig_cleanup_old_models = engine.cleanup_old_models
+
+  def cleanup_old_models(**kwargs):
+    orig_cleanup_old_models(**kwargs)
+    # noinspection PyProtectedMember
+    cleanup_save_pending.append(bool(engine._async_checkpoint_saver))
+
+  engine.cleanup_old_models = cleanup_old_models
+  engine.train()
+  assert not engine._async_checkpoint_saver  # train() waits at the end
+  # The cleanup in each epoch does not wait for the save. The final one after train() waited for it.
+  assert_equal(cleanup_save_pending, [True, True, True, False])
+  assert_equal(sorted(engine.get_existing_models(config).keys()), [3])
+  params = engine.network.get_params_serialized(engine.tf_session)
+  assert not [fn for fn in os.listdir(model_tmp_dir) if ".tmp-save" in fn]
+
+  # The async saved checkpoint is a normal checkpoint. Load it into a new network.
+  engine.network.initialize_params(engine.tf_session)
+  engine.load_model(epoch=3)
+  params_loaded = engine.network.get_params_serialized(engine.tf_session)
+  for layer_name, layer_params in params.values_dict.items():
+    for param_name, param in layer_params.items():
+      numpy.testing.assert_array_equal(param, params_loaded.values_dict[layer_name][param_name])
+
+  # noinspection PyProtectedMember
+  saver = engine.network._async_checkpoint_saver
+  assert saver
+  engine.finalize()
+  # noinspection PyProtectedMember
+  assert saver._session._closed
+
+
+def test_engine_train_eval_in_side_process():
+  from GeneratingDataset import DummyDataset
+  import tempfile
+  model_tmp_dir = tempfile.mkdtemp("tmp-checkpoint")
+  seq_len = 5
+  n_data_dim = 2
+  n_classes_dim = 3
+  train_data = DummyDataset(input_dim=n_data_dim, output_dim=n_classes_dim, num_seqs=4, seq_len=seq_len)
+  train_data.init_seq_order(epoch=1)
+  dev_opts = {"class": "DummyDataset", "input_dim": n_data_dim, "output_dim": n_classes_dim, "num_seqs": 2,
+              "seq_len": seq_len}
+
+  config = Config()
+  config.update({
+    "model": model_tmp_dir + "/model",
+    "learning_rate_control": "newbob",  # needs the dev score of the previous epoch
+    "eval_in_side_process": True,
+    "dev": dev_opts,  # the side process loads it on its own
+    "num_outputs": n_classes_dim,
+    "num_inputs": n_data_dim,
+    "network": {"output": {"class": "softmax", "loss": "ce"}},
+    "start_epoch": 1,
+    "num_epochs": 3
+  })
+  from Dataset import init_dataset
+  dev_data = init_dataset(dev_opts)
+  engine = Engine(config=config)
+  engine.init_train_from_config(config=config, train_data=train_data, dev_data=dev_data, eval_data=None)
+  engine.train()
+  assert not engine._eval_side_process  # train() waits at the end
+  assert not engine.learning_rate_control.has_pending_epoch_errors()
+  for epoch in range(1, 4):
+    assert_equal(engine.learning_rate_control.get_error_key(epoch), "dev_score")
+
+  engine.finalize()
+
+
+def test_engine_train_eval_in_side_process_cleanup_old_models():
+  from GeneratingDataset import DummyDataset
+  import tempfile
+  model_tmp_dir = tempfile.mkdtemp("tmp-checkpoint")
+  seq_len = 5
+  n_data_dim = 2
+  n_classes_dim = 3
+  train_data = DummyDataset(input_dim=n_data_dim, output_dim=n_classes_dim, num_seqs=4, seq_len=seq_len)
+  train_data.init_seq_order(epoch=1)
+  dev_opts = {"class": "DummyDataset", "input_dim": n_data_dim, "output_dim": n_classes_dim, "num_seqs": 2,
+              "seq_len": seq_len}
+
+  config = Config()
+  config.update({
+    "model": model_tmp_dir + "/model",
+    "learning_rate_control": "newbob",  # waits in each epoch for the dev score of the previous epoch
+    "eval_in_side_process": True,
+    "cleanup_old_models": {"keep_last_n": 1, "keep_best_n": 0, "keep": []},
+    "dev": dev_opts,
+    "num_outputs": n_classes_dim,
+    "num_inputs": n_data_dim,
+    "network": {"output": {"class": "softmax", "loss": "ce"}},
+    "start_epoch": 1,
+    "num_epochs": 3
+  })
+  from Dataset import init_dataset
+  dev_data = init_dataset(dev_opts)
+  engine = Engine(config=config)
+  engine.init_train_from_config(config=config, train_data=train_data, dev_data=dev_data, eval_data=None)
+  cleanup_calls = []  # type: typing.List[typing.Tuple[int,typing.List[int],typing.List[int]]]
+  orig_cleanup_old_models = engine.cleanup_old_models
+
+  def cleanup_old_models(**kwargs):
+    orig_cleanup_old_models(**kwargs)
+    cleanup_calls.append((
+      engine.epoch, sorted(kwargs.get("extra_keep_epochs", [])), sorted(engine.get_existing_models(config).keys())))
+
+  engine.cleanup_old_models = cleanup_old_models
+  engine.train()
+  # In each epoch, even when the eval of this epoch is pending. The final call is after all evals are done.
+  assert_equal([epoch for (epoch, _, _) in cleanup_calls], [1, 2, 3, 3])
+  for epoch, pending_epochs, existing_epochs in cleanup_calls[:-1]:
+    assert_in(epoch, pending_epochs)
+    # The pending ones are kept, and otherwise only the last epoch.
+    assert_equal(existing_epochs, pending_epochs)
+  assert_equal(cleanup_calls[-1], (3, [], [3]))
+  engine.finalize()
+
+
+def test_engine_network_construction_cache():
+  from GeneratingDataset import DummyDataset
+  seq_len = 5
+  n_data_dim = 2
+  n_classes_dim = 3
+  train_data = DummyDataset(input_dim=n_data_dim, output_dim=n_classes_dim, num_seqs=4, seq_len=seq_len)
+  train_data.init_seq_order(epoch=1)
+
+  net_dict1 = {"output": {"class": "softmax", "loss": "ce"}}
+  net_dict2 = {
+    "hidden": {"class": "linear", "activation": "tanh", "n_out": 5},
+    "output": {"class": "softmax", "loss": "ce", "from": "hidden"}}
+  config = Config()
+  config.update({
+    "model": "/tmp/model",
+    "num_outputs": n_classes_dim,
+    "num_inputs": n_data_dim,
+    "network": net_dict1,
+    "network_construction_cache": 2,
+    "start_epoch": 1,
+    "num_epochs": 1
+  })
+  engine = Engine(config=config)
+  engine.init_train_from_config(config=config, train_data=train_data, dev_data=None, eval_data=None)
+  network1 = engine.network
+  engine._init_network(net_desc=net_dict2)
+  network2 = engine.network
+  assert network2 is not network1
+  assert_equal(set(network2.layers.keys()), {"data", "hidden", "output"})
+  engine._init_network(net_desc=dict(net_dict1))  # equal dict, but other instance
+  assert engine.network is network1
+  assert engine.tf_session.graph is network1.get_root_network().extern_data.data["data"].placeholder.graph
+  assert tf.get_default_graph() is engine.tf_session.graph
+  engine._init_network(net_desc=net_dict2)
+  assert engine.network is network2
+  engine.train()
+
+  engine.finalize()
+
+
 def test_engine_train_uneven_batches():
   rnd = numpy.random.RandomState(42)
   from GeneratingDataset import StaticDataset
@@ -200,6 +384,150 @@ def test_engine_train_uneven_batches():
   engine.finalize()
 
 
+def test_engine_steps_per_fetch():
+  from GeneratingDataset import DummyDataset
+  n_data_dim = 2
+  n_classes_dim = 3
+  train_data = DummyDataset(input_dim=n_data_dim, output_dim=n_classes_dim, num_seqs=7, seq_len=5)
+  train_data.init_seq_order(epoch=1)
+
+  config = Config()
+  config.update({
+    "model": "/tmp/model",
+    "num_outputs": n_classes_dim,
+    "num_inputs": n_data_dim,
+    "network": {"output": {"class": "softmax", "loss": "ce"}},
+    "batch_size": 10,
+    "max_seqs": 2,
+    "start_epoch": 1,
+    "num_epochs": 1
+  })
+  engine = Engine(config=config)
+  engine.init_train_from_config(config=config, train_data=train_data, dev_data=None, eval_data=None)
+
+  results = {}
+  for steps_per_fetch in [1, 3]:
+    config.set("steps_per_fetch", steps_per_fetch)
+    train_data.init_seq_order(epoch=1)
+    batches = train_data.generate_batches(
+      recurrent_net=engine.network.recurrent, batch_size=engine.batch_size, max_seqs=engine.max_seqs,
+      used_data_keys=engine.network.used_data_keys)
+    runner = Runner(engine=engine, dataset=train_data, batches=batches, train=False)
+    runner.run(report_prefix="eval steps_per_fetch=%i" % steps_per_fetch)
+    assert runner.finalized and not runner.run_exception
+    assert_equal(runner.num_steps, 4)  # the last fetch is only in the flush at the end
+    results[steps_per_fetch] = runner
+  assert_equal(dict(results[1].num_frames_accumulated.items()), dict(results[3].num_frames_accumulated.items()))
+  assert_equal(sorted(results[1].results.keys()), sorted(results[3].results.keys()))
+  for key, value in results[1].results.items():
+    numpy.testing.assert_almost_equal(value, results[3].results[key], decimal=5)
+
+  engine.finalize()
+
+
+def test_engine_tf_data_provider():
+  from GeneratingDataset import DummyDataset
+  from TFDataPipeline import TFDataDataProvider, FeedDictDataProvider
+  n_data_dim = 2
+  n_classes_dim = 3
+  train_data = DummyDataset(input_dim=n_data_dim, output_dim=n_classes_dim, num_seqs=7, seq_len=5)
+  train_data.init_seq_order(epoch=1)
+  cv_data = DummyDataset(input_dim=n_data_dim, output_dim=n_classes_dim, num_seqs=3, seq_len=7)
+  cv_data.init_seq_order(epoch=1)
+
+  config = Config()
+  config.update({
+    "model": "/tmp/model",
+    "num_outputs": n_classes_dim,
+    "num_inputs": n_data_dim,
+    "network": {
+      "rnn": {"class": "rec", "unit": "lstm", "n_out": 3},
+      "output": {"class": "softmax", "loss": "ce", "from": "rnn"}},
+    "data_provider": "tf_data",
+    "batch_size": 100,
+    "max_seqs": 2,
+    "start_epoch": 1,
+    "num_epochs": 2
+  })
+  engine = Engine(config=config)
+  engine.init_train_from_config(config=config, train_data=train_data, dev_data=cv_data, eval_data=None)
+  engine.train()
+
+  results = {}
+  for use_feed_dict in [False, True]:
+    cv_data.init_seq_order(epoch=1)
+    batches = cv_data.generate_batches(
+      recurrent_net=engine.network.recurrent, batch_size=engine.batch_size, max_seqs=engine.max_seqs,
+      used_data_keys=engine.network.used_data_keys)
+    tf_data_input = engine.tf_data_input
+    if use_feed_dict:
+      engine.tf_data_input = None  # the placeholders can still be fed
+    runner = Runner(engine=engine, dataset=cv_data, batches=batches, train=False)
+    engine.tf_data_input = tf_data_input
+    assert_is_instance(runner.data_provider, FeedDictDataProvider if use_feed_dict else TFDataDataProvider)
+    runner.run(report_prefix="eval use_feed_dict=%r" % use_feed_dict)
+    assert runner.finalized and not runner.run_exception
+    assert_equal(runner.num_steps, 2)
+    results[use_feed_dict] = runner
+  assert_equal(dict(results[False].num_frames_accumulated.items()), dict(results[True].num_frames_accumulated.items()))
+  for key, value in results[True].results.items():
+    numpy.testing.assert_almost_equal(value, results[False].results[key], decimal=5)
+
+  engine.finalize()
+
+
+def test_engine_chunking_in_graph():
+  rnd = numpy.random.RandomState(42)
+  from GeneratingDataset import StaticDataset
+  n_data_dim = 2
+  n_classes_dim = 3
+  data = [
+    {
+      "data": rnd.uniform(-1., 1., (seq_len, n_data_dim)).astype("float32"),
+      "classes": rnd.choice(range(n_classes_dim), (seq_len,)).astype("int32")
+    }
+    for seq_len in [3, 11, 7, 4, 9]]
+
+  results = {}
+  for chunking_in_graph in [False, True]:
+    config = Config()
+    config.update({
+      "model": "/tmp/model",
+      "num_outputs": n_classes_dim,
+      "num_inputs": n_data_dim,
+      "network": {
+        "rnn": {"class": "rec", "unit": "lstm", "n_out": 3},
+        "output": {"class": "softmax", "loss": "ce", "from": "rnn"}},
+      "max_seqs": 3,
+      "start_epoch": 1,
+      "num_epochs": 1
+    })
+    if chunking_in_graph:
+      config.set("chunking_in_graph", "4:2")
+      dataset = StaticDataset(input_dim=n_data_dim, output_dim=n_classes_dim, data=data)
+    else:
+      dataset = StaticDataset(input_dim=n_data_dim, output_dim=n_classes_dim, data=data, chunking="4:2")
+    dataset.init_seq_order(epoch=1)
+    engine = Engine(config=config)
+    engine.init_train_from_config(config=config, train_data=dataset, dev_data=None, eval_data=None)
+    if chunking_in_graph:
+      assert engine.network.extern_data.chunking
+      assert engine.network.extern_data.get_data("data") is not engine.network.extern_data.get_feed_data("data")
+    batches = dataset.generate_batches(
+      recurrent_net=engine.network.recurrent, batch_size=engine.batch_size, max_seqs=engine.max_seqs,
+      used_data_keys=engine.network.used_data_keys)
+    runner = Runner(engine=engine, dataset=dataset, batches=batches, train=False, train_flag=True)
+    runner.run(report_prefix="eval chunking_in_graph=%r" % chunking_in_graph)
+    assert runner.finalized and not runner.run_exception
+    results[chunking_in_graph] = runner
+    engine.finalize()
+
+  # The chunks are the same, thus also the number of frames and the scores.
+  assert_equal(dict(results[False].num_frames_accumulated.items()), dict(results[True].num_frames_accumulated.items()))
+  for key, value in results[False].results.items():
+    numpy.testing.assert_almost_equal(value, results[True].results[key], decimal=5)
+
+
 def test_engine_train_subnet_loss():
   from GeneratingDataset import DummyDataset
   seq_len = 5
@@ -426,7 +754,48 @@ def test_engine_analyze():
   # engine.init_network_from_config(config=config)
   engine.init_train_from_config(config=config, train_data=dataset, dev_data=None, eval_data=None)
 
-  engine.analyze(data=dataset, statistics=None)
+  analyzer = engine.analyze(data=dataset, statistics=None)
+  assert_equal(analyzer.stats["stats:analyze:accumulated_seq_length"], 2 * seq_len)
+  assert_equal(
+    analyzer.stats["stats:analyze:accumulated_seq_length_sil"] +
+    analyzer.stats["stats:analyze:accumulated_seq_length_no_sil"],
+    2 * seq_len)
+  histogram = analyzer.stats["stats:analyze:accumulated_true_label_prob_histogram"]
+  numpy.testing.assert_almost_equal(numpy.sum(histogram), 1.)
+
+  engine.finalize()
+
+
+def test_engine_compute_priors():
+  from GeneratingDataset import DummyDataset
+  import tempfile
+  seq_len = 5
+  n_data_dim = 2
+  n_classes_dim = 3
+  dataset = DummyDataset(input_dim=n_data_dim, output_dim=n_classes_dim, num_seqs=3, seq_len=seq_len)
+  dataset.init_seq_order(epoch=1)
+  output_file = tempfile.mktemp(suffix=".txt", prefix="test_engine_compute_priors")
+
+  config = Config()
+  config.update({
+    "model": "/tmp/model",
+    "num_outputs": n_classes_dim,
+    "num_inputs": n_data_dim,
+    "network": {"output": {"class": "softmax", "loss": "ce"}},
+    "max_seqs": 2,
+    "output_file": output_file,
+  })
+  engine = Engine(config=config)
+  engine.init_train_from_config(config=config, train_data=dataset, dev_data=None, eval_data=None)
+
+  try:
+    engine.compute_priors(dataset=dataset, config=config)
+    log_priors = numpy.loadtxt(output_file)
+  finally:
+    if os.path.exists(output_file):
+      os.remove(output_file)
+  assert_equal(log_priors.shape, (n_classes_dim,))
+  numpy.testing.assert_almost_equal(numpy.sum(numpy.exp(log_priors)), 1., decimal=5)
 
   engine.finalize()
 
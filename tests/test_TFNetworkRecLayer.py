@@ -3026,6 +3026,74 @@ def test_KenLmStateLayer_dense():
       print("Scores are as expected.")
 
 
+def test_KenLmStateLayer_stateful():
+  import TFKenLM
+  TFKenLM.get_tf_mod(verbose=True)
+  test_lm_file = TFKenLM.kenlm_dir + "/lm/test.arpa"
+  assert os.path.exists(test_lm_file)
+  from GeneratingDataset import Vocabulary
+  from TFNetworkLayer import InternalLayer
+  import tempfile
+  with make_scope() as session:
+    with tempfile.NamedTemporaryFile(mode="w", prefix="vocab") as tmp_bpe_vocab_file:
+      labels = "</s> <unk> be@@ yond imm@@ edi@@ ate conc@@ erns".split()
+      bpe_vocab_dict = Vocabulary.create_vocab_dict_from_labels(labels)
+      tmp_bpe_vocab_file.write(repr(bpe_vocab_dict))
+      tmp_bpe_vocab_file.flush()
+
+      net = TFNetwork(extern_data=ExternData())
+      net.extern_data.register_data(Data(
+        name="data", shape=(), time_dim_axis=None, dim=len(labels), sparse=True,
+        auto_create_placeholders=True))
+      data_layer = net.construct_layer(name="data", net_dict={})
+      layers = {}  # (stateful, dense) -> (layer, prev_layer)
+      for stateful in [False, True]:
+        for dense_output in [False, True]:
+          layer_base_opts = dict(
+            name="output_%s_%s" % ("stateful" if stateful else "string", "dense" if dense_output else "sparse"),
+            network=net, sources=[data_layer],
+            lm_file=test_lm_file,
+            vocab_file=tmp_bpe_vocab_file.name, vocab_unknown_label="<unk>",
+            bpe_merge_symbol="@@",
+            dense_output=dense_output)
+          layer_out = KenLmStateLayer.get_out_data_from_opts(**layer_base_opts)
+          initial_state = KenLmStateLayer.get_rec_initial_extra_outputs(
+            batch_dim=2, rec_layer=None, **layer_base_opts)
+          prev_layer = InternalLayer(
+            name="prev:%s" % layer_base_opts["name"], network=net, output=layer_out.copy())
+          prev_layer.rec_vars_outputs = {
+            k: tf.placeholder(name="prev_layer_%s" % k, shape=v.shape, dtype=v.dtype)
+            for (k, v) in initial_state.items()}
+          with reuse_name_scope(KenLmStateLayer.cls_get_tf_scope_name(layer_base_opts["name"])):
+            layer = KenLmStateLayer(
+              output=layer_out, rec_previous_layer=prev_layer, stateful=stateful, **layer_base_opts)
+            net.layers[layer.name] = layer
+          layers[(stateful, dense_output)] = (layer, prev_layer, initial_state)
+
+      net.initialize_params(session=session)
+      rec_states = {key: session.run(initial_state) for (key, (_, _, initial_state)) in layers.items()}
+
+      seqs = [
+        "be@@ yond imm@@ edi@@ ate conc@@ erns </s>".split(),
+        "imm@@ edi@@ ate be@@ yond </s> </s> </s>".split()]
+      input_word_ids = [[labels.index(w) for w in seq] for seq in seqs]
+      for t in range(len(seqs[0])):
+        feed_dict = {net.extern_data.data["data"].placeholder: [seq[t] for seq in input_word_ids]}
+        for key, (layer, prev_layer, _) in layers.items():
+          feed_dict.update({prev_layer.rec_vars_outputs[k]: v for (k, v) in rec_states[key].items()})
+        res = session.run(
+          {key: (layer.output.placeholder, layer.rec_vars_outputs) for (key, (layer, _, _)) in layers.items()},
+          feed_dict=feed_dict)
+        for key in layers.keys():
+          rec_states[key] = res[key][1]
+        for dense_output in [False, True]:
+          string_scores = res[(False, dense_output)][0]
+          stateful_scores = res[(True, dense_output)][0]
+          print("step %i, dense %r, scores %r, stateful scores %r" % (t, dense_output, string_scores, stateful_scores))
+          assert_equal(string_scores.tolist(), stateful_scores.tolist())
+      print("Scores are the same.")
+
+
 @unittest.skipIf(not is_gpu_available(), "no gpu on this system")
 def test_BlocksparseLSTM_load_params_from_native_lstm():
   from TFNativeOp import have_blocksparse_requirements, init_blocksparse
@@ -61,6 +61,29 @@ def test_Data_default_time_no_time():
   assert data.time_dim_axis is None and data.feature_dim_axis == 2
 
 
+def test_Data_copy_equal_to_init():
+  # Data.copy and Data.copy_template do not go through __init__. Check that this is equivalent.
+  for data in [
+        Data(name="my_data", dim=13),
+        Data(name="my_data", dim=13, time_dim_axis=0, batch_dim_axis=1),
+        Data(name="my_data", shape=(None,), batch_dim_axis=1),
+        Data(name="my_data", shape=(3, 5), feature_dim_axis=1),
+        Data(name="my_data", shape=(None,), dtype="int32", sparse=True, dim=7, beam_size=3),
+        Data(name="my_data", shape=(), batch_dim_axis=None, time_dim_axis=None)]:
+    data_init = Data(**data.get_kwargs())
+    for data_copy in [data.copy(), data.copy_template()]:
+      print(data, data_copy)
+      assert data_copy is not data
+      for key in Data.__slots__:
+        assert_equal(getattr(data_copy, key), getattr(data_init, key), "%s differs" % key)
+  data = Data(name="my_data", dim=13, size_placeholder={0: tf.constant([3, 2])})
+  data_copy = data.copy(name="other")
+  assert_equal(data_copy.name, "other")
+  assert data_copy.size_placeholder is not data.size_placeholder
+  assert_equal(data_copy.size_placeholder, data.size_placeholder)
+  assert_equal(data.copy_template().size_placeholder, None)
+
+
 def test_Data_copy_time_major():
   data = Data(name="my_data", dim=13)
   assert_equal(data.batch_dim_axis, 0)
@@ -1506,6 +1529,31 @@ def test_VariableAssigner_ResourceVariable():
   assert_equal(session.run(v), 2.)
 
 
+def test_InGraphReduction():
+  x = tf.placeholder(tf.float32, shape=(None, 2), name="test_InGraphReduction_x")
+  reductions = [
+    InGraphReduction("sum", x, reduce="sum", axis=0),
+    InGraphReduction("count", x, reduce="count", axis=0),
+    InGraphReduction("min", x, reduce="min", axis=None),
+    InGraphReduction("max", x, reduce="max", axis=[0, 1]),
+    InGraphReduction("histogram", x, reduce="histogram", num_bins=2, value_range=(0., 2.))]
+  session.run([r.var.initializer for r in reductions])
+  for step_value in [[[0., 1.], [2., 3.]], [[-1., 0.5]]]:
+    session.run([r.update_op for r in reductions], feed_dict={x: step_value})
+  values = session.run({r.name: r.value for r in reductions})
+  assert_allclose(values["sum"], [1., 4.5])
+  assert_equal(values["count"], 3)
+  assert_equal(values["min"], -1.)
+  assert_equal(values["max"], 3.)
+  assert_equal(values["histogram"].tolist(), [3, 3])
+  session.run([r.reset_op for r in reductions])
+  session.run([r.update_op for r in reductions], feed_dict={x: [[1., 1.]]})
+  values = session.run({r.name: r.value for r in reductions})
+  assert_allclose(values["sum"], [1., 1.])
+  assert_equal(values["count"], 1)
+  assert_equal(values["min"], 1.)
+
+
 def test_map_labels():
   x = tf.constant([0, 1, 2, 3, 2, 1, 0])
   label_map = {0: 1, 1: 2, 2: 3, 3: 0}
@@ -1989,6 +2037,43 @@ def test_kenlm_bpe():
   print("Scores are as expected.")
 
 
+def test_kenlm_advance_bpe_strings():
+  import TFKenLM
+  input_strings = [
+    "beyond immediate concerns </s>",
+    "be@@ yond imm@@ edi@@ ate conc@@ erns </s>",
+    "be@@ yond imm@@",
+    "be@@ yond <unk>"
+    ]
+  test_lm_file = TFKenLM.kenlm_dir + "/lm/test.arpa"
+  assert os.path.exists(test_lm_file)
+  lm_tf = TFKenLM.ken_lm_load(filename=test_lm_file)
+  states_tf = tf.placeholder(tf.string, [None])
+  pieces_tf = tf.placeholder(tf.string, [None])
+  accumulated_strings_tf = tf.placeholder(tf.string, [None])
+  new_states_tf, scores_tf = TFKenLM.ken_lm_advance_bpe_strings(
+    handle=lm_tf, bpe_merge_symbol="@@", states=states_tf, strings=pieces_tf)
+  ref_scores_tf = TFKenLM.ken_lm_abs_score_bpe_strings(
+    handle=lm_tf, bpe_merge_symbol="@@", strings=accumulated_strings_tf)
+  input_pieces = [[w + " " for w in s.split()] for s in input_strings]
+  max_len = max([len(p) for p in input_pieces])
+  input_pieces = [p + [""] * (max_len - len(p)) for p in input_pieces]
+  with tf.Session() as session:
+    states = [""] * len(input_strings)
+    accumulated = [""] * len(input_strings)
+    for t in range(max_len):
+      pieces = [p[t] for p in input_pieces]
+      accumulated = [a + p for (a, p) in zip(accumulated, pieces)]
+      states, scores = session.run(
+        (new_states_tf, scores_tf), feed_dict={states_tf: states, pieces_tf: pieces})
+      ref_scores = session.run(ref_scores_tf, feed_dict={accumulated_strings_tf: accumulated})
+      print("step %i, pieces %r, scores %r, ref scores %r" % (t, pieces, scores, ref_scores))
+      assert_equal(scores.tolist(), ref_scores.tolist())
+  assert_almost_equal(scores[0], -9.251298)  # example from above
+  assert_equal(scores[0], scores[1])
+  print("Scores are as expected.")
+
+
 def test_layer_norms():
   from TFNativeOp import have_blocksparse_requirements
   from tensorflow.contrib.layers import layer_norm as tf_contrib_layer_norm
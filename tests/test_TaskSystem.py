@@ -8,6 +8,7 @@ except ImportError:  # Python 3
   from io import BytesIO as StringIO
 from TaskSystem import *
 import inspect
+import contextlib
 from nose.tools import assert_equal, assert_is_instance
 import better_exchook
 better_exchook.replace_traceback_format_tb()
@@ -97,6 +98,114 @@ def test_pickle():
   assert_equal(inst(), 42)
 
 
+def test_pickle_numpy_out_of_band():
+  import numpy
+  obj = {
+    "data": numpy.arange(24, dtype="float32").reshape((2, 3, 4)),
+    "fortran": numpy.asfortranarray(numpy.arange(6, dtype="int32").reshape((2, 3))),
+    "slice": numpy.arange(10)[::3],
+    "empty": numpy.zeros((0, 5), dtype="int8"),
+    "scalar": numpy.array(3.5),
+    "objects": numpy.array([None, "a"], dtype=object),  # in-band
+    "func": test_pickle}
+  sio = StringIO()
+  buffers = []
+  shared_mem_enabled = SharedMemNumpyConfig["enabled"]
+  SharedMemNumpyConfig["enabled"] = False  # otherwise the arrays might go via shared memory
+  try:
+    Pickler(sio, buffer_callback=buffers.append).dump(obj)
+  finally:
+    SharedMemNumpyConfig["enabled"] = shared_mem_enabled
+  assert_equal(len(buffers), 5)
+  assert len(sio.getvalue()) < 1000
+  obj2 = Unpickler(StringIO(sio.getvalue()), buffers=[bytes(bytearray(b)) for b in buffers]).load()
+  assert_equal(set(obj2.keys()), set(obj.keys()))
+  for key in ["data", "fortran", "slice", "empty", "scalar", "objects"]:
+    assert_equal(obj2[key].dtype, obj[key].dtype)
+    assert_equal(obj2[key].shape, obj[key].shape)
+    assert_equal(obj2[key].tolist(), obj[key].tolist())
+  assert obj2["data"].flags.writeable
+  assert obj2["func"] is test_pickle
+
+
+def test_ExecingProcess_Pipe_numpy():
+  import numpy
+  c1, c2 = ExecingProcess_Pipe()
+  c1.send(("foo", numpy.arange(5, dtype="float32"), [numpy.ones((2, 2), dtype="int8")]))
+  c1.send("bar")
+  name, x, (y,) = c2.recv()
+  assert_equal(name, "foo")
+  assert_equal(x.tolist(), list(range(5)))
+  assert_equal(y.tolist(), [[1, 1], [1, 1]])
+  assert_equal(c2.recv(), "bar")
+
+
+@contextlib.contextmanager
+def _out_of_band_numpy_buffers():
+  """
+  test_TaskSystem_SharedMem enables the shared memory for all Numpy arrays, but we want the out-of-band buffers.
+  """
+  enabled = SharedMemNumpyConfig["enabled"]
+  SharedMemNumpyConfig["enabled"] = False
+  try:
+    yield
+  finally:
+    SharedMemNumpyConfig["enabled"] = enabled
+
+
+def test_ExecingProcess_Pipe_numpy_threads():
+  import numpy
+  import threading
+  c1, c2 = ExecingProcess_Pipe()
+  num_threads, num_values = 4, 20
+
+  def send_values(thread_idx):
+    for i in range(num_values):
+      c1.send((thread_idx, i, numpy.arange(1000, dtype="int32") + i, numpy.full((5,), thread_idx, dtype="float64")))
+
+  with _out_of_band_numpy_buffers():
+    threads = [threading.Thread(target=send_values, args=(thread_idx,)) for thread_idx in range(num_threads)]
+    for thread in threads:
+      thread.start()
+    last_idx = {}
+    for _ in range(num_threads * num_values):
+      thread_idx, i, x, y = c2.recv()
+      assert_equal(i, last_idx.get(thread_idx, -1) + 1)  # in order per thread
+      last_idx[thread_idx] = i
+      assert_equal(x.tolist(), list(range(i, i + 1000)))
+      assert_equal(y.tolist(), [thread_idx] * 5)
+    for thread in threads:
+      thread.join()
+  assert_equal(last_idx, {thread_idx: num_values - 1 for thread_idx in range(num_threads)})
+
+
+class _UnpicklingFails(object):
+  def __reduce__(self):
+    return _raise_unpickling_error, ()
+
+
+def _raise_unpickling_error():
+  raise pickle.UnpicklingError("test error")
+
+
+def test_ExecingProcess_Pipe_numpy_unpickling_error():
+  import numpy
+  c1, c2 = ExecingProcess_Pipe()
+  with _out_of_band_numpy_buffers():
+    c1.send((_UnpicklingFails(), numpy.arange(5, dtype="float32"), numpy.ones((3,), dtype="int8")))
+    c1.send(("bar", numpy.arange(3, dtype="int32")))
+  try:
+    c2.recv()
+  except pickle.UnpicklingError as exc:
+    assert_equal(str(exc), "test error")
+  else:
+    assert False, "expected UnpicklingError"
+  # The buffers of the first value are not left in the pipe.
+  name, x = c2.recv()
+  assert_equal(name, "bar")
+  assert_equal(x.tolist(), [0, 1, 2])
+
+
 def test_AsyncTask():
   def func(asyncTask):
     """
@@ -159,3 +159,30 @@ def test_pickle_unpickle_auto_unused():
       assert isinstance(s, SharedNumpyArray)
       assert s.is_server
       assert not s.is_in_use()
+
+
+@unittest.skipIf(not have_working_shmget(), "shmget does not work")
+def test_SharedNumpyBuffer():
+  writer = SharedNumpyBuffer(name="test")
+  reader = SharedNumpyBuffer(name="test")
+  shared = None
+  for i, (n_time, n_batch) in enumerate([(3, 2), (5, 4), (10 ** 7, 1), (2, 2)]):
+    arrays = writer.alloc([("data", (n_time, n_batch), "float32"), ("index", (n_time, n_batch), "int8")])
+    arrays["data"][...] = i
+    arrays["index"][...] = 1
+    msg = writer.get_message()
+    if i in (0, 2):  # first one, or we needed more memory
+      assert isinstance(msg["shared"], SharedNumpyArray)
+      shared = msg["shared"]
+    else:
+      assert msg["shared"] is None
+    assert shared not in SharedNumpyArray.ServerInstances
+    # This goes via the pipe usually. Only the handle of the shared memory gets pickled, not the data.
+    msg_pickled = pickle_dumps(msg)
+    assert len(msg_pickled) < 1000
+    read_arrays = reader.read(pickle_loads(msg_pickled))
+    assert read_arrays["data"].shape == (n_time, n_batch)
+    assert read_arrays["data"].dtype == numpy.float32
+    assert (read_arrays["data"] == i).all()
+    assert (read_arrays["index"] == 1).all()
+    reader.read_done()
@@ -49,6 +49,27 @@ def test_uniq():
   assert (uniq(np.array([0, 1, 1, 1, 2, 2])) == np.array([0, 1, 2])).all()
 
 
+def test_edit_distance_batch():
+  def _edit_distance_ref(x, y):
+    d = list(range(len(y) + 1))
+    for i in range(1, len(x) + 1):
+      prev_diag, d[0] = d[0], i
+      for j in range(1, len(y) + 1):
+        prev_diag, d[j] = d[j], min(d[j] + 1, d[j - 1] + 1, prev_diag + int(x[i - 1] != y[j - 1]))
+    return d[-1]
+
+  rnd = np.random.RandomState(42)
+  n_batch = 50
+  a_seq_lens = rnd.randint(0, 8, size=(n_batch,))
+  b_seq_lens = rnd.randint(0, 10, size=(n_batch,))
+  a = rnd.randint(0, 3, size=(n_batch, a_seq_lens.max()))
+  b = rnd.randint(0, 3, size=(n_batch, b_seq_lens.max()))
+  res = edit_distance_batch(a, a_seq_lens, b, b_seq_lens)
+  assert_equal(res.shape, (n_batch,))
+  for i in range(n_batch):
+    assert_equal(res[i], _edit_distance_ref(a[i, :a_seq_lens[i]], b[i, :b_seq_lens[i]]))
+
+
 def test_slice_pad_zeros():
   assert_equal(list(slice_pad_zeros(np.array([1, 2, 3, 4]), begin=1, end=3)), [2, 3])
   assert_equal(list(slice_pad_zeros(np.array([1, 2, 3, 4]), begin=-2, end=2)), [0, 0, 1, 2])
@@ -177,6 +198,41 @@ def test_NativeCodeCompiler():
   assert_equal(lib.get_magic(), 42)
 
 
+def test_NativeCodeCompiler_compile_parallel():
+  import tempfile
+  import shutil
+  cache_dir = tempfile.mkdtemp(prefix="returnn-test-native-cache-")
+  old_cache_base_dir = NativeCodeCompiler.CacheBaseDir
+  NativeCodeCompiler.CacheBaseDir = cache_dir
+  try:
+    def make_compilers():
+      """
+      :rtype: list[NativeCodeCompiler]
+      """
+      return [
+        NativeCodeCompiler(
+          base_name="test_NativeCodeCompiler_parallel_%i" % i, code_version=1,
+          code='extern "C" int get_magic() { return %i; }\n' % i)
+        for i in range(3)]
+
+    stats = dict(NativeCodeCompiler.Stats)
+    compilers = make_compilers()
+    NativeCodeCompiler.compile_parallel(compilers, num_workers=3)
+    assert_equal(NativeCodeCompiler.Stats["compiles"], stats["compiles"] + 3)
+    for compiler in compilers:
+      assert compiler.get_lib_filename().startswith(cache_dir + "/")
+    assert_equal(NativeCodeCompiler.Stats["cache_hits"], stats["cache_hits"] + 3)
+    # All in the cache now.
+    for i, compiler in enumerate(make_compilers()):
+      assert_equal(compiler.load_lib_ctypes().get_magic(), i)
+    assert_equal(NativeCodeCompiler.Stats["compiles"], stats["compiles"] + 3)
+    assert_equal(NativeCodeCompiler.Stats["cache_hits"], stats["cache_hits"] + 6)
+    print(NativeCodeCompiler.get_stats_str())
+  finally:
+    NativeCodeCompiler.CacheBaseDir = old_cache_base_dir
+    shutil.rmtree(cache_dir)
+
+
 def test_Stats():
   rnd = numpy.random.RandomState(42)
   m = rnd.uniform(-2., 10., (1000, 3))
@@ -214,6 +270,68 @@ def test_Stats():
   assert_almost_equal(stddev1, 1.)
 
 
+def test_Stats_merge():
+  rnd = numpy.random.RandomState(42)
+  m = rnd.uniform(-2., 10., (1000, 3))
+  parts = [Stats() for _ in range(3)]
+  t = 0
+  while t < len(m):
+    s = int(rnd.uniform(10, 100))
+    parts[rnd.randint(len(parts))].collect(m[t:t + s])
+    t += s
+  stats = Stats()
+  for part in parts:
+    stats.merge(part)
+  assert_equal(stats.total_data_len, len(m))
+  assert_equal(stats.num_seqs, sum([part.num_seqs for part in parts]))
+  assert_almost_equal(stats.get_mean(), numpy.mean(m, axis=0))
+  assert_almost_equal(stats.get_std_dev(), numpy.std(m, axis=0))
+  assert_almost_equal(stats.mean_sq, numpy.mean(m * m, axis=0))
+  assert_almost_equal(stats.min, numpy.min(m, axis=0))
+  assert_almost_equal(stats.max, numpy.max(m, axis=0))
+
+
+def test_PhaseTimer():
+  import json
+  import tempfile
+  timer = PhaseTimer(window=3, collect_trace=True)
+  timer.start_steps()
+
+  def data_thread_main():
+    with timer.phase("load_batch", in_step=False):
+      time.sleep(0.01)
+
+  data_thread = threading.Thread(target=data_thread_main, name="data thread")
+  data_thread.start()
+  for step in range(5):
+    with timer.phase("get_feed_dict"):
+      pass
+    with timer.phase("session_run"):
+      time.sleep(0.002)
+    timer.add("session_run", duration=0.001)  # accumulated within the step
+    timer.end_step()
+  data_thread.join()
+  assert_equal(timer.num_steps, 5)
+  assert_equal(timer.in_step_phases, ["get_feed_dict", "session_run"])
+  assert_equal(len(timer.recent["session_run"]), 3)
+  assert min(timer.recent["session_run"]) >= 0.003
+  summary = timer.get_summary()
+  assert_equal(summary["session_run"]["count"], 10)
+  assert_almost_equal(summary["session_run"]["mean"], summary["session_run"]["total"] / 5)
+  assert_equal(summary["load_batch"]["count"], 1)
+  assert summary["step"]["total"] >= 5 * 0.002
+  print(timer.get_percentiles_str())
+  print(timer.get_summary_str())
+  assert "(other thread)" in timer.get_summary_str()
+  with tempfile.NamedTemporaryFile(suffix=".json") as f:
+    timer.write_chrome_trace(f.name)
+    trace = json.load(open(f.name))
+  events = trace["traceEvents"]
+  assert_equal(len([e for e in events if e["name"] == "step"]), 5)
+  assert_equal(len([e for e in events if e["name"] == "thread_name"]), 2)
+  assert_equal(len([e for e in events if e["name"] == "session_run"]), 10)
+
+
 def test_deepcopy():
   deepcopy({"a": 1, "b": 2, "c": [3, {}, (), [42, True]]})
 
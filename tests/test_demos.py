@@ -92,6 +92,14 @@ class TestDemos(object):
     fer = run_config_get_fer("demos/demo-task12ax.config")
     assert_less(fer, 0.01)
 
+  def test_demo_tf_local_data_parallel(self):
+    config_filename = "demos/demo-tf-vanilla-lstm.12ax.config"
+    cleanup_tmp_models(config_filename)
+    fer = run_and_parse_last_fer(
+      py, "rnn.py", config_filename, "++num_epochs", "2", "++device", "cpu", "++local_data_parallel", "2")
+    cleanup_tmp_models(config_filename)
+    assert_less(fer, 0.1)
+
   def test_demo_iter_dataset_task12ax(self):
     cleanup_tmp_models("demos/demo-task12ax.config")
     out = run(py, "demos/demo-iter-dataset.py", "demos/demo-task12ax.config")
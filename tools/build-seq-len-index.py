@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+
+"""
+Creates the seq length index (:class:`CachedDataset2.SeqLenIndex`) of a dataset with ``seq_len_index_dir``,
+such that length-based ``seq_ordering`` (e.g. "sorted" or "laplace") does not need to load the seqs anymore.
+The sequences are split into contiguous ranges, which are processed in parallel by a pool of worker processes.
+This needs a dataset which supports random access to the seqs, otherwise use ``--workers 1``.
+Alternatively, the index is also created as a side effect of loading all the seqs once, e.g. in the first epoch.
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import time
+import multiprocessing
+
+my_dir = os.path.dirname(os.path.abspath(__file__))
+returnn_dir = os.path.dirname(my_dir)
+sys.path.insert(0, returnn_dir)
+
+import rnn
+from Log import log
+import argparse
+from Util import hms
+from Dataset import init_dataset, get_dataset_config_hash
+from CachedDataset2 import CachedDataset2, SeqLenIndex
+
+
+def get_scan_dataset_opts(dataset_opts):
+  """
+  :param dict[str] dataset_opts: with seq_len_index_dir
+  :return: opts to iterate through the corpus in default order, without using the index itself
+  :rtype: dict[str]
+  """
+  dataset_opts = dataset_opts.copy()
+  dataset_opts.pop("seq_len_index_dir")
+  dataset_opts.pop("seq_len_index_key", None)
+  dataset_opts.update({"seq_ordering": "default", "partition_epoch": 1, "repeat_epoch": 1})
+  return dataset_opts
+
+
+def collect_seq_lens(job):
+  """
+  Executed in the worker processes.
+
+  :param (dict[str],int,int,int,int) job: dataset opts, num seqs, start seq idx, end seq idx, verbosity
+  :return: index with the lengths of the seqs [start, end)
+  :rtype: SeqLenIndex
+  """
+  dataset_opts, num_seqs, start_seq_idx, end_seq_idx, verbosity = job
+  if not log.initialized:
+    log.initialize(verbosity=[verbosity])
+  dataset = init_dataset(dataset_opts)
+  dataset.init_seq_order(epoch=1)
+  index = SeqLenIndex(num_seqs=num_seqs)
+  seq_idx = start_seq_idx
+  while seq_idx < end_seq_idx and dataset.is_less_than_num_seqs(seq_idx):
+    dataset.load_seqs(seq_idx, seq_idx + 1)
+    index.add(dataset.get_corpus_seq_idx(seq_idx), dataset.get_seq_length(seq_idx))
+    seq_idx += 1
+  return index
+
+
+def build_seq_len_index(dataset_opts, options):
+  """
+  :param dict[str] dataset_opts:
+  :param options: argparse.Namespace
+  :return: filename of the index
+  :rtype: str
+  """
+  assert isinstance(dataset_opts, dict) and dataset_opts.get("seq_len_index_dir"), "need dataset seq_len_index_dir"
+  filename = "%s/%s.seq_lens.npz" % (
+    dataset_opts["seq_len_index_dir"], dataset_opts.get("seq_len_index_key") or get_dataset_config_hash(dataset_opts))
+  scan_dataset_opts = get_scan_dataset_opts(dataset_opts)
+  dataset = init_dataset(scan_dataset_opts)
+  assert isinstance(dataset, CachedDataset2) and dataset.supports_seq_len_index(), (
+    "%r does not support the seq len index" % dataset)
+  dataset.init_seq_order(epoch=1)
+  num_seqs = dataset.num_seqs
+  num_workers = max(min(options.workers or multiprocessing.cpu_count(), num_seqs), 1)
+  jobs = [
+    (scan_dataset_opts, num_seqs, num_seqs * i // num_workers, num_seqs * (i + 1) // num_workers, options.verbosity)
+    for i in range(num_workers)]
+  del dataset  # not needed anymore, the workers init their own instance
+  print("Collect seq lens of %i seqs with %i workers." % (num_seqs, num_workers), file=log.v2)
+  start_time = time.time()
+  index = SeqLenIndex(num_seqs=num_seqs)
+  if num_workers == 1:
+    index.merge(collect_seq_lens(jobs[0]))
+  else:
+    pool = multiprocessing.Pool(num_workers)
+    try:
+      for i, job_index in enumerate(pool.imap_unordered(collect_seq_lens, jobs)):
+        index.merge(job_index)
+        print("Finished part %i/%i, elapsed %s." % (i + 1, num_workers, hms(time.time() - start_time)), file=log.v3)
+    finally:
+      pool.terminate()
+      pool.join()
+  assert index.is_complete(), "%r incomplete" % index
+  index.save(filename)
+  print("Saved %r to %r. Total time %s." % (index, filename, hms(time.time() - start_time)), file=log.v2)
+  return filename
+
+
+def init(config_filename, log_verbosity):
+  """
+  :param str|None config_filename: filename to config-file
+  :param int log_verbosity:
+  """
+  rnn.init_better_exchook()
+  rnn.init_thread_join_hack()
+  if config_filename:
+    print("Using config file %r." % config_filename)
+    assert os.path.exists(config_filename)
+  rnn.init_config(config_filename=config_filename, command_line_options=[])
+  global config
+  config = rnn.config
+  config.set("task", "dump")
+  config.set("log", None)
+  config.set("log_verbosity", log_verbosity)
+  rnn.init_log()
+  print("Returnn build-seq-len-index starting up.", file=log.v2)
+  rnn.returnn_greeting()
+  rnn.init_faulthandler()
+
+
+def main(argv):
+  argparser = argparse.ArgumentParser(description='Create the seq length index of a dataset.')
+  argparser.add_argument('--config', help="filename to config-file. will use dataset 'train' from it")
+  argparser.add_argument("--dataset", help="dataset, overwriting config. dict, with seq_len_index_dir")
+  argparser.add_argument("--workers", type=int, default=0, help="number of worker processes (default: num CPUs)")
+  argparser.add_argument("--verbosity", default=3, type=int, help="log verbosity (default: 3)")
+  args = argparser.parse_args(argv[1:])
+  assert args.config or args.dataset
+
+  init(config_filename=args.config, log_verbosity=args.verbosity)
+  if args.dataset:
+    dataset_opts = eval(args.dataset)
+  else:
+    dataset_opts = config.opt_typed_value("train")
+  try:
+    build_seq_len_index(dataset_opts=dataset_opts, options=args)
+  except KeyboardInterrupt:
+    print("KeyboardInterrupt")
+    sys.exit(1)
+  finally:
+    rnn.finalize()
+
+
+if __name__ == '__main__':
+  main(sys.argv)
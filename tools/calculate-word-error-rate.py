@@ -5,8 +5,9 @@ from __future__ import print_function
 import os
 import sys
 import time
-import tensorflow as tf
+import typing
 import numpy
+from collections import deque
 
 my_dir = os.path.dirname(os.path.abspath(__file__))
 returnn_dir = os.path.dirname(my_dir)
@@ -18,11 +19,16 @@ import argparse
 from Util import Stats, hms
 from Dataset import Dataset, init_dataset
 import Util
-import TFUtil
 
 
 class WerComputeGraph:
+  """
+  Calculates the WER in a TF session, via :func:`TFUtil.string_words_calc_wer`.
+  """
+
   def __init__(self):
+    import tensorflow as tf
+    import TFUtil
     self.hyps = tf.placeholder(tf.string, [None])
     self.refs = tf.placeholder(tf.string, [None])
     self.wer, self.ref_num_words = TFUtil.string_words_calc_wer(hyps=self.hyps, refs=self.refs)
@@ -32,16 +38,142 @@ class WerComputeGraph:
     self.update_ref_num_words = self.total_ref_num_words_var.assign_add(tf.reduce_sum(self.ref_num_words))
     self.updated_normalized_wer = \
       tf.cast(self.update_total_wer, tf.float32) / tf.cast(self.update_ref_num_words, tf.float32)
+    self.session = tf.Session(config=tf.ConfigProto(device_count={"GPU": 0}))
+    self.session.run(tf.global_variables_initializer())
+    self.wer = 1.0
 
-  def step(self, session, hyps, refs):
+  def step(self, hyps, refs):
     """
-    :param tf.Session session:
     :param list[str] hyps:
     :param list[str] refs:
     :return: updated normalized WER
     :rtype: float
     """
-    return session.run(self.updated_normalized_wer, feed_dict={self.hyps: hyps, self.refs: refs})
+    self.wer = self.session.run(self.updated_normalized_wer, feed_dict={self.hyps: hyps, self.refs: refs})
+    return self.wer
+
+  def finish(self):
+    """
+    :return: final normalized WER
+    :rtype: float
+    """
+    self.session.close()
+    return self.wer
+
+
+def calc_wer_words(hyps, refs, batch_size=100):
+  """
+  Pure NumPy variant of :func:`TFUtil.string_words_calc_wer`, via :func:`Util.edit_distance_batch`.
+  As in :func:`TFUtil.words_split`, the words are delimited by space.
+  The seqs are sorted by length and calculated in batches.
+
+  :param list[str] hyps:
+  :param list[str] refs:
+  :param int batch_size: for :func:`Util.edit_distance_batch`
+  :return: total num of word errors, total num of ref words
+  :rtype: (int,int)
+  """
+  assert len(hyps) == len(refs)
+  vocab = {}  # type: typing.Dict[str,int]  # word -> idx
+
+  def words_to_idx(s):
+    """
+    :param str s:
+    :rtype: list[int]
+    """
+    return [vocab.setdefault(w, len(vocab)) for w in s.split(" ") if w]
+
+  def make_batch(seqs):
+    """
+    :param list[list[int]] seqs:
+    :return: padded seqs, seq lens
+    :rtype: (numpy.ndarray,numpy.ndarray)
+    """
+    seq_lens = numpy.array([len(seq) for seq in seqs], dtype="int64")
+    x = numpy.full((len(seqs), max(seq_lens)), -1, dtype="int64")
+    for i, seq in enumerate(seqs):
+      x[i, :len(seq)] = seq
+    return x, seq_lens
+
+  hyps = [words_to_idx(s) for s in hyps]
+  refs = [words_to_idx(s) for s in refs]
+  order = sorted(range(len(refs)), key=lambda i: (len(refs[i]), len(hyps[i])))
+  total_num_errors = 0
+  total_ref_num_words = sum([len(ref) for ref in refs])
+  for start in range(0, len(order), batch_size):
+    idxs = order[start:start + batch_size]
+    refs_batch, refs_seq_lens = make_batch([refs[i] for i in idxs])
+    hyps_batch, hyps_seq_lens = make_batch([hyps[i] for i in idxs])
+    total_num_errors += int(numpy.sum(Util.edit_distance_batch(refs_batch, refs_seq_lens, hyps_batch, hyps_seq_lens)))
+  return total_num_errors, total_ref_num_words
+
+
+class WerComputeNumpy:
+  """
+  Like :class:`WerComputeGraph`, but pure NumPy, via :func:`calc_wer_words`, i.e. no TF session is needed.
+  With num_workers > 1, the steps are calculated asynchronously by a pool of worker processes.
+  """
+
+  def __init__(self, num_workers=1):
+    """
+    :param int num_workers:
+    """
+    self.total_num_errors = 0
+    self.total_ref_num_words = 0
+    self.num_steps_done = 0
+    self.pool = None
+    self.pending = deque()
+    self.max_num_pending = num_workers * 2
+    if num_workers > 1:
+      import multiprocessing
+      self.pool = multiprocessing.Pool(num_workers)
+
+  def _add(self, num_errors, ref_num_words):
+    """
+    :param int num_errors:
+    :param int ref_num_words:
+    """
+    self.total_num_errors += num_errors
+    self.total_ref_num_words += ref_num_words
+    self.num_steps_done += 1
+
+  def _get_normalized_wer(self):
+    """
+    :return: normalized WER, in float32, as in :class:`WerComputeGraph`, such that the result is exactly the same
+    :rtype: float
+    """
+    if not self.num_steps_done:
+      return 1.0
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+      return numpy.float32(self.total_num_errors) / numpy.float32(self.total_ref_num_words)
+
+  def step(self, hyps, refs):
+    """
+    :param list[str] hyps:
+    :param list[str] refs:
+    :return: updated normalized WER. with worker processes, this only covers the finished steps
+    :rtype: float
+    """
+    if self.pool:
+      # Copy the lists, as they are sent asynchronously, and the caller might reuse them.
+      self.pending.append(self.pool.apply_async(calc_wer_words, (list(hyps), list(refs))))
+      while self.pending and (self.pending[0].ready() or len(self.pending) > self.max_num_pending):
+        self._add(*self.pending.popleft().get())
+    else:
+      self._add(*calc_wer_words(hyps, refs))
+    return self._get_normalized_wer()
+
+  def finish(self):
+    """
+    :return: final normalized WER
+    :rtype: float
+    """
+    while self.pending:
+      self._add(*self.pending.popleft().get())
+    if self.pool:
+      self.pool.close()
+      self.pool.join()
+    return self._get_normalized_wer()
 
 
 def calc_wer_on_dataset(dataset, refs, options, hyps):
@@ -63,7 +195,7 @@ def calc_wer_on_dataset(dataset, refs, options, hyps):
   remaining_hyp_seq_tags = set(hyps.keys())
   interactive = Util.is_tty() and not log.verbose[5]
   collected = {"hyps": [], "refs": []}
-  max_num_collected = 1
+  max_num_collected = options.batch_size
   if dataset:
     dataset.init_seq_order(epoch=1)
   else:
@@ -117,7 +249,7 @@ def calc_wer_on_dataset(dataset, refs, options, hyps):
     collected["refs"].append(ref)
 
     if len(collected["hyps"]) >= max_num_collected:
-      wer = wer_compute.step(session, **collected)
+      wer = wer_compute.step(**collected)
       del collected["hyps"][:]
       del collected["refs"][:]
 
@@ -127,7 +259,8 @@ def calc_wer_on_dataset(dataset, refs, options, hyps):
       print(progress_prefix, "seq tag %r, ref/hyp len %i/%i chars" % (seq_tag, len(ref), len(hyp)))
     seq_idx += 1
   if len(collected["hyps"]) > 0:
-    wer = wer_compute.step(session, **collected)
+    wer_compute.step(**collected)
+  wer = wer_compute.finish()
   print("Done. Num seqs %i. Total time %s." % (
     seq_idx, hms(time.time() - start_time)), file=log.v1)
   print("Remaining num hyp seqs %i." % (len(remaining_hyp_seq_tags),), file=log.v1)
@@ -140,10 +273,11 @@ def calc_wer_on_dataset(dataset, refs, options, hyps):
   return wer
 
 
-def init(config_filename, log_verbosity):
+def init(config_filename, log_verbosity, use_tensorflow):
   """
   :param str config_filename: filename to config-file
   :param int log_verbosity:
+  :param bool use_tensorflow:
   """
   rnn.init_better_exchook()
   rnn.init_thread_join_hack()
@@ -156,12 +290,14 @@ def init(config_filename, log_verbosity):
   config.set("task", "calculate_wer")
   config.set("log", None)
   config.set("log_verbosity", log_verbosity)
-  config.set("use_tensorflow", True)
+  if use_tensorflow:
+    config.set("use_tensorflow", True)
   rnn.init_log()
   print("Returnn calculate-word-error-rate starting up.", file=log.v1)
   rnn.returnn_greeting()
-  rnn.init_backend_engine()
-  assert Util.BackendEngine.is_tensorflow_selected(), "this is only for TensorFlow"
+  if use_tensorflow:
+    rnn.init_backend_engine()
+    assert Util.BackendEngine.is_tensorflow_selected(), "this is only for TensorFlow"
   rnn.init_faulthandler()
   rnn.init_config_json_network()
   rnn.print_task_properties()
@@ -196,10 +332,16 @@ def main(argv):
   argparser.add_argument("--verbosity", default=4, type=int, help="5 for all seqs (default: 4)")
   argparser.add_argument("--out", help="if provided, will write WER% (as string) to this file")
   argparser.add_argument("--expect_full", action="store_true", help="full dataset should be scored")
+  argparser.add_argument(
+    "--backend", default="numpy", choices=["numpy", "tf"], help="how to calculate the WER (default: numpy)")
+  argparser.add_argument("--batch_size", type=int, default=1000, help="num seqs per step (default: 1000)")
+  argparser.add_argument(
+    "--num_workers", type=int, default=1, help="num processes, for the numpy backend (default: 1)")
   args = argparser.parse_args(argv[1:])
   assert args.config or args.dataset or args.refs
+  assert args.batch_size >= 1
 
-  init(config_filename=args.config, log_verbosity=args.verbosity)
+  init(config_filename=args.config, log_verbosity=args.verbosity, use_tensorflow=args.backend == "tf")
   dataset = None
   refs = None
   if args.refs:
@@ -213,23 +355,22 @@ def main(argv):
   hyps = load_hyps_refs(args.hyps)
 
   global wer_compute
-  wer_compute = WerComputeGraph()
-  with tf.Session(config=tf.ConfigProto(device_count={"GPU": 0})) as _session:
-    global session
-    session = _session
-    session.run(tf.global_variables_initializer())
-    try:
-      wer = calc_wer_on_dataset(dataset=dataset, refs=refs, options=args, hyps=hyps)
-      print("Final WER: %.02f%%" % (wer * 100), file=log.v1)
-      if args.out:
-        with open(args.out, "w") as output_file:
-          output_file.write("%.02f\n" % (wer * 100))
-        print("Wrote WER%% to %r." % args.out)
-    except KeyboardInterrupt:
-      print("KeyboardInterrupt")
-      sys.exit(1)
-    finally:
-      rnn.finalize()
+  if args.backend == "tf":
+    wer_compute = WerComputeGraph()
+  else:
+    wer_compute = WerComputeNumpy(num_workers=args.num_workers)
+  try:
+    wer = calc_wer_on_dataset(dataset=dataset, refs=refs, options=args, hyps=hyps)
+    print("Final WER: %.02f%%" % (wer * 100), file=log.v1)
+    if args.out:
+      with open(args.out, "w") as output_file:
+        output_file.write("%.02f\n" % (wer * 100))
+      print("Wrote WER%% to %r." % args.out)
+  except KeyboardInterrupt:
+    print("KeyboardInterrupt")
+    sys.exit(1)
+  finally:
+    rnn.finalize()
 
 
 if __name__ == '__main__':
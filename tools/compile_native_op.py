@@ -22,10 +22,12 @@ import Util
 import TFUtil
 
 
-def init(config_filename, log_verbosity):
+def init(config_filename, log_verbosity, prebuild=False, jobs=0):
   """
   :param str config_filename: filename to config-file
   :param int log_verbosity:
+  :param bool prebuild: compile the native ops referenced by the network in parallel, see :func:`rnn.init_native_ops`
+  :param int jobs: number of parallel compile jobs for prebuild (0: num CPUs)
   """
   rnn.init_better_exchook()
   rnn.init_thread_join_hack()
@@ -38,6 +40,9 @@ def init(config_filename, log_verbosity):
   config.set("log", None)
   config.set("log_verbosity", log_verbosity)
   config.set("use_tensorflow", True)
+  if prebuild:
+    config.set("native_ops_prebuild", True)
+    config.set("native_ops_prebuild_jobs", jobs)
   rnn.init_log()
   print("Returnn compile-native-op starting up.", file=log.v1)
   rnn.returnn_greeting()
@@ -45,6 +50,7 @@ def init(config_filename, log_verbosity):
   assert Util.BackendEngine.is_tensorflow_selected(), "this is only for TensorFlow"
   rnn.init_faulthandler()
   rnn.init_config_json_network()
+  rnn.init_native_ops()
   if 'network' in config.typed_dict:
     print("Loading network")
     from TFNetwork import TFNetwork
@@ -65,7 +71,10 @@ def main(argv):
 
   argparser = argparse.ArgumentParser(description='Compile some op')
   argparser.add_argument('--config', help="filename to config-file")
-  argparser.add_argument('--native_op', help="op name. e.g. 'LstmGenericBase'")
+  argparser.add_argument('--native_op', help="op name. e.g. 'LstmGenericBase'. can be comma-separated")
+  argparser.add_argument('--all', action='store_true', help="compile all native ops")
+  argparser.add_argument('--jobs', type=int, default=0, help="number of parallel compile jobs (default: num CPUs)")
+  argparser.add_argument('--cache_dir', help="native code cache base dir. see NativeCodeCompiler.get_cache_base_dir")
   argparser.add_argument('--blas_lib', default=None,
                          help="specify which blas lib to use (path to .so or file name to search for)")
   argparser.add_argument('--search_for_numpy_blas', dest='search_for_numpy_blas', action='store_true',
@@ -75,14 +84,30 @@ def main(argv):
   argparser.add_argument("--verbosity", default=4, type=int, help="5 for all seqs (default: 4)")
   argparser.add_argument("--output_file", help='if given, will write the list of libs to this file')
   args = argparser.parse_args(argv[1:])
-  init(config_filename=args.config, log_verbosity=args.verbosity)
+  if args.cache_dir:
+    NativeCodeCompiler.CacheBaseDir = args.cache_dir
+  # The ops referenced by the config are compiled in parallel already in init(), before the network is constructed.
+  init(config_filename=args.config, log_verbosity=args.verbosity, prebuild=bool(args.config), jobs=args.jobs)
 
   import NativeOp
-  from TFNativeOp import make_op, OpMaker
+  from TFNativeOp import make_op, OpMaker, prebuild_ops, get_all_op_names
+  op_names = []
+  if args.all:
+    op_names += get_all_op_names()
   if args.native_op:
-    print("Loading native op %r" % args.native_op)
-    make_op(getattr(NativeOp, args.native_op), compiler_opts={"verbose": True},
-            search_for_numpy_blas=args.search_for_numpy_blas, blas_lib=args.blas_lib)
+    op_names += [name for name in args.native_op.split(",") if name not in op_names]
+  if op_names:
+    print("Compiling native ops: %s" % ", ".join(op_names))
+    start_time = time.time()
+    prebuild_ops(
+      op_names, num_workers=args.jobs or None, compiler_opts={"verbose": True},
+      search_for_numpy_blas=args.search_for_numpy_blas, blas_lib=args.blas_lib)
+    print("Compiling took %s." % hms(time.time() - start_time))
+  if args.native_op:
+    for name in args.native_op.split(","):
+      print("Loading native op %r" % name)
+      make_op(getattr(NativeOp, name), compiler_opts={"verbose": True},
+              search_for_numpy_blas=args.search_for_numpy_blas, blas_lib=args.blas_lib)
 
   libs = []
   if OpMaker.with_cuda and OpMaker.tf_blas_gemm_workaround:
@@ -96,12 +121,13 @@ def main(argv):
     print(compiler)
     libs.append(compiler._so_filename)
 
+  print("Native code compiler: %s" % NativeCodeCompiler.get_stats_str())
   if libs:
     print("libs:")
     for fn in libs:
       print(fn)
   else:
-    print("no libs compiled. use --native_op or --config")
+    print("no libs compiled. use --native_op, --all or --config")
 
   if args.output_file:
     with open(args.output_file, "w") as f:
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+
+"""
+Calculates the mean and variance (std dev) of some data key of any RETURNN dataset.
+The sequences are split into contiguous ranges, which are processed in parallel by a pool of worker processes,
+and the partial statistics are merged via :func:`Util.Stats.merge`.
+This needs a dataset which supports random access to the seqs (e.g. :class:`HDFDataset`),
+otherwise use ``--workers 1``.
+
+See also ``tools/dump-dataset.py --stats``, which does the same serially,
+and :func:`NormalizationData.NormalizationData.createNormalizationFile` for bundle files.
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import time
+import multiprocessing
+
+my_dir = os.path.dirname(os.path.abspath(__file__))
+returnn_dir = os.path.dirname(my_dir)
+sys.path.insert(0, returnn_dir)
+
+import rnn
+from Log import log
+import argparse
+from Util import Stats, hms
+from Dataset import init_dataset
+
+
+def collect_stats(job):
+  """
+  Executed in the worker processes.
+
+  :param (dict[str]|str,int,str,int,int,int) job: dataset opts, epoch, key, start seq idx, end seq idx, verbosity
+  :return: stats over the seqs [start, end)
+  :rtype: Stats
+  """
+  dataset_opts, epoch, key, start_seq_idx, end_seq_idx, verbosity = job
+  if not log.initialized:
+    log.initialize(verbosity=[verbosity])
+  dataset = init_dataset(dataset_opts)
+  dataset.init_seq_order(epoch=epoch)
+  stats = Stats()
+  seq_idx = start_seq_idx
+  while seq_idx < end_seq_idx and dataset.is_less_than_num_seqs(seq_idx):
+    dataset.load_seqs(seq_idx, seq_idx + 1)
+    stats.collect(dataset.get_data(seq_idx, key))
+    seq_idx += 1
+  return stats
+
+
+def compute_stats(dataset_opts, options):
+  """
+  :param dict[str]|str dataset_opts:
+  :param options: argparse.Namespace
+  :rtype: Stats
+  """
+  dataset = init_dataset(dataset_opts)
+  dataset.init_seq_order(epoch=options.epoch)
+  assert options.key in dataset.get_data_keys(), "key %r not in %r" % (options.key, dataset.get_data_keys())
+  try:
+    num_seqs = dataset.num_seqs
+  except NotImplementedError:
+    print("Dataset %r does not know its num seqs, cannot split, use a single worker." % dataset, file=log.v2)
+    num_seqs = None
+  num_workers = options.workers or multiprocessing.cpu_count()
+  if num_seqs is None:
+    num_workers = 1
+  else:
+    num_workers = max(min(num_workers, num_seqs), 1)
+  end_seq_idx = num_seqs if num_seqs is not None else float("inf")
+  if num_workers == 1:
+    jobs = [(dataset_opts, options.epoch, options.key, 0, end_seq_idx, options.verbosity)]
+  else:
+    jobs = [
+      (dataset_opts, options.epoch, options.key,
+       num_seqs * i // num_workers, num_seqs * (i + 1) // num_workers, options.verbosity)
+      for i in range(num_workers)]
+  del dataset  # not needed anymore, the workers init their own instance
+  print("Collect stats for key %r with %i workers." % (options.key, num_workers), file=log.v2)
+  start_time = time.time()
+  stats = Stats()
+  if num_workers == 1:
+    stats.merge(collect_stats(jobs[0]))
+  else:
+    pool = multiprocessing.Pool(num_workers)
+    try:
+      # imap keeps the order of the jobs, so the result is deterministic.
+      for i, job_stats in enumerate(pool.imap(collect_stats, jobs)):
+        stats.merge(job_stats)
+        print("Finished part %i/%i (%i seqs), elapsed %s." % (
+          i + 1, num_workers, job_stats.num_seqs, hms(time.time() - start_time)), file=log.v3)
+    finally:
+      pool.terminate()
+      pool.join()
+  print("Done. Total time %s." % hms(time.time() - start_time), file=log.v2)
+  return stats
+
+
+def init(config_filename, log_verbosity):
+  """
+  :param str|None config_filename: filename to config-file
+  :param int log_verbosity:
+  """
+  rnn.init_better_exchook()
+  rnn.init_thread_join_hack()
+  if config_filename:
+    print("Using config file %r." % config_filename)
+    assert os.path.exists(config_filename)
+  rnn.init_config(config_filename=config_filename, command_line_options=[])
+  global config
+  config = rnn.config
+  config.set("task", "dump")
+  config.set("log", None)
+  config.set("log_verbosity", log_verbosity)
+  rnn.init_log()
+  print("Returnn compute-dataset-stats starting up.", file=log.v2)
+  rnn.returnn_greeting()
+  rnn.init_faulthandler()
+
+
+def main(argv):
+  argparser = argparse.ArgumentParser(description='Calculate mean/stddev of some data key of a dataset.')
+  argparser.add_argument('--config', help="filename to config-file. will use dataset 'train' from it")
+  argparser.add_argument("--dataset", help="dataset, overwriting config. dict, or filename of HDF file")
+  argparser.add_argument('--epoch', type=int, default=1)
+  argparser.add_argument("--key", default="data", help="data-key, e.g. 'data' or 'classes'. (default: 'data')")
+  argparser.add_argument("--workers", type=int, default=0, help="number of worker processes (default: num CPUs)")
+  argparser.add_argument("--verbosity", default=3, type=int, help="log verbosity (default: 3)")
+  argparser.add_argument('--dump_stats', help="file-prefix to dump stats to")
+  args = argparser.parse_args(argv[1:])
+  assert args.config or args.dataset
+
+  init(config_filename=args.config, log_verbosity=args.verbosity)
+  if args.dataset:
+    if args.dataset.endswith(".hdf"):
+      assert os.path.exists(args.dataset)
+      dataset_opts = {"class": "HDFDataset", "files": [args.dataset]}
+    else:
+      dataset_opts = args.dataset
+  else:
+    dataset_opts = config.opt_typed_value("train")
+  try:
+    stats = compute_stats(dataset_opts=dataset_opts, options=args)
+    stats.dump(output_file_prefix=args.dump_stats, stream_prefix="Data %r " % args.key, stream=log.v1)
+  except KeyboardInterrupt:
+    print("KeyboardInterrupt")
+    sys.exit(1)
+  finally:
+    rnn.finalize()
+
+
+if __name__ == '__main__':
+  main(sys.argv)
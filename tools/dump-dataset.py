@@ -208,8 +208,14 @@ def main():
   argparser.add_argument("--key", default="data", help="data-key, e.g. 'data' or 'classes'. (default: 'data')")
   argparser.add_argument('--stats', action="store_true", help="calculate mean/stddev stats")
   argparser.add_argument('--dump_stats', help="file-prefix to dump stats to")
+  argparser.add_argument("--profile_startup", action="store_true", help="print time per startup phase")
   args = argparser.parse_args()
+  if args.profile_startup:
+    rnn.startup_profile = []
+    rnn.startup_profile_phase("imports")
   init(config_str=args.crnn_config, verbosity=args.verbosity)
+  rnn.startup_profile_phase("init")
+  rnn.print_startup_profile()
   try:
     dump_dataset(rnn.train_data, args)
   except KeyboardInterrupt: